@@ -1,36 +1,68 @@
 import sys
 import os
-import xml.etree.ElementTree as ET
-import xml.dom.minidom as minidom
+import re
+from xml.parsers.expat import ExpatError
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPlainTextEdit, QVBoxLayout, 
                              QWidget, QToolBar, QAction, QFileDialog, 
-                             QMessageBox, QLabel, QStatusBar, QColorDialog, QTreeWidget, QTreeWidgetItem, QSplitter, QComboBox, QFontComboBox, QAbstractItemView, QProgressBar, QStyle)
+                             QMessageBox, QLabel, QStatusBar, QColorDialog, QTreeView, QSplitter, QComboBox, QFontComboBox, QAbstractItemView, QProgressBar, QStyle)
 from PyQt5.QtGui import QFont, QPalette, QColor, QTextCursor, QIcon
-from PyQt5.QtCore import Qt, QSettings, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QSettings, QStandardPaths, QThread, pyqtSignal, QModelIndex
 from PyQt5.QtGui import QTextOption
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
 from ui.syntax_highlighter import XmlHighlighter
 from ui.settings_dialog import SettingsDialog
 from PyQt5.QtWidgets import QDialog
-from threads.tree_builder import TreeBuilderThread, ElementTreeBuilderThread
-from threads.file_loader import FileLoaderThread
+from threads.task_scheduler import TaskScheduler
+from threads.tree_builder import build_document
+from threads.file_loader import load_file
+from threads.xml_formatter import format_text, format_file
+from threads.text_replacer import replace_all
+from model.pretty_printer import pretty_format
+from model.document import XmlDocument
+from model.index_cache import IndexCache
+from model.document_cache import DocumentCache
+from model.text_search import compile_pattern, compile_replacement, find_match
 from ui.ui_builder import UIBuilder
+from ui.xml_tree_model import XmlTreeModel, parse_attributes
+from ui.highlight_scheduler import HighlightScheduler
+from ui.batch_edit import BatchEdit
+from ui.progressive_load import ProgressiveLoad
+from ui.recent_prefetch import RecentPrefetcher
 
 class XMLEditor(QMainWindow):
     """Главное окно XML-редактора: редактор текста, дерево, меню и действия."""
+    # Текст длиннее этого числа символов форматируется в фоновом потоке
+    FORMAT_SYNC_LIMIT = 1_000_000
+    # Текст длиннее этого числа символов вставляется в редактор порциями
+    PROGRESSIVE_LOAD_LIMIT = 4_000_000
+    # Настройки в INI-файле рядом с приложением
+    SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_settings.ini")
+
     def __init__(self):
         """Инициализирует состояние, UI и загружает сохранённые настройки."""
         super().__init__()
         self.current_file = None
-        # Настройки в INI-файле рядом с приложением
-        settings_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_settings.ini")
-        self.settings = QSettings(settings_path, QSettings.IniFormat)
+        self.settings = QSettings(self.SETTINGS_PATH, QSettings.IniFormat)
         self.is_dirty = False
-        self._suppress_tree_update = False
-        self._DUMMY_ROLE = Qt.UserRole + 1
-        self._tree_builder_thread = None
-        self._file_loader_thread = None
+        # Снимки текста по ревизиям (создаются вместе с редактором в UIBuilder)
+        self.snapshots = None
+        # Общий пул фоновых задач; результаты для устаревшей ревизии текста отбрасываются
+        self.task_scheduler = TaskScheduler(version_provider=lambda: self.snapshots.revision, parent=self)
+        # Индексы структуры недавно открытых файлов: повторное открытие без разбора
+        cache_dir = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+        self.index_cache = IndexCache(os.path.join(cache_dir, "index_cache"), self._index_cache_mb() * 1024 * 1024)
+        # Недавние файлы, заранее прочитанные в паузах работы
+        self.document_cache = DocumentCache(self._prefetch_mb() * 1024 * 1024)
         self._progress_bar = None
+        self._cancel_button = None
+        self._validation_label = None
+        # Результат проверки XML по F7 показывается, когда закончится фоновая проверка
+        self._validation_requested = False
+        # Замены, применяемые к тексту порциями («Заменить все»)
+        self._batch_edit = None
+        # Вставка большого текста в редактор порциями и выделение, ждущее её конца
+        self._text_load = None
+        self._pending_selection = None
         # Инициализация недавних файлов (до создания меню)
         self.recent_files = []
         self._load_recent_files()
@@ -39,11 +71,18 @@ class XMLEditor(QMainWindow):
         self.ui_builder = UIBuilder(self)
         self.ui_builder.setup_main_window()
         self.ui_builder.create_central_widget()
+        self.ui_builder.create_problems_panel()
+        self.ui_builder.create_search_results_panel()
+        self.ui_builder.create_query_panel()
         self.ui_builder.create_toolbars()
         self.ui_builder.create_menus()
         self.ui_builder.create_status_bar()
         
         self.load_settings()
+        self.recent_prefetch = RecentPrefetcher(self.task_scheduler, self.document_cache,
+                                                self._prefetch_candidates, self.index_cache, self)
+        if self._prefetch_files() > 0:
+            self.recent_prefetch.start()
         
 
     def _refresh_window_title(self):
@@ -68,8 +107,10 @@ class XMLEditor(QMainWindow):
         row_find.addWidget(find_input)
         case_cb = QCheckBox("Регистр")
         whole_cb = QCheckBox("Целое слово")
+        regex_cb = QCheckBox("Рег. выражение")
         row_find.addWidget(case_cb)
         row_find.addWidget(whole_cb)
+        row_find.addWidget(regex_cb)
         layout.addLayout(row_find)
 
         row_replace = QHBoxLayout()
@@ -81,65 +122,29 @@ class XMLEditor(QMainWindow):
         row_btns = QHBoxLayout()
         find_next_btn = QPushButton("Найти далее")
         find_prev_btn = QPushButton("Найти назад")
+        find_all_btn = QPushButton("Найти все")
         replace_btn = QPushButton("Заменить")
         replace_all_btn = QPushButton("Заменить все")
         close_btn = QPushButton("Закрыть")
         row_btns.addWidget(find_next_btn)
         row_btns.addWidget(find_prev_btn)
+        row_btns.addWidget(find_all_btn)
         row_btns.addWidget(replace_btn)
         row_btns.addWidget(replace_all_btn)
         row_btns.addWidget(close_btn)
         layout.addLayout(row_btns)
 
-        def build_flags():
-            from PyQt5.QtGui import QTextDocument
-            flags = QTextDocument.FindFlags()
-            if case_cb.isChecked():
-                flags |= QTextDocument.FindCaseSensitively
-            if whole_cb.isChecked():
-                flags |= QTextDocument.FindWholeWords
-            return flags
-
-        def do_find(forward: bool):
-            from PyQt5.QtGui import QTextDocument
-            pattern = find_input.text()
-            if not pattern:
-                return
-            flags = build_flags()
-            if not forward:
-                flags |= QTextDocument.FindBackward
-            self.editor.find(pattern, flags)
-
-        def do_replace_once():
-            cursor = self.editor.textCursor()
-            if not cursor.hasSelection():
-                do_find(True)
-                cursor = self.editor.textCursor()
-                if not cursor.hasSelection():
-                    return
-            cursor.insertText(replace_input.text())
-            self.is_dirty = True
-            do_find(True)
-
-        def do_replace_all():
-            pattern = find_input.text()
-            if not pattern:
-                return
-            replacement = replace_input.text()
-            text = self.editor.toPlainText()
-            new_text = text.replace(pattern, replacement)
-            count = text.count(pattern)
-            if count > 0:
-                self.editor.blockSignals(True)
-                self.editor.setPlainText(new_text)
-                self.editor.blockSignals(False)
-                self.is_dirty = True
-                self.status_bar.showMessage(f"Заменено: {count}")
-
-        find_next_btn.clicked.connect(lambda: do_find(True))
-        find_prev_btn.clicked.connect(lambda: do_find(False))
-        replace_btn.clicked.connect(do_replace_once)
-        replace_all_btn.clicked.connect(do_replace_all)
+        def pattern():
+            return self._search_pattern(find_input.text(), case_cb.isChecked(),
+                                        whole_cb.isChecked(), regex_cb.isChecked())
+
+        find_next_btn.clicked.connect(lambda: self.find_text(pattern(), forward=True))
+        find_prev_btn.clicked.connect(lambda: self.find_text(pattern(), forward=False))
+        find_all_btn.clicked.connect(lambda: self.find_all(pattern(), regex_cb.isChecked()))
+        replace_btn.clicked.connect(
+            lambda: self.replace_current(pattern(), replace_input.text(), regex_cb.isChecked()))
+        replace_all_btn.clicked.connect(
+            lambda: self.replace_all_matches(pattern(), replace_input.text(), regex_cb.isChecked()))
         close_btn.clicked.connect(dlg.close)
 
         dlg.setModal(True)
@@ -160,10 +165,14 @@ class XMLEditor(QMainWindow):
         row_find.addWidget(self.case_cb)
         self.whole_cb = QCheckBox("Целое слово")
         row_find.addWidget(self.whole_cb)
+        self.regex_cb = QCheckBox("Рег. выражение")
+        row_find.addWidget(self.regex_cb)
         self.find_next_btn = QPushButton("Найти далее")
         self.find_prev_btn = QPushButton("Найти назад")
+        self.find_all_btn = QPushButton("Найти все")
         row_find.addWidget(self.find_next_btn)
         row_find.addWidget(self.find_prev_btn)
+        row_find.addWidget(self.find_all_btn)
         layout.addLayout(row_find)
 
         # Строка замены
@@ -180,91 +189,185 @@ class XMLEditor(QMainWindow):
         # Связи
         self.find_next_btn.clicked.connect(lambda: self._find(forward=True))
         self.find_prev_btn.clicked.connect(lambda: self._find(forward=False))
+        self.find_all_btn.clicked.connect(lambda: self.find_all(self._tab_pattern(), self.regex_cb.isChecked()))
         self.replace_btn.clicked.connect(self._replace_once)
         self.replace_all_btn.clicked.connect(self._replace_all)
 
-    def _build_find_flags(self):
-        from PyQt5.QtGui import QTextDocument
-        flags = QTextDocument.FindFlags()
-        if self.case_cb.isChecked():
-            flags |= QTextDocument.FindCaseSensitively
-        if self.whole_cb.isChecked():
-            flags |= QTextDocument.FindWholeWords
-        return flags
+    def _tab_pattern(self):
+        """Компилирует шаблон из полей вкладки поиска."""
+        return self._search_pattern(self.find_input.text(), self.case_cb.isChecked(),
+                                    self.whole_cb.isChecked(), self.regex_cb.isChecked())
 
     def _find(self, forward: bool):
-        from PyQt5.QtGui import QTextDocument
-        pattern = self.find_input.text()
-        if not pattern:
-            return
-        flags = self._build_find_flags()
-        if not forward:
-            flags |= QTextDocument.FindBackward
-        self.editor.find(pattern, flags)
+        self.find_text(self._tab_pattern(), forward)
 
     def _select_range(self, start: int, end: int):
+        """Выделяет в редакторе участок [start, end) текста (позиции строки снимка)."""
+        if self._defer_selection(start, end):
+            return
+        positions = self.snapshots.positions()
         cursor = self.editor.textCursor()
-        cursor.setPosition(start)
-        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        cursor.setPosition(positions.to_qt(start))
+        cursor.setPosition(positions.to_qt(end), QTextCursor.KeepAnchor)
         self.editor.setTextCursor(cursor)
         self.editor.ensureCursorVisible()
 
+    def _select_document_range(self, start: int, end: int):
+        """Выделяет участок [start, end), заданный позициями документа Qt."""
+        self._select_range(*self.snapshots.positions().span_from_qt(start, end))
+
     def _replace_once(self):
-        cursor = self.editor.textCursor()
-        if not cursor.hasSelection():
-            self._find(forward=True)
-            cursor = self.editor.textCursor()
-            if not cursor.hasSelection():
-                return
-        replacement = self.replace_input.text()
-        cursor.insertText(replacement)
-        self.is_dirty = True
-        # перейти к следующему
-        self._find(forward=True)
+        self.replace_current(self._tab_pattern(), self.replace_input.text(), self.regex_cb.isChecked())
 
     def _replace_all(self):
-        from PyQt5.QtGui import QTextDocument
-        pattern = self.find_input.text()
+        self.replace_all_matches(self._tab_pattern(), self.replace_input.text(), self.regex_cb.isChecked())
+
+    def _search_pattern(self, pattern: str, case_sensitive: bool, whole_word: bool, regex: bool):
+        """Компилирует шаблон поиска или возвращает None (пустой шаблон, ошибка в выражении)."""
         if not pattern:
+            return None
+        try:
+            return compile_pattern(pattern, regex, case_sensitive, whole_word)
+        except re.error as e:
+            self.status_bar.showMessage(f"Ошибка в регулярном выражении: {e}")
+            return None
+
+    def find_text(self, compiled, forward=True) -> bool:
+        """Выделяет следующее (или предыдущее) от курсора совпадение с шаблоном.
+
+        Если для шаблона уже найдены все совпадения, текст не просматривается:
+        совпадение берётся из их индекса.
+        """
+        if compiled is None:
+            return False
+        cursor = self.editor.textCursor()
+        positions = self.snapshots.positions()
+        if self.search_results.covers(compiled):
+            # Индекс совпадений хранит позиции документа
+            span = self.search_results.find(cursor.selectionStart(), cursor.selectionEnd(), forward)
+            if span is not None:
+                span = positions.span_from_qt(*span)
+        else:
+            start, end = positions.span_from_qt(cursor.selectionStart(), cursor.selectionEnd())
+            span = find_match(compiled, self.snapshots.text(), start, end, forward)
+        if span is None:
+            self.status_bar.showMessage("Совпадений не найдено")
+            return False
+        self._select_range(*span)
+        return True
+
+    def find_all(self, compiled, regex=False):
+        """Ищет все совпадения в фоне и показывает их в панели результатов."""
+        if compiled is None:
             return
-        replacement = self.replace_input.text()
+        self.search_results.search(compiled, regex)
+        self.search_results_panel.show()
 
-        doc = self.editor.document()
-        flags = self._build_find_flags()
-        # Для replace all всегда идём вперёд
-        flags &= ~QTextDocument.FindBackward
+    def replace_current(self, compiled, replacement: str, regex=False):
+        """Заменяет выделенное совпадение и переходит к следующему.
 
-        count = 0
-        self.editor.blockSignals(True)
+        Если выделение не совпадает с шаблоном, только ищет следующее.
+        """
+        if compiled is None:
+            return
         cursor = self.editor.textCursor()
-        cursor.beginEditBlock()
+        match = None
+        if cursor.hasSelection():
+            start, end = self.snapshots.positions().span_from_qt(cursor.selectionStart(), cursor.selectionEnd())
+            match = compiled.fullmatch(self.snapshots.text(), start, end)
+        if match is None:
+            self.find_text(compiled, forward=True)
+            return
+        self._complete_text_load()
         try:
-            pos = 0
-            while True:
-                hit = doc.find(pattern, pos, flags)
-                if hit.isNull():
-                    break
-                hit.insertText(replacement)
-                pos = hit.position()
-                count += 1
-        finally:
-            cursor.endEditBlock()
-            self.editor.blockSignals(False)
-
-        if count:
-            self.is_dirty = True
+            cursor.insertText(compile_replacement(compiled, replacement, regex)(match))
+        except re.error as e:
+            self.status_bar.showMessage(f"Ошибка в шаблоне замены: {e}")
+            return
+        self.find_text(compiled, forward=True)
+
+    def replace_all_matches(self, compiled, replacement: str, regex=False):
+        """Заменяет все совпадения: ищет их в фоне и применяет одним шагом отмены.
+
+        Совпадения ищутся в снимке текущей ревизии; если текст изменится
+        раньше, чем они найдены, результат отбрасывается. Найденные
+        замены применяются порциями (``BatchEdit``), редактор на это время
+        доступен только для чтения.
+        """
+        if compiled is None:
+            return
+        if self.task_scheduler.is_running("replace") or self._batch_edit is not None:
+            QMessageBox.information(self, "Замена", "Замена уже выполняется.")
+            return
+        try:
+            replace = compile_replacement(compiled, replacement, regex)
+        except re.error as e:
+            self.status_bar.showMessage(f"Ошибка в шаблоне замены: {e}")
+            return
+        self._show_progress("Поиск совпадений...")
+
+        def found(result):
+            edits, count = result
+            if not count:
+                self._hide_progress()
+                self.status_bar.showMessage("Совпадений не найдено")
+                return
+            self._show_progress(f"Замена совпадений: {count}...")
+            self._complete_text_load()
+            # Правки найдены в позициях снимка, а применяются в позициях документа
+            positions = self.snapshots.positions()
+            if not positions.identity:
+                edits = [positions.span_to_qt(start, end) + (text,) for start, end, text in edits]
+            self._batch_edit = BatchEdit(self.editor, edits, self)
+            self._batch_edit.progress.connect(self._progress_bar.setValue)
+            self._batch_edit.finished.connect(lambda done: self._on_replace_applied(done, count))
+            self._batch_edit.start()
+
+        def failed(error):
+            self._hide_progress()
+            self.status_bar.showMessage(f"Ошибка замены: {error}")
+
+        def stale():
+            self._hide_progress()
+            self.status_bar.showMessage("Текст изменился во время замены, результат отброшен")
+
+        def cancelled():
+            self._hide_progress()
+            self.status_bar.showMessage("Замена отменена")
+
+        self.task_scheduler.submit(
+            "replace", replace_all, self.snapshots.text(), compiled, replace,
+            on_result=found,
+            on_error=failed,
+            on_progress=self._progress_bar.setValue,
+            on_cancelled=cancelled,
+            on_stale=stale,
+            version=self.snapshots.revision,
+        )
+
+    def _on_replace_applied(self, done: bool, count: int):
+        """Сообщает итог замены всех совпадений."""
+        self._batch_edit.deleteLater()
+        self._batch_edit = None
+        self._hide_progress()
+        self.update_status()
+        if done:
             self.status_bar.showMessage(f"Заменено: {count}")
+        else:
+            self.status_bar.showMessage("Замена прервана: изменения можно отменить")
     
     def new_file(self):
         """Очищает редактор и начинает новый документ."""
         if not self.confirm_save_if_dirty():
             return
-        self.editor.clear()
+        self._close_large_file()
+        self._set_editor_text("")
         self.current_file = None
         self.is_dirty = False
         self._refresh_window_title()
         self.status_bar.showMessage("Создан новый файл")
-        self.tree.clear()
+        self.tree_model.clear()
+        self.xpath_query.set_document(None)
         
     def open_file(self):
         """Открывает файл через диалог и запускает асинхронную загрузку."""
@@ -278,33 +381,131 @@ class XMLEditor(QMainWindow):
             self._start_file_loading(file_path)
 
     def _start_file_loading(self, file_path: str):
-        """Запускает поток загрузки файла и настраивает прогресс."""
-        # Показываем индикатор загрузки
-        self.status_bar.showMessage("Загрузка файла...")
-        
-        # Останавливаем предыдущий поток загрузки, если он есть
-        if self._file_loader_thread and self._file_loader_thread.isRunning():
-            self._file_loader_thread.terminate()
-            self._file_loader_thread.wait()
-        
-        # Настройка прогресса
-        self._progress_bar.setVisible(True)
-        self._progress_bar.setRange(0, 100)
-        self._progress_bar.setValue(50)
+        """Запускает поток загрузки файла и настраивает прогресс.
+
+        Файл не меньше порога из настроек открывается только для просмотра.
+        """
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0  # ошибку чтения сообщит загрузка
+        if size >= self._large_file_limit_mb() * 1024 * 1024:
+            self.open_large_file(file_path)
+            return
+        cached = self.document_cache.take(file_path)
+        if cached is not None:
+            # Файл прочитан заранее и с тех пор не менялся
+            self.task_scheduler.cancel("load")
+            self.on_file_loaded(file_path, *cached)
+            return
+        self.highlight_scheduler.stop()
+        # Показываем прогресс по прочитанным байтам и кнопку отмены
+        self._show_progress("Загрузка файла...")
         
-        # Запускаем загрузку файла в отдельном потоке
-        self._file_loader_thread = FileLoaderThread(file_path)
-        self._file_loader_thread.file_loaded.connect(self.on_file_loaded)
-        self._file_loader_thread.error_occurred.connect(self.on_file_load_error)
-        self._file_loader_thread.progress_updated.connect(self.on_file_load_progress)
-        self._file_loader_thread.start()
+        # Новая загрузка отменяет предыдущую, если та ещё не завершилась
+        self.task_scheduler.submit(
+            "load", load_file, file_path, self.index_cache,
+            on_result=lambda result: self.on_file_loaded(*result),
+            on_error=lambda error: self.on_file_load_error(str(error)),
+            on_progress=self.on_file_load_progress,
+            on_cancelled=self.on_file_load_cancelled,
+        )
                 
+    def open_large_file(self, file_path: str):
+        """Открывает большой файл без загрузки: текст читается из отображения в память.
+
+        Редактор заменяется просмотром видимых строк, а дерево — скелетом
+        верхних уровней; оба пополняются в фоне. Когда индекс строк
+        построен, файл можно править в просмотре и сохранять. Действия,
+        которым нужен текст в редакторе, на это время отключаются.
+        """
+        try:
+            self.large_file.open(file_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть файл: {str(e)}")
+            return
+        self.task_scheduler.cancel("load")
+        self._hide_progress()
+        self.highlight_scheduler.stop()
+        self.search_results.clear()
+        self.editor.blockSignals(True)
+        self._set_editor_text("")
+        self.editor.blockSignals(False)
+        self.tree_model.clear()
+        self.problems_panel.set_problems([])
+        self.xpath_query.set_document(None)
+        self.large_view.setFont(self.editor.font())
+        self.large_view.setPalette(self.editor.palette())
+        self.large_view.reset()
+        self.editor_stack.setCurrentWidget(self.large_view)
+        self.tree.setModel(self.large_file.model)
+        for action in self._text_actions():
+            action.setEnabled(False)
+        self.current_file = file_path
+        self.is_dirty = False
+        self._refresh_window_title()
+        self._add_recent_file(file_path)
+        self.update_status()
+
+    def _close_large_file(self):
+        """Закрывает просмотр большого файла и возвращает редактор и обычное дерево."""
+        if not self.large_file.is_open:
+            return
+        self.large_file.close()
+        self.tree.setModel(self.tree_model)
+        self.editor_stack.setCurrentWidget(self.editor)
+        for action in self._text_actions():
+            action.setEnabled(True)
+
+    def _text_actions(self):
+        """Возвращает действия, которым нужен текст в редакторе."""
+        return [self.print_action, self.export_html_action, self.export_pdf_action, self.find_replace_action,
+                self.validate_action, self.pretty_action, self.query_action, self.refresh_tree_action]
+
+    def on_large_file_changed(self):
+        """Помечает большой файл как изменённый после правки в просмотре."""
+        self.is_dirty = True
+        self._refresh_window_title()
+        self.update_status()
+
+    def on_large_file_error(self, message: str):
+        """Показывает ошибку чтения большого файла."""
+        self.status_bar.showMessage("Ошибка чтения файла")
+        QMessageBox.critical(self, "Ошибка", f"Не удалось прочитать файл: {message}")
+
+    def _large_file_limit_mb(self) -> int:
+        """Возвращает из настроек размер файла (МБ), с которого он открывается только для просмотра."""
+        return self.settings.value("large_file/limit_mb", 512, type=int)
+
+    def _index_cache_mb(self) -> int:
+        """Возвращает из настроек наибольший размер кэша индексов (МБ; 0 — кэш отключен)."""
+        return self.settings.value("cache/max_mb", 512, type=int)
+
+    def _prefetch_files(self) -> int:
+        """Возвращает из настроек число недавних файлов, читаемых заранее (0 — не читать)."""
+        return self.settings.value("cache/prefetch_files", 3, type=int)
+
+    def _prefetch_mb(self) -> int:
+        """Возвращает из настроек объём памяти (МБ) для заранее прочитанных файлов."""
+        return self.settings.value("cache/prefetch_mb", 256, type=int)
+
+    def _prefetch_candidates(self):
+        """Возвращает недавние файлы для упреждающего чтения: кроме открытого и больших."""
+        limit = self._large_file_limit_mb() * 1024 * 1024
+        paths = []
+        for path in self.recent_files[:self._prefetch_files()]:
+            try:
+                if path != self.current_file and os.path.getsize(path) < limit:
+                    paths.append(path)
+            except OSError:
+                continue
+        return paths
+
     def save_file(self):
         """Сохраняет текущий документ в текущий файл либо предлагает 'Сохранить как'."""
         if self.current_file:
             try:
-                with open(self.current_file, 'w', encoding='utf-8') as file:
-                    file.write(self.editor.toPlainText())
+                self._write_file(self.current_file)
                 self.status_bar.showMessage(f"Файл сохранен: {self.current_file}")
                 self.is_dirty = False
                 self._refresh_window_title()
@@ -323,8 +524,7 @@ class XMLEditor(QMainWindow):
                 file_path += '.xml'
                 
             try:
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    file.write(self.editor.toPlainText())
+                self._write_file(file_path)
                 
                 self.current_file = file_path
                 self.is_dirty = False
@@ -334,6 +534,17 @@ class XMLEditor(QMainWindow):
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл: {str(e)}")
                 
+    def _write_file(self, file_path: str):
+        """Записывает текст документа в файл; большой файл пишется порциями из буфера правок."""
+        if not self.large_file.is_open:
+            with open(file_path, 'w', encoding='utf-8') as file:
+                file.write(self.snapshots.text())
+            return
+        self.large_file.save(file_path)
+        # Сохранённый файл открыт заново: индексы строятся с начала
+        self.large_view.reset()
+        self.update_status()
+
     def print_file(self):
         """Открывает диалог печати и отправляет документ на принтер/PDF."""
         printer = QPrinter(QPrinter.HighResolution)
@@ -355,7 +566,7 @@ class XMLEditor(QMainWindow):
             file_path += '.html'
         try:
             _export_to_html(
-                text=self.editor.toPlainText(),
+                text=self.snapshots.text(),
                 font=self.editor.font(),
                 palette=self.editor.palette(),
                 target_path=file_path,
@@ -448,15 +659,46 @@ class XMLEditor(QMainWindow):
             self.settings.setValue("appearance/bg_color", color.name())
             
     def update_status(self):
-        """Обновляет строку состояния (строки, символы, позиция курсора)."""
-        text = self.editor.toPlainText()
-        lines = text.count('\n') + 1
-        chars = len(text)
-
-        cursor = self.editor.textCursor()
-        line = cursor.blockNumber() + 1
-        col = cursor.positionInBlock() + 1
-        self.status_bar.showMessage(f"Строк: {lines} | Символов: {chars} | Позиция: {line}:{col}")
+        """Обновляет строку состояния (строки, символы, элементы, позиция, глубина и путь курсора)."""
+        if self.large_file.is_open:
+            self.status_bar.showMessage(self._large_file_status())
+            return
+        if self._batch_edit is not None:
+            # Пока применяются замены, в строке состояния их прогресс: пересчитывать
+            # элементы после каждой порции правок незачем, счётчики обновятся в конце
+            return
+        # Счётчики ведутся по правкам, текст документа при этом не копируется
+        stats = self.document_stats
+        line, col = stats.cursor_position()
+        message = (f"Строк: {stats.line_count} | Символов: {stats.char_count} | "
+                   f"Элементов: {stats.element_count} | Позиция: {line}:{col}")
+        path = stats.element_path()
+        if path:
+            message += f" | Глубина: {len(path)} | /" + "/".join(path)
+        self.status_bar.showMessage(message)
+
+    def _large_file_status(self) -> str:
+        """Возвращает строку состояния просмотра большого файла с ходом построения индексов."""
+        large_file = self.large_file
+        lines = large_file.lines
+        mode = "Правка" if large_file.editable else "Только чтение"
+        message = f"{mode} | Размер: {large_file.size / (1024 * 1024):.1f} МБ | Строк: {large_file.line_count}"
+        if not lines.complete:
+            message += f" (просмотрено {lines.indexed * 100 // len(large_file.data)}%)"
+        message += f" | Строка: {self.large_view.current_line + 1}"
+        if not large_file.scan_complete:
+            message += f" | Дерево: {large_file.scanned_to * 100 // len(large_file.data)}%"
+        elif large_file.scanner.truncated:
+            message += f" | В дереве первые {large_file.scanner.count} элементов"
+        return message
+
+    def _current_document(self):
+        """Возвращает разобранный документ текущей ревизии текста (или None).
+
+        Документ разбирается не более одного раза на ревизию: результат
+        задачи построения дерева или синхронного разбора хранится в снимке.
+        """
+        return self.snapshots.document()
 
     def on_text_changed(self):
         """Помечает документ как изменённый и обновляет статус."""
@@ -466,7 +708,9 @@ class XMLEditor(QMainWindow):
 
     def confirm_save_if_dirty(self):
         """Предлагает сохранить изменения; возвращает True, если можно продолжать."""
-        if not self.is_dirty or not self.editor.toPlainText().strip():
+        text = self.snapshots.text()
+        # В режиме большого файла редактор пуст, а правки хранит буфер просмотра
+        if not self.is_dirty or (not self.large_file.is_open and (not text or text.isspace())):
             return True
         msg = QMessageBox(self)
         msg.setIcon(QMessageBox.Warning)
@@ -485,29 +729,262 @@ class XMLEditor(QMainWindow):
         return False
 
     def validate_xml(self):
-        """Проверяет, что текущий XML корректен синтаксически (well-formed)."""
-        xml_text = self.editor.toPlainText()
-        try:
-            ET.fromstring(xml_text)
+        """Проверяет, что текущий XML корректен синтаксически (well-formed).
+
+        Если текущий текст уже проверен в фоне, результат показывается сразу,
+        иначе — когда завершится запущенная немедленно фоновая проверка.
+        """
+        if self.live_validator.is_current():
+            self._report_validation(self.live_validator.problem)
+            return
+        self._validation_requested = True
+        self.live_validator.validate_now()
+
+    def _report_validation(self, problem):
+        """Показывает результат проверки XML в окне сообщения."""
+        if problem is None:
             QMessageBox.information(self, "Проверка XML", "XML корректен (well-formed).")
-        except ET.ParseError as e:
-            QMessageBox.critical(self, "Ошибка XML", f"Некорректный XML:\n{str(e)}")
+        else:
+            line, column, message = problem
+            QMessageBox.critical(self, "Ошибка XML",
+                                 f"Некорректный XML:\n{message}: строка {line}, столбец {column + 1}")
+
+    def on_validation_started(self):
+        """Показывает, что результат проверки XML ожидает паузы в наборе."""
+        self._validation_label.setText("XML: проверка…")
+        self._validation_label.setToolTip("")
+
+    def on_validation_finished(self, problem):
+        """Показывает результат фоновой проверки XML в строке состояния."""
+        if problem is None:
+            self._validation_label.setText("XML: корректен" if self.document_stats.char_count else "")
+            self._validation_label.setToolTip("")
+        else:
+            line, column, message = problem
+            self._validation_label.setText(f'<a href="#error" style="color: #c00;">XML: ошибка в строке {line}</a>')
+            self._validation_label.setToolTip(f"{message} (строка {line}, столбец {column + 1})")
+        self._follow_edits_in_tree()
+        if self._validation_requested:
+            self._validation_requested = False
+            self._report_validation(problem)
+
+    def _follow_edits_in_tree(self):
+        """Переводит показанное дерево на документ, разобранный при проверке.
+
+        Полный разбор ради корректного дерева здесь не запускается: дерево
+        следует за правками, только если документ ревизии уже получен. Если
+        текст некорректен, дерево перестраивается в фоне с восстановлением
+        после ошибок, чтобы список ошибок соответствовал тексту.
+        """
+        shown = self.tree_model.document()
+        if shown is None:
+            return
+        document = self.snapshots.parsed_document()
+        if document is not None:
+            if document is not shown:
+                self._show_tree_document(document)
+        elif self.live_validator.problem is not None and shown.version != self.snapshots.revision:
+            self.build_tree_from_editor()
+
+    def go_to_validation_error(self):
+        """Переводит курсор к месту ошибки, найденной фоновой проверкой."""
+        position = self.live_validator.error_position()
+        if position is not None:
+            self.go_to_position(self.snapshots.positions().from_qt(position))
+
+    def go_to_position(self, position: int):
+        """Переводит курсор в позицию ``position`` текста (строки снимка) и показывает её."""
+        if self._defer_selection(position, position):
+            return
+        cursor = self.editor.textCursor()
+        cursor.setPosition(self.snapshots.positions().to_qt(position))
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+        self.editor.setFocus()
 
     def pretty_format_xml(self):
-        """Форматирует текущий XML с отступами и обновляет дерево."""
-        xml_text = self.editor.toPlainText()
-        try:
-            # Сначала проверим корректность
-            ET.fromstring(xml_text)
-            pretty = minidom.parseString(xml_text).toprettyxml(indent="  ")
-            pretty_lines = [line for line in pretty.splitlines() if line.strip()]
-            self.editor.setPlainText("\n".join(pretty_lines))
-            self.is_dirty = True
-            self.status_bar.showMessage("XML отформатирован")
-            self.build_tree_from_text(self.editor.toPlainText())
-        except ET.ParseError as e:
-            QMessageBox.critical(self, "Ошибка форматирования", f"XML некорректен:\n{str(e)}")
-        
+        """Форматирует текущий XML с отступами и обновляет дерево.
+
+        Небольшой текст форматируется сразу, большой — в фоновом потоке
+        с прогрессом и возможностью отмены.
+        """
+        xml_text = self.snapshots.text()
+        if len(xml_text) <= self.FORMAT_SYNC_LIMIT:
+            try:
+                self._apply_formatted_text(pretty_format(xml_text, self._format_indent()))
+            except ExpatError as e:
+                QMessageBox.critical(self, "Ошибка форматирования", f"XML некорректен:\n{str(e)}")
+            return
+        self._start_formatter(format_text, xml_text, self._format_indent(),
+                              on_result=self._apply_formatted_text, version=self.snapshots.revision)
+
+    def pretty_format_file(self):
+        """Форматирует XML-файл с диска в другой файл, не загружая его в редактор."""
+        source_path, _ = QFileDialog.getOpenFileName(self, "Форматировать файл", "", "XML Files (*.xml);;All Files (*)")
+        if not source_path:
+            return
+        root, ext = os.path.splitext(source_path)
+        target_path, _ = QFileDialog.getSaveFileName(self, "Сохранить отформатированный файл",
+                                                     f"{root}.formatted{ext}", "XML Files (*.xml);;All Files (*)")
+        if not target_path:
+            return
+        if os.path.abspath(target_path) == os.path.abspath(source_path):
+            QMessageBox.warning(self, "Форматирование", "Выберите для результата другой файл.")
+            return
+        self._start_formatter(format_file, source_path, target_path, self._format_indent(),
+                              on_result=self.on_file_formatted)
+
+    def _plain_highlight_limit_mb(self) -> int:
+        """Возвращает из настроек размер текста (МБ), выше которого подсветка отключается."""
+        return self.settings.value("highlight/plain_limit_mb", 200, type=int)
+
+    def _set_editor_text(self, text: str):
+        """Заменяет весь текст редактора, выбирая режим подсветки по его размеру.
+
+        Текст длиннее ``PROGRESSIVE_LOAD_LIMIT`` вставляется порциями
+        (``ProgressiveLoad``): снимок ревизии и дерево доступны сразу,
+        а подсветка и проверка начинаются после вставки.
+        """
+        self._cancel_text_load()
+        self.highlight_scheduler.prepare(len(text))
+        if len(text) > self.PROGRESSIVE_LOAD_LIMIT:
+            self.editor.setPlainText("")
+            # Снимок ревизии — весь текст, хотя в редактор он ещё не вставлен
+            self.snapshots.adopt(self.snapshots.revision, text)
+            self.live_validator.stop()
+            self._text_load = ProgressiveLoad(self.editor, text, self)
+            self._text_load.progress.connect(self._progress_bar.setValue)
+            self._text_load.finished.connect(self._on_text_loaded)
+            self.status_bar.showMessage("Вставка текста в редактор...")
+            self._progress_bar.setRange(0, 100)
+            self._progress_bar.setValue(0)
+            self._progress_bar.setVisible(True)
+            self._text_load.start()
+            return
+        self.editor.setPlainText(text)
+        # Переданная строка и есть текст новой ревизии: копировать его из редактора не нужно
+        self.snapshots.adopt(self.snapshots.revision, text)
+        self._start_highlighting()
+
+    def _start_highlighting(self):
+        """Запускает подсветку текста, установленного в редактор."""
+        self.highlight_scheduler.start()
+        if self.highlight_scheduler.mode == HighlightScheduler.PLAIN:
+            self.status_bar.showMessage("Подсветка отключена: текст больше заданного в настройках размера")
+
+    def _on_text_loaded(self):
+        """Завершает вставку текста порциями: подсветка, проверка и отложенное выделение."""
+        self._text_load.deleteLater()
+        self._text_load = None
+        self._hide_progress()
+        # Окно подсчёта элементов не видело вставку (сигналы документа были заблокированы)
+        self.document_stats.refresh_window()
+        self._start_highlighting()
+        self.live_validator.validate_now()
+        if self._pending_selection is not None:
+            start, end = self._pending_selection
+            self._pending_selection = None
+            self._select_range(start, end)
+        self.update_status()
+
+    def _complete_text_load(self):
+        """Вставляет остаток загружаемого текста сразу: правке нужен весь текст в редакторе."""
+        if self._text_load is not None:
+            self._text_load.complete()
+
+    def _cancel_text_load(self):
+        """Прекращает вставку текста порциями, если текст редактора заменяется."""
+        if self._text_load is not None:
+            self._text_load.cancel()
+            self._text_load.deleteLater()
+            self._text_load = None
+            self._pending_selection = None
+            self._hide_progress()
+
+    def _defer_selection(self, start: int, end: int) -> bool:
+        """Откладывает выделение участка, который ещё не вставлен в редактор."""
+        if self._text_load is None or end <= self._text_load.loaded:
+            return False
+        self._pending_selection = (start, end)
+        self.status_bar.showMessage("Текст ещё вставляется: переход выполнится после")
+        return True
+
+    def _format_indent(self) -> str:
+        """Возвращает строку отступа для форматирования из настроек."""
+        return self.settings.value("format/indent", "  ")
+
+    def _start_formatter(self, fn, *args, on_result, version=None):
+        """Запускает задачу форматирования и показывает прогресс с кнопкой отмены."""
+        if self.task_scheduler.is_running("format"):
+            QMessageBox.information(self, "Форматирование", "Форматирование уже выполняется.")
+            return
+        self._show_progress("Форматирование XML...")
+
+        def finished(result):
+            self._hide_progress()
+            on_result(result)
+
+        self.task_scheduler.submit(
+            "format", fn, *args,
+            on_result=finished,
+            on_error=self.on_format_error,
+            on_progress=self._progress_bar.setValue,
+            on_cancelled=self.on_format_cancelled,
+            on_stale=self.on_format_stale,
+            version=version,
+        )
+
+    def _show_progress(self, message: str):
+        """Показывает сообщение, пустой прогресс и кнопку отмены фоновой операции."""
+        self.status_bar.showMessage(message)
+        self._progress_bar.setRange(0, 100)
+        self._progress_bar.setValue(0)
+        self._progress_bar.setVisible(True)
+        self._cancel_button.setVisible(True)
+
+    def _hide_progress(self):
+        """Скрывает прогресс и кнопку отмены после фоновой операции."""
+        self._progress_bar.setVisible(False)
+        self._cancel_button.setVisible(False)
+
+    def _apply_formatted_text(self, formatted: str):
+        """Подставляет отформатированный текст в редактор и перестраивает дерево."""
+        self._set_editor_text(formatted)
+        self.is_dirty = True
+        self.status_bar.showMessage("XML отформатирован")
+        self.build_tree_from_editor()
+
+    def on_file_formatted(self, target_path: str):
+        """Сообщает, куда записан отформатированный файл."""
+        self.status_bar.showMessage(f"Отформатированный XML сохранён: {target_path}")
+
+    def on_format_stale(self):
+        """Отбрасывает результат: пока шло форматирование, текст изменился."""
+        self._hide_progress()
+        self.status_bar.showMessage("Текст изменился во время форматирования, результат отброшен")
+
+    def on_format_error(self, error):
+        """Показывает ошибку форматирования."""
+        self._hide_progress()
+        self.status_bar.showMessage("Ошибка форматирования")
+        if isinstance(error, ExpatError):
+            QMessageBox.critical(self, "Ошибка форматирования", f"XML некорректен:\n{str(error)}")
+        else:
+            QMessageBox.critical(self, "Ошибка форматирования", str(error))
+
+    def on_format_cancelled(self):
+        """Сообщает об отмене форматирования."""
+        self._hide_progress()
+        self.status_bar.showMessage("Форматирование отменено")
+
+    def cancel_background_task(self):
+        """Прерывает выполняющиеся загрузку файла, форматирование и замену."""
+        self.task_scheduler.cancel("load")
+        self.task_scheduler.cancel("format")
+        self.task_scheduler.cancel("replace")
+        if self._batch_edit is not None:
+            self._batch_edit.cancel()
+
     def load_settings(self):
         """Загружает сохранённые настройки окна, шрифта, цветов и облика."""
         # Загрузка настроек
@@ -542,23 +1019,25 @@ class XMLEditor(QMainWindow):
 
         # Цвет подсветки тегов
         self.highlighter.set_tag_color(QColor(tag_color))
+        # Размер текста, выше которого подсветка отключается
+        self.highlight_scheduler.plain_limit = self._plain_highlight_limit_mb() * 1024 * 1024
         # Отображение дерева по умолчанию
         # Ничего не строим до загрузки файла/текста
         
             
     def closeEvent(self, event):
         """Останавливает фоновые потоки и сохраняет состояние перед выходом."""
-        # Останавливаем фоновые потоки при закрытии
-        if self._tree_builder_thread and self._tree_builder_thread.isRunning():
-            self._tree_builder_thread.terminate()
-            self._tree_builder_thread.wait()
-        if self._file_loader_thread and self._file_loader_thread.isRunning():
-            self._file_loader_thread.terminate()
-            self._file_loader_thread.wait()
         # Сохранение настроек при закрытии
         if not self.confirm_save_if_dirty():
             event.ignore()
             return
+        # Отменяем фоновые задачи и дожидаемся их завершения
+        self.recent_prefetch.stop()
+        self.live_validator.stop()
+        self.task_scheduler.shutdown()
+        self._cancel_text_load()
+        self.large_file.close()
+        self.highlight_scheduler.stop()
         self.settings.setValue("window/geometry", self.saveGeometry())
         event.accept()
 
@@ -568,282 +1047,238 @@ class XMLEditor(QMainWindow):
         self.tree.setVisible(visible)
 
     def build_tree_from_editor(self):
-        """Строит дерево на основе текущего содержимого редактора."""
-        self.build_tree_from_text(self.editor.toPlainText())
+        """Строит дерево на основе текущего содержимого редактора.
+
+        Если текст этой ревизии уже разобран, документ берётся из снимка;
+        если правки уместились в одном элементе, разбирается заново только он.
+        """
+        snapshot = self.snapshots.snapshot()
+        if snapshot.has_document():
+            self.on_tree_built(snapshot.document())
+        else:
+            self.build_tree_from_text(snapshot.text, self.snapshots.edit_base())
 
-    def build_tree_from_text(self, text: str):
-        """Асинхронно строит дерево из заданного XML-текста."""
-        self.tree.clear()
+    def build_tree_from_text(self, text: str, base=None):
+        """Асинхронно строит дерево из заданного XML-текста.
+
+        ``base`` — основа для разбора только изменённого элемента
+        (см. ``SnapshotService.edit_base``). Текущее дерево остаётся
+        на экране, пока не готов новый документ; затем модель обновляет
+        только изменившиеся строки.
+        """
         if not text.strip():
+            self.tree_model.clear()
+            self.problems_panel.set_problems([])
+            self.xpath_query.set_document(None)
             return
         
         # Показываем индикатор загрузки
         self.status_bar.showMessage("Построение дерева...")
         
-        # Запускаем построение дерева в отдельном потоке
-        if self._tree_builder_thread and self._tree_builder_thread.isRunning():
-            self._tree_builder_thread.terminate()
-            self._tree_builder_thread.wait()
-        
-        self._tree_builder_thread = TreeBuilderThread(text)
-        self._tree_builder_thread.tree_ready.connect(self.on_tree_built)
-        self._tree_builder_thread.error_occurred.connect(self.on_tree_build_error)
-        self._tree_builder_thread.start()
+        # Новое построение отменяет предыдущее, ещё не завершённое; дерево
+        # для устаревшей ревизии не показывается — строится заново
+        revision = self.snapshots.revision
+        self.task_scheduler.submit(
+            "tree", build_document, text, revision, base,
+            on_result=self.on_tree_built,
+            on_error=self._on_tree_task_error,
+            on_stale=self.build_tree_from_editor,
+            version=revision,
+        )
+
+    def _on_tree_task_error(self, error):
+        """Переводит исключение задачи построения дерева в сообщение об ошибке.
+
+        Ошибки XML сюда не попадают: дерево строится частично, а они
+        показываются в панели ошибок.
+        """
+        self.on_tree_build_error(f"Неожиданная ошибка: {str(error)}")
 
     
 
-    def _make_item_for_element(self, elem: ET.Element, path_indices) -> QTreeWidgetItem:
-        """Создаёт визуальный элемент дерева для XML-узла с иконкой."""
-        # Значение элемента (без пробелов по краям)
-        value = (elem.text or "").strip()
-        attrs = " ".join([f"{k}={v}" for k, v in elem.attrib.items()])
-        children = list(elem)
-        has_children = bool(children)
-        has_text = bool(value)
-        has_attrs = bool(elem.attrib)
-
-        #Иконки для узлов дерева
-        if has_children:
-            prefix = "📦"  # контейнер элемента
-        elif has_text and has_attrs:
-            prefix = "🧾"  # элемент с данными и атрибутами
-        elif has_text:
-            prefix = "📝"  # текстовый элемент
-        elif has_attrs:
-            prefix = "🏷️"  # элемент только с атрибутами
-        else:
-            prefix = "📄"  # пустой листовой элемент
-
-        item = QTreeWidgetItem([f"{prefix} {elem.tag}", value, attrs])
-        # Храним путь до элемента
-        item.setData(0, Qt.UserRole, path_indices)
-        # Делаем элемент редактируемым
-        item.setFlags(item.flags() | Qt.ItemIsEditable)
-        # Отложеннное раскрытие детей
-        if has_children:
-            # Добавляем заглушку для последующей подгрузки дочерних узлов
-            dummy = QTreeWidgetItem(["Загрузка…", "", ""])
-            dummy.setData(0, self._DUMMY_ROLE, True)
-            item.addChild(dummy)
-        return item
-
-    def on_tree_item_clicked(self, item: QTreeWidgetItem):
+    def on_tree_item_clicked(self, index: QModelIndex):
         """Переходит к соответствующему элементу в тексте при клике по дереву."""
-        # По клику переходим к соответствующему элементу в тексте
-        visual = item.text(0) or ""
-        # Элемент формируется как "<эмодзи> <tag>", извлекаем чистое имя тега
-        pure_tag = visual.split(" ", 1)[1] if " " in visual else visual
-        if not pure_tag or pure_tag == "XML Document":
-            return
-        #Позиционирование элемент, используя путь индексов
-        path_indices = item.data(0, Qt.UserRole)
-        if isinstance(path_indices, list):
-            pos = self._find_position_for_path(pure_tag, path_indices)
-            if pos is not None:
-                cursor = self.editor.textCursor()
-                cursor.setPosition(pos)
-                # Выделим открывающий тег
-                end_pos = self.editor.toPlainText().find('>', pos)
-                if end_pos != -1:
-                    cursor.setPosition(end_pos + 1, QTextCursor.KeepAnchor)
-                self.editor.setTextCursor(cursor)
-                self.editor.ensureCursorVisible()
-                self.status_bar.showMessage(f"Найден элемент: {pure_tag}")
+        if self.large_file.is_open:
+            node_id = self.large_file.model.node_id(index)
+            if node_id is None:
                 return
+            # Скелет описывает файл до правок: позиции переводятся в позиции текста
+            start, end = self.large_file.model.start_tag_span(node_id)
+            current = self.large_file.from_original(start)
+            if current is None:
+                self.status_bar.showMessage("Элемент удалён правкой")
+            elif not self.large_view.select_span(current, current + end - start):
+                self.status_bar.showMessage("Строки до элемента ещё считаются: переход выполнится после")
+            return
+        node_id = self.tree_model.node_id(index)
+        if node_id is None:
+            return
+        tag_name = self.tree_model.document().tag(node_id)
+        #Позиционирование по индексу смещений: выделяем открывающий тег целиком
+        document, current_id = self._resolve_tree_node(node_id)
+        if current_id is not None:
+            self._select_range(*document.store.start_tag_span(current_id))
+            self.status_bar.showMessage(f"Найден элемент: {tag_name}")
+            return
         #Ищем первое вхождение
-        self.highlight_element_in_text(pure_tag)
-
-    def _find_position_for_path(self, tag_name: str, path_indices):
-        """Находит позицию в тексте для элемента по пути индексов."""
-        xml_text = self.editor.toPlainText()
-        try:
-            root = ET.fromstring(xml_text)
-        except ET.ParseError:
-            return None
-
-        # Найти целевой элемент по пути
-        target = self._get_element_by_path(root, path_indices)
-        if target is None:
-            return None
-
-        # Подсчитать порядковый номер целевого тега среди всех элементов с таким же именем
-        occurrence = 0
-        target_occurrence = None
-
-        def preorder_count(elem):
-            nonlocal occurrence, target_occurrence
-            if elem.tag == tag_name:
-                occurrence += 1
-                if elem is target:
-                    target_occurrence = occurrence
-                    return True  
-            for child in list(elem):
-                if preorder_count(child):
-                    return True
-            return False
+        self.highlight_element_in_text(tag_name)
 
-        preorder_count(root)
-        if not target_occurrence:
-            return None
-
-        needle = f"<{tag_name}"
-        idx = -1
-        start = 0
-        for _ in range(target_occurrence):
-            idx = xml_text.find(needle, start)
-            if idx == -1:
-                return None
-            start = idx + 1
-        return idx
+    def select_tree_node(self, node_id: int):
+        """Выделяет узел документа дерева в дереве и его открывающий тег в тексте."""
+        if self.tree_model.document() is not self.xpath_query.document:
+            return
+        index = self.tree_model.index_for_node(node_id)
+        # Свёрнутые предки узла раскрываются при прокрутке к нему
+        self.tree.setCurrentIndex(index)
+        self.tree.scrollTo(index)
+        self.on_tree_item_clicked(index)
+
+    def open_query_panel(self):
+        """Показывает панель запросов XPath и переводит фокус в строку запроса."""
+        self.query_panel.show()
+        self.query_panel.raise_()
+        self.query_panel.input.setFocus()
+        self.query_panel.input.selectAll()
+
+    def _resolve_tree_node(self, node_id: int):
+        """Возвращает (документ текущей версии, номер узла в нём) для узла дерева.
+
+        Если текст изменился после построения дерева, узел ищется в текущем
+        документе по тому же пути индексов. При неудаче номер узла — None.
+        Дерево, построенное с ошибками по текущему тексту, используется как есть.
+        """
+        tree_document = self.tree_model.document()
+        if tree_document is not None and tree_document.version == self.snapshots.revision:
+            return tree_document, node_id
+        document = self._current_document()
+        if document is None or tree_document is None:
+            return document, None
+        if tree_document is not document:
+            node_id = document.store.node_by_path(tree_document.store.path_of(node_id))
+        return document, node_id
 
     def highlight_element_in_text(self, tag_name):
         """Выделяет первое вхождение открывающего тега в редакторе."""
-        text = self.editor.toPlainText()
+        document = self._current_document()
+        if document is not None:
+            # Первый элемент с таким именем ищется по массиву номеров имён
+            name_id = document.store.name_id(tag_name)
+            if name_id is None:
+                return
+            node_id = document.store.tag_id.index(name_id)
+            self._select_range(*document.store.start_tag_span(node_id))
+            self.status_bar.showMessage(f"Найден элемент: {tag_name}")
+            return
+        text = self.snapshots.text()
         # Ищем первое вхождение тега
         start_pos = text.find(f"<{tag_name}")
         if start_pos != -1:
             # Выделяем открывающий тег целиком
             end_pos = text.find('>', start_pos)
-            cursor = self.editor.textCursor()
-            if end_pos != -1 and end_pos > start_pos:
-                cursor.setPosition(start_pos)
-                cursor.setPosition(end_pos + 1, QTextCursor.KeepAnchor)
-            else:
-                cursor.setPosition(start_pos)
-            self.editor.setTextCursor(cursor)
-            self.editor.ensureCursorVisible()
+            self._select_range(start_pos, end_pos + 1 if end_pos != -1 else start_pos)
             self.status_bar.showMessage(f"Найден элемент: {tag_name}")
 
-    def on_tree_item_changed(self, item: QTreeWidgetItem, column: int):
-        """Синхронизирует изменение значения в дереве с XML-текстом."""
-        if self._suppress_tree_update:
-            return
-        # Интересует изменение значения (колонка 1)
-        if column != 1:
-            return
-        path_indices = item.data(0, Qt.UserRole)
-        if path_indices is None:
-            return
-        new_value = item.text(1)
-        xml_text = self.editor.toPlainText()
-        try:
-            root = ET.fromstring(xml_text)
-        except ET.ParseError:
-            # Если текущий текст некорректен, откатим визуальное изменение
-            self._suppress_tree_update = True
-            # Перестроим дерево из текущего текста (ничего не меняем)
-            self.build_tree_from_text(xml_text)
-            self._suppress_tree_update = False
-            QMessageBox.critical(self, "Ошибка XML", "Текущий XML некорректен, изменение невозможно.")
-            return
+    def on_tree_item_changed(self, node_id: int, column: int, new_value: str):
+        """Переносит правку значения или атрибутов из дерева в XML-текст.
 
-        # Найдем элемент по пути индексов
-        target = self._get_element_by_path(root, path_indices)
-        if target is None:
+        Заменяется только текст элемента или участок атрибутов его
+        открывающего тега; остальной документ не переформатируется.
+        """
+        if column not in (XmlTreeModel.VALUE_COLUMN, XmlTreeModel.ATTRIBUTES_COLUMN):
             return
-        target.text = new_value
-
-        #ОБбратно в текст
-        rough = ET.tostring(root, encoding='unicode')
-        try:
-            pretty = minidom.parseString(rough).toprettyxml(indent="  ")
-            pretty_lines = [line for line in pretty.splitlines() if line.strip()]
-            new_xml = "\n".join(pretty_lines)
-        except Exception:
-            new_xml = rough
-
-        self._suppress_tree_update = True
-        self.editor.blockSignals(True)
-        self.editor.setPlainText(new_xml)
-        self.editor.blockSignals(False)
-        self.is_dirty = True
-        self.status_bar.showMessage("Значение элемента обновлено из дерева")
-        # Перестроим дерево из нового текста
-        self.build_tree_from_text(new_xml)
-        self._suppress_tree_update = False
-
-    def _get_element_by_path(self, root_elem: ET.Element, path_indices):
-        """Возвращает потомка по списку индексов детей от корня."""
-        elem = root_elem
-        for idx in path_indices:
-            children = list(elem)
-            if idx < 0 or idx >= len(children):
-                return None
-            elem = children[idx]
-        return elem
-
-    def on_item_expanded(self, item: QTreeWidgetItem):
-        """Лениво подгружает детей при раскрытии узла, удаляя заглушку."""
-        # Если уже подгружено (нет заглушек) — выходим
-        if item.childCount() == 0:
+        document, node_id = self._resolve_tree_node(node_id)
+        if document is None:
+            # Текущий текст некорректен: перестроим дерево из него (ничего не меняем)
+            self.build_tree_from_editor()
+            QMessageBox.critical(self, "Ошибка XML", "Текущий XML некорректен, изменение невозможно.")
             return
-        first_child = item.child(0)
-        if not first_child.data(0, self._DUMMY_ROLE):
+        if node_id is None:
             return
 
-        # Для обычных файлов используем текст редактора
-        path_indices = item.data(0, Qt.UserRole) or []
-        xml_text = self.editor.toPlainText()
-        try:
-            root = ET.fromstring(xml_text)
-        except ET.ParseError:
-            return
-        parent_elem = self._get_element_by_path(root, path_indices)
-        if parent_elem is None:
+        if column == XmlTreeModel.VALUE_COLUMN:
+            edit = document.value_edit(node_id, new_value)
+            message = "Значение элемента обновлено из дерева"
+        else:
+            edit = document.attributes_edit(node_id, parse_attributes(new_value))
+            message = "Атрибуты элемента обновлены из дерева"
+        if edit is None:
             return
-
-        self._suppress_tree_update = True
-        self.tree.blockSignals(True)
-        self.tree.setUpdatesEnabled(False)
-        try:
-            # Удаляем заглушку
-            item.takeChild(0)
-            # Добавляем реальных детей (только одно «поколение»)
-            for idx, child in enumerate(list(parent_elem)):
-                child_item = self._make_item_for_element(child, path_indices + [idx])
-                item.addChild(child_item)
-        finally:
-            self.tree.setUpdatesEnabled(True)
-            self.tree.blockSignals(False)
-            self._suppress_tree_update = False
-
-    def on_tree_built(self, root_item):
-        """Добавляет построенное дерево на виджет и завершает обновление UI."""
-        self._suppress_tree_update = True
-        self.tree.blockSignals(True)
-        self.tree.setUpdatesEnabled(False)
-        try:
-            self.tree.addTopLevelItem(root_item)
+        self._splice_text(edit)
+        self.status_bar.showMessage(message)
+        # Дерево обновит только изменившиеся строки
+        self.build_tree_from_editor()
+
+    def _splice_text(self, edits):
+        """Заменяет участки текста одним шагом отмены, не трогая остальной документ.
+
+        ``edits`` — непересекающиеся правки (начало, конец, замена) в позициях
+        строки снимка, упорядоченные по началу.
+        """
+        self._complete_text_load()
+        positions = self.snapshots.positions()
+        cursor = QTextCursor(self.editor.document())
+        cursor.beginEditBlock()
+        # С конца: правка не сдвигает позиции предыдущих
+        for start, end, replacement in reversed(edits):
+            cursor.setPosition(positions.to_qt(start))
+            cursor.setPosition(positions.to_qt(end), QTextCursor.KeepAnchor)
+            cursor.insertText(replacement)
+        cursor.endEditBlock()
+
+    def on_tree_built(self, document):
+        """Показывает разобранный документ в дереве и завершает обновление UI."""
+        if document.problems:
+            # Частичное дерево не заменяет разбор корректного текста
+            self.status_bar.showMessage(f"Дерево построено с ошибками: {len(document.problems)}")
+        else:
+            # Разобранный документ переиспользуется, пока текст не изменится
+            self.snapshots.adopt(document.version, document.text, document)
             self.status_bar.showMessage("Дерево построено")
-        finally:
-            self.tree.setUpdatesEnabled(True)
-            self.tree.blockSignals(False)
-            self._suppress_tree_update = False
+        self._show_tree_document(document)
         # По умолчанию не раскрываем всё дерево
 
+    def _show_tree_document(self, document):
+        """Показывает документ в дереве, а его ошибки разбора — в панели ошибок."""
+        self.tree_model.update_document(document)
+        self.problems_panel.set_problems(document.problems)
+        # Активный запрос XPath повторяется для нового документа
+        self.xpath_query.set_document(document)
+
     def on_tree_build_error(self, error_msg):
         """Показывает ошибку, возникшую при построении дерева."""
         self.status_bar.showMessage("Ошибка построения дерева")
         QMessageBox.critical(self, "Ошибка XML", f"Не удалось построить дерево: {error_msg}")
 
-    def on_file_loaded(self, file_path, content):
-        """Заполняет редактор содержимым загруженного файла и строит дерево."""
+    def on_file_loaded(self, file_path, content, store=None, problems=()):
+        """Заполняет редактор содержимым загруженного файла и показывает дерево.
+
+        Хранилище узлов ``store`` построено загрузчиком по ходу чтения; без
+        него дерево строится из текста обычным путём. Ошибки XML
+        (``problems``) открывают панель ошибок.
+        """
         # Скрываем прогресс-бар
-        self._progress_bar.setVisible(False)
+        self._hide_progress()
+        self._close_large_file()
         
         self.current_file = file_path
         
         # Загружаем текст без генерации события textChanged, чтобы не пометить документ как измененный
         self.editor.blockSignals(True)
-        self.editor.setPlainText(content)
+        self._set_editor_text(content)
         self.editor.blockSignals(False)
         self.is_dirty = False
         self.update_status()
-        self.status_bar.showMessage(f"Файл загружен: {file_path}")
+        if self.highlight_scheduler.mode != HighlightScheduler.PLAIN:
+            self.status_bar.showMessage(f"Файл загружен: {file_path}")
         self._refresh_window_title()
         
-        # Построение дерева из текущего текста
-        self.build_tree_from_text(self.editor.toPlainText())
+        if store is None:
+            self.build_tree_from_text(content)
+        else:
+            # Текст редактора совпадает с прочитанным, повторный разбор не нужен
+            self.on_tree_built(XmlDocument(self.snapshots.revision, store, content, problems))
+            if problems:
+                self.problems_panel.show()
         # Обновляем список недавних
         self._add_recent_file(file_path)
 
@@ -921,7 +1356,7 @@ class XMLEditor(QMainWindow):
 
     def on_file_load_error(self, error_msg):
         """Показывает сообщение об ошибке при неудачной загрузке файла."""
-        self._progress_bar.setVisible(False)
+        self._hide_progress()
         self.status_bar.showMessage("Ошибка загрузки файла")
         QMessageBox.critical(self, "Ошибка", f"Не удалось открыть файл: {error_msg}")
 
@@ -929,6 +1364,11 @@ class XMLEditor(QMainWindow):
         """Обновляет индикатор прогресса загрузки файла."""
         self._progress_bar.setValue(progress)
 
+    def on_file_load_cancelled(self):
+        """Скрывает прогресс после отмены загрузки файла."""
+        self._hide_progress()
+        self.status_bar.showMessage("Загрузка отменена")
+
 
     
 
@@ -1035,6 +1475,12 @@ class XMLEditor(QMainWindow):
             bg_color=pal.color(QPalette.Base).name(),
             word_wrap=self.editor.wordWrapMode() != QTextOption.NoWrap,
             tag_color=self.settings.value("appearance/tag_color", "#0066cc"),
+            indent=self._format_indent(),
+            plain_limit_mb=self._plain_highlight_limit_mb(),
+            large_limit_mb=self._large_file_limit_mb(),
+            index_cache_mb=self._index_cache_mb(),
+            prefetch_files=self._prefetch_files(),
+            prefetch_mb=self._prefetch_mb(),
         )
         if dlg.exec_() == QDialog.Accepted:
             vals = dlg.values()
@@ -1064,9 +1510,25 @@ class XMLEditor(QMainWindow):
             self.settings.setValue("appearance/bg_color", vals["bg_color"]) 
             self.settings.setValue("appearance/word_wrap", bool(vals["word_wrap"]))
             self.settings.setValue("appearance/tag_color", vals["tag_color"]) 
+            self.settings.setValue("format/indent", vals["indent"])
+            self.settings.setValue("highlight/plain_limit_mb", vals["plain_limit_mb"])
+            self.settings.setValue("large_file/limit_mb", vals["large_limit_mb"])
+            self.settings.setValue("cache/max_mb", vals["index_cache_mb"])
+            self.index_cache.max_bytes = vals["index_cache_mb"] * 1024 * 1024
+            self.settings.setValue("cache/prefetch_files", vals["prefetch_files"])
+            self.settings.setValue("cache/prefetch_mb", vals["prefetch_mb"])
+            self.document_cache.max_bytes = vals["prefetch_mb"] * 1024 * 1024
+            self.document_cache.trim()
+            if vals["prefetch_files"] > 0:
+                self.recent_prefetch.start()
+            else:
+                self.recent_prefetch.stop()
+                self.document_cache.clear()
 
             # Применить к подсветке
             self.highlighter.set_tag_color(QColor(vals["tag_color"]))
+            self.highlight_scheduler.plain_limit = vals["plain_limit_mb"] * 1024 * 1024
+            self.highlight_scheduler.refresh()
 
     
 
@@ -0,0 +1,229 @@
+"""Разобранная модель XML-документа, общая для всех обработчиков.
+
+Документ разбирается один раз на каждую версию текста редактора и
+переиспользуется при раскрытии узлов дерева, навигации и редактировании,
+пока текст действительно не изменится. После правки внутри элемента
+разбирается заново только его содержимое (``reparse_document``).
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+from model.node_store import NodeStore, NodeStoreBuilder, XmlParseError, build_node_store
+
+
+class XmlDocument:
+    """Результат разбора XML-текста, привязанный к версии содержимого."""
+
+    def __init__(self, version: int, store: NodeStore, text: str = "", problems=()):
+        """Сохраняет номер версии, хранилище узлов, исходный текст и ошибки разбора.
+
+        Имя, значение и атрибуты узла вычисляются по требованию из ``text``.
+        ``problems`` — список (позиция, строка, столбец, сообщение) ошибок,
+        с которыми построено частичное дерево (см. ``locate_problems``).
+        """
+        self.version = version
+        self.store = store
+        self.text = text
+        self.problems = list(problems)
+
+    def tag(self, node_id: int) -> str:
+        """Возвращает имя элемента по номеру узла."""
+        return self.store.tag(node_id)
+
+    def value(self, node_id: int) -> str:
+        """Возвращает текст элемента до первого дочернего узла (без пробелов по краям)."""
+        return self.store.value(node_id, self.text)
+
+    def attributes(self, node_id: int):
+        """Возвращает список пар (имя, значение) атрибутов элемента."""
+        return self.store.attributes(node_id, self.text)
+
+    def value_edit(self, node_id: int, new_value: str):
+        """Возвращает правки [(начало, конец, замена), ...], задающие элементу новый текст.
+
+        Меняются только символьные данные элемента: отступы вокруг текста,
+        комментарии, инструкции обработки и остальной документ остаются байт
+        в байт. Новый текст занимает место первого непустого участка текста
+        (внутри CDATA он пишется без экранирования), остальные непустые
+        участки очищаются. Пустой элемент ``<a/>`` раскрывается в
+        ``<a>...</a>``. Если значение не изменилось, возвращает None.
+        """
+        if self.value(node_id) == new_value:
+            return None
+        store, text = self.store, self.text
+        start, open_end = store.start_tag_span(node_id)
+        if store.close_start[node_id] == open_end and text[open_end - 2:open_end] == "/>":
+            head = text[start:open_end - 2].rstrip()
+            return [(start, open_end, f"{head}>{escape(new_value)}</{store.tag(node_id)}>")]
+
+        text_start, text_end = store.text_span(node_id)
+        runs = [(run_start, run_end, cdata) for run_start, run_end, cdata in store.text_runs(node_id, text)
+                if text[run_start:run_end].strip()]
+        if not runs:
+            if text_start == text_end or text[text_start:text_end].strip() or store.first_child[node_id] != -1:
+                # У контейнера (или элемента с комментарием) текст вставляется перед концом участка
+                return [(text_end, text_end, escape(new_value))]
+            return [(text_start, text_end, escape(new_value))]
+        edits = []
+        for k, (run_start, run_end, cdata) in enumerate(runs):
+            raw = text[run_start:run_end]
+            # Пробелы по краям участков сохраняются
+            run_start += len(raw) - len(raw.lstrip())
+            run_end -= len(raw) - len(raw.rstrip())
+            if k:
+                edits.append((run_start, run_end, ""))
+            elif cdata:
+                edits.append((run_start, run_end, new_value.replace("]]>", "]]]]><![CDATA[>")))
+            else:
+                edits.append((run_start, run_end, escape(new_value)))
+        return edits
+
+    def attributes_edit(self, node_id: int, attrs):
+        """Возвращает правки [(начало, конец, замена), ...] атрибутов открывающего тега.
+
+        Меняются только значения изменившихся атрибутов (в прежних кавычках);
+        удалённые атрибуты вырезаются вместе с пробелами перед ними, новые
+        дописываются после последнего атрибута. Порядок, кавычки, переводы
+        строк и ссылки на символы остальных атрибутов остаются как есть.
+        Если атрибуты не изменились, возвращает None.
+        """
+        store, text = self.store, self.text
+        new_values = dict(attrs)
+        old_spans = store.attribute_spans(node_id, text)
+        old_values = dict(self.attributes(node_id))
+        edits = []
+        start, _ = store.start_tag_span(node_id)
+        previous_end = start + 1 + len(store.tag(node_id))
+        for name, attr_start, value_start, value_end, attr_end in old_spans:
+            if name not in new_values:
+                edits.append((previous_end, attr_end, ""))
+            elif new_values[name] != old_values[name]:
+                quote = text[value_end]
+                entity = "&quot;" if quote == '"' else "&apos;"
+                edits.append((value_start, value_end, escape(new_values[name], {quote: entity})))
+            previous_end = attr_end
+        added = "".join(f" {name}={quoteattr(value)}" for name, value in new_values.items()
+                        if name not in old_values)
+        if added:
+            if edits and edits[-1][1] == previous_end and not edits[-1][2]:
+                # Последний атрибут удалён: новые встают на его место
+                edits[-1] = (edits[-1][0], previous_end, added)
+            else:
+                edits.append((previous_end, previous_end, added))
+        return edits or None
+
+
+def locate_problems(text: str, problems):
+    """Дополняет ошибки разбора номерами строки и столбца.
+
+    ``problems`` — пары (позиция, сообщение), упорядоченные по позиции.
+    Возвращает список (позиция, строка, столбец, сообщение); строка
+    считается с единицы, столбец — с нуля, как у ``check_well_formed``.
+    Переводы строк считаются за один проход по тексту.
+    """
+    located = []
+    line, counted = 1, 0
+    for position, message in problems:
+        line += text.count("\n", counted, position)
+        counted = position
+        column = position - text.rfind("\n", 0, position) - 1
+        located.append((position, line, column, message))
+    return located
+
+
+def parse_document(text: str, version: int, cancel_token=None, tolerant=False) -> XmlDocument:
+    """Разбирает XML-текст; при ошибке структуры выбрасывает ``XmlParseError``.
+
+    ``cancel_token`` (с методом ``raise_if_cancelled``) позволяет прервать
+    разбор из другого потока. В режиме ``tolerant`` разбор не прерывается
+    на ошибках: все они собираются в ``problems`` документа, а дерево
+    строится частично.
+    """
+    if not tolerant:
+        return XmlDocument(version, build_node_store(text, cancel_token), text)
+    builder = NodeStoreBuilder(cancel_token, tolerant=True)
+    builder.feed(text, final=True)
+    store = builder.close()
+    return XmlDocument(version, store, text, locate_problems(text, builder.problems))
+
+
+def reparse_document(document: XmlDocument, text: str, start: int, old_end: int, new_end: int,
+                     version: int, cancel_token=None):
+    """Строит документ для нового текста, разбирая заново только изменённый элемент.
+
+    Участок [start, old_end) прежнего текста ``document.text`` заменён
+    участком [start, new_end) нового текста ``text``. Берётся самый глубокий
+    элемент, содержимое которого включает правку; его новое содержимое
+    разбирается отдельно, должно быть сбалансировано и вставляется в копию
+    хранилища. Возвращает ``(документ, номер элемента)`` или None, если
+    правка задела теги вне элемента (или его собственные) и нужен полный разбор.
+    """
+    store = document.store
+    # Случайный «<» в тексте мог бы после правки начать разметку вне элемента
+    if store.stray_markup or len(text) - len(document.text) != new_end - old_end:
+        return None
+    node_id = store.enclosing_element(start, old_end)
+    if node_id is None:
+        return None
+    delta = new_end - old_end
+    content_start = store.open_end[node_id]
+    content_end = store.close_start[node_id] + delta
+    builder = NodeStoreBuilder(cancel_token, offset=content_start, fragment=True)
+    try:
+        builder.feed(text[content_start:content_end], final=True)
+        fragment = builder.close()
+    except XmlParseError:
+        return None
+    if fragment.stray_markup:
+        return None
+    return XmlDocument(version, store.splice(node_id, fragment, delta), text), node_id
+
+
+def _common_prefix(a: str, b: str, limit: int) -> int:
+    """Возвращает длину общего начала строк (не больше ``limit``)."""
+    step = 1 << 16
+    n = 0
+    while n < limit:
+        m = min(n + step, limit)
+        if a[n:m] != b[n:m]:
+            # Двоичный поиск первого различия внутри блока
+            lo, hi = n, m
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if a[n:mid] == b[n:mid]:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            return lo
+        n = m
+    return limit
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    """Возвращает длину общего окончания строк (не больше ``limit``)."""
+    step = 1 << 16
+    la, lb = len(a), len(b)
+    n = 0
+    while n < limit:
+        m = min(n + step, limit)
+        if a[la - m:la - n] != b[lb - m:lb - n]:
+            lo, hi = n, m
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if a[la - mid:la - n] == b[lb - mid:lb - n]:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            return lo
+        n = m
+    return limit
+
+
+def text_change_region(old: str, new: str):
+    """Возвращает (начало, конец в старом тексте, конец в новом) изменённого участка.
+
+    Сравнение идёт блоками строк, без посимвольного цикла на Python.
+    """
+    limit = min(len(old), len(new))
+    prefix = _common_prefix(old, new, limit)
+    suffix = _common_suffix(old, new, limit - prefix)
+    return prefix, len(old) - suffix, len(new) - suffix
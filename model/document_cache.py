@@ -0,0 +1,91 @@
+"""Разобранные документы в памяти для мгновенного открытия недавних файлов.
+
+``DocumentCache`` хранит текст, хранилище узлов и ошибки разбора файлов,
+прочитанных заранее (см. ``ui.recent_prefetch``). Запись годится, пока у
+файла прежние размер и время изменения. Открытие файла забирает запись
+из кэша: дальше хранилище узлов меняется правками в редакторе. Суммарный
+объём записей ограничен; сверх него удаляются записи, которые дольше
+всего не использовались.
+"""
+
+import os
+import sys
+from collections import OrderedDict
+
+
+class DocumentCache:
+    """Разобранные файлы общим объёмом до ``max_bytes`` байтов (0 — кэш отключен)."""
+
+    def __init__(self, max_bytes: int):
+        """Создаёт пустой кэш."""
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # Путь -> (размер, время изменения, текст, хранилище, ошибки, объём); в порядке использования
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        """Возвращает число записей."""
+        return len(self._entries)
+
+    def contains(self, path: str) -> bool:
+        """Проверяет, есть ли годная запись файла (не меняя порядок использования)."""
+        return self._valid_entry(path) is not None
+
+    def take(self, path: str):
+        """Забирает из кэша (текст, хранилище, ошибки) неизменившегося файла (или None)."""
+        entry = self._valid_entry(path)
+        if entry is None:
+            return None
+        self._remove(os.path.abspath(path))
+        return entry[2:5]
+
+    def put(self, path: str, stat, content: str, store, problems, evict: bool = True) -> bool:
+        """Добавляет разобранный файл; ``stat`` — сведения о файле на момент чтения.
+
+        С ``evict`` = False запись добавляется, только если помещается без
+        удаления других. Возвращает, добавлена ли запись.
+        """
+        key = os.path.abspath(path)
+        self._remove(key)
+        nbytes = sys.getsizeof(content) + (store.memory_size() if store is not None else 0)
+        if nbytes > self.max_bytes or (not evict and self.nbytes + nbytes > self.max_bytes):
+            return False
+        self._entries[key] = (stat.st_size, stat.st_mtime_ns, content, store, problems, nbytes)
+        self.nbytes += nbytes
+        self.trim()
+        return True
+
+    def free_bytes(self) -> int:
+        """Возвращает объём, доступный без удаления записей."""
+        return max(0, self.max_bytes - self.nbytes)
+
+    def trim(self):
+        """Удаляет давно не использованные записи, пока кэш больше ``max_bytes``."""
+        while self._entries and self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Удаляет все записи."""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _valid_entry(self, path: str):
+        """Возвращает запись файла, если он не изменился с момента чтения; иначе удаляет её."""
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(key)
+        except OSError:
+            stat = None
+        if stat is None or (stat.st_size, stat.st_mtime_ns) != entry[:2]:
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key: str):
+        """Удаляет запись по абсолютному пути (если есть)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[5]
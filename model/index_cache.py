@@ -0,0 +1,203 @@
+"""Кэш индексов структуры на диске для быстрого повторного открытия файлов.
+
+Для открытого файла сохраняется то, что дорого строить заново: хранилище
+узлов (``NodeStore``) и ошибки разбора обычного документа либо индекс строк
+и скелет дерева большого файла. Запись находится по пути и подходит, пока
+у файла прежние размер и время изменения; перед использованием она
+проверяется по хешу содержимого (BLAKE2), который считается при чтении
+файла.
+
+Запись — заголовок ``MAGIC``, длина и JSON-описание (путь, размер, время,
+хеш, вид записи, длины массивов и прочие поля), затем байты массивов
+подряд: массивы читаются ``array.fromfile`` без разбора. Суммарный размер
+записей ограничен: сверх него удаляются записи, которые дольше всего не
+использовались (время изменения записи обновляется при каждом чтении).
+Ошибки ввода-вывода кэша не мешают открытию файла: запись просто не
+используется.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+from array import array
+from model.large_file import LineIndex, Skeleton, TagScanner
+from model.node_store import NodeStore
+
+MAGIC = b"XEIDX1\n"
+# Виды записей: обычный документ и большой файл
+DOCUMENT, LARGE = "document", "large"
+# Массивы хранилища узлов в порядке записи
+_STORE_ARRAYS = ("start", "open_end", "close_start", "end", "parent", "first_child", "next_sibling", "tag_id")
+_SUFFIX = ".idx"
+
+
+def new_digest():
+    """Возвращает хеш для проверки содержимого файла."""
+    return hashlib.blake2b(digest_size=16)
+
+
+class IndexCache:
+    """Записи индексов файлов в папке ``directory`` общим размером до ``max_bytes``.
+
+    Методы можно вызывать из фоновых задач: запись и удаление записей
+    выполняются под блокировкой. ``max_bytes`` = 0 отключает кэш.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        """Запоминает папку кэша и его наибольший размер."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def lookup(self, path: str, kind: str):
+        """Возвращает заголовок записи вида ``kind`` для неизменившегося файла (или None)."""
+        if self.max_bytes <= 0:
+            return None
+        try:
+            stat = os.stat(path)
+            with open(self._entry_path(path, kind), 'rb') as file:
+                header = _read_header(file)
+        except (OSError, ValueError):
+            return None
+        if (header.get("path") != os.path.abspath(path) or header.get("size") != stat.st_size
+                or header.get("mtime") != stat.st_mtime_ns):
+            return None
+        return header
+
+    def load_document(self, path: str, header, digest: str):
+        """Возвращает (хранилище узлов, ошибки) из записи, если хеш файла совпал, иначе None."""
+        if header["hash"] != digest:
+            return None
+        arrays = self._load_arrays(path, DOCUMENT, header)
+        if arrays is None:
+            return None
+        store = NodeStore.from_arrays(arrays, header["names"], header["stray_markup"])
+        return store, [tuple(problem) for problem in header["problems"]]
+
+    def save_document(self, path: str, stat, digest: str, store, problems):
+        """Сохраняет хранилище узлов и ошибки разбора файла."""
+        arrays = {name: getattr(store, name) for name in _STORE_ARRAYS}
+        for name in ("start", "open_end", "close_start", "end"):
+            # Хранилище только что построено: сдвиг позиций ещё не накоплен
+            arrays[name] = arrays[name].raw
+        self._save(path, DOCUMENT, stat, digest, arrays, names=store.names,
+                   stray_markup=store.stray_markup, problems=[list(problem) for problem in problems])
+
+    def load_large(self, path: str, header):
+        """Возвращает (индекс строк, просмотр тегов, скелет) из записи (или None).
+
+        Хеш записи проверяется отдельно — чтением файла в фоне.
+        """
+        arrays = self._load_arrays(path, LARGE, header)
+        if arrays is None:
+            return None
+        lines = LineIndex(header["size"], header["block_size"])
+        lines.counts = arrays.pop("line_counts")
+        scanner = TagScanner(header["max_depth"], header["limit"])
+        scanner.position, scanner.count, scanner.truncated = header["size"], header["count"], header["truncated"]
+        return lines, scanner, Skeleton.from_arrays(arrays, header["names"])
+
+    def save_large(self, path: str, stat, digest: str, lines, scanner, skeleton):
+        """Сохраняет индекс строк и скелет дерева большого файла."""
+        arrays = skeleton.to_arrays()
+        arrays["line_counts"] = lines.counts
+        self._save(path, LARGE, stat, digest, arrays, names=skeleton.names, block_size=lines.block_size,
+                   max_depth=scanner.max_depth, limit=scanner.limit, count=scanner.count,
+                   truncated=scanner.truncated)
+
+    def remove(self, path: str, kind: str):
+        """Удаляет запись файла (например, если хеш не совпал)."""
+        with self._lock:
+            try:
+                os.remove(self._entry_path(path, kind))
+            except OSError:
+                pass
+
+    def total_size(self) -> int:
+        """Возвращает суммарный размер записей в байтах."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _entry_path(self, path: str, kind: str) -> str:
+        """Возвращает путь записи для файла ``path``."""
+        key = hashlib.sha1(f"{kind}:{os.path.abspath(path)}".encode('utf-8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _load_arrays(self, path: str, kind: str, header):
+        """Читает массивы записи и отмечает её как использованную (None при ошибке)."""
+        entry = self._entry_path(path, kind)
+        try:
+            with open(entry, 'rb') as file:
+                if _read_header(file) != header:
+                    return None
+                arrays = {}
+                for name, typecode, length in header["arrays"]:
+                    arrays[name] = array(typecode)
+                    arrays[name].fromfile(file, length)
+            os.utime(entry)
+        except (OSError, ValueError, EOFError):
+            return None
+        return arrays
+
+    def _save(self, path: str, kind: str, stat, digest: str, arrays, **fields):
+        """Записывает запись через временный файл и удаляет лишние старые записи."""
+        if self.max_bytes <= 0:
+            return
+        size = sum(a.itemsize * len(a) for a in arrays.values())
+        if size > self.max_bytes:
+            return
+        header = dict(path=os.path.abspath(path), size=stat.st_size, mtime=stat.st_mtime_ns, hash=digest,
+                      kind=kind, arrays=[[name, a.typecode, len(a)] for name, a in arrays.items()], **fields)
+        entry = self._entry_path(path, kind)
+        with self._lock:
+            try:
+                raw = json.dumps(header, ensure_ascii=False).encode('utf-8')
+                os.makedirs(self.directory, exist_ok=True)
+                with open(entry + ".tmp", 'wb') as file:
+                    file.write(MAGIC + struct.pack("<Q", len(raw)) + raw)
+                    for a in arrays.values():
+                        a.tofile(file)
+                os.replace(entry + ".tmp", entry)
+            except (OSError, ValueError):
+                return
+            self._evict(entry)
+
+    def _entries(self):
+        """Возвращает записи кэша: (путь, размер, время последнего использования)."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if item.name.endswith(_SUFFIX):
+                        stat = item.stat()
+                        entries.append((item.path, stat.st_size, stat.st_mtime))
+        except OSError:
+            pass
+        return entries
+
+    def _evict(self, keep: str):
+        """Удаляет давно не использованные записи, пока кэш больше ``max_bytes``."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for entry, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            try:
+                os.remove(entry)
+            except OSError:
+                continue
+            total -= size
+
+
+def _read_header(file):
+    """Читает JSON-заголовок записи; при неверном формате выбрасывает ValueError."""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Неверный формат записи кэша")
+    size = file.read(8)
+    if len(size) != 8:
+        raise ValueError("Запись кэша обрезана")
+    length = struct.unpack("<Q", size)[0]
+    return json.loads(file.read(length).decode('utf-8'))
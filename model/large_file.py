@@ -0,0 +1,343 @@
+"""Индекс строк и скелет структуры большого файла.
+
+Большой файл не загружается в редактор: он отображается в память, а для
+просмотра и навигации строятся два компактных индекса.
+
+``LineIndex`` хранит число строк до начала каждого блока файла (64 КБ):
+начало любой строки находится двоичным поиском блока и просмотром не
+более одного блока, а индекс 10-гигабайтного файла занимает около 1,3 МБ.
+
+``TagScanner`` просматривает теги файла потоком и выдаёт элементы
+верхних уровней (до ``max_depth``) с позициями в байтах; содержимое более
+глубоких элементов пропускается поиском закрывающего тега. Корректность
+XML не проверяется: закрывающий тег закрывает последний открытый элемент.
+
+Оба индекса строятся порциями, поэтому просмотр и дерево доступны
+задолго до конца файла.
+"""
+
+import html
+import re
+from array import array
+from bisect import bisect_left
+
+# Размер блока индекса строк в байтах
+BLOCK_SIZE = 1 << 16
+# Наибольшая показываемая длина строки в байтах
+MAX_LINE_BYTES = 1 << 16
+
+# Тег, комментарий, CDATA, инструкция или объявление; одиночный «<» —
+# незавершённая в этой порции разметка (или ошибка в тексте)
+_TAG_RE = re.compile(
+    rb'<(?:!--.*?-->|!\[CDATA\[.*?\]\]>|\?.*?\?>|!(?!--|\[CDATA\[)(?:[^>\[]|\[[^\]]*\])*>'
+    rb'|(/?)([^\s/>!?<]+)(?:"[^"]*"|\'[^\']*\'|[^"\'>])*?(/?)>|)', re.S)
+_ATTR_RE = re.compile(rb'([^\s=/<>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Незавершённая разметка дальше этого числа байтов от границы просмотра считается ошибкой
+_CARRY_LIMIT = 1 << 20
+# Окно поиска закрывающего тега при пропуске содержимого элемента
+_SKIP_WINDOW = 16 << 20
+# Имя -> (закрывающий тег, начало открывающего, шаблон открывающего тега)
+_OPENERS = {}
+# Байты, которыми может закончиться имя в закрывающем теге
+_NAME_ENDS = (b'>', b' ', b'\t', b'\r', b'\n')
+
+
+class LineIndex:
+    """Число переводов строки до начала каждого блока файла.
+
+    Строки нумеруются с нуля; перевод строки — ``\\n`` (``\\r`` перед ним
+    остаётся частью строки).
+    """
+
+    def __init__(self, size: int, block_size: int = BLOCK_SIZE):
+        """Создаёт пустой индекс файла размером ``size`` байтов."""
+        self.size = size
+        self.block_size = block_size
+        # counts[i] — число переводов строки до начала блока i
+        self.counts = array('q', [0])
+
+    @property
+    def indexed(self) -> int:
+        """Число просмотренных байтов от начала файла."""
+        return min(self.size, (len(self.counts) - 1) * self.block_size)
+
+    @property
+    def complete(self) -> bool:
+        """Проверяет, просмотрен ли весь файл."""
+        return self.indexed >= self.size
+
+    @property
+    def line_count(self) -> int:
+        """Число строк, начинающихся в просмотренной части файла."""
+        return self.counts[-1] + 1
+
+    def extend(self, block_counts):
+        """Добавляет числа переводов строки в очередных блоках."""
+        total = self.counts[-1]
+        for count in block_counts:
+            total += count
+            self.counts.append(total)
+
+    def line_start(self, data, line: int) -> int:
+        """Возвращает позицию начала строки ``line`` (не дальше ``line_count - 1``)."""
+        if line <= 0:
+            return 0
+        counts = self.counts
+        # counts[block] < line <= counts[block + 1]: перевод строки лежит в блоке block
+        block = bisect_left(counts, line) - 1
+        pos = block * self.block_size
+        for _ in range(line - counts[block]):
+            pos = data.find(b'\n', pos) + 1
+        return pos
+
+    def line_of(self, data, offset: int):
+        """Возвращает номер строки с позицией ``offset`` (или None, если блок ещё не просмотрен)."""
+        block = offset // self.block_size
+        if block >= len(self.counts):
+            return None
+        return self.counts[block] + data[block * self.block_size:offset].count(b'\n')
+
+
+def count_newlines(piece: bytes, block_size: int = BLOCK_SIZE):
+    """Возвращает числа переводов строки в каждом блоке порции ``piece``."""
+    return array('q', (piece.count(b'\n', pos, pos + block_size) for pos in range(0, len(piece), block_size)))
+
+
+def read_line(data, index: LineIndex, line: int):
+    """Возвращает (начало, байты строки без перевода, обрезана ли строка)."""
+    start = index.line_start(data, line)
+    end = data.find(b'\n', start, start + MAX_LINE_BYTES + 1)
+    if end == -1:
+        end = min(len(data), start + MAX_LINE_BYTES)
+        raw = data[start:end]
+        return start, raw, end - start == MAX_LINE_BYTES
+    return start, data[start:end].rstrip(b'\r'), False
+
+
+class TagScanner:
+    """Потоковый просмотр тегов файла для построения скелета структуры.
+
+    Состояние между вызовами ``scan`` — позиция продолжения и стек открытых
+    узлов. Содержимое элементов самого глубокого уровня не просматривается:
+    просмотр сразу переходит к их закрывающему тегу, поэтому работа
+    пропорциональна числу узлов скелета, а не числу тегов файла. После
+    ``limit`` узлов просмотр заканчивается (``truncated`` — True).
+    """
+
+    def __init__(self, max_depth: int = 3, limit: int = 500_000):
+        """Создаёт просмотр с начала файла."""
+        self.max_depth = max_depth
+        self.limit = limit
+        self.position = 0
+        self.count = 0
+        self.truncated = False
+        self.stack = []
+
+    def scan(self, data, stop: int, max_nodes: int = None):
+        """Просматривает ``data`` (байты или mmap) от ``position`` до ``stop``.
+
+        Возвращает (новые узлы, закрытые узлы): узел — кортеж (номер,
+        родитель, имя, начало, конец открывающего тега), закрытый —
+        (номер, конец элемента). Незавершённая перед ``stop`` разметка
+        остаётся для следующего вызова; пропуск содержимого элемента может
+        закончиться и дальше ``stop``. Просмотр прерывается и после
+        ``max_nodes`` новых узлов. В конце файла ``position`` равна его размеру.
+        """
+        nodes, closed = [], []
+        stack = self.stack
+        size = len(data)
+        stop = min(stop, size)
+        pos = self.position
+        while True:
+            m = _TAG_RE.search(data, pos, stop)
+            if m is None:
+                # Пропуск содержимого элемента мог уйти дальше ``stop``
+                pos = max(pos, stop)
+                break
+            close, name, empty = m.groups()
+            if name is None:
+                if m.end() - m.start() == 1 and stop < size and stop - m.start() < _CARRY_LIMIT:
+                    # Разметка продолжается за границей просмотра
+                    pos = m.start()
+                    break
+                pos = m.end()
+                continue
+            pos = m.end()
+            if close:
+                if stack:
+                    closed.append((stack.pop(), pos))
+                continue
+            if self.count >= self.limit:
+                # Остальные элементы в скелет не попадут
+                self.truncated = True
+                pos = size
+                break
+            node = self.count
+            self.count += 1
+            nodes.append((node, stack[-1] if stack else -1, name.decode('utf-8', 'replace'), m.start(), pos))
+            if empty:
+                closed.append((node, pos))
+            elif len(stack) + 1 < self.max_depth:
+                stack.append(node)
+            else:
+                end = _element_end(data, pos, name)
+                if end is None:
+                    # Элемент не закрыт до конца файла
+                    pos = size
+                    break
+                closed.append((node, end))
+                pos = end
+            if max_nodes is not None and len(nodes) >= max_nodes:
+                break
+        self.position = pos
+        return nodes, closed
+
+
+def _element_end(data, pos: int, name: bytes):
+    """Возвращает конец элемента ``name``, открытого перед ``pos`` (или None).
+
+    Вложенные элементы с тем же именем учитываются, комментарии и CDATA
+    пропускаются. Файл просматривается окнами, чтобы не копировать большие
+    участки.
+    """
+    patterns = _OPENERS.get(name)
+    if patterns is None:
+        patterns = _OPENERS[name] = (b'</' + name, b'<' + name, re.compile(
+            b'<' + re.escape(name) + rb'(?=[\s/>])(?:"[^"]*"|\'[^\']*\'|[^"\'>])*?(/?)>'))
+    close, prefix, opener = patterns
+    size = len(data)
+    depth = 1
+    while pos < size:
+        window_end = min(size, pos + _SKIP_WINDOW)
+        c = data.find(close, pos, window_end)
+        limit = c
+        if c == -1:
+            if window_end == size:
+                return None
+            # Тег у границы окна просматривается вместе со следующим окном
+            limit = data.rfind(b'<', pos, window_end)
+            if limit <= pos:
+                limit = window_end
+        bang = data.find(b'<!', pos, limit)
+        if bang != -1:
+            # Комментарий или CDATA пропускается целиком: теги в нём не считаются
+            depth += _count_opened(data, pos, bang, prefix, opener)
+            head = data[bang:bang + 9]
+            marker = b'-->' if head.startswith(b'<!--') else b']]>' if head == b'<![CDATA[' else b'>'
+            end = data.find(marker, bang + 2)
+            if end == -1:
+                return None
+            pos = end + len(marker)
+            continue
+        depth += _count_opened(data, pos, limit, prefix, opener)
+        if c == -1:
+            pos = limit
+            continue
+        after = data[c + len(close):c + len(close) + 1]
+        gt = data.find(b'>', c)
+        if gt == -1:
+            return None
+        pos = gt + 1
+        if after in _NAME_ENDS:
+            depth -= 1
+            if not depth:
+                return pos
+    return None
+
+
+def _count_opened(data, start: int, end: int, prefix: bytes, opener) -> int:
+    """Возвращает число незакрытых сразу открывающих тегов ``opener`` на участке."""
+    if data.find(prefix, start, end) == -1:
+        return 0
+    return sum(1 for m in opener.finditer(data, start, end) if not m.group(1))
+
+
+class Skeleton:
+    """Элементы верхних уровней большого файла с позициями в байтах.
+
+    Номера узлов идут в порядке документа; ``end`` — -1, пока закрывающий
+    тег не найден. Списки детей хранятся отдельно от узлов: узел виден
+    в дереве только после ``attach``.
+    """
+
+    def __init__(self):
+        """Создаёт пустой скелет."""
+        self.parent = array('i')
+        self.tag_id = array('i')
+        self.start = array('q')
+        self.open_end = array('q')
+        self.end = array('q')
+        self.names = []
+        self._name_ids = {}
+        # Номер узла -> номера его детей; -1 — корневые элементы
+        self._children = {-1: array('i')}
+
+    def __len__(self):
+        """Возвращает число узлов."""
+        return len(self.parent)
+
+    @classmethod
+    def from_arrays(cls, arrays, names) -> "Skeleton":
+        """Собирает скелет из массивов ``to_arrays`` (например, прочитанных из кэша)."""
+        skeleton = cls()
+        for name in ("parent", "tag_id", "start", "open_end", "end"):
+            setattr(skeleton, name, arrays[name])
+        for name in names:
+            skeleton._name_ids[name] = len(skeleton.names)
+            skeleton.names.append(name)
+        ids = arrays["child_ids"]
+        pos = 0
+        for parent, count in zip(arrays["child_parents"], arrays["child_counts"]):
+            skeleton._children[parent] = ids[pos:pos + count]
+            pos += count
+        return skeleton
+
+    def to_arrays(self):
+        """Возвращает массивы узлов и списков детей по именам (для сохранения)."""
+        parents = array('i', self._children)
+        ids = array('i')
+        for parent in parents:
+            ids.extend(self._children[parent])
+        return {"parent": self.parent, "tag_id": self.tag_id, "start": self.start, "open_end": self.open_end,
+                "end": self.end, "child_parents": parents,
+                "child_counts": array('i', (len(self._children[parent]) for parent in parents)), "child_ids": ids}
+
+    def add(self, nodes):
+        """Добавляет узлы (номер, родитель, имя, начало, конец открывающего тега)."""
+        for node, parent, name, start, open_end in nodes:
+            name_id = self._name_ids.get(name)
+            if name_id is None:
+                name_id = self._name_ids[name] = len(self.names)
+                self.names.append(name)
+            self.parent.append(parent)
+            self.tag_id.append(name_id)
+            self.start.append(start)
+            self.open_end.append(open_end)
+            self.end.append(-1)
+
+    def close(self, closed):
+        """Запоминает концы закрытых элементов (номер, конец)."""
+        end = self.end
+        for node, position in closed:
+            end[node] = position
+
+    def attach(self, parent: int, ids):
+        """Делает узлы ``ids`` видимыми детьми ``parent``."""
+        self._children.setdefault(parent, array('i')).extend(ids)
+
+    def children(self, node: int):
+        """Возвращает номера видимых детей узла (-1 — корневые элементы)."""
+        return self._children.get(node, ())
+
+    def tag(self, node: int) -> str:
+        """Возвращает имя элемента."""
+        return self.names[self.tag_id[node]]
+
+
+def start_tag_attributes(raw: bytes):
+    """Возвращает пары (имя, значение) атрибутов из байтов открывающего тега."""
+    attrs = []
+    for m in _ATTR_RE.finditer(raw):
+        value = (m.group(2) if m.group(2) is not None else m.group(3)).decode('utf-8', 'replace')
+        attrs.append((m.group(1).decode('utf-8', 'replace'), html.unescape(value) if "&" in value else value))
+    return attrs
@@ -0,0 +1,66 @@
+"""Упорядоченный индекс совпадений поиска с отложенным сдвигом позиций.
+
+Начала и концы совпадений хранятся в двух массивах по возрастанию.
+Правка текста заменяет совпадения задетого участка и сдвигает все
+последующие; сдвиг, как и у позиций узлов ``NodeStore``, не записывается
+в хвост массивов, а запоминается (``gap``, ``delta``) и прибавляется при
+чтении, поэтому правка при миллионе совпадений стоит столько же, сколько
+при десятке.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from model.node_store import PositionColumn
+
+
+class MatchIndex:
+    """Позиции совпадений: ``start[i]`` и ``end[i]`` в текущем тексте."""
+
+    def __init__(self, starts=None, ends=None):
+        """Принимает массивы начал и концов совпадений (позиции без сдвига)."""
+        self.start = PositionColumn(self, starts if starts is not None else array('q'))
+        self.end = PositionColumn(self, ends if ends is not None else array('q'))
+        # Отложенный сдвиг позиций совпадений с номерами от gap
+        self.gap = 0
+        self.delta = 0
+
+    def __len__(self):
+        """Возвращает число совпадений."""
+        return len(self.start)
+
+    def span(self, i: int):
+        """Возвращает (начало, конец) совпадения ``i``."""
+        return self.start[i], self.end[i]
+
+    def same_as(self, other: "MatchIndex") -> bool:
+        """Проверяет, что в индексах одни и те же совпадения."""
+        for index in (self, other):
+            # Отложенный сдвиг записывается в массивы, чтобы сравнить их целиком
+            index.splice(len(index), len(index), [], [], 0)
+        return self.start.raw == other.start.raw and self.end.raw == other.end.raw
+
+    def first_from(self, position: int) -> int:
+        """Возвращает номер первого совпадения, начинающегося не раньше ``position``."""
+        return bisect_left(self.start, position)
+
+    def touching(self, start: int, end: int):
+        """Возвращает диапазон [i, j) совпадений, пересекающих или касающихся [start, end]."""
+        return bisect_left(self.end, start), bisect_right(self.start, end)
+
+    def splice(self, i: int, j: int, starts, ends, delta: int):
+        """Заменяет совпадения [i, j) новыми и сдвигает последующие на ``delta``.
+
+        ``starts``/``ends`` — позиции новых совпадений в текущем тексте,
+        ``delta`` — на сколько символов правка сдвинула текст после себя.
+        """
+        gap, old_delta = self.gap, self.delta
+        for column, new in ((self.start.raw, starts), (self.end.raw, ends)):
+            # Сдвиг, отложенный для прежнего gap, переносится на новый gap
+            if old_delta:
+                if gap < i:
+                    column[gap:i] = array('q', [value + old_delta for value in column[gap:i]])
+                elif gap > j:
+                    column[j:gap] = array('q', [value - old_delta for value in column[j:gap]])
+            column[i:j] = array('q', new)
+        self.gap = i + len(starts)
+        self.delta = old_delta + delta
@@ -0,0 +1,639 @@
+"""Компактное хранилище узлов XML на параллельных массивах.
+
+Сканер проходит текст одним регулярным выражением, корректно пропуская
+комментарии, CDATA, инструкции обработки и DOCTYPE, и для каждого элемента
+запоминает точные смещения открывающего тега, закрывающего тега и текста.
+Узлы нумеруются в порядке обхода (preorder). Вместо объектов на каждый
+элемент хранятся массивы чисел и общая таблица имён; текст и атрибуты
+извлекаются из исходного текста только по запросу.
+
+После правки внутри элемента хранилище не строится заново: ``splice``
+заменяет узлы его содержимого, а сдвиг позиций всех последующих узлов
+запоминается одним числом (см. ``PositionColumn``).
+"""
+
+import html
+import re
+from array import array
+from bisect import bisect_right
+
+# Разметка XML: комментарии, CDATA, PI и DOCTYPE распознаются раньше тегов,
+# чтобы «теги» внутри них не попадали в хранилище
+MARKUP_RE = re.compile(r"""
+    <!--.*?-->
+  | <!\[CDATA\[.*?\]\]>
+  | <\?.*?\?>
+  | <!DOCTYPE(?:[^\[>]|\[.*?\])*>
+  | </(?P<close>[^\s<>]+)\s*>
+  | <(?P<open>[^\s<>/!?]+)(?:\s+[^\s<>=/]+\s*=\s*(?:"[^"]*"|'[^']*'))*\s*(?P<empty>/)?>
+""", re.S | re.X)
+
+# Начала открывающего и закрывающего тегов, которые ещё могут закончиться дальше в тексте
+_OPEN_TAG_PREFIX_RE = re.compile(r"""
+    <[^\s<>/!?]*(?:\s+[^\s<>=/]+\s*=\s*(?:"[^"]*"|'[^']*'))*
+    (?:\s+[^\s<>=/]*(?:\s*=\s*(?:"[^"]*|'[^']*)?)?)?\s*/?\Z
+""", re.S | re.X)
+_CLOSE_TAG_PREFIX_RE = re.compile(r"</[^\s<>]*\s*\Z")
+# Разметка, которая заканчивается известной строкой, и эта строка
+_TERMINATORS = (("<!--", "-->"), ("<![CDATA[", "]]>"), ("<?", "?>"))
+
+# Пара «имя=значение» внутри открывающего тега
+_ATTR_RE = re.compile(r"""([^\s<>=/]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+# Разметка внутри текста элемента: CDATA раскрывается, комментарии и PI пропускаются
+_INLINE_MARKUP_RE = re.compile(r"<!\[CDATA\[(.*?)\]\]>|<!--.*?-->|<\?.*?\?>", re.S)
+
+
+def _markup_may_continue(text: str, lt: int) -> bool:
+    """Проверяет, может ли неразобранный ``<`` в позиции ``lt`` начинать разметку,
+    которая закончится в следующей порции текста.
+    """
+    head = text[lt:lt + 9]
+    for opener, _ in _TERMINATORS:
+        if head.startswith(opener) or opener.startswith(head):
+            return True
+    if head.startswith("<!DOCTYPE") or "<!DOCTYPE".startswith(head):
+        return True
+    if head.startswith("<!"):
+        return False
+    if head.startswith("</"):
+        return _CLOSE_TAG_PREFIX_RE.match(text, lt) is not None
+    return _OPEN_TAG_PREFIX_RE.match(text, lt) is not None
+
+
+class XmlParseError(ValueError):
+    """Нарушена структура XML: лишний, незакрытый или чужой закрывающий тег."""
+
+    def __init__(self, message: str, position: int):
+        """Сохраняет сообщение и позицию ошибки в тексте."""
+        super().__init__(message)
+        self.position = position
+
+
+class PositionColumn:
+    """Столбец позиций узлов (начала тегов, концы тегов) с отложенным сдвигом.
+
+    Правка текста сдвигает позиции всех узлов после неё. Вместо перезаписи
+    хвоста массива хранилище запоминает номер первого сдвинутого узла
+    (``gap``) и величину сдвига (``delta``): к «сырым» значениям узлов
+    начиная с ``gap`` сдвиг прибавляется при чтении. Столбец читается как
+    обычная последовательность, в том числе функциями ``bisect``.
+    """
+    __slots__ = ("raw", "_store")
+
+    def __init__(self, store, raw):
+        """Связывает массив ``raw`` с хранилищем, которое ведёт сдвиг."""
+        self.raw = raw
+        self._store = store
+
+    def __len__(self):
+        """Возвращает количество узлов."""
+        return len(self.raw)
+
+    def __getitem__(self, node_id):
+        """Возвращает позицию узла в текущем тексте."""
+        if node_id < 0:
+            node_id += len(self.raw)
+        store = self._store
+        if node_id >= store.gap:
+            return self.raw[node_id] + store.delta
+        return self.raw[node_id]
+
+    def __iter__(self):
+        """Итерирует позиции всех узлов по порядку."""
+        gap, delta = self._store.gap, self._store.delta
+        raw = self.raw
+        if not delta:
+            yield from raw
+            return
+        yield from raw[:gap]
+        for value in raw[gap:]:
+            yield value + delta
+
+
+class NodeStore:
+    """Таблица узлов XML, адресуемая номером узла.
+
+    Для узла ``n`` хранятся:
+    - ``start[n]`` — позиция ``<`` открывающего тега;
+    - ``open_end[n]`` — позиция сразу после ``>`` открывающего тега;
+    - ``close_start[n]`` — позиция ``</`` закрывающего тега
+      (для пустого элемента ``<a/>`` равна ``open_end[n]``);
+    - ``end[n]`` — позиция сразу после закрывающего тега;
+    - ``parent``/``first_child``/``next_sibling`` — связи узлов (-1 — нет);
+    - ``tag_id[n]`` — номер имени элемента в таблице ``names``.
+
+    Имена элементов и атрибутов хранятся в таблице один раз, сколько бы
+    элементов их ни использовали. Позиции читаются через ``PositionColumn``;
+    ``stray_markup`` отмечает, что в тексте встретился ``<``, не начавший
+    разметку (такой текст нельзя разбирать по частям).
+    """
+
+    def __init__(self):
+        """Создаёт пустое хранилище."""
+        self.start = PositionColumn(self, array('q'))
+        self.open_end = PositionColumn(self, array('q'))
+        self.close_start = PositionColumn(self, array('q'))
+        self.end = PositionColumn(self, array('q'))
+        # Отложенный сдвиг позиций узлов с номерами от gap
+        self.gap = 0
+        self.delta = 0
+        self.stray_markup = False
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.tag_id = array('i')
+        self.names = []
+        self._name_ids = {}
+
+    @classmethod
+    def from_arrays(cls, arrays, names, stray_markup: bool = False) -> "NodeStore":
+        """Собирает хранилище из готовых массивов (например, прочитанных из кэша).
+
+        ``arrays`` — словарь массивов по именам атрибутов (``start``,
+        ``parent``, ``tag_id`` и т. д.); позиции — без отложенного сдвига.
+        """
+        store = cls()
+        for name in ("start", "open_end", "close_start", "end"):
+            getattr(store, name).raw = arrays[name]
+        store.parent = arrays["parent"]
+        store.first_child = arrays["first_child"]
+        store.next_sibling = arrays["next_sibling"]
+        store.tag_id = arrays["tag_id"]
+        for name in names:
+            store.intern(name)
+        store.stray_markup = stray_markup
+        return store
+
+    def __len__(self):
+        """Возвращает количество элементов."""
+        return len(self.start)
+
+    def intern(self, name: str) -> int:
+        """Возвращает номер имени в таблице, добавляя его при первой встрече."""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self._name_ids[name] = name_id
+        return name_id
+
+    def name_id(self, name: str):
+        """Возвращает номер уже известного имени или None."""
+        return self._name_ids.get(name)
+
+    def memory_size(self) -> int:
+        """Оценивает размер массивов узлов в байтах (без таблицы имён)."""
+        arrays = (self.start.raw, self.open_end.raw, self.close_start.raw, self.end.raw,
+                  self.parent, self.first_child, self.next_sibling, self.tag_id)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+    def has_same_shape(self, other: "NodeStore") -> bool:
+        """Проверяет, что у хранилищ одинаковые узлы, связи и имена элементов.
+
+        Массивы сравниваются целиком на уровне C, без цикла по узлам.
+        """
+        return (len(self) == len(other)
+                and self.parent == other.parent
+                and self.next_sibling == other.next_sibling
+                and self.first_child == other.first_child
+                and self.tag_id == other.tag_id
+                and self.names[:len(other.names)] == other.names[:len(self.names)])
+
+    def tag(self, node_id: int) -> str:
+        """Возвращает имя элемента."""
+        return self.names[self.tag_id[node_id]]
+
+    def children(self, node_id: int):
+        """Итерирует номера дочерних узлов в порядке документа."""
+        child = self.first_child[node_id]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def start_tag_span(self, node_id: int):
+        """Возвращает (начало, конец) открывающего тега."""
+        return self.start[node_id], self.open_end[node_id]
+
+    def end_tag_span(self, node_id: int):
+        """Возвращает (начало, конец) закрывающего тега (пустой для ``<a/>``)."""
+        return self.close_start[node_id], self.end[node_id]
+
+    def element_span(self, node_id: int):
+        """Возвращает (начало, конец) всего элемента вместе с тегами."""
+        return self.start[node_id], self.end[node_id]
+
+    def text_span(self, node_id: int):
+        """Возвращает (начало, конец) текста элемента до первого дочернего узла."""
+        first = self.first_child[node_id]
+        text_end = self.start[first] if first != -1 else self.close_start[node_id]
+        return self.open_end[node_id], text_end
+
+    def value(self, node_id: int, text: str) -> str:
+        """Возвращает текст элемента до первого дочернего узла (без пробелов по краям)."""
+        start, end = self.text_span(node_id)
+        raw = text[start:end]
+        if "<" in raw:
+            raw = _INLINE_MARKUP_RE.sub(lambda m: m.group(1) or "", raw)
+        if "&" in raw:
+            raw = html.unescape(raw)
+        return raw.strip()
+
+    def text_runs(self, node_id: int, text: str):
+        """Возвращает участки (начало, конец, CDATA ли) символьных данных текста элемента.
+
+        Участки идут в порядке текста; комментарии и инструкции обработки
+        в них не входят, у секций CDATA берётся только содержимое.
+        """
+        start, end = self.text_span(node_id)
+        runs = []
+        pos = start
+        for m in _INLINE_MARKUP_RE.finditer(text, start, end):
+            if m.start() > pos:
+                runs.append((pos, m.start(), False))
+            if m.group(1) is not None:
+                runs.append((m.start(1), m.end(1), True))
+            pos = m.end()
+        if pos < end:
+            runs.append((pos, end, False))
+        return runs
+
+    def attribute_spans(self, node_id: int, text: str):
+        """Возвращает атрибуты открывающего тега с позициями.
+
+        Каждый атрибут — (имя, начало, начало значения, конец значения, конец);
+        значение — участок внутри кавычек, конец — позиция после закрывающей кавычки.
+        """
+        start, end = self.start_tag_span(node_id)
+        spans = []
+        for m in _ATTR_RE.finditer(text, start, end):
+            group = 2 if m.group(2) is not None else 3
+            spans.append((self.names[self.intern(m.group(1))], m.start(), m.start(group), m.end(group), m.end()))
+        return spans
+
+    def attributes(self, node_id: int, text: str):
+        """Возвращает список пар (имя, значение) атрибутов элемента."""
+        start, end = self.start_tag_span(node_id)
+        names = self.names
+        attrs = []
+        for name, double_quoted, single_quoted in _ATTR_RE.findall(text, start, end):
+            value = double_quoted or single_quoted
+            attrs.append((names[self.intern(name)], html.unescape(value) if "&" in value else value))
+        return attrs
+
+    def enclosing_element(self, start: int, end: int):
+        """Возвращает самый глубокий элемент, содержимое которого включает [start, end).
+
+        Участок не должен задевать теги самого элемента; пустой элемент
+        ``<a/>`` содержимого не имеет. Если такого элемента нет, возвращает None.
+        """
+        node_id = bisect_right(self.start, start) - 1
+        while node_id != -1:
+            open_end = self.open_end[node_id]
+            if open_end <= start and end <= self.close_start[node_id] and self.end[node_id] != open_end:
+                return node_id
+            node_id = self.parent[node_id]
+        return None
+
+    def subtree_end(self, node_id: int) -> int:
+        """Возвращает номер первого узла после потомков ``node_id``."""
+        while node_id != -1:
+            sibling = self.next_sibling[node_id]
+            if sibling != -1:
+                return sibling
+            node_id = self.parent[node_id]
+        return len(self)
+
+    def splice(self, node_id: int, fragment: "NodeStore", delta: int) -> "NodeStore":
+        """Возвращает хранилище, в котором содержимое элемента ``node_id`` заменено.
+
+        ``fragment`` — узлы нового содержимого с позициями в новом тексте
+        (у верхних узлов родитель -1), ``delta`` — на сколько символов
+        сместился текст после содержимого. Узлы до элемента копируются
+        как есть; у узлов после него номера сдвигаются на разницу в числе
+        узлов, а позиции — откладываются до чтения. Само хранилище
+        не меняется, поэтому ``splice`` можно вызывать в фоновой задаче.
+        """
+        first = node_id + 1
+        stop = self.subtree_end(node_id)
+        added = len(fragment)
+        shift = added - (stop - first)
+        result = NodeStore()
+        result.names, result._name_ids = list(self.names), dict(self._name_ids)
+        result.stray_markup = self.stray_markup
+        result.gap = first + added
+        result.delta = self.delta + delta
+        gap, old_delta = self.gap, self.delta
+
+        ancestors = []
+        parent_id = node_id
+        while parent_id != -1:
+            ancestors.append(parent_id)
+            parent_id = self.parent[parent_id]
+        # Каждый массив копируется один раз, дальше правится на месте
+        for column in ("start", "open_end", "close_start", "end"):
+            raw = getattr(self, column).raw[:]
+            if old_delta:
+                # Узлы до новой границы сдвига получают отложенный сдвиг явно,
+                # а после неё — наоборот, его лишаются
+                if gap < first:
+                    raw[gap:first] = array('q', [value + old_delta for value in raw[gap:first]])
+                elif gap > stop:
+                    raw[stop:gap] = array('q', [value - old_delta for value in raw[stop:gap]])
+            if delta and column in ("close_start", "end"):
+                # Элемент и его предки заканчиваются после правки
+                for ancestor in ancestors:
+                    raw[ancestor] += delta
+            raw[first:stop] = getattr(fragment, column).raw
+            getattr(result, column).raw = raw
+
+        parent = self.parent[:]
+        first_child = self.first_child[:]
+        next_sibling = self.next_sibling[:]
+        if shift:
+            parent[stop:] = array('i', [p + shift if p >= stop else p for p in parent[stop:]])
+            first_child[stop:] = array('i', [c + shift if c != -1 else -1 for c in first_child[stop:]])
+            next_sibling[stop:] = array('i', [n + shift if n != -1 else -1 for n in next_sibling[stop:]])
+            # До элемента на узлы после него ссылаются только сам элемент и его предки
+            for ancestor in ancestors:
+                if next_sibling[ancestor] != -1:
+                    next_sibling[ancestor] += shift
+        first_child[node_id] = first if added else -1
+        # Номера узлов фрагмента отсчитываются от первого потомка элемента
+        fragment_next_sibling = array('i', [n + first if n != -1 else -1 for n in fragment.next_sibling])
+        top = [n for n, p in enumerate(fragment.parent) if p == -1]
+        for n, sibling in zip(top, top[1:]):
+            fragment_next_sibling[n] = sibling + first
+        parent[first:stop] = array('i', [p + first if p != -1 else node_id for p in fragment.parent])
+        first_child[first:stop] = array('i', [c + first if c != -1 else -1 for c in fragment.first_child])
+        next_sibling[first:stop] = fragment_next_sibling
+        result.parent, result.first_child, result.next_sibling = parent, first_child, next_sibling
+
+        intern = result.intern
+        tag_ids = [intern(name) for name in fragment.names]
+        tag_id = self.tag_id[:]
+        tag_id[first:stop] = array('i', [tag_ids[t] for t in fragment.tag_id])
+        result.tag_id = tag_id
+        return result
+
+    def path_of(self, node_id: int):
+        """Возвращает список индексов детей от корня до узла."""
+        path = []
+        while self.parent[node_id] != -1:
+            parent_id = self.parent[node_id]
+            path.append(list(self.children(parent_id)).index(node_id))
+            node_id = parent_id
+        path.reverse()
+        return path
+
+    def node_by_path(self, path_indices):
+        """Возвращает номер узла по списку индексов детей от корня (или None)."""
+        if not len(self):
+            return None
+        node_id = 0
+        for idx in path_indices:
+            for row, child in enumerate(self.children(node_id)):
+                if row == idx:
+                    node_id = child
+                    break
+            else:
+                return None
+        return node_id
+
+
+class NodeStoreBuilder:
+    """Строит хранилище узлов по тексту, поступающему порциями.
+
+    Порции сканируются по мере поступления, поэтому хранилище готово
+    сразу после последней порции, без второго прохода по тексту.
+    Незаконченная в конце порции разметка (начиная с первого ``<``, который
+    пока не удалось разобрать) откладывается до следующей порции. Позиции
+    узлов считаются от начала всего текста.
+
+    Массивы связей и закрывающих тегов растут блоками по ``_BLOCK`` узлов
+    и обрезаются в ``close``: на узел приходится меньше вызовов ``append``.
+
+    В режиме ``fragment`` разбирается содержимое элемента: верхних узлов
+    может быть несколько или ни одного, а позиции отсчитываются от ``offset``.
+
+    В режиме ``tolerant`` нарушения структуры не прерывают разбор, а
+    собираются в ``problems`` как пары (позиция, сообщение): незакрытые
+    элементы закрываются перед закрывающим тегом их предка или в конце
+    текста, лишние закрывающие теги пропускаются, а лишние корневые
+    элементы становятся детьми корня. Так даже с ошибками получается
+    дерево, по которому можно перемещаться.
+    """
+    _BLOCK = 0x1000
+
+    def __init__(self, cancel_token=None, offset=0, fragment=False, tolerant=False):
+        """Создаёт построитель; ``cancel_token`` проверяется каждые 4096 элементов."""
+        self.store = NodeStore()
+        self.problems = []
+        self._cancel_token = cancel_token
+        self._fragment = fragment
+        self._tolerant = tolerant
+        self._extra_roots = False
+        self._last_child = array('i')
+        self._stack = []
+        # Ещё не разобранный конец поступившего текста (порциями) и строка,
+        # без которой начатые в нём комментарий, CDATA или PI не закончатся
+        self._pending = []
+        self._terminator = None
+        self._base = offset  # позиция начала отложенного текста во всём тексте
+
+    def feed(self, chunk: str, final: bool = False):
+        """Разбирает очередную порцию текста.
+
+        Выбрасывает ``XmlParseError`` при нарушении структуры (кроме режима
+        ``tolerant``).
+        """
+        pending = self._pending
+        if (self._terminator is not None and not final
+                and self._terminator not in pending[-1][-2:] + chunk):
+            # Отложенная разметка всё ещё не закончилась: копим порции,
+            # не сканируя заново уже накопленный текст
+            pending.append(chunk)
+            return
+        pending.append(chunk)
+        text = pending[0] if len(pending) == 1 else "".join(pending)
+        self._pending = []
+        self._terminator = None
+        store = self.store
+        start_append, open_end_append = store.start.raw.append, store.open_end.raw.append
+        parent_append, tag_id_append = store.parent.append, store.tag_id.append
+        close_start, end = store.close_start.raw, store.end.raw
+        first_child, next_sibling = store.first_child, store.next_sibling
+        tag_id, names, name_ids, intern = store.tag_id, store.names, store._name_ids, store.intern
+        last_child, stack = self._last_child, self._stack
+        cancel_token = self._cancel_token
+        fragment = self._fragment
+        grow_q = array('q', [0]) * self._BLOCK
+        grow_i = array('i', [-1]) * self._BLOCK
+        node_id = len(store)
+        base = self._base
+        pos = 0
+        deferred = False
+
+        for m in MARKUP_RE.finditer(text):
+            m_start, m_end = m.span()
+            if m_start != pos:
+                lt = text.find("<", pos, m_start)
+                while lt != -1:
+                    if not final and _markup_may_continue(text, lt):
+                        # Неразобранный «<» может начинать разметку,
+                        # которая закончится в следующей порции
+                        deferred = True
+                        break
+                    self._stray(base + lt)
+                    lt = text.find("<", lt + 1, m_start)
+                if deferred:
+                    pos = lt
+                    break
+            pos = m_end
+            kind = m.lastgroup
+            if kind is None:
+                continue
+            if kind == 'close':
+                name = m.group('close')
+                if not stack or names[tag_id[stack[-1]]] != name:
+                    if not self._recover_close(name, base + m_start):
+                        continue
+                closed = stack.pop()
+                close_start[closed] = base + m_start
+                end[closed] = base + m_end
+                continue
+
+            # Открывающий (kind == 'open') или пустой (kind == 'empty') элемент
+            if not node_id & 0xFFF:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                close_start.extend(grow_q)
+                end.extend(grow_q)
+                first_child.extend(grow_i)
+                next_sibling.extend(grow_i)
+                last_child.extend(grow_i)
+            tag_start = base + m_start
+            tag_end = base + m_end
+            start_append(tag_start)
+            open_end_append(tag_end)
+            name = m.group('open')
+            name_id = name_ids.get(name)
+            tag_id_append(name_id if name_id is not None else intern(name))
+            if stack:
+                parent_id = stack[-1]
+            elif node_id and not fragment:
+                parent_id = self._extra_root(name, tag_start)
+            else:
+                parent_id = -1
+            parent_append(parent_id)
+            if parent_id != -1:
+                prev = last_child[parent_id]
+                if prev == -1:
+                    first_child[parent_id] = node_id
+                else:
+                    next_sibling[prev] = node_id
+                last_child[parent_id] = node_id
+            if kind == 'open':
+                stack.append(node_id)
+            else:
+                close_start[node_id] = tag_end
+                end[node_id] = tag_end
+            node_id += 1
+        else:
+            lt = text.find("<", pos)
+            while lt != -1 and (final or not _markup_may_continue(text, lt)):
+                self._stray(base + lt)
+                lt = text.find("<", lt + 1)
+            pos = lt if lt != -1 else len(text)
+
+        rest = text[pos:]
+        if rest:
+            self._pending = [rest]
+            self._terminator = next((end for opener, end in _TERMINATORS if rest.startswith(opener)), None)
+        self._base = base + pos
+
+    def _stray(self, position: int):
+        """Отмечает ``<``, который не начинает разметку."""
+        self.store.stray_markup = True
+        if self._tolerant:
+            self.problems.append((position, "Символ «<» не начинает разметку"))
+
+    def _recover_close(self, name: str, position: int) -> bool:
+        """Обрабатывает закрывающий тег, не совпавший с последним открытым элементом.
+
+        Без режима ``tolerant`` выбрасывает ``XmlParseError``. Иначе, если
+        элемент с таким именем открыт выше, закрывает незакрытые элементы
+        над ним и возвращает True; если нет — пропускает тег (False).
+        """
+        if not self._tolerant:
+            raise XmlParseError(f"Неожиданный закрывающий тег </{name}>", position)
+        store, stack = self.store, self._stack
+        for depth in range(len(stack) - 1, -1, -1):
+            if store.tag(stack[depth]) == name:
+                break
+        else:
+            self.problems.append((position, f"Неожиданный закрывающий тег </{name}>"))
+            return False
+        while len(stack) - 1 > depth:
+            self._close_unclosed(stack.pop(), position)
+        return True
+
+    def _close_unclosed(self, node_id: int, position: int):
+        """Закрывает незакрытый элемент в позиции ``position`` и запоминает ошибку."""
+        store = self.store
+        store.close_start.raw[node_id] = position
+        store.end.raw[node_id] = position
+        self.problems.append((store.start.raw[node_id], f"Не закрыт элемент <{store.tag(node_id)}>"))
+
+    def _extra_root(self, name: str, position: int) -> int:
+        """Обрабатывает элемент после закрытого корня; возвращает его родителя.
+
+        Без режима ``tolerant`` выбрасывает ``XmlParseError``, иначе
+        элемент становится ребёнком корня.
+        """
+        if not self._tolerant:
+            raise XmlParseError(f"Лишний корневой элемент <{name}>", position)
+        self.problems.append((position, f"Лишний корневой элемент <{name}>"))
+        self._extra_roots = True
+        return 0
+
+    def close(self) -> NodeStore:
+        """Разбирает остаток текста и возвращает готовое хранилище.
+
+        Выбрасывает ``XmlParseError``, если остались незакрытые элементы
+        или в тексте (не во фрагменте) нет корневого элемента; в режиме
+        ``tolerant`` эти ошибки попадают в ``problems``, а элементы
+        закрываются в конце текста.
+        """
+        self.feed("", final=True)
+        store, stack = self.store, self._stack
+        if stack:
+            if not self._tolerant:
+                raise XmlParseError(f"Не закрыт элемент <{store.tag(stack[-1])}>", store.start[stack[-1]])
+            while stack:
+                self._close_unclosed(stack.pop(), self._base)
+        if not len(store) and not self._fragment:
+            if not self._tolerant:
+                raise XmlParseError("Документ не содержит корневого элемента", 0)
+            self.problems.append((0, "Документ не содержит корневого элемента"))
+        if self._extra_roots:
+            # Корень охватывает присоединённые к нему лишние корневые элементы
+            store.end.raw[0] = max(store.end.raw[0], store.end.raw[self._last_child[0]])
+        self.problems.sort()
+        # Обрезаем неиспользованный хвост последнего блока
+        count = len(store)
+        for a in (store.close_start.raw, store.end.raw, store.first_child, store.next_sibling):
+            del a[count:]
+        self._last_child = array('i')
+        return store
+
+
+def build_node_store(text: str, cancel_token=None) -> NodeStore:
+    """Строит хранилище узлов для XML-текста за один проход.
+
+    Выбрасывает ``XmlParseError``, если открывающие и закрывающие теги
+    не сбалансированы. Если передан ``cancel_token``, каждые 4096 элементов
+    вызывается его ``raise_if_cancelled()``.
+    """
+    builder = NodeStoreBuilder(cancel_token)
+    builder.feed(text, final=True)
+    return builder.close()
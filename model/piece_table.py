@@ -0,0 +1,242 @@
+"""Таблица кусков: редактируемый текст поверх неизменяемого исходного файла.
+
+Текст — последовательность кусков, каждый из которых ссылается на участок
+исходного файла (отображённого в память) или буфера добавлений. Вставка
+дописывает байты в буфер добавлений и разбивает кусок, удаление укорачивает
+куски; исходный файл не копируется, поэтому память растёт с объёмом правок,
+а не с размером файла. Позиции — в байтах UTF-8.
+
+Номера строк вычисляются по числу переводов строки в кусках: для кусков
+исходного файла — по индексу строк (``LineIndex``), для добавленных —
+подсчётом. Отмена хранит прежние массивы кусков: буфер добавлений только
+растёт, поэтому старые куски остаются верными.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from model.large_file import MAX_LINE_BYTES
+
+# Источник куска: исходный файл или буфер добавлений
+ORIGINAL, ADDED = 0, 1
+# Наибольшее число шагов отмены
+UNDO_LIMIT = 1000
+# Размер порции при записи текста в файл
+SAVE_CHUNK = 16 << 20
+
+
+class PieceTable:
+    """Текст из кусков исходного файла ``original`` и буфера добавлений.
+
+    ``lines`` — полный индекс строк исходного файла. ``revision`` растёт
+    при каждой правке, отмене и повторе.
+    """
+
+    def __init__(self, original, lines):
+        """Создаёт текст, совпадающий с исходным файлом."""
+        self.original = original
+        self.lines = lines
+        self.added = bytearray()
+        self.revision = 0
+        size = len(original)
+        self._source = array('b', [ORIGINAL] if size else [])
+        self._start = array('q', [0] if size else [])
+        self._length = array('q', [size] if size else [])
+        self._newlines = array('q', [lines.line_count - 1] if size else [])
+        self._undo = []
+        self._redo = []
+        # Конец последней вставки: продолжение набора не создаёт нового шага отмены
+        self._typing_end = None
+        self._offsets = None  # начало каждого куска в тексте (и длина текста в конце)
+        self._line_prefix = None  # число переводов строки до каждого куска
+
+    def __len__(self):
+        """Возвращает длину текста в байтах."""
+        return self._prefixes()[0][-1]
+
+    @property
+    def line_count(self) -> int:
+        """Число строк текста."""
+        return self._prefixes()[1][-1] + 1
+
+    def insert(self, offset: int, data: bytes):
+        """Вставляет ``data`` в позицию ``offset``."""
+        self.replace(offset, offset, data)
+
+    def delete(self, start: int, end: int):
+        """Удаляет участок [start, end)."""
+        self.replace(start, end, b"")
+
+    def replace(self, start: int, end: int, data: bytes):
+        """Заменяет участок [start, end) байтами ``data`` одним шагом отмены."""
+        if start == end and not data:
+            return
+        typing = start == end and start == self._typing_end and self._extends_added(start)
+        if not typing:
+            self._push_undo()
+        self._redo.clear()
+        i, inner = self._locate(start)
+        pieces = []
+        if inner:
+            pieces.append((self._source[i], self._start[i], inner))
+        if data:
+            if typing:
+                # Набор продолжает последний добавленный кусок
+                i -= 1
+                pieces = [(ADDED, self._start[i], self._length[i] + len(data))]
+            else:
+                pieces.append((ADDED, len(self.added), len(data)))
+            self.added += data
+        j, inner_end = self._locate(end)
+        if inner_end:
+            pieces.append((self._source[j], self._start[j] + inner_end, self._length[j] - inner_end))
+            j += 1
+        self._splice(i, max(i + (1 if typing else 0), j), pieces)
+        self._typing_end = start + len(data) if data and start == end else None
+        self.revision += 1
+
+    def undo(self) -> bool:
+        """Отменяет последнюю правку; возвращает False, если отменять нечего."""
+        if not self._undo:
+            return False
+        self._redo.append(self._state())
+        self._restore(self._undo.pop())
+        return True
+
+    def redo(self) -> bool:
+        """Повторяет отменённую правку; возвращает False, если повторять нечего."""
+        if not self._redo:
+            return False
+        self._undo.append(self._state())
+        self._restore(self._redo.pop())
+        return True
+
+    def read(self, start: int, end: int) -> bytes:
+        """Возвращает байты участка [start, end)."""
+        end = min(end, len(self))
+        if start >= end:
+            return b""
+        i, inner = self._locate(start)
+        parts = []
+        remaining = end - start
+        while remaining > 0:
+            take = min(remaining, self._length[i] - inner)
+            parts.append(self._bytes(i, inner, inner + take))
+            remaining -= take
+            i, inner = i + 1, 0
+        return b"".join(parts)
+
+    def chunks(self):
+        """Выдаёт текст порциями не длиннее ``SAVE_CHUNK`` байтов (для записи в файл)."""
+        for i in range(len(self._length)):
+            for pos in range(0, self._length[i], SAVE_CHUNK):
+                yield self._bytes(i, pos, min(self._length[i], pos + SAVE_CHUNK))
+
+    def line_start(self, line: int) -> int:
+        """Возвращает позицию начала строки ``line`` (с нуля)."""
+        if line <= 0:
+            return 0
+        offsets, line_prefix = self._prefixes()
+        line = min(line, line_prefix[-1])
+        # Перевод строки номер ``line`` лежит в куске i
+        i = bisect_left(line_prefix, line) - 1
+        k = line - line_prefix[i]
+        start = self._start[i]
+        if self._source[i] == ORIGINAL:
+            lines, original = self.lines, self.original
+            end = lines.line_start(original, lines.line_of(original, start) + k)
+        else:
+            end = start
+            for _ in range(k):
+                end = self.added.find(b'\n', end) + 1
+        return offsets[i] + end - start
+
+    def line_of(self, offset: int) -> int:
+        """Возвращает номер строки с позицией ``offset``."""
+        i, inner = self._locate(offset)
+        if i == len(self._length):
+            return self._prefixes()[1][-1]
+        return self._prefixes()[1][i] + self._count_newlines(self._source[i], self._start[i], inner)
+
+    def read_line(self, line: int):
+        """Возвращает (начало, байты строки без перевода, обрезана ли строка)."""
+        start = self.line_start(line)
+        raw = self.read(start, start + MAX_LINE_BYTES + 1)
+        end = raw.find(b'\n')
+        if end == -1:
+            raw = raw[:MAX_LINE_BYTES]
+            return start, raw, len(raw) == MAX_LINE_BYTES
+        return start, raw[:end].rstrip(b'\r'), False
+
+    def from_original(self, offset: int):
+        """Возвращает позицию в тексте для позиции ``offset`` исходного файла (None, если удалена)."""
+        offsets = self._prefixes()[0]
+        for i in range(len(self._length)):
+            start = self._start[i]
+            if self._source[i] == ORIGINAL and start <= offset < start + self._length[i]:
+                return offsets[i] + offset - start
+        return None
+
+    def _bytes(self, i: int, start: int, end: int) -> bytes:
+        """Возвращает байты куска i в пределах [start, end) относительно его начала."""
+        base = self._start[i]
+        buffer = self.original if self._source[i] == ORIGINAL else self.added
+        return bytes(buffer[base + start:base + end])
+
+    def _locate(self, offset: int):
+        """Возвращает (номер куска, смещение в нём) для позиции текста."""
+        offsets = self._prefixes()[0]
+        if offset >= offsets[-1]:
+            return len(self._length), 0
+        i = bisect_right(offsets, offset) - 1
+        return i, offset - offsets[i]
+
+    def _extends_added(self, offset: int) -> bool:
+        """Проверяет, что позиция — конец куска, которым заканчивается буфер добавлений."""
+        i, inner = self._locate(offset)
+        return (inner == 0 and i > 0 and self._source[i - 1] == ADDED
+                and self._start[i - 1] + self._length[i - 1] == len(self.added))
+
+    def _count_newlines(self, source: int, start: int, length: int) -> int:
+        """Возвращает число переводов строки на участке источника."""
+        if not length:
+            return 0
+        if source == ADDED:
+            return self.added.count(b'\n', start, start + length)
+        lines, original = self.lines, self.original
+        return lines.line_of(original, start + length) - lines.line_of(original, start)
+
+    def _splice(self, i: int, j: int, pieces):
+        """Заменяет куски [i, j) кусками (источник, начало, длина)."""
+        pieces = [piece for piece in pieces if piece[2]]
+        self._source[i:j] = array('b', [p[0] for p in pieces])
+        self._start[i:j] = array('q', [p[1] for p in pieces])
+        self._length[i:j] = array('q', [p[2] for p in pieces])
+        self._newlines[i:j] = array('q', [self._count_newlines(*p) for p in pieces])
+        self._offsets = self._line_prefix = None
+
+    def _prefixes(self):
+        """Возвращает (и кэширует) начала кусков и числа переводов строки до них."""
+        if self._offsets is None:
+            offsets, line_prefix = array('q', [0]), array('q', [0])
+            for length, newlines in zip(self._length, self._newlines):
+                offsets.append(offsets[-1] + length)
+                line_prefix.append(line_prefix[-1] + newlines)
+            self._offsets, self._line_prefix = offsets, line_prefix
+        return self._offsets, self._line_prefix
+
+    def _state(self):
+        """Возвращает копию массивов кусков."""
+        return (array('b', self._source), array('q', self._start), array('q', self._length),
+                array('q', self._newlines))
+
+    def _push_undo(self):
+        """Запоминает текущие куски для отмены."""
+        self._undo.append(self._state())
+        del self._undo[:-UNDO_LIMIT]
+
+    def _restore(self, state):
+        """Восстанавливает куски из копии."""
+        self._source, self._start, self._length, self._newlines = state
+        self._offsets = self._line_prefix = None
+        self._typing_end = None
+        self.revision += 1
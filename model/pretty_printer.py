@@ -0,0 +1,225 @@
+"""Потоковое форматирование XML с отступами.
+
+Разбор идёт через expat по частям, а результат отдаётся порциями в функцию
+записи, поэтому ни исходный документ, ни результат не нужно держать в памяти
+целиком: так можно форматировать файл любого размера с диска на диск.
+Комментарии, инструкции обработки, CDATA и DOCTYPE сохраняются.
+"""
+
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+
+# Размер порции результата, после которой она передаётся в функцию записи
+_FLUSH_SIZE = 1 << 16
+
+
+class XmlPrettyPrinter:
+    """Форматирует XML, поступающий частями через ``feed``.
+
+    Текстовые элементы записываются в одну строку (``<a>1</a>``), элементы
+    с детьми — с отступом на каждый уровень; пробельный текст между
+    тегами отбрасывается. Текст сохраняется без изменений, вместе с
+    пробелами по краям. Содержимое элементов со смешанным содержимым
+    (текст вперемешку с дочерними узлами) и под ``xml:space="preserve"``
+    записывается как есть, без добавления отступов и переводов строк.
+    Ошибки разбора выбрасываются как ``xml.parsers.expat.ExpatError``.
+    """
+
+    def __init__(self, write, indent: str = "  "):
+        """Принимает функцию записи строк результата и строку отступа."""
+        self._write = write
+        self._indent = indent
+        self._out = []
+        self._out_size = 0
+        self._started = False
+        self._depth = 0
+        self._open_pending = False  # открывающий тег записан без ">"
+        self._has_children = []  # для открытых элементов: были ли дочерние узлы
+        self._preserve = []  # для открытых элементов: действует ли xml:space="preserve"
+        self._mixed = []  # для открытых элементов: есть ли значимый текст среди детей
+        self._text = []
+        self._cdata = None
+        self._doctype = None
+        self.encoding = None  # кодировка из XML-декларации
+
+        parser = expat.ParserCreate()
+        parser.ordered_attributes = True
+        parser.specified_attributes = True
+        parser.buffer_text = True
+        parser.XmlDeclHandler = self._xml_decl
+        parser.StartDoctypeDeclHandler = self._start_doctype
+        parser.EndDoctypeDeclHandler = self._end_doctype
+        parser.DefaultHandlerExpand = self._default
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._characters
+        parser.CommentHandler = self._comment
+        parser.ProcessingInstructionHandler = self._processing_instruction
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        self._parser = parser
+
+    def feed(self, data):
+        """Разбирает очередную часть документа (``str`` или ``bytes``)."""
+        self._parser.Parse(data, False)
+
+    def close(self):
+        """Завершает разбор и передаёт остаток результата в функцию записи."""
+        self._parser.Parse(b"", True)
+        self._flush()
+
+    def _emit(self, s: str):
+        """Добавляет строку к результату, отдавая его порциями."""
+        self._out.append(s)
+        self._out_size += len(s)
+        if self._out_size >= _FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        """Передаёт накопленную порцию результата в функцию записи."""
+        if self._out:
+            self._write("".join(self._out))
+            self._out = []
+            self._out_size = 0
+
+    def _line(self, s: str, depth: int):
+        """Начинает новую строку результата с отступом уровня ``depth``."""
+        if self._started:
+            self._emit("\n")
+        self._started = True
+        self._emit(self._indent * depth + s)
+
+    def _place(self, s: str, depth: int):
+        """Записывает узел с новой строки или вплотную, если содержимое сохраняется как есть."""
+        if self._keeps_content():
+            self._emit(s)
+        else:
+            self._line(s, depth)
+
+    def _keeps_content(self) -> bool:
+        """Проверяет, записывается ли содержимое текущего элемента без изменений."""
+        return bool(self._preserve) and (self._preserve[-1] or self._mixed[-1])
+
+    def _take_text(self) -> str:
+        """Возвращает накопленный текст; пробельный текст между тегами отбрасывается."""
+        text = "".join(self._text)
+        self._text = []
+        if self._mixed and text.strip():
+            self._mixed[-1] = True
+        return text if self._keeps_content() or text.strip() else ""
+
+    def _begin_child(self):
+        """Закрывает открывающий тег родителя и выводит текст перед дочерним узлом."""
+        text = self._take_text()
+        if self._open_pending:
+            self._emit(">")
+            self._open_pending = False
+        if self._has_children:
+            self._has_children[-1] = True
+        self._emit(text)
+
+    def _xml_decl(self, version, encoding, standalone):
+        """Записывает XML-декларацию."""
+        self.encoding = encoding
+        decl = f'<?xml version="{version}"'
+        if encoding:
+            decl += f' encoding="{encoding}"'
+        if standalone != -1:
+            decl += f' standalone="{"yes" if standalone else "no"}"'
+        self._line(decl + "?>", 0)
+
+    def _start_doctype(self, name, sysid, pubid, has_internal_subset):
+        """Начинает DOCTYPE; внутреннее подмножество собирается как есть."""
+        decl = f"<!DOCTYPE {name}"
+        if pubid:
+            decl += f' PUBLIC "{pubid}" "{sysid}"'
+        elif sysid:
+            decl += f' SYSTEM "{sysid}"'
+        self._doctype = [decl, " ["] if has_internal_subset else [decl]
+
+    def _end_doctype(self):
+        """Записывает собранный DOCTYPE."""
+        parts = self._doctype
+        self._doctype = None
+        if len(parts) > 1:
+            parts.append("]")
+        self._line("".join(parts) + ">", 0)
+
+    def _default(self, data):
+        """Собирает текст внутреннего подмножества DOCTYPE; остальное не нужно."""
+        if self._doctype is not None:
+            self._doctype.append(data)
+
+    def _start_element(self, name, attrs):
+        """Записывает открывающий тег (без ``>``: элемент может оказаться пустым)."""
+        self._begin_child()
+        tag = "<" + name
+        for i in range(0, len(attrs), 2):
+            tag += f" {attrs[i]}={quoteattr(attrs[i + 1])}"
+        self._place(tag, self._depth)
+        self._open_pending = True
+        self._has_children.append(False)
+        space = dict(zip(attrs[::2], attrs[1::2])).get("xml:space")
+        if space in ("preserve", "default"):
+            self._preserve.append(space == "preserve")
+        else:
+            self._preserve.append(bool(self._preserve) and self._preserve[-1])
+        self._mixed.append(bool(self._mixed) and self._mixed[-1])
+        self._depth += 1
+
+    def _end_element(self, name):
+        """Записывает закрывающий тег или сворачивает пустой элемент в ``<a/>``."""
+        text = self._take_text()
+        keep = self._keeps_content()
+        self._depth -= 1
+        self._has_children.pop()
+        self._preserve.pop()
+        self._mixed.pop()
+        if self._open_pending:
+            self._open_pending = False
+            self._emit(f">{text}</{name}>" if text else "/>")
+        elif keep:
+            self._emit(f"{text}</{name}>")
+        else:
+            self._line(f"</{name}>", self._depth)
+
+    def _characters(self, data):
+        """Накапливает текст элемента."""
+        if self._cdata is not None:
+            self._cdata.append(data)
+        else:
+            self._text.append(escape(data, {"\r": "&#13;"}))
+
+    def _comment(self, data):
+        """Записывает комментарий отдельной строкой, если содержимое не сохраняется как есть."""
+        if self._doctype is not None:
+            self._doctype.append(f"<!--{data}-->")
+            return
+        self._begin_child()
+        self._place(f"<!--{data}-->", self._depth)
+
+    def _processing_instruction(self, target, data):
+        """Записывает инструкцию обработки отдельной строкой, если содержимое не сохраняется как есть."""
+        if self._doctype is not None:
+            self._doctype.append(f"<?{target} {data}?>" if data else f"<?{target}?>")
+            return
+        self._begin_child()
+        self._place(f"<?{target} {data}?>" if data else f"<?{target}?>", self._depth)
+
+    def _start_cdata(self):
+        """Начинает секцию CDATA."""
+        self._cdata = []
+
+    def _end_cdata(self):
+        """Добавляет секцию CDATA к тексту элемента без экранирования."""
+        self._text.append("<![CDATA[" + "".join(self._cdata) + "]]>")
+        self._cdata = None
+
+
+def pretty_format(text: str, indent: str = "  ") -> str:
+    """Форматирует XML-строку целиком и возвращает результат."""
+    parts = []
+    printer = XmlPrettyPrinter(parts.append, indent)
+    printer.feed(text)
+    printer.close()
+    return "".join(parts)
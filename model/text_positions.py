@@ -0,0 +1,70 @@
+"""Перевод позиций строки Python в позиции ``QTextDocument`` и обратно.
+
+Хранилище узлов, поиск и замена считают позиции в символах строки
+Python, а ``QTextDocument`` (как и QString) — в единицах UTF-16: символ
+вне BMP (например, эмодзи) занимает в документе две позиции.
+``TextPositions`` переводит позиции одного текста. Обычно таких символов
+в тексте нет, и тогда перевод ничего не стоит.
+"""
+
+import re
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+# Короткий текст проверяется поиском, длинный — по размеру строки
+_SEARCH_LIMIT = 1 << 12
+
+
+def has_astral(text: str) -> bool:
+    """Проверяет, есть ли в тексте символы вне BMP."""
+    if text.isascii():
+        return False
+    if len(text) < _SEARCH_LIMIT:
+        return _ASTRAL_RE.search(text) is not None
+    # PEP 393: строка с символом вне BMP хранится по четыре байта на символ,
+    # поэтому длинный текст не нужно просматривать целиком
+    return sys.getsizeof(text) >= 4 * len(text)
+
+
+class TextPositions:
+    """Перевод позиций текста ``text`` в позиции документа Qt и обратно."""
+
+    def __init__(self, text: str):
+        """Запоминает позиции символов вне BMP (если они есть)."""
+        self._astral = None
+        self._qt_astral = None
+        if has_astral(text):
+            self._astral = array('q', (m.start() for m in _ASTRAL_RE.finditer(text)))
+            # Позиция k-го такого символа в документе: перед ним k лишних единиц
+            self._qt_astral = array('q', (offset + k for k, offset in enumerate(self._astral)))
+
+    @property
+    def identity(self) -> bool:
+        """Проверяет, совпадают ли позиции текста и документа."""
+        return self._astral is None
+
+    def to_qt(self, offset: int) -> int:
+        """Переводит позицию в тексте в позицию документа Qt."""
+        if self._astral is None:
+            return offset
+        return offset + bisect_left(self._astral, offset)
+
+    def from_qt(self, position: int) -> int:
+        """Переводит позицию документа Qt в позицию в тексте.
+
+        Позиция между половинами символа вне BMP переводится в позицию
+        после него.
+        """
+        if self._astral is None:
+            return position
+        return position - bisect_right(self._qt_astral, position - 2)
+
+    def span_to_qt(self, start: int, end: int):
+        """Переводит участок текста [start, end) в участок документа Qt."""
+        return self.to_qt(start), self.to_qt(end)
+
+    def span_from_qt(self, start: int, end: int):
+        """Переводит участок документа Qt [start, end) в участок текста."""
+        return self.from_qt(start), self.from_qt(end)
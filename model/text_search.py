@@ -0,0 +1,81 @@
+"""Поиск по тексту документа: обычная строка или регулярное выражение.
+
+Один и тот же скомпилированный шаблон используется для «Найти далее»,
+«Найти назад», «Заменить» и «Заменить все», поэтому все действия находят
+одни и те же совпадения.
+"""
+
+import re
+
+# Метки групп при разборе шаблона замены (символы из области личного использования)
+_MARK_START = "\ue000"
+_MARK_END = "\ue001"
+_MARK_RE = re.compile(f"{_MARK_START}(\\d+){_MARK_END}")
+
+
+def compile_pattern(pattern: str, regex=False, case_sensitive=False, whole_word=False):
+    """Компилирует шаблон поиска; ошибку в регулярном выражении выбрасывает как ``re.error``.
+
+    Обычная строка ищется буквально. «Целое слово» означает, что рядом
+    с совпадением нет букв, цифр и «_». В регулярном выражении ``^`` и ``$``
+    относятся к строкам текста.
+    """
+    source = pattern if regex else re.escape(pattern)
+    if whole_word:
+        source = rf"(?<!\w)(?:{source})(?!\w)"
+    flags = (0 if case_sensitive else re.IGNORECASE) | (re.MULTILINE if regex else 0)
+    return re.compile(source, flags)
+
+
+def find_match(compiled, text: str, start: int, end: int, forward=True):
+    """Ищет совпадение после ``end`` (вперёд) или до ``start`` (назад).
+
+    [start, end) — текущее выделение; пустое совпадение на месте пустого
+    выделения пропускается, чтобы поиск не стоял на месте. Возвращает
+    (начало, конец) совпадения или None.
+    """
+    if forward:
+        match = compiled.search(text, end)
+        if match is not None and match.end() == start == end:
+            match = compiled.search(text, end + 1) if end < len(text) else None
+        return match.span() if match is not None else None
+    found = None
+    for match in compiled.finditer(text):
+        if match.end() > start or match.span() == (start, end):
+            break
+        found = match.span()
+    return found
+
+
+def compile_replacement(compiled, replacement: str, regex=False):
+    """Разбирает шаблон замены один раз и возвращает функцию «совпадение -> замена».
+
+    В регулярном выражении ``\\1`` и ``\\g<имя>`` ссылаются на группы. Чтобы
+    не разбирать шаблон для каждого совпадения (``Match.expand`` делает
+    именно это), он раскрывается один раз для искусственного совпадения,
+    где каждая группа содержит свою метку; по меткам строится строка
+    формата. Ошибка в шаблоне выбрасывается как ``re.error`` сразу.
+    """
+    if not regex or "\\" not in replacement:
+        return lambda match: replacement
+    if _MARK_START in replacement or _MARK_END in replacement:
+        return lambda match: match.expand(replacement)
+    names = {index: name for name, index in compiled.groupindex.items()}
+    marks = [f"{_MARK_START}{index}{_MARK_END}" for index in range(compiled.groups + 1)]
+    groups = "".join(f"(?P<{names[index]}>{re.escape(marks[index])})" if index in names
+                     else f"({re.escape(marks[index])})" for index in range(1, compiled.groups + 1))
+    sample = re.compile(re.escape(marks[0]) + groups).match("".join(marks))
+    pieces = _MARK_RE.split(sample.expand(replacement))
+    fmt = []
+    skip = 0  # метки групп внутри раскрытого \g<0>
+    for i, piece in enumerate(pieces):
+        if i % 2 == 0:
+            fmt.append(piece.replace("{", "{{").replace("}", "}}"))
+        elif skip:
+            skip -= 1
+        else:
+            fmt.append("{%s}" % piece)
+            if piece == "0":
+                skip = compiled.groups
+    fmt = "".join(fmt)
+    return lambda match: fmt.format(match.group(), *match.groups(""))
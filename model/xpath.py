@@ -0,0 +1,1011 @@
+"""Запросы XPath (подмножество XPath 1.0) к разобранному документу.
+
+Запрос компилируется один раз (``compile_xpath``) и вычисляется над
+хранилищем узлов без обхода всего дерева: шаги пути работают с
+упорядоченными множествами номеров узлов, а элементы с нужным именем,
+атрибуты с нужным значением и элементы с дочерним элементом, имеющим
+нужный текст, берутся из обратных индексов документа (``DocumentIndex``).
+Индекс имён строится сразу, индексы атрибутов и текста — при первом
+запросе с этим именем и живут вместе с индексом документа.
+
+Поддерживается:
+- пути ``/a/b``, ``//a``, ``a//b``, ``.``, ``..``, ``*``, ``node()``,
+  ``text()``, ``@имя``, ``@*`` и объединение ``|``;
+- оси child, descendant, descendant-or-self, self, parent, ancestor,
+  ancestor-or-self и attribute;
+- предикаты с номером позиции, ``and``, ``or``, сравнениями
+  ``= != < <= > >=``, сложением и вычитанием (``last()-1``) и функциями
+  из ``_FUNCTIONS``.
+
+Строковое значение элемента — весь его текст без разметки (CDATA
+раскрывается), пробелы по краям сохраняются, как в XPath 1.0;
+``text()`` — текст элемента до первого дочернего элемента. Результат
+запроса — только элементы.
+"""
+
+import html
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Лексемы запроса; имя может содержать префикс пространства имён
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<string>"[^"]*"|'[^']*')
+    | (?P<number>\d+(?:\.\d*)?|\.\d+)
+    | (?P<op>//|::|\.\.|!=|<=|>=|[/.@\[\]()=<>,|*+\-])
+    | (?P<name>[^\W\d][\w.\-]*(?::[^\W\d][\w.\-]*)?)
+    )""", re.X)
+_AXES = {"child", "descendant", "descendant-or-self", "self", "parent",
+         "ancestor", "ancestor-or-self", "attribute"}
+# Функции: наименьшее и наибольшее число аргументов
+_FUNCTIONS = {
+    "position": (0, 0), "last": (0, 0), "count": (1, 1), "not": (1, 1),
+    "true": (0, 0), "false": (0, 0), "contains": (2, 2), "starts-with": (2, 2),
+    "ends-with": (2, 2), "string": (0, 1), "normalize-space": (0, 1),
+    "string-length": (0, 1), "name": (0, 1), "local-name": (0, 1), "number": (0, 1),
+}
+# Функции с числовым результатом: предикат из них сравнивается с позицией
+_NUMERIC_FUNCTIONS = {"position", "last", "count", "string-length", "number"}
+_COMPARISONS = {"=", "!=", "<", "<=", ">", ">="}
+
+# Разметка внутри элемента: CDATA раскрывается, теги, комментарии и PI убираются
+_MARKUP_RE = re.compile(r"<!\[CDATA\[(.*?)\]\]>|<!--.*?-->|<\?.*?\?>|<[^>]*>", re.S)
+# Очередной атрибут открывающего тега
+_ATTR_PAIR_RE = re.compile(r"""\s+([^\s<>=/]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+# Контекстов не больше этой доли от кандидатов: детей ищем для каждого
+# контекста отдельно, иначе — одним проходом по кандидатам
+_PER_CONTEXT_RATIO = 4
+# Кандидатов внутри контекста не больше этого числа: проверяем их,
+# иначе перебираем детей контекста
+_SCAN_LIMIT = 32
+# Отмена проверяется через это число узлов
+_CHECK_EVERY = 0x10000
+
+# Узел документа (родитель корневого элемента)
+DOCUMENT_NODE = -1
+
+
+class XPathError(ValueError):
+    """Запрос XPath записан с ошибкой или использует неподдерживаемое."""
+
+    def __init__(self, message: str, position: int = 0):
+        """Сохраняет сообщение и позицию ошибки в запросе."""
+        super().__init__(message)
+        self.position = position
+
+
+class Step:
+    """Шаг пути: ось, проверка узла и предикаты.
+
+    ``test`` — ("name", имя), ("*",), ("node",) или ("text",). Ось ``//``
+    означает «потомки контекста», то есть ``descendant-or-self::node()/child::``.
+    """
+    __slots__ = ("axis", "test", "predicates", "positional")
+
+    def __init__(self, axis: str, test, predicates=()):
+        """Сохраняет ось, проверку узла и предикаты шага."""
+        self.axis = axis
+        self.test = test
+        self.predicates = list(predicates)
+        # Номер первого предиката, зависящего от позиции узла (или None)
+        self.positional = next((i for i, p in enumerate(self.predicates) if _is_positional(p)), None)
+
+
+class XPath:
+    """Скомпилированный запрос XPath."""
+
+    def __init__(self, expression: str, tree):
+        """Сохраняет исходный текст запроса и его разобранное выражение."""
+        self.expression = expression
+        self._tree = tree
+
+    def evaluate(self, index: "DocumentIndex", cancel_token=None) -> array:
+        """Возвращает номера выбранных элементов по возрастанию (в порядке документа)."""
+        nodes = _Evaluator(index, cancel_token).value(self._tree, DOCUMENT_NODE, 1, 1)
+        return array('i', [n for n in nodes if n != DOCUMENT_NODE])
+
+
+def compile_xpath(expression: str) -> XPath:
+    """Разбирает запрос; ошибку выбрасывает как ``XPathError`` с позицией в запросе."""
+    parser = _Parser(expression)
+    tree = parser.parse()
+    paths = tree[1] if tree[0] == "union" else [tree]
+    for path in paths:
+        if path[0] != "path" or _selects_strings(path):
+            raise XPathError("Запрос должен выбирать элементы")
+    return XPath(expression, tree)
+
+
+def _selects_strings(path) -> bool:
+    """Проверяет, что путь заканчивается атрибутом или ``text()``."""
+    steps = path[2]
+    return bool(steps) and (steps[-1].axis == "attribute" or steps[-1].test == ("text",))
+
+
+def _is_positional(expr) -> bool:
+    """Проверяет, зависит ли предикат от позиции узла."""
+    kind = expr[0]
+    if kind in ("number", "arith", "neg") or (kind == "call" and expr[1] in _NUMERIC_FUNCTIONS):
+        return True
+    return _uses_position(expr)
+
+
+def _uses_position(expr) -> bool:
+    """Проверяет, вызываются ли в выражении (вне вложенных путей) position() или last()."""
+    kind = expr[0]
+    if kind == "call":
+        return expr[1] in ("position", "last") or any(_uses_position(arg) for arg in expr[2])
+    if kind in ("and", "or"):
+        return _uses_position(expr[1]) or _uses_position(expr[2])
+    if kind == "cmp" or kind == "arith":
+        return _uses_position(expr[2]) or _uses_position(expr[3])
+    if kind == "neg":
+        return _uses_position(expr[1])
+    return False
+
+
+class _Parser:
+    """Разбор запроса рекурсивным спуском в дерево кортежей.
+
+    Выражения: ("literal", строка), ("number", число), ("call", имя,
+    аргументы), ("cmp", оператор, левое, правое), ("arith", «+» или «-»,
+    левое, правое), ("neg", выражение), ("and"|"or", левое,
+    правое), ("union", пути), ("path", абсолютный, шаги).
+    """
+
+    def __init__(self, expression: str):
+        """Разбивает запрос на лексемы."""
+        self.expression = expression
+        self.tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            m = _TOKEN_RE.match(expression, pos)
+            if m is None:
+                pos += len(expression[pos:]) - len(expression[pos:].lstrip())
+                raise XPathError(f"Непонятный символ «{expression[pos]}»", pos)
+            kind = m.lastgroup
+            self.tokens.append((kind, m.group(kind), m.start(kind)))
+            pos = m.end()
+        self.tokens.append(("end", "", len(expression)))
+        self.i = 0
+
+    def parse(self):
+        """Разбирает весь запрос."""
+        if self.peek()[0] == "end":
+            raise XPathError("Пустой запрос")
+        tree = self.expr()
+        kind, value, pos = self.peek()
+        if kind != "end":
+            raise XPathError(f"Лишнее «{value}»", pos)
+        return tree
+
+    def peek(self, offset=0):
+        """Возвращает лексему, не сдвигаясь."""
+        return self.tokens[min(self.i + offset, len(self.tokens) - 1)]
+
+    def take(self):
+        """Возвращает лексему и сдвигается к следующей."""
+        token = self.peek()
+        self.i += 1
+        return token
+
+    def expect(self, value: str):
+        """Пропускает ожидаемый знак или выбрасывает ``XPathError``."""
+        kind, got, pos = self.take()
+        if kind != "op" or got != value:
+            raise XPathError(f"Ожидается «{value}»", pos)
+
+    def is_op(self, *values) -> bool:
+        """Проверяет, что следующая лексема — один из знаков ``values``."""
+        kind, value, _ = self.peek()
+        return kind == "op" and value in values
+
+    def is_word(self, word: str) -> bool:
+        """Проверяет, что следующая лексема — слово-оператор ``word``."""
+        kind, value, _ = self.peek()
+        return kind == "name" and value == word
+
+    def expr(self):
+        """OrExpr := AndExpr ('or' AndExpr)*"""
+        left = self.and_expr()
+        while self.is_word("or"):
+            self.take()
+            left = ("or", left, self.and_expr())
+        return left
+
+    def and_expr(self):
+        """AndExpr := CmpExpr ('and' CmpExpr)*"""
+        left = self.cmp_expr()
+        while self.is_word("and"):
+            self.take()
+            left = ("and", left, self.cmp_expr())
+        return left
+
+    def cmp_expr(self):
+        """CmpExpr := AdditiveExpr (оператор сравнения AdditiveExpr)*"""
+        left = self.additive_expr()
+        while self.is_op(*_COMPARISONS):
+            op = self.take()[1]
+            left = ("cmp", op, left, self.additive_expr())
+        return left
+
+    def additive_expr(self):
+        """AdditiveExpr := UnaryExpr (('+' | '-') UnaryExpr)*"""
+        left = self.unary_expr()
+        while self.is_op("+", "-"):
+            op = self.take()[1]
+            left = ("arith", op, left, self.unary_expr())
+        return left
+
+    def unary_expr(self):
+        """UnaryExpr := '-'* UnionExpr"""
+        if self.is_op("-"):
+            self.take()
+            return ("neg", self.unary_expr())
+        return self.union_expr()
+
+    def union_expr(self):
+        """UnionExpr := PrimaryExpr ('|' PrimaryExpr)*"""
+        first = self.primary()
+        if not self.is_op("|"):
+            return first
+        paths = [first]
+        while self.is_op("|"):
+            pos = self.take()[2]
+            paths.append(self.primary())
+            if any(path[0] not in ("path", "union") for path in paths):
+                raise XPathError("«|» объединяет только пути", pos)
+        return ("union", paths)
+
+    def primary(self):
+        """Строка, число, вызов функции, выражение в скобках или путь."""
+        kind, value, pos = self.peek()
+        if kind == "string":
+            self.take()
+            return ("literal", value[1:-1])
+        if kind == "number":
+            self.take()
+            return ("number", float(value))
+        if kind == "op" and value == "(":
+            self.take()
+            inner = self.expr()
+            self.expect(")")
+            return inner
+        if (kind == "name" and self.peek(1)[:2] == ("op", "(")
+                and value not in ("node", "text")):
+            return self.call()
+        if kind == "end":
+            raise XPathError("Запрос оборвался", pos)
+        return self.path()
+
+    def call(self):
+        """Вызов функции с проверкой числа аргументов."""
+        _, name, pos = self.take()
+        if name not in _FUNCTIONS:
+            raise XPathError(f"Функция {name}() не поддерживается", pos)
+        self.expect("(")
+        args = []
+        if not self.is_op(")"):
+            args.append(self.expr())
+            while self.is_op(","):
+                self.take()
+                args.append(self.expr())
+        self.expect(")")
+        low, high = _FUNCTIONS[name]
+        if not low <= len(args) <= high:
+            raise XPathError(f"Неверное число аргументов {name}()", pos)
+        return ("call", name, args)
+
+    def path(self):
+        """LocationPath := ('/' | '//')? Step (('/' | '//') Step)*"""
+        absolute = False
+        steps = []
+        if self.is_op("/", "//"):
+            absolute = True
+            if self.take()[1] == "//":
+                steps.append(Step("descendant-or-self", ("node",)))
+            elif not self._starts_step():
+                # Один «/» выбирает узел документа
+                return ("path", True, steps)
+        steps.append(self.step())
+        while self.is_op("/", "//"):
+            if self.take()[1] == "//":
+                steps.append(Step("descendant-or-self", ("node",)))
+            steps.append(self.step())
+        for step in steps[:-1]:
+            if step.axis == "attribute" or step.test == ("text",):
+                raise XPathError("Атрибут и text() могут быть только последним шагом пути")
+        return ("path", absolute, _fuse_descendants(steps))
+
+    def _starts_step(self) -> bool:
+        """Проверяет, начинается ли со следующей лексемы шаг пути."""
+        kind, value, _ = self.peek()
+        return kind == "name" or (kind == "op" and value in (".", "..", "@", "*"))
+
+    def step(self):
+        """Step := '.' | '..' | (Ось '::' | '@')? Проверка Предикат*"""
+        kind, value, pos = self.peek()
+        if kind == "op" and value in (".", ".."):
+            self.take()
+            return Step("self" if value == "." else "parent", ("node",))
+        axis = "child"
+        if kind == "op" and value == "@":
+            self.take()
+            axis = "attribute"
+        elif kind == "name" and self.peek(1)[:2] == ("op", "::"):
+            if value not in _AXES:
+                raise XPathError(f"Ось {value} не поддерживается", pos)
+            axis = value
+            self.take()
+            self.take()
+        test = self.node_test(axis)
+        predicates = []
+        while self.is_op("["):
+            self.take()
+            predicates.append(self.expr())
+            self.expect("]")
+        if predicates and (axis == "attribute" or test == ("text",)):
+            raise XPathError("Предикаты у атрибутов и text() не поддерживаются", pos)
+        return Step(axis, test, predicates)
+
+    def node_test(self, axis: str):
+        """NodeTest := Имя | '*' | 'node()' | 'text()'"""
+        kind, value, pos = self.take()
+        if kind == "op" and value == "*":
+            return ("*",)
+        if kind != "name":
+            raise XPathError("Ожидается имя элемента", pos)
+        if value in ("node", "text") and self.is_op("("):
+            self.take()
+            self.expect(")")
+            if value == "text" and axis != "child":
+                raise XPathError("text() поддерживается только на оси child", pos)
+            return ("node",) if value == "node" else ("text",)
+        return ("name", value)
+
+
+def _fuse_descendants(steps):
+    """Заменяет пары ``descendant-or-self::node()/child::x`` одним шагом оси ``//``.
+
+    Так ``//x`` ищет элементы ``x`` сразу среди потомков, не перебирая
+    все узлы поддерева; позиция в предикатах считается среди детей
+    одного родителя, как и положено для ``//x[1]``.
+    """
+    fused = []
+    for step in steps:
+        previous = fused[-1] if fused else None
+        if (step.axis == "child" and step.test != ("text",) and previous is not None
+                and previous.axis == "descendant-or-self" and previous.test == ("node",)
+                and not previous.predicates):
+            fused[-1] = Step("//", step.test, step.predicates)
+        else:
+            fused.append(step)
+    return fused
+
+
+class DocumentIndex:
+    """Обратные индексы документа для запросов.
+
+    ``by_tag[номер имени]`` — номера элементов с этим именем по возрастанию;
+    индексы атрибутов (значение -> номера элементов) и текста дочерних
+    элементов (текст -> номера родителей) строятся при первом обращении.
+    """
+
+    def __init__(self, document, cancel_token=None):
+        """Строит индекс имён; ``cancel_token`` проверяется каждые 65536 узлов."""
+        self.document = document
+        store = self.store = document.store
+        self.text = document.text
+        self._attributes = {}
+        self._child_values = {}
+        by_tag = [array('i') for _ in store.names]
+        appends = [ids.append for ids in by_tag]
+        tag_id = store.tag_id
+        for base in range(0, len(tag_id), _CHECK_EVERY):
+            _check(cancel_token)
+            for node_id, name_id in enumerate(tag_id[base:base + _CHECK_EVERY], base):
+                appends[name_id](node_id)
+        self.by_tag = by_tag
+        # Позиции со сдвигом, уже прибавленным (для bisect без вызовов на Python)
+        self._starts = store.start.raw if not store.delta else array('q', store.start)
+        self._open_ends = store.open_end.raw if not store.delta else array('q', store.open_end)
+        self._close_starts = store.close_start.raw if not store.delta else array('q', store.close_start)
+
+    def tagged(self, name: str):
+        """Возвращает номера элементов с именем ``name`` по возрастанию."""
+        name_id = self.store.name_id(name)
+        if name_id is None or name_id >= len(self.by_tag):
+            return array('i')
+        return self.by_tag[name_id]
+
+    def string_value(self, node_id: int) -> str:
+        """Возвращает весь текст элемента без разметки (пробелы по краям сохраняются)."""
+        store = self.store
+        if node_id == DOCUMENT_NODE:
+            if not len(store):
+                return ""
+            node_id = 0
+        return _character_data(self.text[store.open_end[node_id]:store.close_start[node_id]])
+
+    def own_text(self, node_id: int) -> str:
+        """Возвращает текст элемента до первого дочернего элемента (для ``text()``)."""
+        start, end = self.store.text_span(node_id)
+        return _character_data(self.text[start:end])
+
+    def attributes(self, node_id: int):
+        """Возвращает список пар (имя, значение) атрибутов элемента."""
+        if node_id == DOCUMENT_NODE:
+            return []
+        return self.document.attributes(node_id)
+
+    def attribute_index(self, name: str, cancel_token=None):
+        """Возвращает словарь «значение атрибута ``name`` -> номера элементов».
+
+        Ключ None содержит все элементы с этим атрибутом. Строится одним
+        проходом регулярного выражения по тексту: найденное место
+        привязывается к открывающему тегу по позиции и проверяется,
+        что это атрибут, а не часть значения другого атрибута.
+        """
+        index = self._attributes.get(name)
+        if index is not None:
+            return index
+        store, text = self.store, self.text
+        starts, open_ends = self._starts, self._open_ends
+        names, tag_id = store.names, store.tag_id
+        # Шаблон начинается с имени: движок ищет его как подстроку
+        pattern = re.compile(re.escape(name) + r"""\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+        index = {}
+        owners = array('i')
+        lo = 0
+        for count, m in enumerate(pattern.finditer(text)):
+            if not count % _CHECK_EVERY:
+                _check(cancel_token)
+            position = m.start()
+            if not text[position - 1].isspace():
+                # Окончание имени другого атрибута или просто текст
+                continue
+            # Места идут по возрастанию: тег ищется начиная с предыдущего
+            node_id = bisect_right(starts, position, lo) - 1
+            if node_id < 0 or m.end() > open_ends[node_id]:
+                continue
+            lo = node_id
+            tag_start = starts[node_id]
+            if text.find('"', tag_start, position) != -1 or text.find("'", tag_start, position) != -1:
+                # Перед найденным местом есть значения других атрибутов:
+                # проверяем, что оно не внутри одного из них
+                name_end = tag_start + 1 + len(names[tag_id[node_id]])
+                if not _starts_attribute(text, name_end, position):
+                    continue
+            value = m.group(m.lastindex)
+            if "&" in value:
+                value = html.unescape(value)
+            ids = index.get(value)
+            if ids is None:
+                ids = index[value] = array('i')
+            ids.append(node_id)
+            owners.append(node_id)
+        index[None] = owners
+        self._attributes[name] = index
+        return index
+
+    def child_value_index(self, name: str, cancel_token=None):
+        """Возвращает словарь «текст дочернего элемента ``name`` -> номера родителей»."""
+        index = self._child_values.get(name)
+        if index is not None:
+            return index
+        store, text = self.store, self.text
+        parent, first_child = store.parent, store.first_child
+        open_ends, close_starts = self._open_ends, self._close_starts
+        lists = {}
+        for count, node_id in enumerate(self.tagged(name)):
+            if not count % _CHECK_EVERY:
+                _check(cancel_token)
+            value = None
+            if first_child[node_id] == -1:
+                # Текст без разметки и ссылок на сущности берётся как есть
+                value = text[open_ends[node_id]:close_starts[node_id]]
+                if "<" in value or "&" in value:
+                    value = None
+            if value is None:
+                value = self.string_value(node_id)
+            lists.setdefault(value, []).append(parent[node_id])
+        # Родители детей, идущих по порядку, не обязательно идут по порядку
+        for ids in lists.values():
+            if len(ids) > 1:
+                ids[:] = sorted(set(ids))
+        index = lists
+        self._child_values[name] = index
+        return index
+
+
+def _character_data(raw: str) -> str:
+    """Склеивает символьные данные участка: ссылки на символы раскрываются,
+    содержимое CDATA берётся как есть, теги, комментарии и PI пропускаются.
+    """
+    if "<" not in raw:
+        return html.unescape(raw) if "&" in raw else raw
+    parts = []
+    pos = 0
+    for m in _MARKUP_RE.finditer(raw):
+        piece = raw[pos:m.start()]
+        parts.append(html.unescape(piece) if "&" in piece else piece)
+        if m.group(1) is not None:
+            parts.append(m.group(1))
+        pos = m.end()
+    piece = raw[pos:]
+    parts.append(html.unescape(piece) if "&" in piece else piece)
+    return "".join(parts)
+
+
+def _starts_attribute(text: str, name_end: int, position: int) -> bool:
+    """Проверяет, что с ``position`` открывающего тега начинается имя атрибута.
+
+    Атрибуты тега разбираются по порядку от конца имени элемента.
+    """
+    pos = name_end
+    while True:
+        m = _ATTR_PAIR_RE.match(text, pos)
+        if m is None or m.start(1) > position:
+            return False
+        if m.start(1) == position:
+            return True
+        pos = m.end()
+
+
+def _check(cancel_token):
+    """Прерывает вычисление, если запрошена отмена."""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+def _intersect(nodes, ids):
+    """Возвращает общие номера двух упорядоченных последовательностей."""
+    if len(nodes) * 8 < len(ids):
+        found = []
+        for n in nodes:
+            i = bisect_left(ids, n)
+            if i < len(ids) and ids[i] == n:
+                found.append(n)
+        return found
+    members = set(ids)
+    return [n for n in nodes if n in members]
+
+
+def _merge(a, b):
+    """Возвращает объединение двух упорядоченных множеств номеров."""
+    if not a:
+        return list(b)
+    if not b:
+        return list(a)
+    return sorted(set(a).union(b))
+
+
+def _number(value: str) -> float:
+    """Переводит строку в число по правилам XPath (NaN, если это не число)."""
+    try:
+        return float(value.strip())
+    except ValueError:
+        return math.nan
+
+
+def _format_number(value: float) -> str:
+    """Записывает число по правилам XPath: целые — без дробной части."""
+    if math.isnan(value):
+        return "NaN"
+    if value == int(value):
+        return str(int(value))
+    return str(value)
+
+
+class _Evaluator:
+    """Вычисление выражения над индексом документа.
+
+    Значения: список (номера узлов по возрастанию или строки атрибутов и
+    text()), строка, число (float) или логическое значение.
+    """
+
+    def __init__(self, index: DocumentIndex, cancel_token=None):
+        """Запоминает индекс и признак отмены."""
+        self.index = index
+        self.store = index.store
+        self.cancel_token = cancel_token
+
+    # --- значения выражений
+
+    def value(self, expr, node: int, position: int, size: int):
+        """Вычисляет выражение для контекстного узла, его позиции и размера контекста."""
+        kind = expr[0]
+        if kind == "literal" or kind == "number":
+            return expr[1]
+        if kind == "path":
+            return self.path(expr, [node])
+        if kind == "union":
+            result = []
+            for path in expr[1]:
+                result = _merge(result, self.value(path, node, position, size))
+            return result
+        if kind == "and":
+            return (self.boolean(self.value(expr[1], node, position, size))
+                    and self.boolean(self.value(expr[2], node, position, size)))
+        if kind == "or":
+            return (self.boolean(self.value(expr[1], node, position, size))
+                    or self.boolean(self.value(expr[2], node, position, size)))
+        if kind == "cmp":
+            return self.compare(expr[1], self.value(expr[2], node, position, size),
+                                self.value(expr[3], node, position, size))
+        if kind == "arith":
+            left = self.number(self.value(expr[2], node, position, size))
+            right = self.number(self.value(expr[3], node, position, size))
+            return left + right if expr[1] == "+" else left - right
+        if kind == "neg":
+            return -self.number(self.value(expr[1], node, position, size))
+        return self.call(expr[1], expr[2], node, position, size)
+
+    def call(self, name: str, args, node: int, position: int, size: int):
+        """Вычисляет вызов функции."""
+        if name == "position":
+            return float(position)
+        if name == "last":
+            return float(size)
+        if name == "true" or name == "false":
+            return name == "true"
+        values = [self.value(arg, node, position, size) for arg in args]
+        if name == "count":
+            if not isinstance(values[0], list):
+                raise XPathError("count() ожидает путь")
+            return float(len(values[0]))
+        if name == "not":
+            return not self.boolean(values[0])
+        if name in ("name", "local-name"):
+            nodes = values[0] if values else [node]
+            if not isinstance(nodes, list):
+                raise XPathError(f"{name}() ожидает путь")
+            nodes = [n for n in nodes if isinstance(n, int) and n != DOCUMENT_NODE]
+            if not nodes:
+                return ""
+            tag = self.store.tag(nodes[0])
+            return tag.rpartition(":")[2] if name == "local-name" else tag
+        strings = [self.string(value) for value in values] or [self.index.string_value(node)]
+        if name == "contains":
+            return strings[1] in strings[0]
+        if name == "starts-with":
+            return strings[0].startswith(strings[1])
+        if name == "ends-with":
+            return strings[0].endswith(strings[1])
+        if name == "string":
+            return strings[0]
+        if name == "normalize-space":
+            return " ".join(strings[0].split())
+        if name == "string-length":
+            return float(len(strings[0]))
+        # number()
+        if values and isinstance(values[0], float):
+            return values[0]
+        return _number(strings[0])
+
+    def string(self, value) -> str:
+        """Переводит значение в строку (для пути — значение первого узла)."""
+        if isinstance(value, list):
+            if not value:
+                return ""
+            first = value[0]
+            return first if isinstance(first, str) else self.index.string_value(first)
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, float):
+            return _format_number(value)
+        return value
+
+    def number(self, value) -> float:
+        """Переводит значение в число по правилам XPath."""
+        if isinstance(value, bool):
+            return float(value)
+        if isinstance(value, float):
+            return value
+        return _number(self.string(value))
+
+    def boolean(self, value) -> bool:
+        """Переводит значение в логическое по правилам XPath."""
+        if isinstance(value, float):
+            return value != 0 and not math.isnan(value)
+        return bool(value)
+
+    def compare(self, op: str, left, right) -> bool:
+        """Сравнивает значения; путь сравнивается по каждому своему узлу («хотя бы один»)."""
+        if isinstance(left, bool) or isinstance(right, bool):
+            left, right = self.boolean(left), self.boolean(right)
+            if op in ("=", "!="):
+                return (left == right) == (op == "=")
+            return self._compare_atoms(op, float(left), float(right))
+        lefts = self._atoms(left)
+        rights = self._atoms(right)
+        return any(self._compare_atoms(op, a, b) for a in lefts for b in rights)
+
+    def _atoms(self, value):
+        """Возвращает значения для сравнения: строки узлов пути или само значение."""
+        if not isinstance(value, list):
+            return [value]
+        return [v if isinstance(v, str) else self.index.string_value(v) for v in value]
+
+    def _compare_atoms(self, op: str, a, b) -> bool:
+        """Сравнивает строку или число со строкой или числом."""
+        if op in ("=", "!="):
+            if isinstance(a, float) or isinstance(b, float):
+                a = a if isinstance(a, float) else _number(a)
+                b = b if isinstance(b, float) else _number(b)
+            return (a == b) if op == "=" else (a != b)
+        a = a if isinstance(a, float) else _number(a)
+        b = b if isinstance(b, float) else _number(b)
+        if op == "<":
+            return a < b
+        if op == "<=":
+            return a <= b
+        if op == ">":
+            return a > b
+        return a >= b
+
+    # --- пути
+
+    def path(self, expr, contexts):
+        """Вычисляет путь от контекстных узлов; возвращает номера узлов или строки."""
+        _, absolute, steps = expr
+        nodes = [DOCUMENT_NODE] if absolute else contexts
+        for step in steps:
+            _check(self.cancel_token)
+            if step.axis == "attribute":
+                return self._attribute_values(nodes, step.test)
+            if step.test == ("text",):
+                return [self.index.own_text(n) for n in nodes if n != DOCUMENT_NODE]
+            nodes = self.select(nodes, step)
+            if not nodes:
+                break
+        return nodes
+
+    def _attribute_values(self, nodes, test):
+        """Возвращает значения атрибутов узлов (``@имя`` или ``@*``)."""
+        values = []
+        for node in nodes:
+            for name, value in self.index.attributes(node):
+                if test == ("*",) or test == ("node",) or name == test[1]:
+                    values.append(value)
+        return values
+
+    def select(self, contexts, step: Step):
+        """Выполняет шаг пути для упорядоченного множества контекстных узлов."""
+        predicates = step.predicates
+        first_positional = step.positional
+        if first_positional is None:
+            nodes = self.axis(contexts, step)
+            for predicate in predicates:
+                nodes = self.filter(nodes, predicate)
+            return nodes
+        if step.axis in ("child", "//", "self", "parent"):
+            # Позиция считается среди узлов с общим родителем (для self и
+            # parent — у каждого узла своя группа из одного узла)
+            nodes = self.axis(contexts, step)
+            for predicate in predicates[:first_positional]:
+                nodes = self.filter(nodes, predicate)
+            groups = self._group_by_parent(nodes) if step.axis in ("child", "//") else [[n] for n in nodes]
+            rest = predicates[first_positional:]
+        else:
+            groups = [self._axis_nodes(c, step) for c in contexts]
+            rest = predicates
+        selected = set()
+        for group in groups:
+            for predicate in rest:
+                group = self._filter_positional(group, predicate)
+            selected.update(group)
+        return sorted(selected)
+
+    def _group_by_parent(self, nodes):
+        """Разбивает узлы на группы детей одного родителя, сохраняя порядок."""
+        parent = self.store.parent
+        groups = {}
+        for n in nodes:
+            groups.setdefault(parent[n] if n != DOCUMENT_NODE else None, []).append(n)
+        return groups.values()
+
+    def filter(self, nodes, predicate):
+        """Оставляет узлы, для которых верен предикат, не зависящий от позиции."""
+        kind = predicate[0]
+        if kind == "and":
+            return self.filter(self.filter(nodes, predicate[1]), predicate[2])
+        if kind == "or":
+            return _merge(self.filter(nodes, predicate[1]), self.filter(nodes, predicate[2]))
+        ids = self._indexed(predicate)
+        if ids is not None:
+            return _intersect(nodes, ids)
+        result = []
+        for count, n in enumerate(nodes):
+            if not count % _CHECK_EVERY:
+                _check(self.cancel_token)
+            if self.boolean(self.value(predicate, n, 1, 1)):
+                result.append(n)
+        return result
+
+    def _filter_positional(self, group, predicate):
+        """Оставляет узлы группы, для которых верен предикат с учётом их позиций."""
+        size = len(group)
+        if predicate[0] == "number":
+            position = predicate[1]
+            return [group[int(position) - 1]] if position == int(position) and 1 <= position <= size else []
+        result = []
+        for position, n in enumerate(group, 1):
+            value = self.value(predicate, n, position, size)
+            if isinstance(value, float):
+                if value == position:
+                    result.append(n)
+            elif self.boolean(value):
+                result.append(n)
+        return result
+
+    def _indexed(self, predicate):
+        """Возвращает упорядоченные номера узлов, для которых верен предикат,
+        если их можно взять из индекса, иначе None.
+
+        По индексу вычисляются ``[@a]``, ``[@a='v']`` и ``[b='v']``.
+        """
+        kind = predicate[0]
+        if kind == "path":
+            name = _simple_attribute(predicate)
+            if name is None:
+                return None
+            return self.index.attribute_index(name, self.cancel_token).get(None, ())
+        if kind != "cmp" or predicate[1] != "=":
+            return None
+        left, right = predicate[2], predicate[3]
+        if left[0] == "literal":
+            left, right = right, left
+        if right[0] != "literal" or left[0] != "path":
+            return None
+        name = _simple_attribute(left)
+        if name is not None:
+            return self.index.attribute_index(name, self.cancel_token).get(right[1], ())
+        name = _simple_child(left)
+        if name is not None:
+            return self.index.child_value_index(name, self.cancel_token).get(right[1], ())
+        return None
+
+    # --- оси
+
+    def axis(self, contexts, step: Step):
+        """Возвращает упорядоченные узлы оси шага для всех контекстов, прошедшие проверку."""
+        axis, test = step.axis, step.test
+        store = self.store
+        if axis == "child":
+            return self._children(contexts, test)
+        if axis in ("//", "descendant"):
+            return self._descendants(contexts, test)
+        if axis == "descendant-or-self":
+            own = [c for c in contexts if self._matches(c, test)]
+            return _merge(own, self._descendants(contexts, test))
+        if axis == "self":
+            return [c for c in contexts if self._matches(c, test)]
+        if axis == "parent":
+            parents = {store.parent[c] for c in contexts if c != DOCUMENT_NODE}
+            return sorted(p for p in parents if self._matches(p, test))
+        # ancestor, ancestor-or-self
+        seen = set()
+        for c in contexts:
+            n = c if axis == "ancestor-or-self" else self._parent(c)
+            while n is not None and n not in seen:
+                seen.add(n)
+                n = self._parent(n)
+        return sorted(n for n in seen if self._matches(n, test))
+
+    def _axis_nodes(self, context: int, step: Step):
+        """Возвращает узлы оси одного контекста в порядке оси, прошедшие проверку."""
+        axis, test = step.axis, step.test
+        if axis in ("descendant", "descendant-or-self"):
+            nodes = self._descendants([context], test)
+            if axis == "descendant-or-self" and self._matches(context, test):
+                nodes = [context] + list(nodes)
+            return list(nodes)
+        # Обратные оси: ближайший к контексту узел первый
+        nodes = []
+        n = context if axis == "ancestor-or-self" else self._parent(context)
+        while n is not None:
+            if self._matches(n, test):
+                nodes.append(n)
+            n = self._parent(n)
+        return nodes
+
+    def _parent(self, node: int):
+        """Возвращает родителя узла (для корневого элемента — узел документа) или None."""
+        if node == DOCUMENT_NODE:
+            return None
+        return self.store.parent[node]
+
+    def _matches(self, node: int, test) -> bool:
+        """Проверяет узел на соответствие проверке шага."""
+        if test == ("node",):
+            return True
+        if node == DOCUMENT_NODE:
+            return False
+        if test == ("*",):
+            return True
+        return self.store.tag(node) == test[1]
+
+    def _candidates(self, test):
+        """Возвращает упорядоченные номера элементов, подходящих под проверку."""
+        if test[0] == "name":
+            return self.index.tagged(test[1])
+        return range(len(self.store))
+
+    def _subtree_end(self, node: int) -> int:
+        """Возвращает номер первого узла после поддерева."""
+        if node == DOCUMENT_NODE:
+            return len(self.store)
+        return self.store.subtree_end(node)
+
+    def _children(self, contexts, test):
+        """Возвращает детей контекстных узлов, прошедших проверку."""
+        store = self.store
+        parent = store.parent
+        candidates = self._candidates(test)
+        if len(contexts) * _PER_CONTEXT_RATIO > len(candidates):
+            # Один проход по кандидатам с отметками контекстов (сдвиг на 1 — для узла документа)
+            marks = bytearray(len(store) + 1)
+            for c in contexts:
+                marks[c + 1] = 1
+            return [n for n in candidates if marks[parent[n] + 1]]
+        tag_id = store.tag_id
+        result = []
+        for c in contexts:
+            if c == DOCUMENT_NODE:
+                if len(store) and self._matches(0, test):
+                    result.append(0)
+                continue
+            lo = bisect_left(candidates, c + 1)
+            hi = bisect_left(candidates, self._subtree_end(c), lo)
+            if hi - lo <= _SCAN_LIMIT:
+                result.extend(n for n in candidates[lo:hi] if parent[n] == c)
+            elif test[0] == "name":
+                name_id = tag_id[candidates[lo]]
+                result.extend(n for n in store.children(c) if tag_id[n] == name_id)
+            else:
+                result.extend(store.children(c))
+        # Дети вложенных друг в друга контекстов могут идти не по порядку
+        if any(a > b for a, b in zip(result, result[1:])):
+            result.sort()
+        return result
+
+    def _descendants(self, contexts, test):
+        """Возвращает потомков контекстных узлов, прошедших проверку."""
+        candidates = self._candidates(test)
+        result = []
+        end = DOCUMENT_NODE - 1
+        for c in contexts:
+            if c < end:
+                # Поддерево вложено в уже пройденное
+                continue
+            end = self._subtree_end(c)
+            lo = bisect_left(candidates, c + 1)
+            result.extend(candidates[lo:bisect_left(candidates, end, lo)])
+        return result
+
+
+def _simple_attribute(path):
+    """Возвращает имя атрибута для пути ``@имя`` (иначе None)."""
+    _, absolute, steps = path
+    if absolute or len(steps) != 1:
+        return None
+    step = steps[0]
+    if step.axis != "attribute" or step.test[0] != "name":
+        return None
+    return step.test[1]
+
+
+def _simple_child(path):
+    """Возвращает имя элемента для пути из одного дочернего шага без предикатов (иначе None)."""
+    _, absolute, steps = path
+    if absolute or len(steps) != 1:
+        return None
+    step = steps[0]
+    if step.axis != "child" or step.test[0] != "name" or step.predicates:
+        return None
+    return step.test[1]
@@ -3,7 +3,8 @@ import sys
 import os
 
 from PyQt5.QtWidgets import QApplication, QMessageBox
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QStandardPaths
+from PyQt5.QtGui import QTextCursor
 
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -14,6 +15,8 @@ from main import XMLEditor
 @pytest.fixture(scope="session")
 def qapp():
     """Создает QApplication для всех тестов"""
+    # Кэш индексов и прочие файлы приложения — в отдельных папках для тестов
+    QStandardPaths.setTestModeEnabled(True)
     app = QApplication.instance()
     if app is None:
         app = QApplication(sys.argv)
@@ -34,6 +37,13 @@ def stub_dialogs(monkeypatch):
     monkeypatch.setattr("main.XMLEditor.confirm_save_if_dirty", mock_confirm_save_if_dirty)
 
 
+@pytest.fixture(autouse=True)
+def isolated_settings(monkeypatch, tmp_path_factory):
+    """Пишет настройки приложения во временный файл, а не в app_settings.ini"""
+    settings_dir = tmp_path_factory.mktemp("settings")
+    monkeypatch.setattr(XMLEditor, "SETTINGS_PATH", str(settings_dir / "app_settings.ini"))
+
+
 @pytest.fixture
 def editor(qapp):
     """Создает редактор для каждого теста"""
@@ -187,19 +197,18 @@ def test_status_bar_update(editor):
 
 def test_tree_item_creation(editor):
     """Тест: создание элемента дерева"""
-    import xml.etree.ElementTree as ET
-    
-    # Создаем XML элемент
-    elem = ET.fromstring("<test attr='value'>text</test>")
-    
-    # Создаем элемент дерева
-    item = editor._make_item_for_element(elem, [0])
-    
+    from model.document import parse_document
+
+    # Создаем документ и показываем его в модели дерева
+    document = parse_document("<test attr='value'>text</test>", 0)
+    editor.tree_model.set_document(document)
+    model = editor.tree_model
+
     # Проверяем, что элемент создан
-    assert item is not None
-    assert "test" in item.text(0)  # название элемента
-    assert item.text(1) == "text"  # текст элемента
-    assert "attr=value" in item.text(2)  # атрибуты
+    assert model.rowCount() == 1
+    assert "test" in model.index(0, 0).data()  # название элемента
+    assert model.index(0, 1).data() == "text"  # текст элемента
+    assert "attr=value" in model.index(0, 2).data()  # атрибуты
 
 
 def test_empty_tree_build(editor):
@@ -207,7 +216,7 @@ def test_empty_tree_build(editor):
     editor.build_tree_from_text("")
     
     # Дерево должно быть пустым
-    assert editor.tree.topLevelItemCount() == 0
+    assert editor.tree_model.rowCount() == 0
 
 
 def test_window_title(editor):
@@ -216,5 +225,1310 @@ def test_window_title(editor):
     assert "XML-редактор" in title
 
 
+
+def test_document_reused_until_text_changes(editor):
+    """Тест: документ разбирается один раз на версию текста"""
+    editor.editor.setPlainText("<root><a>1</a><b>2</b></root>")
+
+    first = editor._current_document()
+    assert first is not None
+    assert editor._current_document() is first  # повторный разбор не нужен
+    assert first.value(first.store.node_by_path([1])) == "2"
+
+    # Любое изменение текста делает документ устаревшим
+    editor.editor.setPlainText("<root><a>3</a></root>")
+    second = editor._current_document()
+    assert second is not first
+    assert second.value(second.store.node_by_path([0])) == "3"
+    assert second.store.node_by_path([5]) is None
+
+
+def test_node_store_skips_comments_and_cdata():
+    """Тест: хранилище узлов не путает теги в комментариях и CDATA"""
+    from model.node_store import build_node_store
+
+    text = '<root><!-- <item> --><![CDATA[<item>]]><item a=">">x</item><e/></root>'
+    index = build_node_store(text)
+
+    assert len(index) == 3
+    item_id, empty_id = list(index.children(0))
+    start, end = index.start_tag_span(item_id)
+    assert text[start:end] == '<item a=">">'
+    start, end = index.text_span(item_id)
+    assert text[start:end] == "x"
+    start, end = index.end_tag_span(item_id)
+    assert text[start:end] == "</item>"
+    assert index.element_span(empty_id) == index.start_tag_span(empty_id)
+
+
+def test_tree_click_selects_exact_tag(editor):
+    """Тест: клик по узлу дерева выделяет именно его открывающий тег"""
+    text = "<root><!-- <b> --><a/><b k='1'>2</b></root>"
+    editor.editor.setPlainText(text)
+    editor.tree_model.set_document(editor._current_document())
+    root_index = editor.tree_model.index(0, 0)
+    b_index = editor.tree_model.index(1, 0, root_index)
+
+    editor.on_tree_item_clicked(b_index)
+
+    assert editor.editor.textCursor().selectedText() == "<b k='1'>"
+
+
+def test_tree_model_navigation(editor):
+    """Тест: модель дерева отдаёт детей и родителей по номерам узлов"""
+    from model.document import parse_document
+
+    document = parse_document("<r><a><x/><y>&lt;1&gt;</y></a><b/></r>", 0)
+    model = editor.tree_model
+    model.set_document(document)
+
+    root_index = model.index(0, 0)
+    assert model.rowCount(root_index) == 2
+    a_index = model.index(0, 0, root_index)
+    y_index = model.index(1, 0, a_index)
+    assert "y" in y_index.data()
+    assert model.index(1, 1, a_index).data() == "<1>"
+    assert model.parent(y_index) == a_index
+    assert model.index_for_node(model.node_id(y_index)) == y_index
+    assert not model.hasChildren(model.index(1, 0, root_index))
+
+
+def test_node_store_interns_names():
+    """Тест: имена тегов и атрибутов хранятся в таблице один раз"""
+    from model.node_store import build_node_store, XmlParseError
+
+    text = '<ns:feed><ns:rec id="1">a &amp; b</ns:rec><ns:rec id="2"/></ns:feed>'
+    store = build_node_store(text)
+
+    assert store.names.count("ns:rec") == 1
+    assert store.tag_id[1] == store.tag_id[2]
+    assert store.value(1, text) == "a & b"
+    (name1, _), = store.attributes(1, text)
+    (name2, _), = store.attributes(2, text)
+    assert name1 is name2
+
+    with pytest.raises(XmlParseError):
+        build_node_store("<a><b></a>")
+
+
+def test_tree_update_keeps_expanded_nodes(editor):
+    """Тест: обновление дерева не сворачивает раскрытые узлы"""
+    from model.document import parse_document
+
+    model = editor.tree_model
+    model.set_document(parse_document("<r><a><x>1</x></a><b><y>2</y></b></r>", 0))
+    root_index = model.index(0, 0)
+    editor.tree.expand(root_index)
+    editor.tree.expand(model.index(1, 0, root_index))
+
+    # Правка значения: структура та же, сброса модели нет
+    resets = []
+    model.modelReset.connect(lambda: resets.append(True))
+    model.update_document(parse_document("<r><a><x>1</x></a><b><y>3</y></b></r>", 1))
+    b_index = model.index(1, 0, model.index(0, 0))
+    assert model.index(0, 1, b_index).data() == "3"
+    assert editor.tree.isExpanded(b_index)
+
+    # Новый элемент перед раскрытым узлом: номера узлов сдвигаются
+    model.update_document(parse_document("<r><a><x>1</x></a><n/><b><y>3</y></b></r>", 2))
+    b_index = model.index(2, 0, model.index(0, 0))
+    assert "b" in b_index.data()
+    assert editor.tree.isExpanded(b_index)
+    assert not resets
+
+
+def test_text_change_region():
+    """Тест: поиск изменённого участка текста"""
+    from model.document import text_change_region
+
+    assert text_change_region("<a>12</a>", "<a>1x2</a>") == (4, 4, 5)
+    assert text_change_region("abc", "abc") == (3, 3, 3)
+    assert text_change_region("a" * 200000, "a" * 100000 + "b" + "a" * 99999) == (100000, 100001, 100001)
+
+
+def test_tree_edit_splices_text(editor):
+    """Тест: правка значения и атрибутов из дерева меняет только нужный участок"""
+    text = '<root>\n  <!-- keep -->\n  <a k="1">old</a>\n  <b/>\n</root>'
+    editor.editor.setPlainText(text)
+    editor.tree_model.set_document(editor._current_document())
+    model = editor.tree_model
+    root_index = model.index(0, 0)
+
+    model.setData(model.index(0, 1, root_index), "x < y")
+    assert editor.editor.toPlainText() == text.replace(">old<", ">x &lt; y<")
+
+    model.setData(model.index(1, 1, root_index), "new")
+    model.setData(model.index(0, 2, root_index), "k=2 id=a b")
+    assert editor.editor.toPlainText() == (
+        '<root>\n  <!-- keep -->\n  <a k="2" id="a b">x &lt; y</a>\n  <b>new</b>\n</root>')
+    assert not model.setData(model.index(0, 2, root_index), "broken")
+
+    # Каждая правка — один шаг отмены
+    editor.editor.undo()
+    editor.editor.undo()
+    assert editor.editor.toPlainText() == text.replace(">old<", ">x &lt; y<")
+
+
+def test_pretty_format_file_task(tmp_path):
+    """Тест: форматирование файла в файл фоновой задачей"""
+    from threads.task_scheduler import CancelToken
+    from threads.xml_formatter import format_file
+
+    source = tmp_path / "in.xml"
+    source.write_bytes('<?xml version="1.0" encoding="windows-1251"?><r><!--c--><a>я</a><b/></r>'.encode("cp1251"))
+    target = tmp_path / "out.xml"
+
+    assert format_file(CancelToken("format"), str(source), str(target), "\t") == str(target)
+    assert target.read_bytes().decode("cp1251") == (
+        '<?xml version="1.0" encoding="windows-1251"?>\n<r>\n\t<!--c-->\n\t<a>я</a>\n\t<b/>\n</r>')
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["in.xml", "out.xml"]
+
+
+def test_highlighter_multiline_comment(editor):
+    """Тест: состояние многострочного комментария переносится между блоками"""
+    from ui.syntax_highlighter import tokenize_block, TEXT, COMMENT, VALUE_DQ, COMMENT_TOKEN, TAG_TOKEN
+
+    spans, state = tokenize_block('<a k="1"><!-- <b>', TEXT)
+    assert state == COMMENT
+    assert spans[-1] == (9, 8, COMMENT_TOKEN)
+    spans, state = tokenize_block("<b> --><c/>", COMMENT)
+    assert spans == [(0, 7, COMMENT_TOKEN), (7, 4, TAG_TOKEN)]
+    assert tokenize_block('<d v="x', TEXT)[1] == VALUE_DQ
+
+    editor.editor.setPlainText("<r>\n<!--\n<x>\n-->\n</r>")
+    block = editor.editor.document().findBlockByNumber(2)
+    assert block.userState() == COMMENT
+    assert all(r.format.fontItalic() for r in block.layout().additionalFormats())
+
+
+def test_background_highlighting(editor, qapp):
+    """Тест: большой текст подсвечивается в фоне, а сверх предела — не подсвечивается"""
+    import time
+    from ui.highlight_scheduler import HighlightScheduler
+
+    scheduler = editor.highlight_scheduler
+    scheduler.async_limit = 1000
+    text = "<r>\n" + '<a k="1">v</a>\n' * 5000 + "<!--\n</r>"
+    editor._set_editor_text(text)
+    assert scheduler.mode == HighlightScheduler.BACKGROUND
+    assert editor.highlighter.document() is None
+    assert editor.editor.document().firstBlock().layout().formats()
+
+    deadline = time.time() + 10
+    while scheduler.is_busy() and time.time() < deadline:
+        qapp.processEvents()
+    last = editor.editor.document().lastBlock()
+    assert last.userState() != -1
+    assert all(r.format.fontItalic() for r in last.layout().formats())
+
+    scheduler.plain_limit = 10000
+    editor._set_editor_text(text)
+    assert scheduler.mode == HighlightScheduler.PLAIN
+    assert not editor.editor.document().firstBlock().layout().formats()
+
+    editor._set_editor_text("<r/>")
+    assert editor.highlighter.document() is editor.editor.document()
+
+
+def test_task_scheduler_supersedes_and_drops_stale(qapp):
+    """Тест: новая задача отменяет старую, результат для старой версии отбрасывается"""
+    import time
+    from threads.task_scheduler import TaskScheduler
+
+    version = [0]
+    scheduler = TaskScheduler(max_workers=2, version_provider=lambda: version[0])
+    events = []
+
+    def slow(token, value):
+        for _ in range(200):
+            token.raise_if_cancelled()
+            time.sleep(0.005)
+        return value
+
+    # Замещённая задача завершается молча, явно отменённая — с on_cancelled
+    scheduler.submit("job", slow, "first", on_result=events.append,
+                     on_cancelled=lambda: events.append("superseded"))
+    scheduler.submit("job", lambda token: "second", on_result=events.append)
+    scheduler.submit("slow", slow, "third", on_result=events.append,
+                     on_cancelled=lambda: events.append("cancelled"))
+    scheduler.cancel("slow")
+    scheduler.submit("other", lambda token: "stale", on_result=events.append,
+                     on_stale=lambda: events.append("dropped"), version=0)
+    version[0] = 1
+    deadline = time.time() + 5
+    while scheduler._runnables and time.time() < deadline:
+        qapp.processEvents()
+
+    assert sorted(events) == ["cancelled", "dropped", "second"]
+
+
+def test_file_loader_chunks_progress_and_cancel(tmp_path, monkeypatch):
+    """Тест: загрузка файла порциями с разбором, прогрессом и отменой"""
+    import threads.file_loader as file_loader
+    from threads.task_scheduler import CancelToken, TaskCancelled
+    from model.node_store import build_node_store
+
+    # Маленькие порции, чтобы многобайтовые символы попадали на их границы
+    monkeypatch.setattr(file_loader, "CHUNK_SIZE", 3)
+    path = tmp_path / "doc.xml"
+    path.write_bytes("<r>\r\n<!-- <x> --><a k='я'>привет</a>\r\n</r>\r\n".encode("utf-8"))
+    text = "<r>\n<!-- <x> --><a k='я'>привет</a>\n</r>\n"
+
+    token = CancelToken("load")
+    progress = []
+    token._report = progress.append
+    loaded_path, content, store, problems = file_loader.load_file(token, str(path))
+    assert (loaded_path, content, problems) == (str(path), text, [])
+    assert progress == sorted(set(progress)) and progress[-1] == 100
+    # Хранилище узлов построено по ходу чтения и совпадает с разбором целиком
+    assert list(store.start) == list(build_node_store(text).start)
+    assert store.attributes(1, content) == [("k", "я")]
+
+    # Ошибка XML не мешает построить частичное дерево
+    path.write_bytes(b"<r><a></r>")
+    _, _, store, problems = file_loader.load_file(CancelToken("load"), str(path))
+    assert [store.tag(i) for i in range(len(store))] == ["r", "a"]
+    assert problems == [(3, 1, 3, "Не закрыт элемент <a>")]
+
+    token = CancelToken("load")
+    token.cancel()
+    with pytest.raises(TaskCancelled):
+        file_loader.load_file(token, str(path))
+
+
+
+def test_snapshot_shared_per_revision(editor, qapp):
+    """Тест: обработчики одной ревизии текста делят один снимок"""
+    from model.document import parse_document
+
+    snapshots = editor.snapshots
+    editor._set_editor_text("<r>\n<a/>\n</r>")
+    snapshot = snapshots.snapshot()
+    assert snapshot.text == "<r>\n<a/>\n</r>" and snapshot.line_count == 3
+    editor.editor.moveCursor(QTextCursor.End)
+    editor.update_status()
+    assert snapshots.snapshot() is snapshot
+    assert editor._current_document() is editor._current_document()
+
+    # Перекраска подсветки не меняет текст и не начинает новую ревизию
+    revision = snapshots.revision
+    editor.highlighter.rehighlight()
+    assert snapshots.revision == revision
+
+    editor.editor.insertPlainText("x")
+    assert snapshots.revision > revision
+    assert snapshots.snapshot() is not snapshot
+    assert snapshots.text() == "<r>\n<a/>\n</r>x"
+    # Документ для устаревшей ревизии не принимается
+    assert not snapshots.adopt(revision, snapshot.text, parse_document(snapshot.text, revision))
+
+    # Асинхронный запрос читает текст порциями; правка отменяет ожидающие запросы
+    received = []
+    editor.editor.insertPlainText("y")
+    snapshots.request_text(received.append)
+    editor.editor.insertPlainText("\u2028")
+    snapshots.request_text(received.append)
+    assert received == [] and snapshots.cached_text() is None
+    while not received:
+        qapp.processEvents()
+    assert received == ["<r>\n<a/>\n</r>xy\u2028"]
+    assert snapshots.cached_text() == received[0]
+
+
+def test_document_stats_incremental(editor):
+    """Тест: счётчики строки состояния обновляются по правкам без копирования текста"""
+    text = "<r>\n  <a>1</a>\n  <b/>\n</r>"
+    editor._set_editor_text(text)
+    stats = editor.document_stats
+    assert (stats.line_count, stats.char_count, stats.element_count) == (4, len(text), 3)
+
+    editor._current_document()
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(text.index("1"))
+    editor.editor.setTextCursor(cursor)
+    assert stats.cursor_position() == (2, 6)
+    assert stats.element_path() == ["r", "a"]
+
+    # Правка у курсора пересчитывает только соседние строки, снимок текста не нужен
+    cursor.insertText("<c/>")
+    assert editor.snapshots._snapshot is None
+    assert stats.element_count == 4
+    assert editor.snapshots._snapshot is None
+    assert stats.element_path() is None  # новая ревизия ещё не разобрана
+    editor.update_status()
+    assert "Элементов: 4" in editor.status_bar.currentMessage()
+
+
+def test_live_validation_marks_error(editor, qapp):
+    """Тест: фоновая проверка отмечает ошибку в тексте и в строке состояния"""
+    import time
+    validator = editor.live_validator
+
+    def wait_result():
+        deadline = time.time() + 5
+        while not validator.is_current() and time.time() < deadline:
+            qapp.processEvents()
+        assert validator.is_current()
+
+    editor.editor.setPlainText("<r>\n  <a>\xa01</a>\n</r>")
+    # Правка у курсора: снимка новой ревизии нет, текст читается из документа порциями
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(13)
+    cursor.deleteChar()
+    cursor.insertText("b")
+    text = "<r>\n  <a>\xa01</b>\n</r>"
+    assert editor._validation_label.text() == "XML: проверка…"
+    assert editor.snapshots.cached_text() is None
+    validator.validate_now()
+    wait_result()
+    assert editor.snapshots.cached_text() == text
+    line, column, _ = validator.problem
+    assert (line, column) == (2, 9)
+    assert "строке 2" in editor._validation_label.text()
+    selections = editor.editor.extraSelections()
+    assert selections and selections[-1].cursor.selectedText() == "b"
+
+    editor.go_to_validation_error()
+    assert editor.editor.textCursor().position() == text.index("b>")
+
+    editor.editor.setPlainText("<r>\n  <a>1</a>\n</r>")
+    validator.validate_now()
+    wait_result()
+    assert validator.problem is None
+    assert editor._validation_label.text() == "XML: корректен"
+    assert not editor.editor.extraSelections()
+
+
+
+def test_reparse_document_only_edited_element():
+    """Тест: правка внутри элемента разбирает заново только его содержимое"""
+    from model.document import parse_document, reparse_document
+    from model.node_store import build_node_store
+
+    def assert_same(store, text):
+        full = build_node_store(text)
+        for column in ("start", "open_end", "close_start", "end"):
+            assert list(getattr(store, column)) == list(getattr(full, column))
+        assert (store.parent, store.first_child, store.next_sibling) == (full.parent, full.first_child, full.next_sibling)
+        assert [store.tag(n) for n in range(len(store))] == [full.tag(n) for n in range(len(full))]
+
+    def edit(document, text, start, end, replacement, version):
+        new_text = text[:start] + replacement + text[end:]
+        return reparse_document(document, new_text, start, end, start + len(replacement), version), new_text
+
+    text = "<r><a>1<b>2</b></a><c k='v'/><d>3</d></r>"
+    document = parse_document(text, 0)
+    # Изменение текста: узлы не меняются, позиции после правки сдвигаются
+    (document, node_id), text = edit(document, text, text.index("2"), text.index("2") + 1, "22", 1)
+    assert document.tag(node_id) == "b"
+    assert_same(document.store, text)
+    # Новые элементы внутри <a> сдвигают номера узлов после него
+    (document, node_id), text = edit(document, text, text.index("1"), text.index("1"), "<x/><y>7</y>", 2)
+    assert document.tag(node_id) == "a"
+    assert_same(document.store, text)
+    assert document.value(len(document.store) - 1) == "3"
+    # Правки подряд копят отложенный сдвиг позиций
+    (document, _), text = edit(document, text, text.index("3"), text.index("3") + 1, "", 3)
+    (document, _), text = edit(document, text, text.index("7"), text.index("7"), "<z></z>", 4)
+    assert_same(document.store, text)
+
+    # Правка тега дочернего элемента разбирает заново содержимое родителя
+    (document, node_id), text = edit(document, text, text.index("<c"), text.index("<c") + 2, "<e", 5)
+    assert node_id == 0
+    assert_same(document.store, text)
+
+    # Теги корня, несбалансированное содержимое и случайный «<» требуют полного разбора
+    assert edit(document, text, 1, 2, "s", 6)[0] is None
+    assert edit(document, text, text.index("<z>"), text.index("<z>") + 3, "", 6)[0] is None
+    assert edit(document, text, text.index("22"), text.index("22"), "<", 6)[0] is None
+
+
+def test_edit_updates_tree_by_reparsing_element(editor, qapp):
+    """Тест: после паузы в наборе дерево и проверка обновляются разбором одного элемента"""
+    import time
+    from model.node_store import build_node_store
+
+    text = "<r>\n  <a>1</a>\n  <b>2</b>\n</r>"
+    editor._set_editor_text(text)
+    editor.on_tree_built(editor._current_document())
+    validator = editor.live_validator
+    validator.validate_now()
+    while not validator.is_current():
+        qapp.processEvents()
+    shown = editor.tree_model.document()
+
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(text.index("1"))
+    cursor.insertText("<c>5</c>")
+    document, start, old_end, new_end = editor.snapshots.edit_base()
+    assert document is shown and (start, old_end, new_end) == (text.index("1"), text.index("1"), text.index("1") + 8)
+
+    validator.validate_now()
+    deadline = time.time() + 5
+    while not validator.is_current() and time.time() < deadline:
+        qapp.processEvents()
+    assert validator.problem is None
+    document = editor.snapshots.parsed_document()
+    assert document is not None and editor.tree_model.document() is document
+    new_text = editor.snapshots.text()
+    assert list(document.store.end) == list(build_node_store(new_text).end)
+    a_index = editor.tree_model.index(0, 0, editor.tree_model.index(0, 0))
+    assert editor.tree_model.rowCount(a_index) == 1
+    assert editor.tree_model.index(0, 1, a_index).data() == "5"
+
+
+def test_tolerant_parse_collects_all_problems():
+    """Тест: разбор с восстановлением находит все ошибки и строит частичное дерево"""
+    from model.document import parse_document
+    from model.node_store import NodeStoreBuilder, XmlParseError
+
+    text = "<r>\n  <a><b>1</a>\n  </x>\n  <c>a < b</c>\n</r>\n<d/>"
+    with pytest.raises(XmlParseError):
+        parse_document(text, 0)
+    document = parse_document(text, 0, tolerant=True)
+    assert document.problems == [
+        (text.index("<b>"), 2, 5, "Не закрыт элемент <b>"),
+        (text.index("</x>"), 3, 2, "Неожиданный закрывающий тег </x>"),
+        (text.index("< b"), 4, 7, "Символ «<» не начинает разметку"),
+        (text.index("<d/>"), 6, 0, "Лишний корневой элемент <d>"),
+    ]
+    store = document.store
+    assert [store.tag(i) for i in range(len(store))] == ["r", "a", "b", "c", "d"]
+    assert [store.parent[i] for i in range(len(store))] == [-1, 0, 1, 0, 0]
+    # Незакрытый <b> закрывается перед </a>, корень охватывает лишний элемент
+    assert store.end[2] == text.index("</a>") and store.end[0] == len(text)
+    assert document.value(3) == "a < b"
+
+    # Разбор порциями даёт то же дерево и те же ошибки
+    builder = NodeStoreBuilder(tolerant=True)
+    for ch in text:
+        builder.feed(ch)
+    chunked = builder.close()
+    assert list(chunked.end) == list(store.end)
+    assert [p for p, _ in builder.problems] == [p[0] for p in document.problems]
+
+    empty = parse_document("текст", 0, tolerant=True)
+    assert len(empty.store) == 0 and empty.problems == [(0, 1, 0, "Документ не содержит корневого элемента")]
+
+
+def test_broken_xml_tree_and_problems_panel(editor, qapp, monkeypatch):
+    """Тест: некорректный XML даёт частичное дерево и список ошибок без модальных окон"""
+    import time
+
+    dialogs = []
+    monkeypatch.setattr(QMessageBox, "critical", lambda *a, **k: dialogs.append(a))
+    text = "<r>\n  <a>1\n  <b>2</b>\n</r>\n<c/>"
+    editor._set_editor_text(text)
+    editor.build_tree_from_editor()
+    panel = editor.problems_panel
+    deadline = time.time() + 5
+    while panel.model.rowCount() == 0 and time.time() < deadline:
+        qapp.processEvents()
+    assert dialogs == []
+    assert [panel.model.index(row, 2).data() for row in range(panel.model.rowCount())] == [
+        "Не закрыт элемент <a>", "Лишний корневой элемент <c>"]
+    assert panel.model.index(0, 0).data() == 2 and panel.model.index(0, 1).data() == 3
+
+    model = editor.tree_model
+    root = model.index(0, 0)
+    assert model.rowCount(root) == 2 and model.document().tag(model.node_id(model.index(1, 0, root))) == "c"
+    # Узел частичного дерева ведёт к своему тегу в тексте
+    editor.on_tree_item_clicked(model.index(0, 0, model.index(0, 0, root)))
+    assert editor.editor.textCursor().selectedText() == "<b>"
+    panel.view.activated.emit(panel.model.index(1, 0))
+    assert editor.editor.textCursor().position() == text.index("<c/>")
+
+
+def test_replace_all_single_undo_step(editor, qapp, monkeypatch):
+    """Тест: «Заменить все» с регулярным выражением отменяется одним шагом"""
+    import time
+    import threads.text_replacer as text_replacer
+    from model.text_search import compile_pattern, find_match
+
+    text = "<r>\n  <item id='1'>Cat</item>\n  <item id='22'>cat</item>\n  <cats/>\n</r>"
+    word = compile_pattern("cat", whole_word=True)
+    assert [m.group() for m in word.finditer(text)] == ["Cat", "cat"]
+    assert find_match(word, text, 0, 0) == (text.index("Cat"), text.index("Cat") + 3)
+    assert find_match(word, text, text.index("<cats"), text.index("<cats"), forward=False) == (
+        text.index("cat<"), text.index("cat<") + 3)
+
+    editor._set_editor_text(text)
+    # Каждое совпадение — отдельная порция правок
+    monkeypatch.setattr(text_replacer, "SEGMENT_CHARS", 1)
+    editor.replace_all_matches(compile_pattern(r"id='(\d+)'", regex=True), r'key="\1"', regex=True)
+    deadline = time.time() + 5
+    while editor.status_bar.currentMessage() != "Заменено: 2" and time.time() < deadline:
+        qapp.processEvents()
+    expected = text.replace("id='1'", 'key="1"').replace("id='22'", 'key="22"')
+    assert editor.editor.toPlainText() == expected and not editor.editor.isReadOnly()
+    # Все замены отменяются одним шагом
+    editor.editor.undo()
+    assert editor.editor.toPlainText() == text
+
+    # Замена текущего совпадения переходит к следующему
+    editor.find_text(word)
+    editor.replace_current(word, "dog")
+    assert editor.editor.toPlainText() == text.replace("Cat", "dog", 1)
+    assert editor.editor.textCursor().selectedText() == "cat"
+    assert editor._search_pattern("(", False, False, True) is None
+
+
+def test_find_all_index_follows_edits(editor, qapp):
+    """Тест: «Найти все» строит индекс совпадений, который следует за правками"""
+    import time
+    from model.text_search import compile_pattern
+
+    text = "<r>\n  <a>cat</a>\n  <b>dog</b>\n  <c>cat cat</c>\n</r>"
+    editor.show()
+    editor._set_editor_text(text)
+    results = editor.search_results
+    editor.find_all(compile_pattern("cat"))
+    deadline = time.time() + 5
+    while results.index is None and time.time() < deadline:
+        qapp.processEvents()
+    model = results.model
+    assert model.rowCount() == 3 and not editor.search_results_panel.isHidden()
+    assert [model.index(row, 0).data() for row in range(3)] == [2, 4, 4]
+    assert model.index(0, 1).data() == "<a>cat</a>"
+    qapp.processEvents()
+    assert len(editor.selection_layers._layers["search"]) == 3
+
+    # Правка обновляет только задетые строки, остальные совпадения сдвигаются
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(text.index("dog"))
+    cursor.insertText("cat\n")
+    current = editor.editor.toPlainText()
+    expected = [i for i in range(len(current)) if current.startswith("cat", i)]
+    assert list(results.index.start) == expected
+    assert [model.index(row, 0).data() for row in range(4)] == [2, 3, 5, 5]
+
+    # «Найти далее» берёт совпадение из индекса
+    cursor.setPosition(0)
+    editor.editor.setTextCursor(cursor)
+    assert editor.find_text(compile_pattern("cat"))
+    assert editor.editor.textCursor().selectionStart() == expected[0]
+    editor.search_results_panel.match_activated.emit(expected[2], expected[2] + 3)
+    assert editor.editor.textCursor().selectionStart() == expected[2]
+
+    editor.search_results_panel.close()
+    assert results.index is None and not editor.selection_layers._layers["search"]
+    editor.hide()
+
+
+def test_xpath_queries_use_indexes():
+    """Тест: запросы XPath выбирают элементы по индексам имён, атрибутов и текста"""
+    from model.document import parse_document
+    from model.xpath import DocumentIndex, XPathError, compile_xpath
+
+    text = ("<shop>\n"
+            "  <order status='open' n='1'><id>7</id><item sku='a'/><item sku='b'/></order>\n"
+            "  <order status=\"closed\" n='2'><id>8</id><item sku='a'/></order>\n"
+            "  <order status='open' n='3'><id>9</id></order>\n"
+            "  <note title='status=\"open\"'/>\n"
+            "</shop>")
+    document = parse_document(text, 0)
+    index = DocumentIndex(document)
+    store = document.store
+
+    def select(expression):
+        return [(store.tag(n), store.start[n]) for n in compile_xpath(expression).evaluate(index)]
+
+    orders = [i for i in range(len(text)) if text.startswith("<order", i)]
+    assert select("//order[@status='open']") == [("order", orders[0]), ("order", orders[2])]
+    assert select("//order[id='8']/item") == [("item", text.index("<item sku='a'/></order>\n  <order"))]
+    assert len(select("/shop/order/item[@sku='a']")) == 2
+    assert select("//order[2]/id/..") == [("order", orders[1])]
+    assert select("//order[item][last()]/id") == [("id", text.index("<id>8"))]
+    assert select("//order[count(item) = 0 or @n > 2]") == [("order", orders[2])]
+    # Значение атрибута внутри другого атрибута не считается атрибутом
+    assert select("//*[@status]") == [("order", n) for n in orders]
+    assert select("//id[. = '7'] | //note") == [("id", text.index("<id>7")), ("note", text.index("<note"))]
+    assert select("//missing | //order[@nope]") == []
+
+    for expression, position in (("//order[", 8), ("count(//order)", 0), ("//order/@n", 0)):
+        with pytest.raises(XPathError) as error:
+            compile_xpath(expression)
+        assert error.value.position == position
+
+
+def test_xpath_panel_selects_tree_node_and_text(editor, qapp):
+    """Тест: панель XPath строит дерево, выполняет запрос в фоне и выделяет выбранный элемент"""
+    import time
+
+    text = "<r>\n  <a k='1'><b>x</b></a>\n  <a k='2'><b>y</b></a>\n</r>"
+    editor._set_editor_text(text)
+    editor.open_query_panel()
+    panel, query = editor.query_panel, editor.xpath_query
+    panel.input.setText("//a[@k='2']/b")
+    panel.run_button.click()
+    deadline = time.time() + 5
+    while query.ids is None and time.time() < deadline:
+        qapp.processEvents()
+    model = query.model
+    assert model.rowCount() == 1 and panel.windowTitle() == "XPath (1)"
+    assert model.index(0, 0).data() == 3 and model.index(0, 1).data() == "<b>"
+
+    panel.view.activated.emit(model.index(0, 0))
+    cursor = editor.editor.textCursor()
+    assert cursor.selectionStart() == text.index("<b>y") and cursor.selectedText() == "<b>"
+    current = editor.tree.currentIndex()
+    assert editor.tree_model.node_id(current) == query.ids[0] and editor.tree.isExpanded(current.parent())
+
+    panel.input.setText("//a[")
+    panel.run_button.click()
+    assert not panel.message.isHidden() and "Позиция 5" in panel.message.text()
+    panel.close()
+    assert query.ids is None and query.query is None
+
+
+def test_large_file_line_index_and_skeleton():
+    """Тест: индекс строк и скелет дерева большого файла строятся порциями с тем же результатом"""
+    from model.large_file import LineIndex, Skeleton, TagScanner, count_newlines, read_line
+
+    data = ("<?xml version='1.0'?>\n<!-- <fake> -->\n<root>\n"
+            + "".join(f"  <rec n='{i}'>\n    <v>{i}</v><![CDATA[</rec>]]>\n  </rec>\n" for i in range(50))
+            + "  <rec><rec>x</rec></rec>\n</root>\n").encode()
+    index = LineIndex(len(data), block_size=16)
+    for pos in range(0, len(data), 64):
+        index.extend(count_newlines(data[pos:pos + 64], 16))
+    lines = data.split(b"\n")
+    assert index.complete and index.line_count == len(lines)
+    for line in (0, 1, 7, len(lines) - 2):
+        start, raw, cut = read_line(data, index, line)
+        assert raw == lines[line] and not cut
+        assert index.line_of(data, start + len(raw)) == line
+
+    whole = TagScanner(max_depth=2)
+    expected = whole.scan(data, len(data))
+    scanner = TagScanner(max_depth=2)
+    nodes, closed = [], []
+    while scanner.position < len(data):
+        start = scanner.position
+        step = 9
+        while scanner.position == start:
+            new_nodes, new_closed = scanner.scan(data, start + step)
+            step *= 2
+        nodes += new_nodes
+        closed += new_closed
+    assert (nodes, closed) == expected
+    skeleton = Skeleton()
+    skeleton.add(nodes)
+    skeleton.close(closed)
+    assert len(skeleton) == 52 and skeleton.tag(0) == "root" and skeleton.tag(51) == "rec"
+    # Содержимое элементов нижнего уровня пропускается вместе с CDATA и вложенным тем же именем
+    assert data[skeleton.start[51]:skeleton.end[51]] == b"<rec><rec>x</rec></rec>"
+    assert data[skeleton.end[0] - 7:skeleton.end[0]] == b"</root>"
+
+    truncated = TagScanner(max_depth=2, limit=5)
+    assert len(truncated.scan(data, len(data))[0]) == 5 and truncated.truncated
+
+
+def test_large_file_read_only_view(editor, qapp, monkeypatch, tmp_path):
+    """Тест: файл больше порога открывается в просмотре со скелетом дерева"""
+    import time
+
+    path = tmp_path / "big.xml"
+    path.write_text("<root>\n" + "".join(f"  <item id='{i}'>\n    <v>{i}</v>\n  </item>\n" for i in range(300))
+                    + "</root>\n", encoding="utf-8")
+    monkeypatch.setattr(editor, "_large_file_limit_mb", lambda: 0)
+    large_file = editor.large_file
+    done = []
+    large_file.scanned.connect(lambda: large_file.scan_complete and done.append(True))
+    editor._start_file_loading(str(path))
+    assert large_file.is_open and editor.editor_stack.currentWidget() is editor.large_view
+    assert not editor.find_replace_action.isEnabled() and editor.tree.model() is large_file.model
+    deadline = time.time() + 5
+    while not (done and large_file.lines.complete) and time.time() < deadline:
+        qapp.processEvents()
+    assert large_file.lines.line_count == 903
+    model = large_file.model
+    root = model.index(0, 0)
+    assert model.rowCount(root) == 300 and model.index(7, 2, root).data() == "id=7"
+    item = model.index(7, 0, root)
+    assert model.index(0, 0, item).data() == "📄 v" and model.index(0, 1, item).data() == "7"
+
+    # Выбор узла дерева переводит просмотр к строке элемента
+    editor.on_tree_item_clicked(item)
+    assert editor.large_view.current_line == 1 + 7 * 3
+    assert "Правка" in editor.status_bar.currentMessage()
+
+    editor.new_file()
+    assert not large_file.is_open and editor.find_replace_action.isEnabled()
+    assert editor.tree.model() is editor.tree_model and editor.editor_stack.currentWidget() is editor.editor
+
+
+def test_piece_table_edits_lines_and_save():
+    """Тест: таблица кусков правит текст поверх исходного, считает строки и отменяет правки"""
+    from model.large_file import LineIndex, count_newlines
+    from model.piece_table import PieceTable
+
+    original = "".join(f"<i n='{i}'>строка {i}</i>\n" for i in range(40)).encode()
+    lines = LineIndex(len(original), block_size=32)
+    lines.extend(count_newlines(original, 32))
+    table = PieceTable(original, lines)
+    expected = bytearray(original)
+    for start, end, data in ((10, 10, b"X\nY"), (100, 180, b""), (0, 3, "ё".encode()), (len(expected) - 5, len(expected) - 5, b"\n\n")):
+        table.replace(start, end, data)
+        expected[start:end] = data
+    # Набор подряд продолжает последний кусок и отменяется одним шагом
+    for char in b"abc":
+        table.insert(40 + char - ord("a"), bytes([char]))
+        expected[40 + char - ord("a"):40 + char - ord("a")] = bytes([char])
+    assert table.read(0, len(table)) == bytes(expected) and b"".join(table.chunks()) == bytes(expected)
+    assert table.line_count == expected.count(b"\n") + 1
+    for line in range(table.line_count):
+        start = table.line_start(line)
+        assert start == 0 or expected[start - 1] == ord("\n")
+        assert table.line_of(start) == line
+    assert table.read_line(3)[1] == bytes(expected).split(b"\n")[3]
+    # Позиция исходного файла переводится с учётом вставок и удалений
+    assert table.from_original(original.index(b"<i n='39'>")) == bytes(expected).index(b"<i n='39'>")
+    assert table.from_original(120) is None
+
+    table.undo()
+    assert table.read(0, len(table)).count(b"abc") == 0
+    while table.undo():
+        pass
+    assert table.read(0, len(table)) == original and table.line_count == 41
+    table.redo()
+    assert table.read(0, 13) == original[:10] + b"X\nY"
+
+
+def test_large_file_edit_and_save(editor, qapp, monkeypatch, tmp_path):
+    """Тест: большой файл правится в просмотре и сохраняется порциями с заменой файла"""
+    import time
+    from PyQt5.QtCore import QEvent, Qt
+    from PyQt5.QtGui import QKeyEvent
+
+    path = tmp_path / "big.xml"
+    text = "<root>\n" + "".join(f"  <item id='{i}'/>\n" for i in range(100)) + "</root>\n"
+    path.write_text(text, encoding="utf-8")
+    monkeypatch.setattr(editor, "_large_file_limit_mb", lambda: 0)
+    large_file, view = editor.large_file, editor.large_view
+    editor._start_file_loading(str(path))
+    deadline = time.time() + 5
+    while not (large_file.editable and large_file.scan_complete) and time.time() < deadline:
+        qapp.processEvents()
+    assert large_file.editable and editor.save_action.isEnabled()
+
+    def press(key, text=""):
+        view.keyPressEvent(QKeyEvent(QEvent.KeyPress, key, Qt.NoModifier, text))
+
+    view.go_to_line(1)
+    press(Qt.Key_End)
+    press(Qt.Key_Return)
+    for char in "<новый/>":
+        press(Qt.Key_A, char)
+    assert view.current_line == 2 and large_file.line_count == 104
+    assert large_file.read_line(2)[1] == "<новый/>".encode()
+    press(Qt.Key_Backspace)
+    press(Qt.Key_Backspace)
+    press(Qt.Key_Home)
+    press(Qt.Key_Backspace)
+    assert large_file.read_line(1)[1] == "  <item id='0'/><новый".encode() and editor.is_dirty
+
+    # Узел дерева после правки находится по переведённой позиции
+    item = large_file.model.index(5, 0, large_file.model.index(0, 0))
+    editor.on_tree_item_clicked(item)
+    assert view.current_line == 6 and large_file.read_line(6)[1] == b"  <item id='5'/>"
+
+    editor.save_file()
+    assert not editor.is_dirty
+    expected = text.replace("<item id='0'/>\n", "<item id='0'/><новый\n", 1)
+    assert path.read_text(encoding="utf-8") == expected
+    assert [p.name for p in tmp_path.iterdir()] == ["big.xml"]
+    deadline = time.time() + 5
+    while not large_file.editable and time.time() < deadline:
+        qapp.processEvents()
+    assert large_file.line_count == expected.count("\n") + 1
+    editor.new_file()
+
+
+def test_progressive_text_load(editor, qapp, monkeypatch, tmp_path):
+    """Тест: большой текст вставляется в редактор порциями, дерево и снимок доступны сразу"""
+    import time
+    import ui.progressive_load
+    from model.document import parse_document
+
+    monkeypatch.setattr(editor, "PROGRESSIVE_LOAD_LIMIT", 100)
+    monkeypatch.setattr(ui.progressive_load, "_CHUNK_CHARS", 64)
+    monkeypatch.setattr(ui.progressive_load, "_SLICE_SECONDS", 0)
+    text = "<root>\n" + "".join(f"  <item id='{i}'>{i}</item>\n" for i in range(200)) + "</root>\n"
+    path = str(tmp_path / "doc.xml")
+    editor.on_file_loaded(path, text, parse_document(text, 0).store)
+    qapp.processEvents()
+    document = editor.editor.document()
+    assert 0 < document.characterCount() - 1 < len(text) and editor.editor.isReadOnly()
+    assert editor.snapshots.text() == text and editor.tree_model.rowCount() == 1
+    assert editor.editor.textCursor().position() == 0 and not editor.is_dirty
+
+    # Элемент ещё не вставлен: выделение выполнится после вставки
+    root = editor.tree_model.index(0, 0)
+    editor.on_tree_item_clicked(editor.tree_model.index(199, 0, root))
+    assert editor._pending_selection is not None and not editor.editor.textCursor().hasSelection()
+    deadline = time.time() + 5
+    while editor._text_load is not None and time.time() < deadline:
+        qapp.processEvents()
+    assert editor.snapshots.text() == text and document.toPlainText() == text
+    assert editor.editor.textCursor().selectedText() == "<item id='199'>"
+    assert not editor.editor.isReadOnly() and document.isUndoRedoEnabled() and not document.isUndoAvailable()
+    assert not editor.is_dirty and editor.document_stats.element_count == 201
+
+    # Правке нужен весь текст: остаток вставляется сразу
+    editor.on_file_loaded(path, text, parse_document(text, 0).store)
+    editor._splice_text([(len(text) - 8, len(text) - 1, "</root2>")])
+    assert editor._text_load is None and editor.snapshots.text() == text[:-8] + "</root2>\n"
+
+
+def test_index_cache_reuses_checked_entries(tmp_path):
+    """Тест: кэш индексов возвращает запись только для неизменившегося файла и удаляет старые записи"""
+    from threads import file_loader
+    from model.index_cache import DOCUMENT, IndexCache
+    from model.large_file import LineIndex, Skeleton, TagScanner
+    from threads.task_scheduler import CancelToken
+
+    cache = IndexCache(str(tmp_path / "cache"), 1 << 20)
+    path = tmp_path / "doc.xml"
+    path.write_text("<root><a x='1'>t</a><b/><c></root>", encoding="utf-8")
+    _, _, store, problems = file_loader.load_file(CancelToken("load"), str(path), cache)
+    header = cache.lookup(str(path), DOCUMENT)
+    assert header is not None and problems
+
+    # Повторное открытие не разбирает текст: хранилище берётся из кэша
+    original = file_loader.NodeStoreBuilder
+    file_loader.NodeStoreBuilder = None
+    try:
+        _, _, cached, cached_problems = file_loader.load_file(CancelToken("load"), str(path), cache)
+    finally:
+        file_loader.NodeStoreBuilder = original
+    assert cached_problems == problems and cached.names == store.names
+    assert [cached.tag(i) for i in range(len(cached))] == [store.tag(i) for i in range(len(store))]
+    assert list(cached.start) == list(store.start) and list(cached.first_child) == list(store.first_child)
+
+    # Другое содержимое того же размера и времени отвергается по хешу
+    stat = os.stat(path)
+    path.write_text("<root><a x='2'>t</a><b/><c></root>", encoding="utf-8")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.load_document(str(path), cache.lookup(str(path), DOCUMENT), "0" * 32) is None
+    _, _, store, _ = file_loader.load_file(CancelToken("load"), str(path), cache)
+    assert cache.lookup(str(path), DOCUMENT)["hash"] != header["hash"]
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.lookup(str(path), DOCUMENT) is None
+
+    # Индексы большого файла: строки, просмотр тегов и скелет
+    lines, scanner, skeleton = LineIndex(stat.st_size, 8), TagScanner(2), Skeleton()
+    lines.extend([1, 0, 2, 0, 0])
+    skeleton.add([(0, -1, "root", 0, 6), (1, 0, "a", 6, 15)])
+    skeleton.attach(-1, [0])
+    skeleton.attach(0, [1])
+    scanner.position, scanner.count = stat.st_size, 2
+    cache.save_large(str(path), os.stat(path), "h", lines, scanner, skeleton)
+    restored = cache.load_large(str(path), cache.lookup(str(path), "large"))
+    assert list(restored[0].counts) == list(lines.counts) and restored[1].count == 2
+    assert restored[2].children(0) == skeleton.children(0) and restored[2].tag(1) == "a"
+
+    # Сверх размера кэша удаляются давно не использованные записи
+    cache.max_bytes = os.path.getsize(cache._entry_path(str(path), "large")) + 1
+    other = tmp_path / "other.xml"
+    other.write_text("<r/>", encoding="utf-8")
+    file_loader.load_file(CancelToken("load"), str(other), cache)
+    assert cache.lookup(str(other), DOCUMENT) is not None
+    assert cache.lookup(str(path), DOCUMENT) is None and cache.total_size() <= cache.max_bytes
+
+
+def test_large_file_reopens_from_index_cache(editor, qapp, monkeypatch, tmp_path):
+    """Тест: повторно открытый большой файл сразу показывает дерево из кэша, а правка доступна после проверки хеша"""
+    import time
+    from model.index_cache import IndexCache
+
+    def wait(condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            qapp.processEvents()
+
+    path = tmp_path / "big.xml"
+    path.write_text("<root>\n" + "".join(f"  <item id='{i}'/>\n" for i in range(100)) + "</root>\n",
+                    encoding="utf-8")
+    monkeypatch.setattr(editor, "_large_file_limit_mb", lambda: 0)
+    large_file = editor.large_file
+    large_file.cache = editor.index_cache = IndexCache(str(tmp_path / "cache"), 1 << 20)
+    editor._start_file_loading(str(path))
+    wait(lambda: large_file.cache.lookup(str(path), "large") is not None)
+    editor.new_file()
+
+    editor._start_file_loading(str(path))
+    model = large_file.model
+    assert large_file.scan_complete and large_file.lines.complete and not large_file.editable
+    assert model.rowCount(model.index(0, 0)) == 100 and large_file.line_count == 103
+    wait(lambda: large_file.editable)
+    assert large_file.editable and model.index(5, 2, model.index(0, 0)).data() == "id=5"
+    editor.new_file()
+
+
+def test_recent_files_prefetched_while_idle(editor, qapp, monkeypatch, tmp_path):
+    """Тест: недавние файлы читаются заранее в паузах работы и открываются из кэша"""
+    import time
+    import main as main_module
+    import ui.recent_prefetch
+    from PyQt5.QtGui import QKeyEvent
+    from PyQt5.QtCore import QEvent
+    from model.document import parse_document
+
+    def wait(condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            qapp.processEvents()
+
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.xml"
+        path.write_text(f"<{name}>" + "<i/>" * 1000 + f"</{name}>", encoding="utf-8")
+        paths.append(str(path))
+    monkeypatch.setattr(ui.recent_prefetch, "IDLE_MS", 0)
+    monkeypatch.setattr(editor, "recent_files", paths)
+    cache = editor.document_cache
+    prefetch = editor.recent_prefetch
+    prefetch.index_cache = None
+    # Места хватает на два файла: первые по списку не вытесняются последним
+    text = open(paths[0], encoding="utf-8").read()
+    cache.max_bytes = (sys.getsizeof(text) + parse_document(text, 0).store.memory_size()) * 5 // 2
+    prefetch.start()
+    wait(lambda: len(cache) == 2 and not editor.task_scheduler.is_running("prefetch"))
+    assert cache.contains(paths[0]) and cache.contains(paths[1]) and not cache.contains(paths[2])
+
+    # Действие пользователя отменяет начатое чтение
+    cache.clear()
+    monkeypatch.setattr(ui.recent_prefetch, "IDLE_MS", 60_000)
+    prefetch._prefetch_next()
+    assert editor.task_scheduler.is_running("prefetch")
+    qapp.sendEvent(editor.editor, QKeyEvent(QEvent.KeyPress, Qt.Key_Shift, Qt.NoModifier))
+    assert not editor.task_scheduler.is_running("prefetch")
+    wait(lambda: not editor.task_scheduler._runnables)
+    assert len(cache) == 0
+
+    # Файл из кэша открывается без чтения с диска; изменённый файл читается заново
+    prefetch._prefetch_next()
+    wait(lambda: cache.contains(paths[0]))
+    monkeypatch.setattr(main_module, "load_file", None)
+    editor._start_file_loading(paths[0])
+    assert editor.current_file == paths[0] and editor.editor.toPlainText().startswith("<a><i/>")
+    assert editor.tree_model.rowCount() == 1 and not cache.contains(paths[0])
+    assert paths[0] not in editor._prefetch_candidates()
+    stat = os.stat(paths[1])
+    prefetch._prefetch_next()
+    wait(lambda: cache.contains(paths[1]))
+    os.utime(paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.take(paths[1]) is None and cache.nbytes == 0
+
+
+def test_tree_navigation_after_astral_characters(editor):
+    """Тест: выделение узла и путь под курсором верны после символов вне BMP"""
+    from model.text_positions import TextPositions
+
+    text = "<root>😀<a>𝄞x</a><b k='1'>2</b></root>"
+    editor.editor.setPlainText(text)
+    editor.tree_model.set_document(editor._current_document())
+    root_index = editor.tree_model.index(0, 0)
+    editor.on_tree_item_clicked(editor.tree_model.index(1, 0, root_index))
+    assert editor.editor.textCursor().selectedText() == "<b k='1'>"
+    assert editor.document_stats.element_path() == ["root", "b"]
+    editor.highlight_element_in_text("a")
+    assert editor.editor.textCursor().selectedText() == "<a>"
+
+    positions = TextPositions("a😀b")
+    assert [positions.to_qt(i) for i in range(4)] == [0, 1, 3, 4]
+    assert [positions.from_qt(q) for q in range(5)] == [0, 1, 2, 2, 3]
+
+
+def test_tree_edit_after_astral_characters(editor):
+    """Тест: правка из дерева после символа вне BMP меняет именно значение и атрибуты"""
+    text = '<root>😀<a k="1">old</a><b>𝄞</b></root>'
+    editor.editor.setPlainText(text)
+    editor.tree_model.set_document(editor._current_document())
+    model = editor.tree_model
+    root_index = model.index(0, 0)
+
+    model.setData(model.index(0, 1, root_index), "new")
+    assert editor.editor.toPlainText() == '<root>😀<a k="1">new</a><b>𝄞</b></root>'
+    model.setData(model.index(0, 2, root_index), "k=2")
+    model.setData(model.index(1, 1, root_index), "z")
+    assert editor.editor.toPlainText() == '<root>😀<a k="2">new</a><b>z</b></root>'
+
+
+def test_replace_with_astral_characters(editor, qapp, monkeypatch):
+    """Тест: замены после символов вне BMP и на них не сдвигают следующие правки"""
+    import time
+    import threads.text_replacer as text_replacer
+    from model.text_search import compile_pattern
+
+    text = "<r>😀 foo bar foo</r>"
+    editor._set_editor_text(text)
+    monkeypatch.setattr(text_replacer, "SEGMENT_CHARS", 1)
+    editor.replace_all_matches(compile_pattern("foo"), "𝄞X")
+    deadline = time.time() + 5
+    while editor.status_bar.currentMessage() != "Заменено: 2" and time.time() < deadline:
+        qapp.processEvents()
+    assert editor.editor.toPlainText() == "<r>😀 𝄞X bar 𝄞X</r>"
+
+    # Замена выделенного совпадения
+    editor.editor.undo()
+    start = text.index("bar")
+    editor._select_range(start, start + 3)
+    editor.replace_current(compile_pattern("bar"), "baz")
+    assert editor.editor.toPlainText() == "<r>😀 foo baz foo</r>"
+
+
+def test_find_with_astral_characters(editor, qapp):
+    """Тест: поиск, индекс совпадений и их подсветка верны после символов вне BMP"""
+    import time
+    from model.text_search import compile_pattern
+
+    text = "<r>😀 foo bar\n𝄞 foo</r>"
+    editor.show()
+    editor._set_editor_text(text)
+    pattern = compile_pattern("foo")
+    assert editor.find_text(pattern) and editor.editor.textCursor().selectedText() == "foo"
+    assert editor.find_text(pattern) and editor.editor.textCursor().selectedText() == "foo"
+    assert editor.find_text(pattern, forward=False)
+    assert editor.editor.textCursor().selectionStart() == 6
+
+    results = editor.search_results
+    editor.find_all(pattern)
+    deadline = time.time() + 5
+    while results.index is None and time.time() < deadline:
+        qapp.processEvents()
+    qapp.processEvents()
+    highlighted = [selection.cursor.selectedText() for selection in editor.selection_layers._layers["search"]]
+    assert highlighted == ["foo", "foo"] and results.model.index(1, 1).data() == "𝄞 foo</r>"
+
+    # Правка перед совпадениями пересчитывает задетую строку в позициях документа
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(14)
+    cursor.insertText("🙂foo")
+    qapp.processEvents()
+    highlighted = [selection.cursor.selectedText() for selection in editor.selection_layers._layers["search"]]
+    assert highlighted == ["foo", "foo", "foo"]
+    editor.search_results_panel.match_activated.emit(*results.index.span(2))
+    assert editor.editor.textCursor().selectedText() == "foo"
+    editor.search_results_panel.close()
+    editor.hide()
+
+
+def test_edit_after_astral_characters_reparses_whole_text(editor):
+    """Тест: правка в тексте с символами вне BMP не разбирает заново не тот элемент"""
+    from model.node_store import build_node_store
+
+    text = "<r><a>" + "😀" * 10 + "</a><b>yy</b><c>zz</c></r>"
+    editor.editor.setPlainText(text)
+    editor.snapshots.document()
+    cursor = editor.editor.textCursor()
+    # Позиция документа между «y»: каждый эмодзи занимает две позиции
+    cursor.setPosition(text.index("yy") + 1 + 10)
+    cursor.insertText("Q")
+    assert editor.snapshots.edit_base() is None
+    new_text = editor.snapshots.text()
+    assert "yQy" in new_text
+    assert list(editor.snapshots.document().store.close_start) == list(build_node_store(new_text).close_start)
+
+
+def test_stale_tree_is_not_shown(editor, qapp):
+    """Тест: дерево, построенное для прежней ревизии, не заменяет дерево текущего текста"""
+    import time
+
+    editor.editor.setPlainText("<r><a/></r>")
+    editor.build_tree_from_editor()
+    editor.editor.setPlainText("<r><a/><b/><c/></r>")
+    revision = editor.snapshots.revision
+    deadline = time.time() + 5
+    while editor.task_scheduler.is_running("tree") and time.time() < deadline:
+        qapp.processEvents()
+    document = editor.tree_model.document()
+    assert document is not None and document.version == revision
+    assert editor.tree_model.rowCount(editor.tree_model.index(0, 0)) == 3
+
+
+def test_background_highlighting_long_line(editor, qapp):
+    """Тест: очень длинная строка размечается только в фоне, остановка не ждёт задачу"""
+    import time
+
+    scheduler = editor.highlight_scheduler
+    scheduler.async_limit = 1000
+    text = "<r>" + '<a k="1">v</a>' * 20000 + "</r>"
+    editor._set_editor_text(text)
+    first = editor.editor.document().firstBlock()
+    assert not first.layout().formats()
+
+    deadline = time.time() + 10
+    while scheduler.is_busy() and time.time() < deadline:
+        qapp.processEvents()
+    assert first.layout().formats()
+
+    scheduler.refresh()
+    scheduler.stop()
+    assert not scheduler.is_busy()
+
+
+def test_large_file_save_unmaps_before_replace(editor, qapp, monkeypatch, tmp_path):
+    """Тест: на время замены файла отображение закрыто, при ошибке правки сохраняются"""
+    import os
+    import time
+
+    path = tmp_path / "big.xml"
+    text = "<root>\n" + "".join(f"  <item id='{i}'/>\n" for i in range(100)) + "</root>\n"
+    path.write_text(text, encoding="utf-8")
+    monkeypatch.setattr(editor, "_large_file_limit_mb", lambda: 0)
+    large_file = editor.large_file
+    editor._start_file_loading(str(path))
+    deadline = time.time() + 5
+    while not (large_file.editable and large_file.scan_complete) and time.time() < deadline:
+        qapp.processEvents()
+    large_file.edit(0, 0, b"<!-- x -->")
+
+    mapped = []
+
+    def failing_replace(source, target):
+        mapped.append(large_file.data is not None)
+        raise PermissionError("файл занят")
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+    try:
+        large_file.save(str(path))
+    except PermissionError:
+        pass
+    assert mapped == [False]
+    assert path.read_text(encoding="utf-8") == text
+    assert [p.name for p in tmp_path.iterdir()] == ["big.xml"]
+    assert large_file.editable and large_file.read_line(0)[1] == b"<!-- x --><root>"
+    assert large_file.read_line(5)[1] == b"  <item id='4'/>"
+    monkeypatch.undo()
+
+    large_file.save(str(path))
+    assert path.read_text(encoding="utf-8") == "<!-- x -->" + text
+    editor.is_dirty = False
+
+
+def test_tree_update_emits_row_signals(editor):
+    """Тест: изменение структуры приходит в дерево вставкой и удалением строк, без сброса"""
+    from PyQt5.QtTest import QAbstractItemModelTester
+    from model.document import parse_document
+
+    model = editor.tree_model
+    texts = [
+        "<r><a><x>1</x></a><b><y>2</y></b><c/></r>",
+        "<r><a><x>1</x></a><b><y>2</y><z/></b><c/></r>",
+        "<r><a><x>1</x></a><n/><b><y>2</y><z/></b><c/></r>",
+        "<r><a><x>1</x></a><b><y>2</y><z/></b><c/></r>",
+        "<r><b><y>2</y><z/></b><c/></r>",
+    ]
+    model.set_document(parse_document(texts[0], 0))
+    tester = QAbstractItemModelTester(model, QAbstractItemModelTester.FailureReportingMode.Warning)
+    root_index = model.index(0, 0)
+    editor.tree.expand(root_index)
+    editor.tree.expand(model.index(1, 0, root_index))
+    editor.tree.setCurrentIndex(model.index(2, 0, root_index))
+    events = []
+    model.modelReset.connect(lambda: events.append("reset"))
+    model.layoutChanged.connect(lambda: events.append("layout"))
+    model.rowsInserted.connect(lambda parent, first, last: events.append(("+", parent.data(), first, last)))
+    model.rowsRemoved.connect(lambda parent, first, last: events.append(("-", parent.data(), first, last)))
+
+    for revision, text in enumerate(texts[1:], 1):
+        model.update_document(parse_document(text, revision))
+    assert events == [("+", "📦 b", 1, 1), ("+", "📦 r", 1, 1), ("-", "📦 r", 1, 1), ("-", "📦 r", 0, 0)]
+
+    root_index = model.index(0, 0)
+    b_index = model.index(0, 0, root_index)
+    assert "b" in b_index.data() and editor.tree.isExpanded(b_index)
+    assert model.rowCount(b_index) == 2
+    assert "c" in editor.tree.currentIndex().data()
+    del tester
+
+
+def test_tree_edit_keeps_markup_and_attribute_layout():
+    """Тест: правка из дерева не трогает комментарии, CDATA, кавычки и переносы между атрибутами"""
+    from model.document import parse_document
+
+    def apply(text, edits):
+        for start, end, replacement in reversed(edits):
+            text = text[:start] + replacement + text[end:]
+        return text
+
+    cases = [
+        ("<a><!--c-->x</a>", "<a><!--c-->NEW</a>"),
+        ("<a>x<!--c-->y</a>", "<a>NEW<!--c--></a>"),
+        ("<a> x <?pi?> y </a>", "<a> NEW <?pi?>  </a>"),
+        ("<a><![CDATA[x]]></a>", "<a><![CDATA[NEW]]></a>"),
+        ("<a><!--c--></a>", "<a><!--c-->NEW</a>"),
+    ]
+    for text, expected in cases:
+        document = parse_document(text, 0)
+        result = apply(text, document.value_edit(0, "NEW"))
+        assert result == expected
+        assert parse_document(result, 1).value(0) == "NEW"
+
+    text = "<a k='1' \n   id=\"x&#65;\"\tq='2'/>"
+    document = parse_document(text, 0)
+    assert document.attributes_edit(0, [("k", "1"), ("id", "xA"), ("q", "2")]) is None
+    assert apply(text, document.attributes_edit(0, [("k", "it's"), ("id", "xA"), ("q", "2")])) == (
+        "<a k='it&apos;s' \n   id=\"x&#65;\"\tq='2'/>")
+    assert apply(text, document.attributes_edit(0, [("id", "xA"), ("q", "2")])) == "<a \n   id=\"x&#65;\"\tq='2'/>"
+    assert apply(text, document.attributes_edit(0, [("k", "1"), ("id", "xA"), ("n", "<")])) == (
+        "<a k='1' \n   id=\"x&#65;\" n=\"&lt;\"/>")
+
+
+def test_document_stats_use_parsed_document(editor):
+    """Тест: число элементов берётся из разобранного документа, в строке состояния есть глубина"""
+    text = "<r>\n  <!-- <x/><y> -->\n  <a><![CDATA[<z/>]]><b/></a>\n</r>"
+    editor._set_editor_text(text)
+    stats = editor.document_stats
+    editor._current_document()
+    assert stats.element_count == 3
+
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(text.index("<b/>") + 1)
+    editor.editor.setTextCursor(cursor)
+    editor.update_status()
+    message = editor.status_bar.currentMessage()
+    assert "Элементов: 3" in message and "Глубина: 3 | /r/a/b" in message
+
+
+def test_xpath_string_values_and_arithmetic():
+    """Тест: строковые значения XPath не обрезаются, в предикатах работают «+» и «-»"""
+    from model.document import parse_document
+    from model.xpath import DocumentIndex, compile_xpath
+
+    text = "<r><a><b> x </b></a><a><b>x</b></a><c>1</c><c>2<![CDATA[&amp;]]></c><c>3</c></r>"
+    document = parse_document(text, 0)
+    index = DocumentIndex(document)
+    store = document.store
+
+    def select(expression):
+        return [store.start[n] for n in compile_xpath(expression).evaluate(index)]
+
+    tight, spaced = text.index("<b>x"), text.index("<b> x")
+    assert select("//b[.='x']") == [tight]
+    assert select("//a[b='x']/b") == [tight]
+    assert select("//a[b=' x ']/b") == [spaced]
+    assert select("//b[normalize-space()='x']") == [spaced, tight]
+    assert select("//b[string-length(text()) = 3]") == [spaced]
+    assert select("//c[.='2&amp;']") == [text.index("<c>2")]
+    assert select("//c[last()-1]") == [text.index("<c>2")]
+    assert select("//c[position() = last() - 2 + 1]") == [text.index("<c>2")]
+    assert select("//c[. = -(-3)]") == [text.index("<c>3")]
+
+
+def test_pretty_format_keeps_significant_whitespace():
+    """Тест: форматирование сохраняет значимые пробелы и содержимое под xml:space"""
+    from model.pretty_printer import pretty_format
+
+    assert pretty_format('<a xml:space="preserve">  keep  me </a>') == '<a xml:space="preserve">  keep  me </a>'
+    assert pretty_format("<a>x&#10;</a>") == "<a>x\n</a>"
+    assert pretty_format("<a>x&#13;</a>") == "<a>x&#13;</a>"
+    assert pretty_format("<r><p>Hello <b> world </b> end</p><q>\n <c/>\n</q></r>") == (
+        "<r>\n  <p>Hello <b> world </b> end</p>\n  <q>\n    <c/>\n  </q>\n</r>")
+    assert pretty_format('<r xml:space="preserve"><a> <b/> </a><c xml:space="default"><d/> <e/></c></r>') == (
+        '<r xml:space="preserve"><a> <b/> </a><c xml:space="default">\n    <d/>\n    <e/>\n  </c></r>')
+
+
 if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
\ No newline at end of file
+    pytest.main([__file__, "-v"])
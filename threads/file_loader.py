@@ -1,31 +1,88 @@
-from PyQt5.QtCore import QThread, pyqtSignal
+"""Чтение файла с диска в фоновой задаче.
 
+Файл отображается в память через ``mmap`` и декодируется порциями
+инкрементальным декодером, поэтому прогресс соответствует прочитанным
+байтам, а отмена срабатывает между порциями. Каждая порция сразу же
+разбирается в хранилище узлов, так что дерево готово вместе с текстом.
+Ошибки XML не прерывают разбор: дерево строится частично, а ошибки
+возвращаются вместе с ним.
 
-class FileLoaderThread(QThread):
-    """Асинхронно читает файл с диска и сообщает результат через сигналы.
+С кэшем индексов (``IndexCache``) хранилище узлов неизменившегося файла
+читается из кэша, а разбор пропускается; совпадение содержимого
+проверяется хешем, который считается по ходу чтения. Построенное заново
+хранилище сохраняется в кэш.
+"""
 
-    Сигналы:
-    - file_loaded(path: str, content: str): успешная загрузка
-    - error_occurred(msg: str): ошибка чтения
-    - progress_updated(value: int): обновление прогресса (0-100)
+import codecs
+import io
+import mmap
+import os
+from model.document import locate_problems
+from model.index_cache import DOCUMENT, new_digest
+from model.node_store import NodeStoreBuilder
+
+# Размер порции чтения в байтах
+CHUNK_SIZE = 4 << 20
+
+
+def load_file(token, file_path, cache=None):
+    """Читает файл в кодировке UTF-8 и возвращает (путь, текст, хранилище узлов, ошибки).
+
+    Переводы строк приводятся к ``\\n``, как при чтении в текстовом режиме,
+    чтобы позиции узлов совпадали с текстом редактора. Если XML нарушен,
+    хранилище содержит частичное дерево, а ошибки — список (позиция,
+    строка, столбец, сообщение). Для пустого файла хранилище — None.
+
+    Выполняется в пуле ``TaskScheduler``: сообщает прогресс по байтам через
+    ``token`` и прерывается при его отмене. Текст передаётся в главный поток
+    как есть, без промежуточных копий.
     """
-    file_loaded = pyqtSignal(str, str)
-    error_occurred = pyqtSignal(str)
-    progress_updated = pyqtSignal(int)
-
-    def __init__(self, file_path):
-        """Создает поток загрузки для указанного пути к файлу."""
-        super().__init__()
-        self.file_path = file_path
-
-    def run(self):
-        """Точка входа потока: читает файл и эмитит соответствующие сигналы."""
-        try:
-            with open(self.file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-            self.progress_updated.emit(100)
-            self.file_loaded.emit(self.file_path, content)
-        except Exception as e:
-            self.error_occurred.emit(str(e))
+    stat = os.stat(file_path)
+    size = stat.st_size
+    if not size:
+        return file_path, "", None, []
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    cached = cache.lookup(file_path, DOCUMENT) if cache is not None else None
+    # Запись кэша подошла по размеру и времени: текст только читается
+    builder = NodeStoreBuilder(token, tolerant=True) if cached is None else None
+    digest = new_digest()
+    parts = []
+    reported = -1
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for pos in range(0, size, CHUNK_SIZE):
+            token.raise_if_cancelled()
+            final = pos + CHUNK_SIZE >= size
+            raw = data[pos:pos + CHUNK_SIZE]
+            digest.update(raw)
+            part = decoder.decode(raw, final=final)
+            parts.append(part)
+            if builder is not None:
+                builder.feed(part)
+            percent = min(size, pos + CHUNK_SIZE) * 100 // size
+            if percent != reported:
+                token.report_progress(percent)
+                reported = percent
+    content = "".join(parts)
+    if cached is not None:
+        result = cache.load_document(file_path, cached, digest.hexdigest())
+        if result is not None:
+            return (file_path, content) + result
+        # Содержимое отличается от записи кэша: разбираем текст целиком
+        builder = NodeStoreBuilder(token, tolerant=True)
+        builder.feed(content)
+    store = builder.close()
+    token.raise_if_cancelled()
+    problems = locate_problems(content, builder.problems)
+    if cache is not None:
+        cache.save_document(file_path, stat, digest.hexdigest(), store, problems)
+    return file_path, content, store, problems
+
 
+def prefetch_file(token, file_path, cache=None):
+    """Читает и разбирает файл заранее (упреждающее чтение недавних файлов).
 
+    Возвращает (сведения ``os.stat`` до чтения, результат ``load_file``):
+    по ним видно, не изменился ли файл с момента чтения.
+    """
+    stat = os.stat(file_path)
+    return stat, load_file(token, file_path, cache)
@@ -0,0 +1,73 @@
+"""Разметка подсветки большого документа фоновой задачей.
+
+``highlight_text`` проходит текст построчно тем же автоматом, что и
+``XmlHighlighter``, и отдаёт результат пачками строк через
+``HighlightBatches``. Форматы к блокам применяет главный поток, поэтому
+задача только размечает текст. Отмена проверяется перед каждой строкой.
+"""
+
+from PyQt5.QtCore import QSemaphore
+from ui.syntax_highlighter import tokenize_block, TEXT
+
+# Наибольшее число строк в одной пачке результата
+BATCH_LINES = 2000
+# Пачка отдаётся раньше, если её строки длиннее этого числа символов
+BATCH_CHARS = 1 << 20
+# Сколько пачек может ждать применения в главном потоке
+MAX_PENDING_BATCHES = 4
+
+
+class HighlightBatches:
+    """Передаёт пачки разметки из фоновой задачи в главный поток.
+
+    ``emit(batches, first_line, results)`` — сигнал главного потока; пачка
+    содержит результаты ``(участки, состояние в конце строки)`` для строк
+    подряд. Чтобы не копить результат в памяти, задача ждёт, пока главный
+    поток не вызовет ``batch_applied`` для ранее отданных пачек.
+    """
+
+    def __init__(self, emit):
+        """Запоминает сигнал, которым пачки отдаются главному потоку."""
+        self._emit = emit
+        self._slots = QSemaphore(MAX_PENDING_BATCHES)
+
+    def batch_applied(self):
+        """Сообщает, что главный поток применил одну пачку."""
+        self._slots.release()
+
+    def emit_batch(self, token, first_line: int, results):
+        """Отдаёт пачку, дождавшись места в очереди; при отмене выбрасывает ``TaskCancelled``."""
+        while not self._slots.tryAcquire(1, 50):
+            token.raise_if_cancelled()
+        token.raise_if_cancelled()
+        self._emit(self, first_line, results)
+
+
+def highlight_text(token, text: str, batches: HighlightBatches, first_line: int = 0, state: int = TEXT):
+    """Размечает строки текста, начиная со строки ``first_line`` в состоянии ``state``."""
+    pos = 0
+    # Пропускаем уже размеченные строки
+    for _ in range(first_line):
+        pos = text.find("\n", pos) + 1
+        if not pos:
+            return
+    line_no = first_line
+    batch = []
+    batch_start = line_no
+    batch_chars = 0
+    n = len(text)
+    while pos <= n:
+        token.raise_if_cancelled()
+        end = text.find("\n", pos)
+        if end == -1:
+            end = n
+        spans, state = tokenize_block(text[pos:end], state)
+        batch.append((spans, state))
+        batch_chars += end - pos
+        pos = end + 1
+        line_no += 1
+        if len(batch) >= BATCH_LINES or batch_chars >= BATCH_CHARS or pos > n:
+            batches.emit_batch(token, batch_start, batch)
+            batch = []
+            batch_start = line_no
+            batch_chars = 0
@@ -0,0 +1,81 @@
+"""Построение индексов большого файла в фоновых задачах.
+
+Каждая задача обрабатывает один участок файла и возвращает результат для
+него; следующий участок запускается из главного потока после получения
+результата. Так индекс строк и скелет дерева пополняются по ходу
+просмотра, а отмена срабатывает между порциями. Задача отображает файл
+в память сама и не делит объект ``mmap`` с главным потоком.
+
+Подсчёт строк заодно считает хеш содержимого для кэша индексов, а
+``hash_file`` проверяет хеш файла, индексы которого взяты из кэша.
+"""
+
+import mmap
+from array import array
+from model.index_cache import new_digest
+from model.large_file import count_newlines
+
+# Размер порции чтения в байтах (кратен размеру блока индекса строк)
+PIECE_SIZE = 4 << 20
+# Размер участка, обрабатываемого одной задачей
+STEP_SIZE = 256 << 20
+# Наибольшее число узлов скелета, найденных одной задачей
+STEP_NODES = 20_000
+
+
+def count_file_lines(token, file_path, start, block_size, digest=None):
+    """Считает переводы строки по блокам участка файла, начиная с ``start``.
+
+    ``start`` кратен ``block_size``. Возвращает массив чисел по блокам.
+    ``digest`` (если задан) дополняется байтами участка: участки
+    обрабатываются по порядку, поэтому в конце он содержит хеш файла.
+    """
+    counts = array('q')
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = min(len(data), start + STEP_SIZE)
+        for pos in range(start, end, PIECE_SIZE):
+            token.raise_if_cancelled()
+            piece = data[pos:min(end, pos + PIECE_SIZE)]
+            if digest is not None:
+                digest.update(piece)
+            counts.extend(count_newlines(piece, block_size))
+    return counts
+
+
+def hash_file(token, file_path):
+    """Возвращает хеш содержимого файла (для проверки записи кэша индексов)."""
+    digest = new_digest()
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for pos in range(0, len(data), PIECE_SIZE):
+            token.raise_if_cancelled()
+            digest.update(data[pos:pos + PIECE_SIZE])
+    return digest.hexdigest()
+
+
+def scan_file_tags(token, file_path, scanner):
+    """Продолжает просмотр тегов ``scanner`` (``TagScanner``) на следующем участке файла.
+
+    Возвращает (просмотр, новые узлы, закрытые узлы); просмотр передаётся
+    в следующую задачу.
+    """
+    nodes, closed = [], []
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        stop = min(len(data), scanner.position + STEP_SIZE)
+        piece = PIECE_SIZE
+        while scanner.position < stop:
+            token.raise_if_cancelled()
+            start = scanner.position
+            new_nodes, new_closed = scanner.scan(data, start + piece, STEP_NODES - len(nodes))
+            nodes += new_nodes
+            closed += new_closed
+            if len(nodes) >= STEP_NODES:
+                break
+            # Разметка длиннее порции: следующая порция вдвое больше
+            piece = PIECE_SIZE if scanner.position > start else piece * 2
+    return scanner, nodes, closed
+
+
+def cache_indexes(token, cache, file_path, stat, digest, lines, scanner, skeleton):
+    """Сохраняет построенные индексы большого файла в кэш индексов."""
+    token.raise_if_cancelled()
+    cache.save_large(file_path, stat, digest, lines, scanner, skeleton)
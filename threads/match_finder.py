@@ -0,0 +1,38 @@
+"""Поиск всех совпадений в фоновой задаче.
+
+Результат — упорядоченный индекс позиций (``MatchIndex``): два массива
+чисел вместо объекта на каждое совпадение, поэтому и миллион совпадений
+занимает немного памяти и быстро передаётся в главный поток. Позиции
+индекса — позиции документа Qt (единицы UTF-16): по ним индекс следует
+за правками и подсвечивает совпадения в редакторе.
+"""
+
+from array import array
+from model.match_index import MatchIndex
+from model.text_positions import TextPositions
+
+# Отмена и прогресс проверяются через это число совпадений
+_CHECK_EVERY = 0x1000
+
+
+def find_all(token, text, compiled):
+    """Находит все непустые совпадения ``compiled`` в ``text`` и возвращает ``MatchIndex``.
+
+    Позиции индекса переведены в позиции документа Qt.
+    """
+    starts, ends = array('q'), array('q')
+    total = len(text) or 1
+    for count, match in enumerate(compiled.finditer(text)):
+        if not count % _CHECK_EVERY:
+            token.raise_if_cancelled()
+            token.report_progress(match.start() * 100 // total)
+        start, end = match.span()
+        if start != end:
+            starts.append(start)
+            ends.append(end)
+    token.raise_if_cancelled()
+    positions = TextPositions(text)
+    if not positions.identity:
+        starts = array('q', map(positions.to_qt, starts))
+        ends = array('q', map(positions.to_qt, ends))
+    return MatchIndex(starts, ends)
@@ -0,0 +1,170 @@
+"""Общий пул фоновых задач с кооперативной отменой.
+
+Задача — обычная функция ``fn(token, *args)``, которая выполняется в
+``QThreadPool`` с ограниченным числом потоков. Функция сама периодически
+вызывает ``token.raise_if_cancelled()``, поэтому поток никогда не
+прерывается принудительно. Новая задача с тем же ключом отменяет
+предыдущую, а результат устаревшей (отменённой или посчитанной для
+старой версии текста) задачи до главного потока не доходит.
+
+Задача с отрицательным приоритетом (упреждающее чтение и т. п.) ждёт в
+очереди пула после остальных и выполняется в потоке с низшим приоритетом.
+"""
+
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, pyqtSignal
+
+
+class TaskCancelled(Exception):
+    """Задача прервана по запросу отмены."""
+
+
+class CancelToken:
+    """Флаг отмены задачи и канал для сообщений о прогрессе."""
+
+    def __init__(self, key, version=None):
+        """Создаёт токен задачи с ключом ``key`` и версией текста ``version``."""
+        self.key = key
+        self.version = version
+        self._cancelled = False
+        self._report = None
+
+    @property
+    def cancelled(self) -> bool:
+        """Проверяет, запрошена ли отмена."""
+        return self._cancelled
+
+    def cancel(self):
+        """Запрашивает отмену задачи."""
+        self._cancelled = True
+
+    def raise_if_cancelled(self):
+        """Выбрасывает ``TaskCancelled``, если запрошена отмена."""
+        if self._cancelled:
+            raise TaskCancelled()
+
+    def report_progress(self, value: int):
+        """Сообщает прогресс задачи (0-100) главному потоку."""
+        if self._report is not None and not self._cancelled:
+            self._report(value)
+
+
+class _Task(QRunnable):
+    """Обёртка функции задачи для ``QThreadPool``."""
+
+    def __init__(self, scheduler, token, fn, args, priority=0):
+        """Запоминает функцию, её аргументы, токен и приоритет."""
+        super().__init__()
+        self.scheduler = scheduler
+        self.token = token
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+
+    def run(self):
+        """Выполняет функцию и передаёт результат или ошибку в главный поток."""
+        result = error = None
+        thread = QThread.currentThread()
+        if self.priority < 0:
+            thread.setPriority(QThread.LowestPriority)
+        try:
+            result = self.fn(self.token, *self.args)
+        except TaskCancelled:
+            self.token.cancel()
+        except Exception as e:
+            error = e
+        finally:
+            if self.priority < 0:
+                # Поток пула выполнит и обычные задачи
+                thread.setPriority(QThread.NormalPriority)
+        self.scheduler.task_done.emit(self.token, result, error)
+
+
+class TaskScheduler(QObject):
+    """Запускает задачи в общем пуле потоков и доставляет их результаты.
+
+    Обработчики ``on_result``, ``on_error``, ``on_progress`` и
+    ``on_cancelled`` вызываются в главном потоке. Если у задачи задана
+    версия, а ``version_provider`` к моменту завершения возвращает другую,
+    результат отбрасывается как устаревший (вызывается ``on_stale``).
+    """
+    task_done = pyqtSignal(object, object, object)  # токен, результат, ошибка
+    task_progress = pyqtSignal(object, int)  # токен, прогресс
+
+    def __init__(self, max_workers=None, version_provider=None, parent=None):
+        """Создаёт пул не более чем из ``max_workers`` потоков."""
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        if max_workers is None:
+            max_workers = max(2, min(4, QThread.idealThreadCount()))
+        self._pool.setMaxThreadCount(max_workers)
+        self._version_provider = version_provider
+        self._active = {}  # ключ → токен последней задачи
+        self._callbacks = {}  # токен → обработчики
+        self._runnables = {}  # токен → QRunnable (держим ссылку до завершения)
+        self.task_done.connect(self._on_task_done)
+        self.task_progress.connect(self._on_task_progress)
+
+    def submit(self, key, fn, *args, on_result=None, on_error=None, on_progress=None,
+               on_cancelled=None, on_stale=None, version=None, priority=0) -> CancelToken:
+        """Запускает ``fn(token, *args)``, отменяя предыдущую задачу с ключом ``key``.
+
+        Замещённая задача завершается молча, без ``on_cancelled``: её место
+        уже заняла новая. Задачи с большим ``priority`` начинаются раньше.
+        """
+        previous = self._active.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+            self._callbacks[previous] = (None, None, None, None, None)
+        token = CancelToken(key, version)
+        if on_progress is not None:
+            token._report = lambda value: self.task_progress.emit(token, value)
+        self._active[key] = token
+        self._callbacks[token] = (on_result, on_error, on_progress, on_cancelled, on_stale)
+        runnable = _Task(self, token, fn, args, priority)
+        runnable.setAutoDelete(False)
+        self._runnables[token] = runnable
+        self._pool.start(runnable, priority)
+        return token
+
+    def cancel(self, key):
+        """Отменяет текущую задачу с ключом ``key`` (если есть)."""
+        token = self._active.pop(key, None)
+        if token is not None:
+            token.cancel()
+
+    def is_running(self, key) -> bool:
+        """Проверяет, выполняется ли задача с ключом ``key``."""
+        return key in self._active
+
+    def shutdown(self, timeout_ms: int = 5000) -> bool:
+        """Отменяет все задачи и ждёт завершения потоков пула."""
+        for key in list(self._active):
+            self.cancel(key)
+        return self._pool.waitForDone(timeout_ms)
+
+    def _on_task_done(self, token, result, error):
+        """Вызывает обработчик завершения, если результат ещё актуален."""
+        self._runnables.pop(token, None)
+        on_result, on_error, _, on_cancelled, on_stale = self._callbacks.pop(token)
+        if self._active.get(token.key) is token:
+            del self._active[token.key]
+        if token.cancelled:
+            if on_cancelled is not None:
+                on_cancelled()
+            return
+        if (token.version is not None and self._version_provider is not None
+                and token.version != self._version_provider()):
+            if on_stale is not None:
+                on_stale()
+            return
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+        elif on_result is not None:
+            on_result(result)
+
+    def _on_task_progress(self, token, value):
+        """Передаёт прогресс задачи обработчику, пока задача не отменена."""
+        callbacks = self._callbacks.get(token)
+        if callbacks is not None and not token.cancelled:
+            callbacks[2](value)
@@ -0,0 +1,48 @@
+"""Замена всех совпадений в фоновой задаче.
+
+Совпадения ищутся за один проход по снимку текста. Результат — не новый
+текст целиком, а упорядоченные участки от совпадения до совпадения
+(примерно по ``SEGMENT_CHARS`` символов) с их новым видом: редактор
+применяет их порциями в одном шаге отмены (см. ``ui.batch_edit``), не
+пересчитывая раскладку документа после каждой замены.
+"""
+
+# Размер участка исходного текста в одной правке, символов
+SEGMENT_CHARS = 1 << 20
+# Отмена и прогресс проверяются через это число совпадений
+_CHECK_EVERY = 0x1000
+
+
+def replace_all(token, text, compiled, replace):
+    """Заменяет все совпадения ``compiled`` в ``text``.
+
+    ``replace`` — функция «совпадение -> замена» (см.
+    ``model.text_search.compile_replacement``). Возвращает (правки, число
+    замен), где правки — список (начало, конец, замена) непересекающихся
+    участков по возрастанию позиций; без совпадений список пуст.
+    """
+    edits = []
+    parts = []
+    segment_start = last = None
+    count = 0
+    total = len(text) or 1
+    for match in compiled.finditer(text):
+        if not count % _CHECK_EVERY:
+            token.raise_if_cancelled()
+            token.report_progress(match.start() * 100 // total)
+        start, end = match.span()
+        if segment_start is None:
+            segment_start = start
+        elif start - segment_start > SEGMENT_CHARS:
+            edits.append((segment_start, last, "".join(parts)))
+            parts = []
+            segment_start = start
+        else:
+            parts.append(text[last:start])
+        parts.append(replace(match))
+        last = end
+        count += 1
+    token.raise_if_cancelled()
+    if count:
+        edits.append((segment_start, last, "".join(parts)))
+    return edits, count
@@ -0,0 +1,76 @@
+"""Форматирование XML в фоновой задаче.
+
+``format_text`` форматирует текст редактора, ``format_file`` — файл с диска
+в другой файл. Файл читается и записывается порциями, поэтому размер
+документа ограничен только местом на диске.
+"""
+
+import codecs
+import os
+import re
+from model.pretty_printer import XmlPrettyPrinter
+
+# Размер порции исходных данных: символов текста или байт файла
+CHUNK_SIZE = 1 << 20
+# Кодировка из XML-декларации в начале файла
+_ENCODING_RE = re.compile(rb"""(?:\xef\xbb\xbf)?\s*<\?xml[^>]*?encoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+
+
+def format_text(token, text, indent="  "):
+    """Форматирует строку и возвращает результат целиком.
+
+    Выполняется в пуле ``TaskScheduler``: сообщает прогресс через ``token``
+    и прерывается при его отмене.
+    """
+    parts = []
+    printer = XmlPrettyPrinter(parts.append, indent)
+    total = len(text) or 1
+    for pos in range(0, len(text), CHUNK_SIZE):
+        token.raise_if_cancelled()
+        printer.feed(text[pos:pos + CHUNK_SIZE])
+        token.report_progress(min(100, (pos + CHUNK_SIZE) * 100 // total))
+    printer.close()
+    return "".join(parts)
+
+
+def format_file(token, source_path, target_path, indent="  "):
+    """Форматирует файл во временный файл рядом с результатом и подменяет его.
+
+    Возвращает путь к результату. При ошибке или отмене временный файл
+    удаляется, а существующий файл результата остаётся нетронутым.
+    """
+    total = os.path.getsize(source_path) or 1
+    tmp_path = target_path + ".tmp"
+    done = 0
+    try:
+        with open(source_path, "rb") as source:
+            data = source.read(CHUNK_SIZE)
+            # Результат пишется в той же кодировке, что объявлена в исходном файле
+            with open(tmp_path, "w", encoding=declared_encoding(data),
+                      errors="xmlcharrefreplace", newline="\n") as out:
+                printer = XmlPrettyPrinter(out.write, indent)
+                while data:
+                    token.raise_if_cancelled()
+                    printer.feed(data)
+                    done += len(data)
+                    token.report_progress(done * 100 // total)
+                    data = source.read(CHUNK_SIZE)
+                printer.close()
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target_path
+
+
+def declared_encoding(head: bytes) -> str:
+    """Определяет кодировку файла по BOM или XML-декларации в его начале."""
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    m = _ENCODING_RE.match(head)
+    if m:
+        try:
+            return codecs.lookup(m.group(1).decode("ascii")).name
+        except LookupError:
+            pass
+    return "utf-8"
@@ -0,0 +1,53 @@
+"""Проверка корректности (well-formedness) XML в фоновой задаче.
+
+Текст подаётся expat небольшими порциями: между порциями проверяется
+отмена, а главный поток не ждёт GIL дольше нескольких миллисекунд.
+После правки внутри одного элемента корректного документа достаточно
+проверить только этот элемент.
+"""
+
+from xml.parsers import expat
+from model.document import reparse_document
+
+# Размер порции текста, передаваемой expat за один вызов
+CHUNK_SIZE = 1 << 18
+
+
+def check_well_formed(token, text):
+    """Проверяет, что XML-текст корректен.
+
+    Возвращает None или (строка, столбец, сообщение) первой ошибки;
+    строка считается с единицы, столбец — с нуля, в символах.
+    """
+    parser = expat.ParserCreate()
+    try:
+        for pos in range(0, len(text), CHUNK_SIZE):
+            token.raise_if_cancelled()
+            parser.Parse(text[pos:pos + CHUNK_SIZE], False)
+        parser.Parse("", True)
+    except expat.ExpatError as e:
+        return e.lineno, e.offset, expat.ErrorString(e.code)
+    return None
+
+
+def check_edit(token, text, base, base_valid, version):
+    """Разбирает заново изменённый элемент и проверяет корректность текста.
+
+    ``base`` — (прежний документ, начало, конец в старом тексте, конец
+    в новом) или None. Если правки уместились в одном элементе, а прежний
+    текст был корректен (``base_valid``), expat проверяет только этот
+    элемент; весь текст проверяется, лишь если в элементе найдена ошибка,
+    чтобы её позиция была точной. Возвращает (документ новой версии или
+    None, результат ``check_well_formed``).
+    """
+    document = reparsed = None
+    if base is not None:
+        reparsed = reparse_document(base[0], text, *base[1:], version, token)
+    if reparsed is not None:
+        document, node_id = reparsed
+        if base_valid:
+            start, end = document.store.element_span(node_id)
+            if check_well_formed(token, text[start:end]) is None:
+                return document, None
+    return document, check_well_formed(token, text)
+
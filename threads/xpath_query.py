@@ -0,0 +1,21 @@
+"""Выполнение запроса XPath в фоновой задаче.
+
+Индекс документа (``DocumentIndex``) строится один раз на версию документа
+и передаётся обратно вместе с результатом, чтобы следующие запросы к той же
+версии использовали уже построенные индексы имён, атрибутов и текста.
+"""
+
+from model.xpath import DocumentIndex
+
+
+def run_query(token, query, document, index=None):
+    """Выполняет скомпилированный запрос ``query`` над ``document``.
+
+    ``index`` — индекс, построенный для предыдущего запроса; если он
+    относится к другому документу, строится новый. Возвращает пару
+    (индекс, номера выбранных элементов по возрастанию).
+    """
+    if index is None or index.document is not document:
+        index = DocumentIndex(document, token)
+    token.raise_if_cancelled()
+    return index, query.evaluate(index, token)
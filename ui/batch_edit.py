@@ -0,0 +1,97 @@
+"""Применение множества правок к документу одним шагом отмены.
+
+Вставка в ``QTextDocument`` нескольких мегабайт текста или сотен тысяч
+мелких правок занимает секунды. ``BatchEdit`` применяет упорядоченные
+правки порциями по таймеру: каждая порция — отдельный блок правки,
+присоединённый к предыдущему (``joinPreviousEditBlock``), поэтому
+интерфейс не замирает надолго, а отмена возвращает всё разом. Пока
+правки применяются, редактор доступен только для чтения.
+"""
+
+import time
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+
+# Время на правки за один шаг таймера, секунд
+_SLICE_SECONDS = 0.05
+
+
+class BatchEdit(QObject):
+    """Применяет правки (начало, конец, замена) к тексту редактора.
+
+    Правки не пересекаются, упорядочены по возрастанию позиций и заданы
+    в позициях исходного документа (единицах UTF-16, см.
+    ``model.text_positions``). Если текст изменится не через эту правку
+    (например, будет загружен другой файл), применение прерывается.
+
+    Сигналы:
+    - progress(percent): доля применённых правок
+    - finished(done): True — все правки применены, False — прервано
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(bool)
+
+    def __init__(self, editor, edits, parent=None):
+        """Принимает редактор и список правок."""
+        super().__init__(parent)
+        self.editor = editor
+        self._edits = edits
+        self._next = 0
+        self._shift = 0  # сдвиг позиций после уже применённых правок
+        self._applying = False
+        self._read_only = editor.isReadOnly()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._step)
+
+    def start(self):
+        """Начинает применение правок со следующего шага цикла событий."""
+        self.editor.setReadOnly(True)
+        self.editor.document().contentsChange.connect(self._on_contents_change)
+        self._timer.start(0)
+
+    def cancel(self):
+        """Прерывает применение; уже применённые правки остаются одним шагом отмены."""
+        if self._next < len(self._edits):
+            self._finish(False)
+
+    def _step(self):
+        """Применяет очередные правки, пока не выйдет время шага."""
+        document = self.editor.document()
+        cursor = QTextCursor(document)
+        deadline = time.perf_counter() + _SLICE_SECONDS
+        edits = self._edits
+        while self._next < len(edits) and time.perf_counter() < deadline:
+            start, end, replacement = edits[self._next]
+            self._applying = True
+            if self._next:
+                cursor.joinPreviousEditBlock()
+            else:
+                cursor.beginEditBlock()
+            cursor.setPosition(start + self._shift)
+            cursor.setPosition(end + self._shift, QTextCursor.KeepAnchor)
+            length = document.characterCount()
+            cursor.insertText(replacement)
+            cursor.endEditBlock()
+            self._applying = False
+            # Длина замены в документе может отличаться от длины строки (символы вне BMP)
+            self._shift += document.characterCount() - length
+            self._next += 1
+        if self._next < len(edits):
+            self.progress.emit(self._next * 100 // len(edits))
+            self._timer.start(0)
+        else:
+            self._finish(True)
+
+    def _on_contents_change(self, position: int, removed: int, added: int):
+        """Прерывает применение, если текст изменился помимо этих правок."""
+        if not self._applying:
+            self._finish(False)
+
+    def _finish(self, done: bool):
+        """Возвращает редактору прежний режим и сообщает результат."""
+        self._timer.stop()
+        self._next = len(self._edits)
+        self.editor.document().contentsChange.disconnect(self._on_contents_change)
+        self.editor.setReadOnly(self._read_only)
+        self.finished.emit(done)
@@ -0,0 +1,251 @@
+"""Снимки текста редактора, общие для всех обработчиков одной ревизии.
+
+``toPlainText()`` каждый раз копирует весь документ. ``SnapshotService``
+хранит снимок текущей ревизии: текст копируется не больше одного раза
+на ревизию, а производные данные (число строк, разобранный документ)
+вычисляются по требованию и живут, пока текст не изменится. Фоновым
+задачам текст можно получить асинхронно: тогда он читается из документа
+небольшими порциями, не останавливая интерфейс.
+
+Позиции снимка — символы строки Python; ``positions`` снимка переводит
+их в позиции документа Qt (единицы UTF-16) и обратно.
+
+Сервис помнит последний разобранный документ и участок, изменённый
+с момента его разбора: пока правки остаются внутри одного элемента,
+новый документ получается повторным разбором только этого элемента.
+"""
+
+import time
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtGui import QTextCursor
+from model.document import parse_document, reparse_document
+from model.node_store import XmlParseError
+from model.text_positions import TextPositions, has_astral
+
+# Порция асинхронного чтения текста из документа, символов
+_READ_CHARS = 1 << 18
+# Время на чтение порций за один шаг таймера, секунд
+_SLICE_SECONDS = 0.008
+
+
+def document_text(raw: str) -> str:
+    """Переводит «сырой» текст ``QTextDocument`` в текст с переводами строк ``\\n``.
+
+    В отличие от ``toPlainText`` неразрывные пробелы и разделители строк
+    U+2028 остаются как есть, поэтому снимок совпадает с загруженным файлом.
+    """
+    return raw.replace("\u2029", "\n")
+
+
+class TextSnapshot:
+    """Текст одной ревизии документа и данные, вычисленные по нему."""
+
+    def __init__(self, revision: int, text: str, document=None, base=None):
+        """Сохраняет номер ревизии, текст и (если уже есть) разобранный документ.
+
+        ``base`` — (прежний документ, начало, конец в старом тексте, конец
+        в новом) для разбора только изменённого элемента.
+        """
+        self.revision = revision
+        self.text = text
+        self._line_count = None
+        self._positions = None
+        self._document = document
+        self._base = base
+        self._parse_failed = False
+
+    @property
+    def line_count(self) -> int:
+        """Возвращает число строк текста."""
+        if self._line_count is None:
+            self._line_count = self.text.count("\n") + 1
+        return self._line_count
+
+    @property
+    def positions(self) -> TextPositions:
+        """Возвращает перевод позиций текста в позиции документа Qt."""
+        if self._positions is None:
+            self._positions = TextPositions(self.text)
+        return self._positions
+
+    def has_document(self) -> bool:
+        """Проверяет, разобран ли уже текст этой ревизии."""
+        return self._document is not None
+
+    def attach_document(self, document):
+        """Запоминает документ, разобранный из этого же текста в другом месте."""
+        self._document = document
+        self._parse_failed = False
+
+    def document(self):
+        """Возвращает разобранный документ или None, если XML некорректен.
+
+        Текст разбирается не более одного раза на ревизию.
+        """
+        if self._document is None and not self._parse_failed:
+            if self._base is not None:
+                old, start, old_end, new_end = self._base
+                reparsed = reparse_document(old, self.text, start, old_end, new_end, self.revision)
+                if reparsed is not None:
+                    self._document = reparsed[0]
+                    return self._document
+            try:
+                self._document = parse_document(self.text, self.revision)
+            except XmlParseError:
+                self._parse_failed = True
+        return self._document
+
+
+class SnapshotService(QObject):
+    """Выдаёт снимок текущей ревизии текста ``QTextDocument``.
+
+    Ревизия растёт при каждом изменении содержимого документа (сигнал
+    ``contentsChange``), даже если сигналы редактора заблокированы;
+    снимок прежней ревизии при этом забывается.
+    """
+
+    def __init__(self, document, parent=None):
+        """Подписывается на изменения ``document``."""
+        super().__init__(parent)
+        self._qdocument = document
+        self.revision = 0
+        self._snapshot = None
+        # (документ, начало, конец в его тексте, конец в текущем) правок после разбора
+        self._base = None
+        # Асинхронное чтение: (курсор, позиция, прочитанные порции) и ожидающие текста
+        self._reader = None
+        self._waiting = []
+        self._read_timer = QTimer(self)
+        self._read_timer.setSingleShot(True)
+        self._read_timer.timeout.connect(self._read_step)
+        document.contentsChange.connect(self._on_contents_change)
+
+    def snapshot(self) -> TextSnapshot:
+        """Возвращает снимок текущей ревизии, копируя текст только при первом обращении."""
+        if self._snapshot is None:
+            text = document_text(self._qdocument.toRawText())
+            self._snapshot = TextSnapshot(self.revision, text, base=self._base)
+        return self._snapshot
+
+    def cached_text(self):
+        """Возвращает текст текущей ревизии, если снимок уже есть, иначе None."""
+        return self._snapshot.text if self._snapshot is not None else None
+
+    def text(self) -> str:
+        """Возвращает текст текущей ревизии."""
+        return self.snapshot().text
+
+    def positions(self) -> TextPositions:
+        """Возвращает перевод позиций текста текущей ревизии в позиции документа Qt."""
+        return self.snapshot().positions
+
+    def request_text(self, callback):
+        """Передаёт текст текущей ревизии в ``callback``, не останавливая интерфейс.
+
+        Если снимок уже есть, ``callback`` вызывается сразу. Иначе текст
+        читается из документа порциями по таймеру и становится снимком.
+        Если текст изменится раньше, чем будет прочитан, чтение и ожидающие
+        вызовы отменяются: запросивший повторит запрос для новой ревизии.
+        """
+        if self._snapshot is not None:
+            callback(self._snapshot.text)
+            return
+        self._waiting.append(callback)
+        if self._reader is None:
+            self._reader = (QTextCursor(self._qdocument), 0, [])
+            self._read_timer.start(0)
+
+    def edit_base(self):
+        """Возвращает основу для разбора только изменённого элемента или None.
+
+        Это (последний разобранный документ, начало, конец в его тексте,
+        конец в текущем тексте) участка, изменённого после его разбора.
+        Если документ текущей ревизии уже есть, возвращает None.
+        """
+        if self._snapshot is not None and self._snapshot.has_document():
+            return None
+        return self._base
+
+    def document(self):
+        """Возвращает разобранный документ текущей ревизии или None."""
+        return self.snapshot().document()
+
+    def parsed_document(self):
+        """Возвращает документ текущей ревизии, только если он уже разобран.
+
+        В отличие от ``document`` не копирует текст и не разбирает его.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.has_document():
+            return snapshot.document()
+        return None
+
+    def adopt(self, revision: int, text: str, document=None) -> bool:
+        """Принимает текст ревизии ``revision`` (и разобранный из него документ).
+
+        Так текст, только что переданный в редактор или разобранный
+        в фоне, становится снимком без копирования содержимого редактора.
+        Данные для устаревшей ревизии не принимаются.
+        """
+        if revision != self.revision:
+            return False
+        if self._snapshot is None:
+            self._snapshot = TextSnapshot(revision, text, document, self._base)
+        elif document is not None:
+            self._snapshot.attach_document(document)
+        return True
+
+    def _read_step(self):
+        """Читает очередные порции текста, пока не выйдет время шага."""
+        cursor, position, parts = self._reader
+        end = self._qdocument.characterCount() - 1
+        deadline = time.perf_counter() + _SLICE_SECONDS
+        # Снимок мог появиться и без чтения (синхронный запрос, adopt)
+        while self._snapshot is None and position < end and time.perf_counter() < deadline:
+            cursor.setPosition(position)
+            position = min(end, position + _READ_CHARS)
+            cursor.setPosition(position, QTextCursor.KeepAnchor)
+            parts.append(document_text(cursor.selectedText()))
+        if self._snapshot is None and position < end:
+            self._reader = (cursor, position, parts)
+            self._read_timer.start(0)
+            return
+        self._reader = None
+        if self._snapshot is None:
+            self._snapshot = TextSnapshot(self.revision, "".join(parts), base=self._base)
+        text = self._snapshot.text
+        waiting, self._waiting = self._waiting, []
+        for callback in waiting:
+            callback(text)
+
+    def _on_contents_change(self, position: int, removed: int, added: int):
+        """Начинает новую ревизию после изменения текста."""
+        self._track_edit(position, removed, added)
+        self.revision += 1
+        self._snapshot = None
+        self._reader = None
+        self._waiting = []
+        self._read_timer.stop()
+
+    def _track_edit(self, position: int, removed: int, added: int):
+        """Добавляет правку к участку, изменённому после последнего разбора."""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.has_document():
+            if has_astral(snapshot.text):
+                # Позиции правки — единицы UTF-16 и не совпадают с позициями хранилища
+                self._base = None
+                return
+            base = (snapshot.document(), position, position + removed, position + added)
+        elif self._base is not None:
+            document, start, old_end, new_end = self._base
+            removed_end = position + removed
+            # Участок в текущих позициях [start, new_end) соответствует [start, old_end) в тексте документа
+            if removed_end > new_end:
+                old_end += removed_end - new_end
+            base = (document, min(start, position), old_end, max(new_end, removed_end) + added - removed)
+        else:
+            return
+        # Правка, задевшая теги корня, всё равно потребует полного разбора
+        if base[0].store.enclosing_element(base[1], base[2]) is None:
+            base = None
+        self._base = base
@@ -0,0 +1,141 @@
+"""Статистика документа для строки состояния без копирования текста.
+
+Число строк и символов ``QTextDocument`` ведёт сам и отдаёт за O(1).
+Если текст текущей ревизии уже разобран, число элементов берётся из
+хранилища узлов. Иначе оно оценивается по тегам в тексте и
+поддерживается по изменениям ``contentsChange``: для окна
+из строки курсора и соседних строк запоминается число тегов, и правка
+внутри окна пересчитывает только его. Правка за пределами окна (вставка
+большого текста, замена всего документа) помечает счётчик устаревшим —
+тогда он пересчитывается по снимку текста при следующем запросе.
+
+Путь к элементу под курсором (и по нему глубина) берётся из разобранного
+документа текущей ревизии (если текст уже разобран) двоичным поиском по
+началам узлов.
+"""
+
+from bisect import bisect_right
+from PyQt5.QtCore import QObject
+
+# Правка, добавившая больше символов, пересчитывается по снимку целиком:
+# str.count по всему тексту быстрее обхода множества блоков на Python
+_LOCAL_EDIT_LIMIT = 1 << 16
+
+
+def count_elements(text: str) -> int:
+    """Оценивает число элементов по открывающим и пустым тегам (``<a>``, ``<a/>``).
+
+    Теги внутри комментариев и CDATA тоже учитываются, поэтому оценка
+    нужна, только пока текст не разобран.
+    """
+    return text.count("<") - text.count("</") - text.count("<!") - text.count("<?")
+
+
+class DocumentStats(QObject):
+    """Счётчики строк, символов и элементов, положение и глубина курсора в документе."""
+
+    def __init__(self, editor, snapshots, parent=None):
+        """Подписывается на изменения текста и перемещения курсора ``editor``."""
+        super().__init__(parent)
+        self.editor = editor
+        self.snapshots = snapshots
+        self._document = editor.document()
+        self._elements = None  # None — пересчитать по снимку текста
+        self._window = None  # (начало, конец, число тегов) строк вокруг курсора
+        self._document.contentsChange.connect(self._on_contents_change)
+        editor.cursorPositionChanged.connect(self._on_cursor_moved)
+
+    @property
+    def line_count(self) -> int:
+        """Возвращает число строк."""
+        return self._document.blockCount()
+
+    @property
+    def char_count(self) -> int:
+        """Возвращает число символов, включая переводы строк."""
+        return self._document.characterCount() - 1
+
+    @property
+    def element_count(self) -> int:
+        """Возвращает число элементов документа.
+
+        По разобранному документу число точное; дальше правки уточняют его
+        по окну у курсора, пока новая ревизия не разобрана.
+        """
+        document = self.snapshots.parsed_document()
+        if document is not None:
+            self._elements = len(document.store)
+        elif self._elements is None:
+            self._elements = count_elements(self.snapshots.text())
+        return self._elements
+
+    def refresh_window(self):
+        """Запоминает окно у курсора заново: текст вставлен без сигналов ``contentsChange``.
+
+        Счётчик элементов при этом остаётся: он считается по снимку ревизии.
+        """
+        self._remember_window(self.editor.textCursor().block())
+
+    def cursor_position(self):
+        """Возвращает (строка, столбец) курсора, считая с единицы."""
+        cursor = self.editor.textCursor()
+        return cursor.blockNumber() + 1, cursor.positionInBlock() + 1
+
+    def element_path(self):
+        """Возвращает имена элементов от корня до элемента под курсором.
+
+        Если текст текущей ревизии ещё не разобран (или разобран с ошибкой),
+        возвращает None: разбор ради строки состояния не запускается.
+        """
+        document = self.snapshots.parsed_document()
+        if document is None:
+            return None
+        store = document.store
+        # Позиции хранилища — символы текста, позиция курсора — единицы UTF-16
+        position = self.snapshots.positions().from_qt(self.editor.textCursor().position())
+        node_id = bisect_right(store.start, position) - 1
+        # Последний начавшийся до курсора узел может уже закончиться — тогда ищем среди предков
+        while node_id != -1 and store.end[node_id] <= position:
+            node_id = store.parent[node_id]
+        path = []
+        while node_id != -1:
+            path.append(store.tag(node_id))
+            node_id = store.parent[node_id]
+        path.reverse()
+        return path
+
+    def _on_contents_change(self, position: int, removed: int, added: int):
+        """Обновляет счётчик элементов по правке, не затрагивая остальной текст."""
+        window = self._window
+        if (self._elements is not None and window is not None and added <= _LOCAL_EDIT_LIMIT
+                and window[0] <= position and position + removed < window[1]):
+            # Правка не задела перевод строки в конце окна: оно по-прежнему состоит из целых строк
+            start, end, count = window
+            self._elements += self._count_blocks(start, end + added - removed) - count
+        else:
+            self._elements = None
+        self._remember_window(self._document.findBlock(position))
+
+    def _on_cursor_moved(self):
+        """Переносит окно подсчёта к строке курсора, если курсор из него вышел."""
+        block = self.editor.textCursor().block()
+        window = self._window
+        if window is None or not window[0] <= block.position() < window[1]:
+            self._remember_window(block)
+
+    def _remember_window(self, block):
+        """Запоминает число тегов в строке ``block`` и соседних с ней."""
+        first = block.previous() if block.previous().isValid() else block
+        last = block.next() if block.next().isValid() else block
+        start = first.position()
+        end = last.position() + last.length()
+        self._window = (start, end, self._count_blocks(start, end))
+
+    def _count_blocks(self, start: int, end: int) -> int:
+        """Считает теги в строках, занимающих позиции с ``start`` по ``end``."""
+        block = self._document.findBlock(start)
+        count = 0
+        while block.isValid() and block.position() < end:
+            count += count_elements(block.text())
+            block = block.next()
+        return count
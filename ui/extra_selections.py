@@ -0,0 +1,22 @@
+"""Дополнительные выделения редактора из нескольких источников.
+
+``QPlainTextEdit.setExtraSelections`` заменяет все выделения сразу, поэтому
+отметка ошибки проверки и подсветка совпадений поиска хранятся отдельными
+слоями и передаются редактору вместе.
+"""
+
+
+class SelectionLayers:
+    """Слои дополнительных выделений редактора, адресуемые именем."""
+
+    def __init__(self, editor):
+        """Привязывает слои к редактору."""
+        self.editor = editor
+        self._layers = {}
+
+    def set(self, name: str, selections):
+        """Заменяет выделения слоя ``name`` и обновляет редактор."""
+        if not selections and not self._layers.get(name):
+            return
+        self._layers[name] = selections
+        self.editor.setExtraSelections([selection for layer in self._layers.values() for selection in layer])
@@ -0,0 +1,303 @@
+"""Подсветка больших документов: сначала видимая часть, остальное в фоне.
+
+``QSyntaxHighlighter`` размечает весь документ в главном потоке сразу после
+``setPlainText``. Для больших текстов планировщик отключает его и сам
+применяет форматы к блокам: видимые строки размечаются сразу, остальные —
+фоновой задачей ``highlight_text`` в общем пуле, а результаты применяются
+небольшими порциями по таймеру, не блокируя интерфейс. Остановка только
+отменяет задачу и не ждёт её завершения. В главном потоке размечается
+ограниченное число символов: очень длинные строки (например, минифицированный
+XML) остаются фоновой задаче. Выше заданного размера подсветка выключается
+совсем.
+
+Состояние автомата в конце строки хранится в ``userState`` блока, как у
+``QSyntaxHighlighter``; ``-1`` означает, что блок ещё не размечен.
+"""
+
+import time
+from PyQt5.QtCore import QObject, QPoint, QTimer, pyqtSignal
+from ui.syntax_highlighter import tokenize_block, TEXT
+from threads.highlight_worker import HighlightBatches, highlight_text
+
+# Время на одну порцию применения форматов в главном потоке, секунд
+_SLICE_SECONDS = 0.008
+# Сколько блоков после правки размечается сразу, прежде чем отдать остальное фону
+_EDIT_BLOCK_BUDGET = 500
+# Сколько символов размечается сразу в главном потоке (видимая часть, правка)
+_SYNC_CHARS = 100_000
+
+
+class HighlightScheduler(QObject):
+    """Выбирает режим подсветки по размеру текста и ведёт фоновую разметку.
+
+    Режимы: ``"sync"`` — обычный ``XmlHighlighter``; ``"background"`` —
+    видимая часть сразу, остальное в фоне; ``"plain"`` — без подсветки.
+    """
+    SYNC, BACKGROUND, PLAIN = "sync", "background", "plain"
+    # Пачка фоновой разметки: очередь пачек задачи, первая строка, результаты
+    batch_ready = pyqtSignal(object, int, object)
+
+    def __init__(self, editor, highlighter, task_scheduler, async_limit=1_000_000,
+                 plain_limit=200 * 1024 * 1024, text_request=None):
+        """Принимает редактор, его подсветку, пул фоновых задач и границы режимов в символах.
+
+        ``text_request(callback)`` передаёт текущий текст для фоновой разметки
+        в ``callback``, возможно позже (по умолчанию — сразу ``editor.toPlainText()``).
+        """
+        super().__init__(editor)
+        self.editor = editor
+        self.highlighter = highlighter
+        self.task_scheduler = task_scheduler
+        self._text_request = text_request or (lambda callback: callback(editor.toPlainText()))
+        self.async_limit = async_limit
+        self.plain_limit = plain_limit
+        self.mode = self.SYNC
+        self._generation = 0
+        self.batch_ready.connect(self._on_batch_ready)
+        # Очередь пачек выполняющейся задачи разметки
+        self._batches = None
+        self._awaiting_text = False
+        self._pending = []
+        # Первая строка, до которой фоновая разметка уже дошла
+        self._frontier = 0
+        self._block_count = 0
+        self._apply_timer = QTimer(self)
+        self._apply_timer.setSingleShot(True)
+        self._apply_timer.timeout.connect(self._apply_pending)
+        # После правок фоновая разметка перезапускается с задержкой
+        self._restart_timer = QTimer(self)
+        self._restart_timer.setSingleShot(True)
+        self._restart_timer.setInterval(300)
+        self._restart_timer.timeout.connect(self._restart_worker)
+        editor.verticalScrollBar().valueChanged.connect(self._highlight_viewport)
+        editor.document().contentsChange.connect(self._on_contents_change)
+
+    def prepare(self, text_length: int):
+        """Готовит подсветку к замене всего текста документом длины ``text_length``.
+
+        Вызывается до ``setPlainText``, чтобы обычная подсветка не успела
+        разметить большой текст целиком.
+        """
+        self.stop()
+        if text_length <= self.async_limit:
+            mode = self.SYNC
+        elif text_length <= self.plain_limit:
+            mode = self.BACKGROUND
+        else:
+            mode = self.PLAIN
+        if mode != self.SYNC and self.highlighter.document() is not None:
+            self.highlighter.setDocument(None)
+        self.mode = mode
+
+    def start(self):
+        """Запускает подсветку текста, установленного после ``prepare``."""
+        document = self.editor.document()
+        if self.mode == self.SYNC:
+            if self.highlighter.document() is None:
+                self.highlighter.setDocument(document)
+            return
+        if self.mode == self.PLAIN:
+            return
+        self._block_count = document.blockCount()
+        self._highlight_viewport()
+        self._frontier = 0
+        self._start_worker(0, TEXT)
+
+    def refresh(self):
+        """Переразмечает документ в фоновом режиме заново (например, после смены цветов).
+
+        В обычном режиме документ переразмечает сам ``XmlHighlighter``.
+        """
+        if self.mode == self.BACKGROUND:
+            self.stop()
+            self._highlight_viewport(force=True)
+            self._frontier = 0
+            self._start_worker(0, TEXT)
+
+    def stop(self):
+        """Останавливает фоновую разметку и отбрасывает её результаты.
+
+        Задача только получает запрос отмены: ждать её завершения не нужно,
+        пачки прежнего поколения отбрасываются при получении.
+        """
+        self._generation += 1
+        self._awaiting_text = False
+        self._pending = []
+        self._apply_timer.stop()
+        self._restart_timer.stop()
+        if self._batches is not None:
+            self.task_scheduler.cancel("highlight")
+            self._batches = None
+
+    def is_busy(self) -> bool:
+        """Проверяет, идёт ли ещё фоновая разметка."""
+        return self._batches is not None or self._awaiting_text or bool(self._pending)
+
+    def _start_worker(self, first_line: int, state: int):
+        """Запускает задачу разметки по снимку текста начиная со строки ``first_line``.
+
+        Задача стартует, когда текст получен; если разметку за это время
+        остановили, запуск пропускается.
+        """
+        generation = self._generation
+
+        def launch(text):
+            if generation != self._generation or self._batches is not None:
+                return
+            self._awaiting_text = False
+            batches = HighlightBatches(self.batch_ready.emit)
+            self._batches = batches
+            finished = lambda *_: self._on_task_finished(batches)
+            self.task_scheduler.submit("highlight", highlight_text, text, batches, first_line, state,
+                                       on_result=finished, on_error=finished, on_cancelled=finished)
+
+        self._awaiting_text = True
+        self._text_request(launch)
+
+    def _on_task_finished(self, batches):
+        """Забывает завершившуюся задачу текущего поколения."""
+        if self._batches is batches:
+            self._batches = None
+
+    def _restart_worker(self):
+        """Продолжает фоновую разметку после правок с первой неразмеченной строки."""
+        if self.mode != self.BACKGROUND:
+            return
+        self.stop()
+        block = self.editor.document().findBlockByNumber(self._frontier)
+        if not block.isValid():
+            return
+        state = block.previous().userState() if block.previous().isValid() else TEXT
+        self._start_worker(self._frontier, state if state != -1 else TEXT)
+
+    def _on_batch_ready(self, batches, first_line: int, results):
+        """Ставит пачку результатов текущей задачи в очередь на применение."""
+        if batches is not self._batches:
+            return
+        self._pending.append((first_line, results, batches))
+        if not self._apply_timer.isActive():
+            self._apply_timer.start(0)
+
+    def _apply_pending(self):
+        """Применяет очередь результатов порциями, чтобы не блокировать интерфейс."""
+        deadline = time.perf_counter() + _SLICE_SECONDS
+        document = self.editor.document()
+        while self._pending:
+            first_line, results, batches = self._pending[0]
+            block = document.findBlockByNumber(first_line)
+            done = 0
+            first_block = block
+            last_block = block
+            for spans, state in results:
+                if not block.isValid():
+                    break
+                self._apply_block(block, spans, state)
+                last_block = block
+                block = block.next()
+                done += 1
+                if done % 64 == 0 and time.perf_counter() > deadline:
+                    break
+            self._mark_dirty(first_block, last_block)
+            self._frontier = first_line + done
+            if done < len(results) and block.isValid():
+                # Время порции вышло: остаток пачки применится на следующем шаге
+                self._pending[0] = (first_line + done, results[done:], batches)
+                self._apply_timer.start(0)
+                return
+            self._pending.pop(0)
+            batches.batch_applied()
+            if time.perf_counter() > deadline:
+                break
+        if self._pending:
+            self._apply_timer.start(0)
+
+    def _apply_block(self, block, spans, state: int):
+        """Задаёт форматы блока и запоминает состояние автомата в его конце."""
+        block.layout().setFormats(self.highlighter.format_ranges(block.text(), spans))
+        block.setUserState(state)
+
+    def _mark_dirty(self, first_block, last_block):
+        """Просит редактор перерисовать диапазон блоков с новыми форматами."""
+        if not first_block.isValid():
+            return
+        start = first_block.position()
+        end = last_block.position() + last_block.length()
+        self.editor.document().markContentsDirty(start, end - start)
+
+    def _visible_blocks(self):
+        """Возвращает первый и последний видимые блоки редактора."""
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).block()
+        last = self.editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+        return first, last
+
+    def _highlight_viewport(self, *_, force=False):
+        """Сразу размечает видимые, ещё не размеченные строки.
+
+        Размечается не больше ``_SYNC_CHARS`` символов: строки дальше первой
+        не уместившейся остаются фоновой задаче.
+        """
+        if self.mode != self.BACKGROUND:
+            return
+        first, last = self._visible_blocks()
+        if not force:
+            # Уже размеченные строки в начале видимой области пропускаем
+            while first.isValid() and first.userState() != -1 and first != last:
+                first = first.next()
+            if first.userState() != -1:
+                return
+        prev = first.previous()
+        state = prev.userState() if prev.isValid() else TEXT
+        block = first
+        end_block = None
+        stop = last.next()
+        chars = _SYNC_CHARS
+        while block.isValid() and block != stop and block.length() <= chars:
+            chars -= block.length()
+            spans, state = tokenize_block(block.text(), state if state != -1 else TEXT)
+            self._apply_block(block, spans, state)
+            end_block = block
+            block = block.next()
+        if end_block is not None:
+            self._mark_dirty(first, end_block)
+
+    def _on_contents_change(self, position: int, removed: int, added: int):
+        """Переразмечает строки, задетые правкой, пока состояние не сойдётся."""
+        if self.mode != self.BACKGROUND:
+            return
+        document = self.editor.document()
+        block = document.findBlock(position)
+        last = document.findBlock(position + added)
+        if block.blockNumber() < self._frontier:
+            # Правка в уже размеченной части сдвигает границу фоновой разметки
+            self._frontier = max(block.blockNumber(), self._frontier + document.blockCount() - self._block_count)
+        self._block_count = document.blockCount()
+        prev = block.previous()
+        state = prev.userState() if prev.isValid() else TEXT
+        first = block
+        end_block = None
+        budget = _EDIT_BLOCK_BUDGET
+        chars = _SYNC_CHARS
+        while block.isValid() and budget:
+            if block.length() > chars:
+                # Слишком длинная строка: её разметит фоновая задача
+                budget = 0
+                break
+            chars -= block.length()
+            old_state = block.userState()
+            spans, state = tokenize_block(block.text(), state if state != -1 else TEXT)
+            self._apply_block(block, spans, state)
+            past_edit = block.blockNumber() >= last.blockNumber()
+            end_block = block
+            block = block.next()
+            budget -= 1
+            if past_edit and state == old_state:
+                break
+        if end_block is not None:
+            self._mark_dirty(first, end_block)
+        if self.is_busy() or not budget:
+            # Снимок текста у фоновой задачи устарел: продолжим с новой границы
+            if not budget:
+                self._frontier = min(self._frontier, block.blockNumber())
+            self.stop()
+            self._restart_timer.start()
@@ -0,0 +1,756 @@
+"""Режим больших файлов: просмотр и правка без загрузки текста в редактор.
+
+Файл не загружается в редактор: ``LargeFile`` отображает его в память и в
+фоне строит индекс строк и скелет дерева (см. ``model.large_file``),
+пополняя их по ходу просмотра файла. ``LargeFileView`` рисует только
+видимые строки, читая их прямо из отображения, поэтому прокрутка и
+переход к строке не зависят от размера файла. ``SkeletonTreeModel``
+показывает скелет в том же ``QTreeView``, что и обычное дерево.
+
+Когда индекс строк построен, файл можно править: правки хранит таблица
+кусков (``model.piece_table``) поверх отображения, а сохранение пишет
+текст порциями во временный файл рядом и заменяет им исходный.
+
+С кэшем индексов (``model.index_cache``) индекс строк и скелет
+неизменившегося файла восстанавливаются сразу при открытии; править файл
+можно после того, как фоновая задача сверит хеш содержимого с записью.
+Построенные заново индексы сохраняются в кэш.
+"""
+
+import mmap
+import os
+import shutil
+import tempfile
+from bisect import bisect_left
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, QObject, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QFontMetrics, QPainter, QPalette
+from PyQt5.QtWidgets import QAbstractScrollArea, QApplication
+from model.index_cache import LARGE, new_digest
+from model.large_file import LineIndex, Skeleton, TagScanner, read_line, start_tag_attributes
+from model.piece_table import SAVE_CHUNK, PieceTable
+from threads.large_file_scanner import cache_indexes, count_file_lines, hash_file, scan_file_tags
+from ui.xml_tree_model import XmlTreeModel, format_attributes
+
+# Наибольшая длина содержимого элемента, показываемого в колонке значения, байтов
+_VALUE_BYTES = 1024
+# Ширина табуляции в просмотре, символов
+_TAB_WIDTH = 4
+
+
+class LargeFile(QObject):
+    """Большой файл, отображённый в память через ``mmap``.
+
+    ``lines`` — индекс строк (``LineIndex``), ``model`` — модель скелета
+    дерева; оба пополняются фоновыми задачами, пока файл не просмотрен.
+    ``scanned_to`` — позиция, до которой узлы скелета уже в модели (сам
+    просмотр тегов в это время может уйти дальше в фоновой задаче).
+    ``buffer`` — текст с правками (``PieceTable``); он создаётся, когда
+    индекс строк построен, до этого файл только просматривается. Скелет
+    дерева описывает файл на момент открытия: его позиции переводятся в
+    позиции текста через ``from_original``. ``cache`` — кэш индексов
+    (``IndexCache``) или None.
+
+    Сигналы:
+    - indexed(): индекс строк пополнен
+    - scanned(): скелет дерева пополнен
+    - changed(): текст изменён правкой, отменой или повтором
+    - failed(message): ошибка чтения файла
+    """
+    indexed = pyqtSignal()
+    scanned = pyqtSignal()
+    changed = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, task_scheduler, max_depth=3, cache=None, parent=None):
+        """Принимает пул фоновых задач, глубину скелета дерева и кэш индексов."""
+        super().__init__(parent)
+        self.task_scheduler = task_scheduler
+        self.max_depth = max_depth
+        self.cache = cache
+        self.path = None
+        self.data = None
+        self.lines = None
+        self.scanner = None
+        self.scanned_to = 0
+        self.buffer = None
+        self._file = None
+        self._stat = None
+        # Хеш содержимого, накапливаемый подсчётом строк (для записи в кэш)
+        self._digest = None
+        self.model = SkeletonTreeModel(self)
+
+    @property
+    def is_open(self) -> bool:
+        """Проверяет, открыт ли файл."""
+        return self.data is not None
+
+    @property
+    def size(self) -> int:
+        """Размер текста в байтах."""
+        if self.buffer is not None:
+            return len(self.buffer)
+        return len(self.data) if self.data is not None else 0
+
+    @property
+    def editable(self) -> bool:
+        """Проверяет, можно ли править текст (индекс строк построен)."""
+        return self.buffer is not None
+
+    @property
+    def line_count(self) -> int:
+        """Число строк текста (в просмотренной части, пока индекс строится)."""
+        if self.buffer is not None:
+            return self.buffer.line_count
+        return self.lines.line_count if self.lines is not None else 1
+
+    @property
+    def scan_complete(self) -> bool:
+        """Проверяет, закончено ли построение скелета."""
+        return self.data is not None and self.scanned_to >= len(self.data)
+
+    def open(self, path: str, use_cache: bool = True):
+        """Открывает файл и начинает построение индексов; ошибку ввода-вывода выбрасывает.
+
+        Индексы неизменившегося файла берутся из кэша, если ``use_cache``.
+        """
+        self.close()
+        file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._stat = os.fstat(file.fileno())
+        except (OSError, ValueError):
+            file.close()
+            self.data = None
+            raise
+        self._file = file
+        self.path = path
+        if use_cache and self._restore_indexes():
+            return
+        self.lines = LineIndex(len(self.data))
+        self.scanner = TagScanner(self.max_depth)
+        self.scanned_to = 0
+        self._digest = new_digest() if self.cache is not None else None
+        self._index_lines()
+        self._scan_tags()
+
+    def close(self):
+        """Прекращает построение индексов и закрывает файл."""
+        self.task_scheduler.cancel("large_lines")
+        self.task_scheduler.cancel("large_tags")
+        self.task_scheduler.cancel("large_verify")
+        self.model.reset()
+        if self.data is not None:
+            self.data.close()
+            self._file.close()
+        self.data = self._file = self.path = self.lines = self.scanner = self.buffer = None
+        self._stat = self._digest = None
+
+    def read_line(self, line: int):
+        """Возвращает (начало, байты строки без перевода, обрезана ли строка)."""
+        if self.buffer is not None:
+            return self.buffer.read_line(line)
+        return read_line(self.data, self.lines, line)
+
+    def line_of(self, offset: int):
+        """Возвращает номер строки с позицией ``offset`` (или None, если она ещё не просмотрена)."""
+        if self.buffer is not None:
+            return self.buffer.line_of(offset)
+        return self.lines.line_of(self.data, offset)
+
+    def line_start(self, line: int) -> int:
+        """Возвращает позицию начала строки ``line``."""
+        if self.buffer is not None:
+            return self.buffer.line_start(line)
+        return self.lines.line_start(self.data, line)
+
+    def from_original(self, offset: int):
+        """Переводит позицию исходного файла в позицию текста (None, если участок удалён)."""
+        return self.buffer.from_original(offset) if self.buffer is not None else offset
+
+    def edit(self, start: int, end: int, data: bytes):
+        """Заменяет участок [start, end) текста байтами ``data``."""
+        self.buffer.replace(start, end, data)
+        self.changed.emit()
+
+    def undo(self) -> bool:
+        """Отменяет последнюю правку."""
+        if self.buffer is None or not self.buffer.undo():
+            return False
+        self.changed.emit()
+        return True
+
+    def redo(self) -> bool:
+        """Повторяет отменённую правку."""
+        if self.buffer is None or not self.buffer.redo():
+            return False
+        self.changed.emit()
+        return True
+
+    def save(self, path: str):
+        """Записывает текст в ``path`` и открывает сохранённый файл заново.
+
+        Текст пишется порциями во временный файл в той же папке, который
+        затем заменяет ``path``; при ошибке исходный файл не меняется.
+        Ошибку ввода-вывода выбрасывает.
+        """
+        path = os.path.abspath(path)
+        handle, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in self._chunks():
+                    file.write(chunk)
+            if os.path.exists(path):
+                shutil.copymode(path, temp_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        # Windows не даёт заменить файл, отображённый в память: отображение
+        # закрывается на время замены, а если она не удалась, открывается снова
+        remap = self.path is not None and os.path.abspath(self.path) == path
+        if remap:
+            self._unmap()
+        try:
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if remap:
+                self._remap()
+            raise
+        self.open(path)
+
+    def _unmap(self):
+        """Закрывает отображение файла, не трогая индексы и правки."""
+        self.data.close()
+        self._file.close()
+        self.data = self._file = None
+
+    def _remap(self):
+        """Отображает неизменившийся файл заново после ``_unmap``.
+
+        Куски исходного файла в таблице правок ссылаются на новое
+        отображение. Если файл не открылся, он закрывается совсем.
+        """
+        try:
+            file = open(self.path, 'rb')
+        except OSError:
+            self.close()
+            return
+        try:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            file.close()
+            self.close()
+            return
+        self._file = file
+        if self.buffer is not None:
+            self.buffer.original = self.data
+
+    def _chunks(self):
+        """Выдаёт текст порциями для записи в файл."""
+        if self.buffer is not None:
+            yield from self.buffer.chunks()
+            return
+        for pos in range(0, len(self.data), SAVE_CHUNK):
+            yield self.data[pos:pos + SAVE_CHUNK]
+
+    def _restore_indexes(self) -> bool:
+        """Берёт индекс строк и скелет из кэша и запускает проверку хеша файла."""
+        header = self.cache.lookup(self.path, LARGE) if self.cache is not None else None
+        restored = self.cache.load_large(self.path, header) if header is not None else None
+        if restored is None or restored[1].max_depth != self.max_depth:
+            return False
+        self.lines, self.scanner, skeleton = restored
+        self.scanned_to = self.scanner.position
+        self.model.reset(skeleton)
+        self.task_scheduler.submit("large_verify", hash_file, self.path,
+                                   on_result=lambda digest: self._on_verified(header["hash"], digest),
+                                   on_error=self._on_error)
+        return True
+
+    def _on_verified(self, expected: str, digest: str):
+        """Разрешает правку, если содержимое файла совпало с записью кэша, иначе строит индексы заново."""
+        if digest == expected:
+            self.buffer = PieceTable(self.data, self.lines)
+        else:
+            # Файл изменён без смены размера и времени: запись кэша не годится
+            self.cache.remove(self.path, LARGE)
+            self.open(self.path, use_cache=False)
+        self.indexed.emit()
+        self.scanned.emit()
+
+    def _index_lines(self):
+        """Считает строки следующего участка файла в фоне."""
+        self.task_scheduler.submit("large_lines", count_file_lines, self.path, self.lines.indexed,
+                                   self.lines.block_size, self._digest,
+                                   on_result=self._on_lines, on_error=self._on_error)
+
+    def _on_lines(self, counts):
+        """Пополняет индекс строк и продолжает построение."""
+        self.lines.extend(counts)
+        if self.lines.complete:
+            self.buffer = PieceTable(self.data, self.lines)
+            self._cache_indexes()
+        else:
+            self._index_lines()
+        self.indexed.emit()
+
+    def _scan_tags(self):
+        """Просматривает теги следующего участка файла в фоне."""
+        self.task_scheduler.submit("large_tags", scan_file_tags, self.path, self.scanner,
+                                   on_result=self._on_tags, on_error=self._on_error)
+
+    def _on_tags(self, result):
+        """Пополняет скелет дерева и продолжает просмотр."""
+        self.scanner, nodes, closed = result
+        self.scanned_to = self.scanner.position
+        self.model.append(nodes, closed)
+        self.scanned.emit()
+        if self.scan_complete:
+            self._cache_indexes()
+        else:
+            self._scan_tags()
+
+    def _cache_indexes(self):
+        """Сохраняет в кэш индексы, когда построены и индекс строк, и скелет."""
+        if self._digest is None or not (self.lines.complete and self.scan_complete):
+            return
+        digest, self._digest = self._digest.hexdigest(), None
+        self.task_scheduler.submit("large_cache", cache_indexes, self.cache, self.path, self._stat, digest,
+                                   self.lines, self.scanner, self.model.skeleton)
+
+    def _on_error(self, error):
+        """Сообщает об ошибке фоновой задачи."""
+        self.failed.emit(str(error))
+
+
+class SkeletonTreeModel(QAbstractItemModel):
+    """Модель «Элемент / Значение / Атрибуты» поверх скелета большого файла.
+
+    Имя, значение и атрибуты читаются из файла только для строк, которые
+    запрашивает представление. Модель только для чтения.
+    """
+    HEADERS = XmlTreeModel.HEADERS
+
+    def __init__(self, large_file):
+        """Привязывает модель к открытому файлу."""
+        super().__init__(large_file)
+        self.large_file = large_file
+        self.skeleton = Skeleton()
+
+    def reset(self, skeleton=None):
+        """Очищает модель или показывает готовый скелет (например, из кэша)."""
+        self.beginResetModel()
+        self.skeleton = skeleton if skeleton is not None else Skeleton()
+        self.endResetModel()
+
+    def append(self, nodes, closed):
+        """Добавляет узлы и концы элементов, найденные очередной задачей."""
+        skeleton = self.skeleton
+        first_new = nodes[0][0] if nodes else len(skeleton)
+        skeleton.add(nodes)
+        skeleton.close(closed)
+        groups = {}
+        for node, parent, *_ in nodes:
+            groups.setdefault(parent, []).append(node)
+        for parent, ids in groups.items():
+            if parent >= first_new:
+                # Родитель ещё не показан: о его детях представление узнает вместе с ним
+                skeleton.attach(parent, ids)
+        for parent, ids in groups.items():
+            if parent < first_new:
+                row = len(skeleton.children(parent))
+                self.beginInsertRows(self.index_for_node(parent), row, row + len(ids) - 1)
+                skeleton.attach(parent, ids)
+                self.endInsertRows()
+        for node, _ in closed:
+            if node < first_new:
+                # Значение элемента стало известно после его появления в дереве
+                index = self.index_for_node(node, 1)
+                self.dataChanged.emit(index, index)
+
+    def node_id(self, index: QModelIndex):
+        """Возвращает номер узла для индекса модели (или None)."""
+        return index.internalId() if index.isValid() else None
+
+    def index_for_node(self, node_id: int, column: int = 0) -> QModelIndex:
+        """Возвращает индекс модели для номера узла (-1 — корень)."""
+        if node_id == -1:
+            return QModelIndex()
+        return self.createIndex(self._row_of(node_id), column, node_id)
+
+    def start_tag_span(self, node_id: int):
+        """Возвращает (начало, конец) открывающего тега в байтах файла."""
+        return self.skeleton.start[node_id], self.skeleton.open_end[node_id]
+
+    def _row_of(self, node_id: int) -> int:
+        """Возвращает номер строки узла среди его соседей."""
+        return bisect_left(self.skeleton.children(self.skeleton.parent[node_id]), node_id)
+
+    def index(self, row, column, parent=QModelIndex()):
+        """Возвращает индекс дочерней строки ``row`` узла ``parent``."""
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        parent_id = parent.internalId() if parent.isValid() else -1
+        return self.createIndex(row, column, self.skeleton.children(parent_id)[row])
+
+    def parent(self, index):
+        """Возвращает индекс родителя."""
+        if not index.isValid():
+            return QModelIndex()
+        return self.index_for_node(self.skeleton.parent[index.internalId()])
+
+    def rowCount(self, parent=QModelIndex()):
+        """Возвращает число дочерних строк."""
+        if parent.column() > 0:
+            return 0
+        return len(self.skeleton.children(parent.internalId() if parent.isValid() else -1))
+
+    def columnCount(self, parent=QModelIndex()):
+        """Возвращает число колонок."""
+        return len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Возвращает имя, значение или атрибуты элемента, читая их из файла."""
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        node_id = index.internalId()
+        column = index.column()
+        if column == 0:
+            icon = "📦" if self.skeleton.children(node_id) else "📄"
+            return f"{icon} {self.skeleton.tag(node_id)}"
+        if column == 1:
+            return self._value(node_id)
+        start, open_end = self.start_tag_span(node_id)
+        return format_attributes(start_tag_attributes(self.large_file.data[start:open_end]))
+
+    def _value(self, node_id: int) -> str:
+        """Возвращает текст короткого элемента без вложенных элементов (иначе пустую строку)."""
+        skeleton = self.skeleton
+        open_end, end = skeleton.open_end[node_id], skeleton.end[node_id]
+        if end == -1 or end - open_end > _VALUE_BYTES or skeleton.children(node_id):
+            return ""
+        content = self.large_file.data[open_end:end]
+        content = content[:content.rfind(b'</')]
+        if b'<' in content:
+            return ""
+        return content.decode('utf-8', 'replace').strip()
+
+    def flags(self, index):
+        """Разрешает только выбор строк."""
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Возвращает заголовки колонок."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+
+class LargeFileView(QAbstractScrollArea):
+    """Просмотр и правка большого файла: рисуются только видимые строки.
+
+    Вертикальная прокрутка идёт по номерам строк из индекса строк и
+    расширяется по мере его построения. Строки длиннее ``MAX_LINE_BYTES``
+    показываются обрезанными. Когда текст можно править, в текущей строке
+    показывается курсор: ``column`` — его смещение в байтах строки; набор,
+    удаление, вставка и отмена передаются в ``LargeFile``.
+
+    Сигналы:
+    - cursor_moved(): изменилась позиция курсора
+    """
+    cursor_moved = pyqtSignal()
+
+    def __init__(self, large_file, parent=None):
+        """Привязывает просмотр к открытому файлу."""
+        super().__init__(parent)
+        self.large_file = large_file
+        self.current_line = 0
+        self.column = 0
+        self._selection = None  # (начало, конец) выделения в байтах
+        self._pending = None  # выделение в ещё не просмотренной части файла
+        self._widest = 0  # ширина самой длинной показанной строки, символов
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.setAttribute(Qt.WA_InputMethodEnabled)
+        large_file.indexed.connect(self._on_indexed)
+        large_file.changed.connect(self._on_changed)
+
+    def reset(self):
+        """Переходит к началу файла и сбрасывает выделение."""
+        self.current_line = self.column = 0
+        self._selection = self._pending = None
+        self._widest = 0
+        self.verticalScrollBar().setValue(0)
+        self.horizontalScrollBar().setValue(0)
+        self._update_scrollbars()
+        self.viewport().update()
+
+    @property
+    def position(self) -> int:
+        """Позиция курсора в байтах текста."""
+        return self.large_file.line_start(self.current_line) + self.column
+
+    def select_span(self, start: int, end: int) -> bool:
+        """Выделяет участок [start, end) текста и прокручивает к нему.
+
+        Если индекс строк ещё не дошёл до участка, выделение выполняется,
+        когда дойдёт; тогда возвращается False.
+        """
+        large_file = self.large_file
+        line = large_file.line_of(start)
+        if line is None or line >= large_file.line_count:
+            self._pending = (start, end)
+            return False
+        self._pending = None
+        self._selection = (start, end)
+        line_start, raw, _ = large_file.read_line(line)
+        self.column = min(start - line_start, len(raw))
+        self.go_to_line(line)
+        column = self._column(raw, self.column)
+        bar = self.horizontalScrollBar()
+        if not bar.value() <= column < bar.value() + bar.pageStep():
+            bar.setValue(max(0, column - bar.pageStep() // 4))
+        return True
+
+    def go_to_line(self, line: int):
+        """Делает строку ``line`` текущей и прокручивает к ней."""
+        self.current_line = max(0, min(line, self.large_file.line_count - 1))
+        bar = self.verticalScrollBar()
+        rows = self._visible_rows()
+        if not bar.value() <= self.current_line < bar.value() + rows:
+            bar.setValue(self.current_line - rows // 3)
+        self.viewport().update()
+        self.cursor_moved.emit()
+
+    def go_to_position(self, position: int):
+        """Ставит курсор в позицию ``position`` текста."""
+        line = self.large_file.line_of(position)
+        self.column = position - self.large_file.line_start(line)
+        self.go_to_line(line)
+
+    def _on_indexed(self):
+        """Расширяет прокрутку и выполняет отложенное выделение."""
+        self._update_scrollbars()
+        if self._pending is not None:
+            self.select_span(*self._pending)
+        self.viewport().update()
+
+    def _on_changed(self):
+        """Пересчитывает прокрутку после правки текста."""
+        self._selection = None
+        self._update_scrollbars()
+        self.viewport().update()
+
+    def _edit(self, start: int, end: int, data: bytes):
+        """Заменяет участок текста и ставит курсор после вставленного."""
+        self.large_file.edit(start, end, data)
+        self.go_to_position(start + len(data))
+
+    def _metrics(self) -> QFontMetrics:
+        """Возвращает метрики шрифта просмотра."""
+        return QFontMetrics(self.font())
+
+    def _visible_rows(self) -> int:
+        """Возвращает число строк, умещающихся в видимой части."""
+        return max(1, self.viewport().height() // self._metrics().height())
+
+    def _gutter_width(self) -> int:
+        """Возвращает ширину колонки номеров строк."""
+        digits = len(str(self.large_file.line_count))
+        return self._metrics().horizontalAdvance("9") * max(digits, 3) + 12
+
+    def _update_scrollbars(self):
+        """Задаёт диапазоны прокрутки по числу строк и ширине показанных строк."""
+        rows = self._visible_rows()
+        vertical = self.verticalScrollBar()
+        vertical.setRange(0, max(0, self.large_file.line_count - rows))
+        vertical.setPageStep(rows)
+        columns = max(1, (self.viewport().width() - self._gutter_width()) // self._metrics().horizontalAdvance(" "))
+        horizontal = self.horizontalScrollBar()
+        horizontal.setRange(0, max(0, self._widest - columns))
+        horizontal.setPageStep(columns)
+
+    @staticmethod
+    def _column(raw: bytes, offset: int) -> int:
+        """Возвращает номер колонки для смещения ``offset`` в байтах строки ``raw``."""
+        return len(raw[:max(0, offset)].decode('utf-8', 'replace').expandtabs(_TAB_WIDTH))
+
+    @staticmethod
+    def _offset_at(raw: bytes, column: int) -> int:
+        """Возвращает смещение в байтах строки ``raw`` ближайшего к колонке ``column`` символа."""
+        offset = current = 0
+        while offset < len(raw) and current < column:
+            current = (current // _TAB_WIDTH + 1) * _TAB_WIDTH if raw[offset] == 9 else current + 1
+            offset = _next_char(raw, offset)
+        return offset
+
+    def resizeEvent(self, event):
+        """Пересчитывает прокрутку под новый размер."""
+        super().resizeEvent(event)
+        self._update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        """Перерисовывает видимую часть после прокрутки."""
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        """Рисует номера и текст видимых строк и курсор."""
+        painter = QPainter(self.viewport())
+        palette = self.palette()
+        rect = self.viewport().rect()
+        painter.fillRect(rect, palette.color(QPalette.Base))
+        large_file = self.large_file
+        if not large_file.is_open:
+            return
+        metrics = self._metrics()
+        height, ascent, char_width = metrics.height(), metrics.ascent(), metrics.horizontalAdvance(" ")
+        gutter = self._gutter_width()
+        painter.fillRect(0, 0, gutter - 4, rect.height(), QColor(240, 240, 240))
+        first = self.verticalScrollBar().value()
+        left = self.horizontalScrollBar().value()
+        columns = (rect.width() - gutter) // char_width + 2
+        line_count = large_file.line_count
+        widest = self._widest
+        for row in range(self._visible_rows() + 1):
+            line = first + row
+            if line >= line_count:
+                break
+            start, raw, _ = large_file.read_line(line)
+            text = raw.decode('utf-8', 'replace').expandtabs(_TAB_WIDTH)
+            widest = max(widest, len(text))
+            y = row * height
+            if line == self.current_line:
+                painter.fillRect(gutter - 4, y, rect.width(), height, QColor(232, 242, 254))
+            selection = self._selection
+            if selection is not None and selection[0] <= start + len(raw) and selection[1] > start:
+                first_column = self._column(raw, selection[0] - start)
+                last_column = self._column(raw, min(selection[1], start + len(raw)) - start)
+                painter.fillRect(gutter + (first_column - left) * char_width, y,
+                                 max(1, last_column - first_column) * char_width, height,
+                                 palette.color(QPalette.Highlight).lighter(160))
+            painter.setPen(QColor(128, 128, 128))
+            painter.drawText(0, y, gutter - 10, height, Qt.AlignRight | Qt.AlignVCenter, str(line + 1))
+            painter.setPen(palette.color(QPalette.Text))
+            painter.drawText(gutter, y + ascent, text[left:left + columns])
+            if line == self.current_line and large_file.editable:
+                x = gutter + (self._column(raw, self.column) - left) * char_width
+                painter.fillRect(x, y, 2, height, palette.color(QPalette.Text))
+        if widest != self._widest:
+            self._widest = widest
+            self._update_scrollbars()
+
+    def mousePressEvent(self, event):
+        """Ставит курсор в позицию под указателем."""
+        large_file = self.large_file
+        line = self.verticalScrollBar().value() + event.pos().y() // self._metrics().height()
+        if large_file.is_open and line < large_file.line_count:
+            metrics = self._metrics()
+            column = (event.pos().x() - self._gutter_width() + metrics.horizontalAdvance(" ") // 2) \
+                // metrics.horizontalAdvance(" ") + self.horizontalScrollBar().value()
+            self.column = self._offset_at(large_file.read_line(line)[1], max(0, column))
+            self.go_to_line(line)
+
+    def keyPressEvent(self, event):
+        """Перемещает курсор и передаёт правки из клавиатуры в текст.
+
+        Стрелки, страницы и Ctrl+Home/End работают и при просмотре;
+        набор, Backspace/Delete, Enter, Ctrl+V, Ctrl+Z и Ctrl+Y — когда
+        текст можно править.
+        """
+        large_file = self.large_file
+        if not large_file.is_open:
+            return super().keyPressEvent(event)
+        key, rows = event.key(), self._visible_rows()
+        control = bool(event.modifiers() & Qt.ControlModifier)
+        steps = {Qt.Key_Up: -1, Qt.Key_Down: 1, Qt.Key_PageUp: -rows, Qt.Key_PageDown: rows}
+        if key in steps:
+            line = max(0, min(self.current_line + steps[key], large_file.line_count - 1))
+            self.column = min(self.column, len(large_file.read_line(line)[1]))
+            self.go_to_line(line)
+        elif key == Qt.Key_Home and control:
+            self.column = 0
+            self.go_to_line(0)
+        elif key == Qt.Key_End and control:
+            line = large_file.line_count - 1
+            self.column = len(large_file.read_line(line)[1])
+            self.go_to_line(line)
+        elif not large_file.editable:
+            super().keyPressEvent(event)
+        elif not self._edit_key(event, key, control):
+            super().keyPressEvent(event)
+
+    def _edit_key(self, event, key, control: bool) -> bool:
+        """Выполняет перемещение в строке или правку по клавише; возвращает False для остальных."""
+        large_file = self.large_file
+        start, raw, _ = large_file.read_line(self.current_line)
+        column = min(self.column, len(raw))
+        last_line = self.current_line == large_file.line_count - 1
+        if key == Qt.Key_Left:
+            if column:
+                self.column = _prev_char(raw, column)
+                self.go_to_line(self.current_line)
+            elif self.current_line:
+                self.go_to_position(start - 1)
+        elif key == Qt.Key_Right:
+            if column < len(raw):
+                self.column = _next_char(raw, column)
+                self.go_to_line(self.current_line)
+            elif not last_line:
+                self.go_to_position(large_file.line_start(self.current_line + 1))
+        elif key == Qt.Key_Home:
+            self.column = 0
+            self.go_to_line(self.current_line)
+        elif key == Qt.Key_End:
+            self.column = len(raw)
+            self.go_to_line(self.current_line)
+        elif key == Qt.Key_Backspace:
+            if column:
+                self._edit(start + _prev_char(raw, column), start + column, b"")
+            elif self.current_line:
+                previous, previous_raw, _ = large_file.read_line(self.current_line - 1)
+                self._edit(previous + len(previous_raw), start, b"")
+        elif key == Qt.Key_Delete:
+            if column < len(raw):
+                self._edit(start + column, start + _next_char(raw, column), b"")
+            elif not last_line:
+                self._edit(start + column, large_file.line_start(self.current_line + 1), b"")
+        elif key in (Qt.Key_Return, Qt.Key_Enter):
+            self._edit(start + column, start + column, b"\n")
+        elif control and key == Qt.Key_Z:
+            self._undo_redo(large_file.redo if event.modifiers() & Qt.ShiftModifier else large_file.undo)
+        elif control and key == Qt.Key_Y:
+            self._undo_redo(large_file.redo)
+        elif control and key == Qt.Key_V:
+            text = QApplication.clipboard().text()
+            if text:
+                self._edit(start + column, start + column, text.replace("\r\n", "\n").encode('utf-8'))
+        elif event.text() and event.text().isprintable() and not control:
+            self._edit(start + column, start + column, event.text().encode('utf-8'))
+        else:
+            return False
+        return True
+
+    def _undo_redo(self, action):
+        """Отменяет или повторяет правку, оставляя курсор в пределах текста."""
+        if action():
+            line = min(self.current_line, self.large_file.line_count - 1)
+            self.column = min(self.column, len(self.large_file.read_line(line)[1]))
+            self.go_to_line(line)
+
+
+def _next_char(raw: bytes, offset: int) -> int:
+    """Возвращает смещение следующего символа UTF-8 в ``raw``."""
+    offset += 1
+    while offset < len(raw) and raw[offset] & 0xC0 == 0x80:
+        offset += 1
+    return offset
+
+
+def _prev_char(raw: bytes, offset: int) -> int:
+    """Возвращает смещение предыдущего символа UTF-8 в ``raw``."""
+    offset -= 1
+    while offset > 0 and raw[offset] & 0xC0 == 0x80:
+        offset -= 1
+    return offset
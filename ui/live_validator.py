@@ -0,0 +1,135 @@
+"""Проверка корректности XML «на лету», после паузы в наборе текста.
+
+После каждой правки запускается таймер; когда пользователь перестаёт
+печатать, текст текущей ревизии проверяется задачей ``TaskScheduler``,
+а новая правка отменяет начатую проверку. Текст берётся у сервиса снимков
+асинхронно, поэтому копирование большого документа не останавливает
+интерфейс. Если правки после последнего разбора уместились в одном
+элементе, задача разбирает заново и проверяет только его, а полученный
+документ становится документом ревизии. Ошибка отмечается в редакторе
+дополнительным выделением.
+"""
+
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QTextCharFormat, QTextCursor, QTextFormat
+from PyQt5.QtWidgets import QTextEdit
+from threads.xml_validator import check_edit
+from ui.extra_selections import SelectionLayers
+
+# Пауза после правки перед проверкой, мс; для больших текстов она растёт
+_DELAY_MS = 500
+# Дополнительная пауза на каждый миллион символов, мс
+_DELAY_PER_MILLION_MS = 20
+
+
+class LiveValidator(QObject):
+    """Фоновая проверка корректности XML с отметкой ошибки в редакторе.
+
+    Сигналы:
+    - started(): текст изменился, результат ожидается
+    - finished(problem): None или (строка, столбец, сообщение) первой ошибки
+    """
+    started = pyqtSignal()
+    finished = pyqtSignal(object)
+
+    def __init__(self, editor, snapshots, task_scheduler, selections=None, parent=None):
+        """Принимает редактор, сервис снимков текста, пул фоновых задач и слои выделений."""
+        super().__init__(parent)
+        self.editor = editor
+        self.selections = selections if selections is not None else SelectionLayers(editor)
+        self.snapshots = snapshots
+        self.task_scheduler = task_scheduler
+        self.problem = None
+        # Ревизия, для которой известен результат проверки (-1 — ещё нет)
+        self.checked_revision = -1
+        self._request = 0  # номер запроса текста; устаревшие ответы пропускаются
+        self._delay_timer = QTimer(self)
+        self._delay_timer.setSingleShot(True)
+        self._delay_timer.timeout.connect(self.validate_now)
+        editor.document().contentsChange.connect(self._on_contents_change)
+
+    def is_current(self) -> bool:
+        """Проверяет, что результат относится к текущему тексту."""
+        return self.checked_revision == self.snapshots.revision
+
+    def validate_now(self):
+        """Запускает проверку текущей ревизии без ожидания паузы."""
+        self._delay_timer.stop()
+        self._request += 1
+        revision = self.snapshots.revision
+        if self.editor.document().isEmpty():
+            self._show_result(revision, None)
+            return
+        request = self._request
+        self.snapshots.request_text(lambda text: self._submit(request, revision, text))
+
+    def stop(self):
+        """Отменяет ожидание паузы, запрос текста и выполняющуюся проверку."""
+        self._delay_timer.stop()
+        self._request += 1
+        self.task_scheduler.cancel("validate")
+
+    def _on_contents_change(self, position: int, removed: int, added: int):
+        """Откладывает проверку до паузы в наборе и отменяет устаревшую."""
+        self.stop()
+        self.started.emit()
+        length = self.editor.document().characterCount()
+        self._delay_timer.start(_DELAY_MS + length // 1_000_000 * _DELAY_PER_MILLION_MS)
+
+    def _submit(self, request: int, revision: int, text: str):
+        """Запускает задачу проверки текста ревизии ``revision``."""
+        if request != self._request:
+            return
+        base = self.snapshots.edit_base()
+        # Проверить только изменённый элемент можно, если прежний текст был корректен
+        base_valid = (base is not None and self.problem is None
+                      and self.checked_revision == base[0].version)
+
+        def done(result):
+            document, problem = result
+            if document is not None:
+                self.snapshots.adopt(revision, text, document)
+            self._show_result(revision, problem)
+
+        self.task_scheduler.submit("validate", check_edit, text, base, base_valid, revision,
+                                   on_result=done, version=revision)
+
+    def _show_result(self, revision: int, problem):
+        """Запоминает результат и отмечает ошибку в редакторе."""
+        self.problem = problem
+        self.checked_revision = revision
+        self.selections.set("validation", self._error_selections(problem))
+        self.finished.emit(problem)
+
+    def error_position(self):
+        """Возвращает позицию ошибки в документе или None."""
+        if self.problem is None:
+            return None
+        line, column, _ = self.problem
+        block = self.editor.document().findBlockByNumber(line - 1)
+        if not block.isValid():
+            return None
+        # Символы вне BMP занимают в документе две позиции
+        prefix = block.text()[:column]
+        column += sum(1 for ch in prefix if ch > "\uffff")
+        return block.position() + min(column, block.length() - 1)
+
+    def _error_selections(self, problem):
+        """Строит выделения строки и символа с ошибкой."""
+        position = self.error_position() if problem is not None else None
+        if position is None:
+            return []
+        line = QTextEdit.ExtraSelection()
+        line.format.setBackground(QColor(255, 230, 230))
+        line.format.setProperty(QTextFormat.FullWidthSelection, True)
+        line.cursor = QTextCursor(self.editor.document())
+        line.cursor.setPosition(position)
+
+        char = QTextEdit.ExtraSelection()
+        char.format.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+        char.format.setUnderlineColor(Qt.red)
+        char.format.setToolTip(problem[2])
+        char.cursor = QTextCursor(self.editor.document())
+        char.cursor.setPosition(position)
+        char.cursor.movePosition(QTextCursor.NextCharacter, QTextCursor.KeepAnchor)
+        return [line, char]
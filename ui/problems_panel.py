@@ -0,0 +1,87 @@
+"""Панель со списком ошибок разбора XML.
+
+Разбор с восстановлением после ошибок находит сразу все нарушения
+структуры; они показываются в прикрепляемой панели вместо модального
+окна. Модель списка виртуальная: строки таблицы берутся прямо из списка
+ошибок документа, поэтому даже тысячи ошибок не создают объектов на строку.
+"""
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, pyqtSignal
+from PyQt5.QtWidgets import QAbstractItemView, QDockWidget, QHeaderView, QTableView
+
+
+class ProblemsModel(QAbstractTableModel):
+    """Таблица ошибок (позиция, строка, столбец, сообщение) документа."""
+    HEADERS = ["Строка", "Столбец", "Сообщение"]
+
+    def __init__(self, parent=None):
+        """Создаёт пустую модель."""
+        super().__init__(parent)
+        self._problems = []
+
+    def set_problems(self, problems):
+        """Заменяет список ошибок."""
+        self.beginResetModel()
+        self._problems = problems
+        self.endResetModel()
+
+    def position(self, row: int) -> int:
+        """Возвращает позицию ошибки из строки ``row`` в тексте."""
+        return self._problems[row][0]
+
+    def rowCount(self, parent=QModelIndex()):
+        """Возвращает число ошибок."""
+        return 0 if parent.isValid() else len(self._problems)
+
+    def columnCount(self, parent=QModelIndex()):
+        """Возвращает число колонок."""
+        return len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Возвращает строку, столбец (с единицы) или текст ошибки."""
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        _, line, column, message = self._problems[index.row()]
+        return (line, column + 1, message)[index.column()]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Возвращает заголовки колонок."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+
+class ProblemsPanel(QDockWidget):
+    """Прикрепляемая панель ошибок; выбор строки переводит к месту ошибки.
+
+    Сигналы:
+    - problem_activated(position): позиция выбранной ошибки в тексте
+    """
+    problem_activated = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        """Создаёт таблицу ошибок внутри панели."""
+        super().__init__("Ошибки XML", parent)
+        self.setObjectName("problems_panel")
+        self.model = ProblemsModel(self)
+        self.view = QTableView(self)
+        self.view.setModel(self.model)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.verticalHeader().hide()
+        # Высота строк не замеряется для каждой строки
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.activated.connect(self._on_activated)
+        self.view.clicked.connect(self._on_activated)
+        self.setWidget(self.view)
+
+    def set_problems(self, problems):
+        """Показывает список ошибок; в заголовке панели — их число."""
+        self.model.set_problems(problems)
+        self.setWindowTitle(f"Ошибки XML ({len(problems)})" if problems else "Ошибки XML")
+
+    def _on_activated(self, index):
+        """Сообщает позицию ошибки из выбранной строки."""
+        if index.isValid():
+            self.problem_activated.emit(self.model.position(index.row()))
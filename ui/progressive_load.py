@@ -0,0 +1,112 @@
+"""Вставка загруженного текста в редактор порциями.
+
+``setPlainText`` большого текста останавливает интерфейс на всё время
+вёрстки документа (десятки секунд на сотню мегабайт). ``ProgressiveLoad``
+вставляет текст в конец документа порциями по таймеру: первая страница
+видна сразу, а дерево, строка состояния и прокрутка доступны, пока
+вставляется остальное.
+
+Порции вставляются при заблокированных сигналах документа: для
+обработчиков ``contentsChange`` (снимки, статистика, подсветка) текст
+заменяется один раз — при очистке редактора перед вставкой, — а снимок
+ревизии сразу содержит весь текст. Пока текст вставляется, редактор
+доступен только для чтения, а история отмены отключена.
+"""
+
+import time
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+
+# Время на вставку за один шаг таймера, секунд
+_SLICE_SECONDS = 0.05
+# Размер одной вставки, символов
+_CHUNK_CHARS = 1 << 16
+
+
+class ProgressiveLoad(QObject):
+    """Вставляет ``text`` в конец пустого документа редактора порциями.
+
+    ``loaded`` — число уже вставленных символов.
+
+    Сигналы:
+    - progress(percent): доля вставленного текста
+    - finished(): весь текст вставлен
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+
+    def __init__(self, editor, text: str, parent=None):
+        """Принимает редактор с пустым документом и текст для вставки."""
+        super().__init__(parent)
+        self.editor = editor
+        self.text = text
+        self.loaded = 0
+        self._read_only = editor.isReadOnly()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._step)
+
+    @property
+    def is_done(self) -> bool:
+        """Проверяет, вставлен ли весь текст."""
+        return self.loaded >= len(self.text)
+
+    def start(self):
+        """Начинает вставку со следующего шага цикла событий."""
+        self.editor.setReadOnly(True)
+        self.editor.document().setUndoRedoEnabled(False)
+        self._timer.start(0)
+
+    def complete(self):
+        """Вставляет остаток текста сразу (перед правкой, которой нужен весь текст)."""
+        if not self.is_done:
+            self._insert(len(self.text), None)
+            self._finish()
+
+    def cancel(self):
+        """Прекращает вставку (текст редактора заменяется другим)."""
+        if not self.is_done:
+            self.loaded = len(self.text)
+            self._timer.stop()
+            self._restore()
+
+    def _step(self):
+        """Вставляет очередные порции, пока не выйдет время шага."""
+        self._insert(len(self.text), time.perf_counter() + _SLICE_SECONDS)
+        if self.is_done:
+            self._finish()
+        else:
+            self.progress.emit(self.loaded * 100 // len(self.text))
+            self._timer.start(0)
+
+    def _insert(self, end: int, deadline):
+        """Вставляет порции до позиции ``end`` текста или до времени ``deadline``."""
+        document = self.editor.document()
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        first = not self.loaded
+        blocked = document.blockSignals(True)
+        try:
+            # Хотя бы одна порция за шаг, даже если время уже вышло
+            while self.loaded < end:
+                chunk = self.text[self.loaded:self.loaded + _CHUNK_CHARS]
+                cursor.insertText(chunk)
+                self.loaded += len(chunk)
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+        finally:
+            document.blockSignals(blocked)
+        if first:
+            # Курсор редактора стоял в точке вставки и ушёл в конец первой порции
+            self.editor.moveCursor(QTextCursor.Start)
+
+    def _finish(self):
+        """Возвращает редактору прежний режим и сообщает о конце вставки."""
+        self._timer.stop()
+        self._restore()
+        self.finished.emit()
+
+    def _restore(self):
+        """Включает историю отмены и прежний режим редактора."""
+        self.editor.document().setUndoRedoEnabled(True)
+        self.editor.setReadOnly(self._read_only)
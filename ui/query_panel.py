@@ -0,0 +1,224 @@
+"""Запросы XPath к документу дерева: выполнение в фоне и панель результатов.
+
+``XPathQuery`` компилирует запрос и выполняет его в фоновой задаче над
+документом, показанным в дереве. Индексы документа (имена, атрибуты,
+текст дочерних элементов) сохраняются между запросами и строятся заново
+только для новой версии документа; после перестроения дерева активный
+запрос выполняется повторно.
+
+Модель панели виртуальная: номер строки и текст открывающего тега
+вычисляются только для строк, которые показывает представление.
+"""
+
+from array import array
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QObject, Qt, pyqtSignal
+from PyQt5.QtWidgets import (QAbstractItemView, QDockWidget, QHBoxLayout, QHeaderView, QLabel, QLineEdit,
+                             QPushButton, QTableView, QVBoxLayout, QWidget)
+from model.xpath import XPathError, compile_xpath
+from threads.xpath_query import run_query
+
+# Длина показываемого текста открывающего тега, символов
+_TAG_CHARS = 200
+
+
+class XPathQuery(QObject):
+    """Активный запрос XPath и номера выбранных им элементов документа.
+
+    ``ids`` — номера элементов в ``document`` по возрастанию или None,
+    пока запрос не выполнен.
+
+    Сигналы:
+    - started(): начато выполнение запроса
+    - finished(count): результат готов
+    - failed(message): ошибка в запросе или при его выполнении
+    - document_needed(): нет разобранного документа, нужно построить дерево
+    """
+    started = pyqtSignal()
+    finished = pyqtSignal(int)
+    failed = pyqtSignal(str)
+    document_needed = pyqtSignal()
+
+    def __init__(self, editor, task_scheduler, parent=None):
+        """Принимает редактор (для номеров строк) и пул фоновых задач."""
+        super().__init__(parent)
+        self.editor = editor
+        self.task_scheduler = task_scheduler
+        self.document = None
+        self.query = None
+        self.ids = None
+        self.model = QueryResultsModel(self)
+        self._index = None
+
+    def run(self, expression: str):
+        """Компилирует и выполняет запрос ``expression``."""
+        try:
+            query = compile_xpath(expression)
+        except XPathError as error:
+            self.failed.emit(f"Позиция {error.position + 1}: {error}")
+            return
+        self.query = query
+        self._set_ids(None)
+        if self.document is None:
+            self.document_needed.emit()
+            return
+        self._start()
+
+    def set_document(self, document):
+        """Запоминает документ дерева (или None) и повторяет для него активный запрос."""
+        if document is self.document:
+            return
+        self.document = document
+        # Номера элементов относятся к прежнему документу
+        self._set_ids(None)
+        if document is None:
+            self.task_scheduler.cancel("xpath")
+        elif self.query is not None:
+            self._start()
+
+    def clear(self):
+        """Прекращает выполнение запроса и убирает результаты."""
+        self.query = None
+        self.task_scheduler.cancel("xpath")
+        self._set_ids(None)
+
+    def span(self, row: int):
+        """Возвращает (начало, конец) открывающего тега элемента из строки ``row``."""
+        return self.document.store.start_tag_span(self.ids[row])
+
+    def _start(self):
+        """Выполняет запрос над текущим документом в фоне."""
+        self.started.emit()
+        self.task_scheduler.submit("xpath", run_query, self.query, self.document, self._index,
+                                   on_result=self._on_result, on_error=self._on_error)
+
+    def _on_result(self, result):
+        """Сохраняет индекс документа и показывает выбранные элементы."""
+        index, ids = result
+        if index.document is not self.document:
+            # Пока шёл запрос, дерево перестроено: результат уже повторяется
+            return
+        self._index = index
+        self._set_ids(ids)
+        self.finished.emit(len(ids))
+
+    def _on_error(self, error):
+        """Сообщает об ошибке выполнения запроса."""
+        self._set_ids(array('i'))
+        self.failed.emit(str(error))
+
+    def _set_ids(self, ids):
+        """Заменяет список выбранных элементов."""
+        self.model.beginResetModel()
+        self.ids = ids
+        self.model.endResetModel()
+
+
+class QueryResultsModel(QAbstractTableModel):
+    """Виртуальная таблица выбранных элементов: номер строки и открывающий тег."""
+    HEADERS = ["Строка", "Элемент"]
+
+    def __init__(self, query):
+        """Привязывает модель к запросу."""
+        super().__init__(query)
+        self.query = query
+
+    def rowCount(self, parent=QModelIndex()):
+        """Возвращает число выбранных элементов."""
+        ids = self.query.ids
+        return 0 if parent.isValid() or ids is None else len(ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        """Возвращает число колонок."""
+        return len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Возвращает номер строки элемента или текст его открывающего тега."""
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        start, end = self.query.span(index.row())
+        if index.column() == 0:
+            return self.query.editor.document().findBlock(start).blockNumber() + 1
+        text = self.query.document.text[start:min(end, start + _TAG_CHARS)]
+        return " ".join(text.split()) + ("…" if end - start > _TAG_CHARS else "")
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Возвращает заголовки колонок."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+
+class QueryPanel(QDockWidget):
+    """Прикрепляемая панель запроса XPath; выбор строки переводит к элементу.
+
+    Сигналы:
+    - node_activated(node_id): номер выбранного элемента в документе запроса
+    """
+    node_activated = pyqtSignal(int)
+
+    def __init__(self, query, parent=None):
+        """Создаёт строку запроса и таблицу результатов внутри панели."""
+        super().__init__("XPath", parent)
+        self.setObjectName("query_panel")
+        self.query = query
+        widget = QWidget(self)
+        layout = QVBoxLayout(widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        row = QHBoxLayout()
+        self.input = QLineEdit()
+        self.input.setPlaceholderText("//элемент[@атрибут='значение']")
+        self.input.returnPressed.connect(self._run)
+        self.run_button = QPushButton("Найти")
+        self.run_button.clicked.connect(self._run)
+        row.addWidget(self.input)
+        row.addWidget(self.run_button)
+        layout.addLayout(row)
+        self.message = QLabel()
+        self.message.hide()
+        layout.addWidget(self.message)
+        self.view = QTableView()
+        self.view.setModel(query.model)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.verticalHeader().hide()
+        # Высота строк не замеряется для каждой строки
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.activated.connect(self._on_activated)
+        self.view.clicked.connect(self._on_activated)
+        layout.addWidget(self.view)
+        self.setWidget(widget)
+        query.started.connect(self._on_started)
+        query.finished.connect(self._on_finished)
+        query.failed.connect(self._on_failed)
+
+    def _run(self):
+        """Выполняет введённый запрос."""
+        expression = self.input.text().strip()
+        if expression:
+            self.message.hide()
+            self.query.run(expression)
+
+    def _on_started(self):
+        """Показывает в заголовке, что запрос выполняется."""
+        self.setWindowTitle("XPath: поиск…")
+
+    def _on_finished(self, count: int):
+        """Показывает в заголовке число выбранных элементов."""
+        self.setWindowTitle(f"XPath ({count})")
+
+    def _on_failed(self, message: str):
+        """Показывает ошибку запроса под строкой ввода."""
+        self.setWindowTitle("XPath")
+        self.message.setText(f"Ошибка запроса: {message}")
+        self.message.show()
+
+    def _on_activated(self, index):
+        """Сообщает номер элемента из выбранной строки."""
+        if index.isValid():
+            self.node_activated.emit(self.query.ids[index.row()])
+
+    def closeEvent(self, event):
+        """Прекращает выполнение запроса, когда панель закрыта."""
+        self.query.clear()
+        super().closeEvent(event)
@@ -0,0 +1,104 @@
+"""Упреждающее чтение недавних файлов, пока пользователь не работает.
+
+После паузы без нажатий клавиш и кнопок мыши ``RecentPrefetcher`` по
+одному читает и разбирает недавние файлы фоновой задачей с низким
+приоритетом и складывает результат в ``DocumentCache``: открытие такого
+файла не ждёт чтения и разбора. Любое действие пользователя отменяет
+начатое чтение и откладывает следующее до новой паузы. Файлы, которые
+не поместились в кэш или не прочитались, не читаются снова, пока не
+изменятся.
+"""
+
+import os
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+from threads.file_loader import prefetch_file
+
+# Пауза без действий пользователя перед упреждающим чтением, мс
+IDLE_MS = 5000
+# Пауза между чтением соседних файлов, мс
+_NEXT_MS = 100
+# События, означающие, что пользователь работает
+_ACTIVITY_EVENTS = (QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.Wheel)
+
+
+class RecentPrefetcher(QObject):
+    """Читает файлы из ``candidates()`` в кэш ``document_cache`` в паузах работы.
+
+    ``candidates`` возвращает пути в порядке важности; ``index_cache`` —
+    кэш индексов, которым пользуется чтение (или None).
+    """
+
+    def __init__(self, task_scheduler, document_cache, candidates, index_cache=None, parent=None):
+        """Принимает пул фоновых задач, кэш документов и источник путей."""
+        super().__init__(parent)
+        self.task_scheduler = task_scheduler
+        self.document_cache = document_cache
+        self.candidates = candidates
+        self.index_cache = index_cache
+        self.active = False
+        # Путь -> (размер, время изменения) файла, который не нужно читать снова
+        self._skipped = {}
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._prefetch_next)
+
+    def start(self):
+        """Начинает следить за паузами в работе пользователя."""
+        if not self.active:
+            self.active = True
+            QApplication.instance().installEventFilter(self)
+        self._timer.start(IDLE_MS)
+
+    def stop(self):
+        """Прекращает упреждающее чтение."""
+        if self.active:
+            self.active = False
+            QApplication.instance().removeEventFilter(self)
+        self._timer.stop()
+        self.task_scheduler.cancel("prefetch")
+
+    def eventFilter(self, obj, event):
+        """Откладывает чтение при каждом действии пользователя."""
+        if event.type() in _ACTIVITY_EVENTS:
+            self.task_scheduler.cancel("prefetch")
+            self._timer.start(IDLE_MS)
+        return False
+
+    def _prefetch_next(self):
+        """Запускает чтение первого подходящего файла, которого нет в кэше."""
+        if self.task_scheduler.is_running("load"):
+            # Файл открывается: чтение подождёт новой паузы
+            self._timer.start(IDLE_MS)
+            return
+        for path in self.candidates():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if self._skipped.get(path) == key or self.document_cache.contains(path):
+                continue
+            if stat.st_size > self.document_cache.free_bytes():
+                self._skipped[path] = key
+                continue
+            self.task_scheduler.submit("prefetch", prefetch_file, path, self.index_cache,
+                                       on_result=self._on_loaded,
+                                       on_error=lambda error, path=path, key=key: self._skip(path, key),
+                                       priority=-1)
+            return
+
+    def _on_loaded(self, result):
+        """Кладёт прочитанный файл в кэш и переходит к следующему."""
+        stat, (path, content, store, problems) = result
+        # Прочитанные раньше файлы важнее: их записи не вытесняются
+        if not self.document_cache.put(path, stat, content, store, problems, evict=False):
+            self._skip(path, (stat.st_size, stat.st_mtime_ns))
+        if self.active:
+            self._timer.start(_NEXT_MS)
+
+    def _skip(self, path: str, key):
+        """Запоминает файл, который не нужно читать снова, пока он не изменится."""
+        self._skipped[path] = key
+        if self.active:
+            self._timer.start(_NEXT_MS)
@@ -0,0 +1,315 @@
+"""Поиск всех совпадений: индекс, панель результатов и подсветка в редакторе.
+
+``SearchResults`` находит все совпадения шаблона в фоновой задаче и хранит
+их упорядоченный индекс (``MatchIndex``). Правка текста обновляет индекс
+на месте: заново просматриваются только задетые правкой строки, а позиции
+последующих совпадений сдвигаются отложенно. Совпадение регулярного
+выражения может захватить соседние строки, поэтому для него после паузы
+в правках результат сверяется с поиском по всему тексту в фоне. После
+большой правки (вставка файла, замена всех совпадений) поиск тоже
+повторяется в фоне.
+
+Позиции индекса — позиции документа (единицы UTF-16, см.
+``model.text_positions``), как у правок из ``contentsChange``.
+
+В редакторе подсвечиваются только совпадения в видимой части. Модель
+панели виртуальная: номер строки и её текст вычисляются по документу
+только для строк, которые показывает представление.
+"""
+
+from bisect import bisect_right
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QObject, QPoint, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QTextCursor
+from PyQt5.QtWidgets import QAbstractItemView, QDockWidget, QHeaderView, QTableView, QTextEdit
+from model.text_positions import TextPositions
+from threads.match_finder import find_all
+from ui.document_snapshot import document_text
+
+# Правка длиннее этого числа символов запускает повторный поиск в фоне
+_RESCAN_LIMIT = 1 << 16
+# Пауза после большой правки перед повторным поиском, мс
+_RESCAN_DELAY_MS = 300
+# Наибольшее число подсвечиваемых совпадений в видимой части
+_HIGHLIGHT_LIMIT = 2000
+# Длина текста строки, показываемого в панели, символов
+_CONTEXT_CHARS = 200
+
+
+class SearchResults(QObject):
+    """Все совпадения шаблона в тексте редактора, обновляемые по правкам.
+
+    ``index`` — ``MatchIndex`` или None, пока поиск не запускался или идёт.
+
+    Сигналы:
+    - started(): начат поиск в фоне
+    - finished(): индекс готов
+    """
+    started = pyqtSignal()
+    finished = pyqtSignal()
+
+    def __init__(self, editor, snapshots, task_scheduler, selections, parent=None):
+        """Принимает редактор, сервис снимков, пул фоновых задач и слои выделений."""
+        super().__init__(parent)
+        self.editor = editor
+        self.snapshots = snapshots
+        self.task_scheduler = task_scheduler
+        self.selections = selections
+        self.compiled = None
+        self.index = None
+        self.model = SearchResultsModel(self)
+        self._regex = False
+        self._request = 0  # номер запроса текста; устаревшие ответы пропускаются
+        self._block_count = editor.document().blockCount()
+        self._scan_timer = QTimer(self)
+        self._scan_timer.setSingleShot(True)
+        self._scan_timer.timeout.connect(self._start_scan)
+        self._highlight_timer = QTimer(self)
+        self._highlight_timer.setSingleShot(True)
+        self._highlight_timer.timeout.connect(self._highlight_visible)
+        editor.document().contentsChange.connect(self._on_contents_change)
+        editor.updateRequest.connect(self._on_update_request)
+
+    def search(self, compiled, regex=False):
+        """Начинает поиск всех совпадений ``compiled`` в текущем тексте.
+
+        ``regex`` — шаблон задан регулярным выражением (а не строкой).
+        """
+        self.compiled = compiled
+        self._regex = regex
+        self._set_index(None)
+        self._start_scan()
+
+    def clear(self):
+        """Прекращает поиск и убирает результаты и подсветку."""
+        self.compiled = None
+        self._request += 1
+        self._scan_timer.stop()
+        self.task_scheduler.cancel("find_all")
+        self._set_index(None)
+
+    def covers(self, compiled) -> bool:
+        """Проверяет, что готовый индекс построен для того же шаблона."""
+        current = self.compiled
+        return (self.index is not None and current is not None
+                and current.pattern == compiled.pattern and current.flags == compiled.flags)
+
+    def find(self, start: int, end: int, forward=True):
+        """Возвращает (начало, конец) совпадения после выделения [start, end) или до него."""
+        index = self.index
+        if forward:
+            i = index.first_from(end)
+            return index.span(i) if i < len(index) else None
+        i = bisect_right(index.end, start) - 1
+        return index.span(i) if i >= 0 else None
+
+    def _set_index(self, index):
+        """Заменяет индекс целиком."""
+        self.model.beginResetModel()
+        self.index = index
+        self._block_count = self.editor.document().blockCount()
+        self.model.endResetModel()
+        self._highlight_visible()
+
+    def _start_scan(self):
+        """Запрашивает текст текущей ревизии и ищет в нём в фоне."""
+        if self.compiled is None:
+            return
+        self._request += 1
+        request, revision, compiled = self._request, self.snapshots.revision, self.compiled
+        self.started.emit()
+
+        def scan(text):
+            if request != self._request:
+                return
+            self.task_scheduler.submit("find_all", find_all, text, compiled,
+                                       on_result=self._on_scanned, on_stale=self._start_scan,
+                                       version=revision)
+
+        self.snapshots.request_text(scan)
+
+    def _on_scanned(self, index):
+        """Показывает найденные совпадения, если они отличаются от уже показанных."""
+        if self.index is None or not self.index.same_as(index):
+            self._set_index(index)
+        self.finished.emit()
+
+    def _on_contents_change(self, position: int, removed: int, added: int):
+        """Обновляет индекс после правки текста."""
+        if self.compiled is None:
+            return
+        if self.index is None or max(removed, added) > _RESCAN_LIMIT:
+            # Результат начатого поиска устарел: повторим его после паузы в правках
+            if self.index is not None:
+                self._set_index(None)
+            self._request += 1
+            self.task_scheduler.cancel("find_all")
+            self._scan_timer.start(_RESCAN_DELAY_MS)
+            return
+        # Начатая сверка с поиском по всему тексту устарела
+        self._request += 1
+        self.task_scheduler.cancel("find_all")
+        self._rescan_lines(position, removed, added)
+        if self._regex:
+            self._scan_timer.start(_RESCAN_DELAY_MS)
+
+    def _rescan_lines(self, position: int, removed: int, added: int):
+        """Заново ищет совпадения в строках, задетых правкой."""
+        document = self.editor.document()
+        index, model = self.index, self.model
+        delta = added - removed
+        first = document.findBlock(position)
+        last = document.findBlock(position + added)
+        start = first.position()
+        new_end = last.position() + len(last.text())
+        # Участок [start, old_end) старого текста стал участком [start, new_end)
+        old_end = new_end - delta
+        i, j = index.touching(start, old_end)
+        if i < j:
+            # Совпадения, частично задетые участком, просматриваются целиком
+            start = min(start, index.start[i])
+            old_end = max(old_end, index.end[j - 1])
+            new_end = old_end + delta
+        cursor = QTextCursor(document)
+        cursor.setPosition(start)
+        cursor.setPosition(min(new_end, document.characterCount() - 1), QTextCursor.KeepAnchor)
+        text = document_text(cursor.selectedText())
+        positions = TextPositions(text)
+        spans = [positions.span_to_qt(*match.span()) for match in self.compiled.finditer(text)]
+        starts = [start + s for s, e in spans if s != e]
+        ends = [start + e for s, e in spans if s != e]
+
+        if j > i:
+            model.beginRemoveRows(QModelIndex(), i, j - 1)
+            index.splice(i, j, [], [], 0)
+            model.endRemoveRows()
+        if starts:
+            model.beginInsertRows(QModelIndex(), i, i + len(starts) - 1)
+            index.splice(i, i, starts, ends, delta)
+            model.endInsertRows()
+        else:
+            index.splice(i, i, [], [], delta)
+        block_count = document.blockCount()
+        if block_count != self._block_count and i + len(starts) < len(index):
+            # У последующих совпадений изменились номера строк
+            model.dataChanged.emit(model.index(i + len(starts), 0), model.index(len(index) - 1, 0))
+        self._block_count = block_count
+        self._highlight_timer.start(0)
+
+    def _on_update_request(self, rect, dy: int):
+        """Обновляет подсветку после прокрутки или перерисовки всей видимой части."""
+        if self.index is not None and (dy or rect.contains(self.editor.viewport().rect())):
+            self._highlight_timer.start(0)
+
+    def _highlight_visible(self):
+        """Подсвечивает совпадения в видимой части редактора."""
+        index = self.index
+        if index is None or not len(index):
+            self.selections.set("search", [])
+            return
+        editor = self.editor
+        viewport = editor.viewport()
+        top = editor.firstVisibleBlock().position()
+        bottom = editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+        i, j = index.touching(top, bottom.position() + bottom.length())
+        selections = []
+        document = editor.document()
+        for k in range(i, min(j, i + _HIGHLIGHT_LIMIT)):
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(QColor(255, 235, 120))
+            selection.cursor = QTextCursor(document)
+            selection.cursor.setPosition(index.start[k])
+            selection.cursor.setPosition(index.end[k], QTextCursor.KeepAnchor)
+            selections.append(selection)
+        self.selections.set("search", selections)
+
+
+class SearchResultsModel(QAbstractTableModel):
+    """Виртуальная таблица совпадений: номер строки и текст строки."""
+    HEADERS = ["Строка", "Текст"]
+
+    def __init__(self, results):
+        """Привязывает модель к результатам поиска."""
+        super().__init__(results)
+        self.results = results
+
+    def rowCount(self, parent=QModelIndex()):
+        """Возвращает число совпадений."""
+        index = self.results.index
+        return 0 if parent.isValid() or index is None else len(index)
+
+    def columnCount(self, parent=QModelIndex()):
+        """Возвращает число колонок."""
+        return len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Возвращает номер строки совпадения или текст этой строки."""
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        start, end = self.results.index.span(index.row())
+        block = self.results.editor.document().findBlock(start)
+        if index.column() == 0:
+            return block.blockNumber() + 1
+        text = block.text()
+        column = TextPositions(text).from_qt(start - block.position())
+        # Длинная строка показывается вокруг совпадения
+        left = max(0, column - _CONTEXT_CHARS // 4)
+        context = text[left:left + _CONTEXT_CHARS].strip()
+        return ("…" if left else "") + context
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Возвращает заголовки колонок."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+
+class SearchResultsPanel(QDockWidget):
+    """Прикрепляемая панель результатов поиска; выбор строки выделяет совпадение.
+
+    Закрытие панели прекращает поиск и убирает подсветку.
+
+    Сигналы:
+    - match_activated(start, end): позиции выбранного совпадения в документе
+    """
+    match_activated = pyqtSignal(int, int)
+
+    def __init__(self, results, parent=None):
+        """Создаёт таблицу совпадений внутри панели."""
+        super().__init__("Результаты поиска", parent)
+        self.setObjectName("search_results_panel")
+        self.results = results
+        self.view = QTableView(self)
+        self.view.setModel(results.model)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.verticalHeader().hide()
+        # Высота строк не замеряется для каждой строки
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.activated.connect(self._on_activated)
+        self.view.clicked.connect(self._on_activated)
+        self.setWidget(self.view)
+        model = results.model
+        for signal in (model.modelReset, model.rowsInserted, model.rowsRemoved):
+            signal.connect(self._update_title)
+        results.started.connect(self._update_title)
+
+    def _update_title(self, *args):
+        """Показывает в заголовке число совпадений или что поиск идёт."""
+        index = self.results.index
+        if self.results.compiled is None:
+            self.setWindowTitle("Результаты поиска")
+        elif index is None:
+            self.setWindowTitle("Результаты поиска: поиск…")
+        else:
+            self.setWindowTitle(f"Результаты поиска ({len(index)})")
+
+    def _on_activated(self, index):
+        """Сообщает позиции совпадения из выбранной строки."""
+        if index.isValid():
+            self.match_activated.emit(*self.results.index.span(index.row()))
+
+    def closeEvent(self, event):
+        """Прекращает поиск, когда панель закрыта."""
+        self.results.clear()
+        super().closeEvent(event)
@@ -1,13 +1,14 @@
-from PyQt5.QtWidgets import QDialog, QFormLayout, QFontComboBox, QComboBox, QCheckBox, QPushButton, QWidget, QDialogButtonBox
+from PyQt5.QtWidgets import QDialog, QFormLayout, QFontComboBox, QComboBox, QCheckBox, QPushButton, QWidget, QDialogButtonBox, QSpinBox
 from PyQt5.QtGui import QFont, QColor
 from PyQt5.QtWidgets import QColorDialog
 
 
 class SettingsDialog(QDialog):
     """Диалог настроек внешнего вида редактора и подсветки."""
+    INDENTS = [("2 пробела", "  "), ("4 пробела", "    "), ("Табуляция", "\t")]
 
-    def __init__(self, parent=None, *, font_family, font_size, bold, italic, underline, text_color, bg_color, word_wrap, tag_color):
-        """Создает форму с параметрами шрифта, цветов, переноса и цвета тегов."""
+    def __init__(self, parent=None, *, font_family, font_size, bold, italic, underline, text_color, bg_color, word_wrap, tag_color, indent="  ", plain_limit_mb=200, large_limit_mb=512, index_cache_mb=512, prefetch_files=3, prefetch_mb=256):
+        """Создает форму с параметрами шрифта, цветов, переноса, подсветки и отступа."""
         super().__init__(parent)
         self.setWindowTitle("Настройки")
 
@@ -62,6 +63,46 @@ class SettingsDialog(QDialog):
         self._update_button_color(self.tag_color_btn, self._tag_color)
         form.addRow("Цвет тегов", self.tag_color_btn)
 
+        # Отступ при форматировании XML
+        self.indent_combo = QComboBox()
+        for title, value in self.INDENTS:
+            self.indent_combo.addItem(title, value)
+        self.indent_combo.setCurrentIndex(max(0, self.indent_combo.findData(indent)))
+        form.addRow("Отступ", self.indent_combo)
+
+        # Выше этого размера подсветка синтаксиса отключается
+        self.plain_limit_spin = QSpinBox()
+        self.plain_limit_spin.setRange(1, 4096)
+        self.plain_limit_spin.setSuffix(" МБ")
+        self.plain_limit_spin.setValue(int(plain_limit_mb))
+        form.addRow("Подсветка до", self.plain_limit_spin)
+
+        # С этого размера файл открывается в просмотре без загрузки в редактор
+        self.large_limit_spin = QSpinBox()
+        self.large_limit_spin.setRange(1, 1024 * 1024)
+        self.large_limit_spin.setSuffix(" МБ")
+        self.large_limit_spin.setValue(int(large_limit_mb))
+        form.addRow("Большой файл от", self.large_limit_spin)
+
+        # Наибольший размер кэша индексов структуры (0 — кэш отключен)
+        self.index_cache_spin = QSpinBox()
+        self.index_cache_spin.setRange(0, 65536)
+        self.index_cache_spin.setSuffix(" МБ")
+        self.index_cache_spin.setValue(int(index_cache_mb))
+        form.addRow("Кэш индексов", self.index_cache_spin)
+
+        # Недавние файлы, которые читаются заранее в паузах работы (0 — не читать)
+        self.prefetch_files_spin = QSpinBox()
+        self.prefetch_files_spin.setRange(0, 10)
+        self.prefetch_files_spin.setValue(int(prefetch_files))
+        form.addRow("Читать заранее недавних", self.prefetch_files_spin)
+
+        self.prefetch_mb_spin = QSpinBox()
+        self.prefetch_mb_spin.setRange(1, 65536)
+        self.prefetch_mb_spin.setSuffix(" МБ")
+        self.prefetch_mb_spin.setValue(int(prefetch_mb))
+        form.addRow("Память для них", self.prefetch_mb_spin)
+
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(self.accept)
         buttons.rejected.connect(self.reject)
@@ -105,6 +146,12 @@ class SettingsDialog(QDialog):
             "bg_color": self._bg_color.name(),
             "word_wrap": self.wrap_cb.isChecked(),
             "tag_color": self._tag_color.name(),
+            "indent": self.indent_combo.currentData(),
+            "plain_limit_mb": self.plain_limit_spin.value(),
+            "large_limit_mb": self.large_limit_spin.value(),
+            "index_cache_mb": self.index_cache_spin.value(),
+            "prefetch_files": self.prefetch_files_spin.value(),
+            "prefetch_mb": self.prefetch_mb_spin.value(),
         }
 
 
@@ -1,16 +1,159 @@
-from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QFont, QColor
-from PyQt5.QtCore import QRegExp
+"""Подсветка синтаксиса XML.
+
+Блок текста размечается за один проход конечным автоматом: каждый участок
+получает формат ровно один раз. Незавершённые в конце блока комментарий,
+CDATA, тег, значение атрибута, инструкция обработки или DOCTYPE
+запоминаются в состоянии блока и продолжаются в следующем.
+"""
+
+import re
+from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QTextLayout, QFont, QColor
+
+# Состояния автомата (сохраняются как состояние блока)
+TEXT, COMMENT, CDATA, TAG, VALUE_DQ, VALUE_SQ, DECL, DOCTYPE, DOCTYPE_SUBSET = range(9)
+
+# Виды размеченных участков
+TAG_TOKEN, ATTR_NAME_TOKEN, ATTR_VALUE_TOKEN, COMMENT_TOKEN, DECL_TOKEN, ENTITY_TOKEN = range(6)
+
+# В тексте: законченная в этой строке конструкция целиком, иначе её начало
+_TEXT_RE = re.compile(r"""
+    (?P<tag></?(?P<name>[^\s<>/!?="']*)(?P<attrs>(?:\s+[^\s=<>/"']+\s*=\s*(?:"[^"]*"|'[^']*'))*)\s*/?>)
+  | (?P<entity>&[a-zA-Z0-9\#]+;)
+  | (?P<comment><!--.*?-->)
+  | (?P<pi><\?.*?\?>)
+  | (?P<cdata><!\[CDATA\[.*?\]\]>)
+  | (?P<doctype><!DOCTYPE[^\[>]*>)
+  | (?P<open><!--|<!\[CDATA\[|<\?|<!DOCTYPE|</?[^\s<>/!?="']*)
+""", re.X)
+# Атрибут внутри законченного тега: имя, «=» с пробелами, значение
+_ATTR_RE = re.compile(r"""([^\s=<>/"']+)\s*=\s*("[^"]*"|'[^']*')""")
+# Содержимое тега: пробелы, конец тега, имя атрибута, «=», кавычка или посторонний символ
+_TAG_RE = re.compile(r"""\s+|(?P<end>/?>)|(?P<name>[^\s=<>/"']+)|(?P<eq>=)|(?P<quote>["'])|(?P<other>.)""")
+# Конец внутреннего подмножества DOCTYPE
+_SUBSET_END_RE = re.compile(r"\]\s*>")
+# Символы вне BMP занимают в QString две позиции
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+
+# Состояние → (вид участка, строка конца конструкции)
+_UNTIL = {
+    COMMENT: (COMMENT_TOKEN, "-->"),
+    CDATA: (None, "]]>"),
+    DECL: (DECL_TOKEN, "?>"),
+    VALUE_DQ: (ATTR_VALUE_TOKEN, '"'),
+    VALUE_SQ: (ATTR_VALUE_TOKEN, "'"),
+}
+
+
+def tokenize_block(text: str, state: int = TEXT):
+    """Размечает строку текста, начиная в состоянии ``state``.
+
+    Возвращает (список участков (начало, длина, вид), состояние в конце строки).
+    Позиции считаются в символах Python.
+    """
+    spans = []
+    append = spans.append
+    pos = 0
+    start = 0  # начало многострочной конструкции в этой строке
+    n = len(text)
+    while True:
+        if state == TEXT:
+            m = _TEXT_RE.search(text, pos)
+            if m is None:
+                break
+            kind = m.lastgroup
+            start, pos = m.span()
+            if kind == "tag":
+                attrs_start, attrs_end = m.span("attrs")
+                if attrs_start == attrs_end:
+                    append((start, pos - start, TAG_TOKEN))
+                    continue
+                append((start, attrs_start - start, TAG_TOKEN))
+                for a in _ATTR_RE.finditer(text, attrs_start, attrs_end):
+                    name_start, name_end = a.span(1)
+                    value_start, value_end = a.span(2)
+                    append((name_start, name_end - name_start, ATTR_NAME_TOKEN))
+                    append((name_end, value_start - name_end, TAG_TOKEN))
+                    append((value_start, value_end - value_start, ATTR_VALUE_TOKEN))
+                append((attrs_end, pos - attrs_end, TAG_TOKEN))
+                continue
+            if kind == "entity":
+                append((start, pos - start, ENTITY_TOKEN))
+            elif kind == "comment":
+                append((start, pos - start, COMMENT_TOKEN))
+            elif kind == "pi" or kind == "doctype":
+                append((start, pos - start, DECL_TOKEN))
+            elif kind == "open":
+                # Конструкция продолжается на следующих строках
+                tok = m.group()
+                if tok == "<!--":
+                    state = COMMENT
+                elif tok == "<![CDATA[":
+                    state = CDATA
+                elif tok == "<?":
+                    state = DECL
+                elif tok == "<!DOCTYPE":
+                    state = DOCTYPE
+                else:
+                    append((start, pos - start, TAG_TOKEN))
+                    state = TAG
+        elif state == TAG:
+            if pos >= n:
+                break
+            m = _TAG_RE.match(text, pos)
+            kind = m.lastgroup
+            if kind == "other" and m.group() == "<":
+                # Тег не закрыт: дальше снова текст
+                state = TEXT
+                continue
+            if kind == "end":
+                append((pos, m.end() - pos, TAG_TOKEN))
+                state = TEXT
+            elif kind == "name":
+                append((pos, m.end() - pos, ATTR_NAME_TOKEN))
+            elif kind == "eq":
+                append((pos, 1, TAG_TOKEN))
+            elif kind == "quote":
+                start = pos
+                state = VALUE_DQ if m.group() == '"' else VALUE_SQ
+            pos = m.end()
+        elif state == DOCTYPE or state == DOCTYPE_SUBSET:
+            end = 0
+            if state == DOCTYPE:
+                close = text.find(">", pos)
+                bracket = text.find("[", pos, close if close != -1 else n)
+                if bracket == -1:
+                    end = close + 1
+                else:
+                    state = DOCTYPE_SUBSET
+                    pos = bracket + 1
+            if state == DOCTYPE_SUBSET:
+                m = _SUBSET_END_RE.search(text, pos)
+                end = m.end() if m else 0
+            if not end:
+                append((start, n - start, DECL_TOKEN))
+                return spans, state
+            append((start, end - start, DECL_TOKEN))
+            pos = end
+            state = TEXT
+        else:
+            kind, terminator = _UNTIL[state]
+            i = text.find(terminator, pos)
+            end = n if i == -1 else i + len(terminator)
+            if kind is not None:
+                append((start, end - start, kind))
+            if i == -1:
+                return spans, state
+            pos = end
+            state = TAG if kind == ATTR_VALUE_TOKEN else TEXT
+    return spans, state
 
 
 class XmlHighlighter(QSyntaxHighlighter):
     """Подсветка синтаксиса XML для QTextDocument."""
     def __init__(self, document):
-        """Инициализирует правила подсветки и форматы."""
+        """Инициализирует форматы участков."""
         super().__init__(document)
 
-        self.rules = []
-
-        
         self.tag_format = QTextCharFormat()
         self.tag_format.setFontWeight(QFont.Bold)
 
@@ -26,36 +169,61 @@ class XmlHighlighter(QSyntaxHighlighter):
 
         entity_format = QTextCharFormat()
 
-        # Паттерны подсветки (регулярные выражения)
-        #Закрывающие теги
-        self.rules.append((QRegExp(r"</[^>]+>"), self.tag_format))
-        #Открывающие теги 
-        self.rules.append((QRegExp(r"<[^!?/][^>]*>"), self.tag_format))
-        #Имя атрибута
-        self.rules.append((QRegExp(r"\b[\w:-]+\b(?=\=)"), attr_name_format))
-        #Значение атрибута в кавычках
-        self.rules.append((QRegExp(r'(["\']).*?\1'), attr_value_format))
-        #Комментарии
-        self.rules.append((QRegExp(r"<!--[^>]*-->"), comment_format))
-        #Декларация XML
-        self.rules.append((QRegExp(r"<\?xml[^>]*\?>"), decl_format))
-        #DOCTYPE
-        self.rules.append((QRegExp(r"<!DOCTYPE[^>]*>"), decl_format))
-        #Сущности
-        self.rules.append((QRegExp(r"&[a-zA-Z0-9#]+;"), entity_format))
+        # Формат для каждого вида участка
+        self.formats = {
+            TAG_TOKEN: self.tag_format,
+            ATTR_NAME_TOKEN: attr_name_format,
+            ATTR_VALUE_TOKEN: attr_value_format,
+            COMMENT_TOKEN: comment_format,
+            DECL_TOKEN: decl_format,
+            ENTITY_TOKEN: entity_format,
+        }
+        self._update_active_formats()
+
+    def _update_active_formats(self):
+        """Запоминает непустые форматы: участки с пустым форматом не размечаются."""
+        self._active_formats = [None if fmt.isEmpty() else fmt
+                                for _, fmt in sorted(self.formats.items())]
 
     def highlightBlock(self, text):
-        """Выделяет найденные паттерны в одном текстовом блоке."""
-        for pattern, fmt in self.rules:
-            index = pattern.indexIn(text, 0)
-            while index >= 0:
-                length = pattern.matchedLength()
-                if length == 0:
-                    break
-                self.setFormat(index, length, fmt)
-                index = pattern.indexIn(text, index + length)
+        """Размечает блок за один проход и переносит состояние в следующий блок."""
+        state = self.previousBlockState()
+        spans, state = tokenize_block(text, state if state != -1 else TEXT)
+        self.setCurrentBlockState(state)
+        for start, length, fmt in self.qt_spans(text, spans):
+            self.setFormat(start, length, fmt)
+
+    def qt_spans(self, text: str, spans):
+        """Переводит участки ``tokenize_block`` в (начало, длина, формат) для Qt.
+
+        Участки с пустым форматом пропускаются; позиции переводятся
+        в единицы UTF-16, как в QString.
+        """
+        formats = self._active_formats
+        astral = _ASTRAL_RE.search(text) is not None
+        for start, length, kind in spans:
+            fmt = formats[kind]
+            if fmt is None:
+                continue
+            if astral:
+                inside = len(_ASTRAL_RE.findall(text, start, start + length))
+                start += len(_ASTRAL_RE.findall(text, 0, start))
+                length += inside
+            yield start, length, fmt
+
+    def format_ranges(self, text: str, spans):
+        """Возвращает участки как список ``QTextLayout.FormatRange`` для блока."""
+        ranges = []
+        for start, length, fmt in self.qt_spans(text, spans):
+            r = QTextLayout.FormatRange()
+            r.start = start
+            r.length = length
+            r.format = fmt
+            ranges.append(r)
+        return ranges
 
     def set_tag_color(self, color: QColor):
         """Меняет цвет подсветки тегов и перерисовывает документ."""
         self.tag_format.setForeground(color)
+        self._update_active_formats()
         self.rehighlight()
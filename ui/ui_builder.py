@@ -5,11 +5,22 @@
 
 import os
 from PyQt5.QtWidgets import (QPlainTextEdit, QVBoxLayout, QWidget, QToolBar, QAction, 
-                             QTreeWidget, QTreeWidgetItem, QSplitter, QComboBox, QFontComboBox, 
-                             QAbstractItemView, QProgressBar, QStyle, QStatusBar, QMenuBar, QMenu)
+                             QTreeView, QSplitter, QComboBox, QFontComboBox, 
+                             QAbstractItemView, QProgressBar, QStyle, QStatusBar, QMenuBar, QMenu,
+                             QPushButton, QLabel, QStackedWidget)
 from PyQt5.QtGui import QFont, QPalette, QColor, QTextCursor, QIcon, QTextOption
 from PyQt5.QtCore import Qt
 from ui.syntax_highlighter import XmlHighlighter
+from ui.highlight_scheduler import HighlightScheduler
+from ui.document_snapshot import SnapshotService
+from ui.document_stats import DocumentStats
+from ui.live_validator import LiveValidator
+from ui.problems_panel import ProblemsPanel
+from ui.query_panel import QueryPanel, XPathQuery
+from ui.extra_selections import SelectionLayers
+from ui.large_file_view import LargeFile, LargeFileView
+from ui.search_results import SearchResults, SearchResultsPanel
+from ui.xml_tree_model import XmlTreeModel
 
 
 class UIBuilder:
@@ -45,10 +56,14 @@ class UIBuilder:
         self.main_window.splitter = QSplitter(self.main_window)
         self._create_tree_widget()
         self._create_editor()
+        self._create_large_file_view()
         
-        # Добавляем виджеты в сплиттер
+        # Добавляем виджеты в сплиттер; редактор и просмотр больших файлов делят одно место
+        self.main_window.editor_stack = QStackedWidget()
+        self.main_window.editor_stack.addWidget(self.main_window.editor)
+        self.main_window.editor_stack.addWidget(self.main_window.large_view)
         self.main_window.splitter.addWidget(self.main_window.tree)
-        self.main_window.splitter.addWidget(self.main_window.editor)
+        self.main_window.splitter.addWidget(self.main_window.editor_stack)
         self.main_window.splitter.setStretchFactor(0, 0)
         self.main_window.splitter.setStretchFactor(1, 1)
         # Шире панель дерева по умолчанию
@@ -57,26 +72,89 @@ class UIBuilder:
         # Устанавливаем центральный виджет
         self.main_window.setCentralWidget(self.main_window.splitter)
     
+    def create_problems_panel(self):
+        """Создает прикрепляемую панель ошибок разбора XML (по умолчанию скрыта)."""
+        self.main_window.problems_panel = ProblemsPanel(self.main_window)
+        self.main_window.problems_panel.problem_activated.connect(self.main_window.go_to_position)
+        self.main_window.addDockWidget(Qt.BottomDockWidgetArea, self.main_window.problems_panel)
+        self.main_window.problems_panel.hide()
+        self.main_window.toggle_problems_action = self.main_window.problems_panel.toggleViewAction()
+        self.main_window.toggle_problems_action.setText("Ошибки XML")
+
+    def create_search_results_panel(self):
+        """Создает поиск всех совпадений и его прикрепляемую панель (по умолчанию скрыта)."""
+        self.main_window.search_results = SearchResults(self.main_window.editor, self.main_window.snapshots,
+                                                        self.main_window.task_scheduler,
+                                                        self.main_window.selection_layers, self.main_window)
+        self.main_window.search_results_panel = SearchResultsPanel(self.main_window.search_results,
+                                                                   self.main_window)
+        self.main_window.search_results_panel.match_activated.connect(self.main_window._select_document_range)
+        self.main_window.addDockWidget(Qt.BottomDockWidgetArea, self.main_window.search_results_panel)
+        self.main_window.search_results_panel.hide()
+
+    def create_query_panel(self):
+        """Создает запросы XPath и их прикрепляемую панель (по умолчанию скрыта)."""
+        self.main_window.xpath_query = XPathQuery(self.main_window.editor, self.main_window.task_scheduler,
+                                                  self.main_window)
+        self.main_window.xpath_query.document_needed.connect(self.main_window.build_tree_from_editor)
+        self.main_window.query_panel = QueryPanel(self.main_window.xpath_query, self.main_window)
+        self.main_window.query_panel.node_activated.connect(self.main_window.select_tree_node)
+        self.main_window.addDockWidget(Qt.BottomDockWidgetArea, self.main_window.query_panel)
+        self.main_window.query_panel.hide()
+        self.main_window.query_action = QAction("Запрос XPath...", self.main_window)
+        self.main_window.query_action.setShortcut("Ctrl+Shift+X")
+        self.main_window.query_action.triggered.connect(self.main_window.open_query_panel)
+
+    def _create_large_file_view(self):
+        """Создает просмотр и правку больших файлов (файл отображается в память)."""
+        self.main_window.large_file = LargeFile(self.main_window.task_scheduler, cache=self.main_window.index_cache,
+                                              parent=self.main_window)
+        self.main_window.large_file.scanned.connect(self.main_window.update_status)
+        self.main_window.large_file.indexed.connect(self.main_window.update_status)
+        self.main_window.large_file.failed.connect(self.main_window.on_large_file_error)
+        self.main_window.large_file.changed.connect(self.main_window.on_large_file_changed)
+        self.main_window.large_view = LargeFileView(self.main_window.large_file)
+        self.main_window.large_view.cursor_moved.connect(self.main_window.update_status)
+
     def _create_tree_widget(self):
-        """Создает виджет дерева XML."""
-        self.main_window.tree = QTreeWidget()
-        self.main_window.tree.setHeaderLabels(["Элемент", "Значение", "Атрибуты"])
+        """Создает виртуальное дерево XML (представление и модель без объектов на узел)."""
+        self.main_window.tree = QTreeView()
+        self.main_window.tree_model = XmlTreeModel(self.main_window.tree)
+        self.main_window.tree.setModel(self.main_window.tree_model)
+        # Одинаковая высота строк избавляет представление от замеров каждой строки
+        self.main_window.tree.setUniformRowHeights(True)
         # По умолчанию делаем столбец атрибутов шире
         self.main_window.tree.setColumnWidth(2, 300)
-        self.main_window.tree.itemClicked.connect(self.main_window.on_tree_item_clicked)
-        self.main_window.tree.itemChanged.connect(self.main_window.on_tree_item_changed)
+        self.main_window.tree.clicked.connect(self.main_window.on_tree_item_clicked)
+        self.main_window.tree_model.item_edited.connect(self.main_window.on_tree_item_changed)
         self.main_window.tree.setEditTriggers(QAbstractItemView.DoubleClicked | QAbstractItemView.SelectedClicked | QAbstractItemView.EditKeyPressed)
-        self.main_window.tree.itemExpanded.connect(self.main_window.on_item_expanded)
     
     def _create_editor(self):
         """Создает текстовый редактор с подсветкой синтаксиса."""
         self.main_window.editor = QPlainTextEdit()
         self.main_window.editor.setFont(QFont("Consolas", 12))
+        # Ревизия текста растёт при любом изменении, даже при заблокированных сигналах редактора;
+        # сервис подписывается первым, чтобы остальные обработчики видели новую ревизию
+        self.main_window.snapshots = SnapshotService(self.main_window.editor.document(), self.main_window)
+        # Счётчики для строки состояния обновляются по правкам, без копирования текста
+        self.main_window.document_stats = DocumentStats(self.main_window.editor, self.main_window.snapshots,
+                                                        self.main_window)
+        # Отметка ошибки и подсветка совпадений поиска — слои дополнительных выделений
+        self.main_window.selection_layers = SelectionLayers(self.main_window.editor)
+        # Корректность XML проверяется в фоне после паузы в наборе
+        self.main_window.live_validator = LiveValidator(self.main_window.editor, self.main_window.snapshots,
+                                                        self.main_window.task_scheduler,
+                                                        self.main_window.selection_layers, self.main_window)
         self.main_window.editor.textChanged.connect(self.main_window.on_text_changed)
         self.main_window.editor.cursorPositionChanged.connect(self.main_window.update_status)
         
         # Настройка подсветки синтаксиса
         self.main_window.highlighter = XmlHighlighter(self.main_window.editor.document())
+        # Большие документы подсвечиваются с видимой части, остальное — в фоне
+        self.main_window.highlight_scheduler = HighlightScheduler(self.main_window.editor,
+                                                                  self.main_window.highlighter,
+                                                                  self.main_window.task_scheduler,
+                                                                  text_request=self.main_window.snapshots.request_text)
         
         # Настройка переноса строк
         self.main_window.editor.setLineWrapMode(QPlainTextEdit.NoWrap)
@@ -126,6 +204,9 @@ class UIBuilder:
         self.main_window.pretty_action.setShortcut("Ctrl+Shift+F")
         self.main_window.pretty_action.triggered.connect(self.main_window.pretty_format_xml)
 
+        self.main_window.format_file_action = QAction("Форматировать файл...", self.main_window)
+        self.main_window.format_file_action.triggered.connect(self.main_window.pretty_format_file)
+
         self.main_window.wrap_action = QAction("Перенос строк", self.main_window)
         self.main_window.wrap_action.setCheckable(True)
         self.main_window.wrap_action.setChecked(False)
@@ -183,12 +264,16 @@ class UIBuilder:
         # Вид
         view_menu = menubar.addMenu("Вид")
         view_menu.addAction(self.main_window.toggle_tree_action)
+        view_menu.addAction(self.main_window.toggle_problems_action)
         view_menu.addAction(self.main_window.wrap_action)
 
         # XML
         xml_menu = menubar.addMenu("XML")
         xml_menu.addAction(self.main_window.validate_action)
         xml_menu.addAction(self.main_window.pretty_action)
+        xml_menu.addAction(self.main_window.format_file_action)
+        xml_menu.addSeparator()
+        xml_menu.addAction(self.main_window.query_action)
 
         # Настройки
         settings_menu = menubar.addMenu("Настройки")
@@ -214,3 +299,16 @@ class UIBuilder:
         self.main_window._progress_bar = QProgressBar()
         self.main_window._progress_bar.setVisible(False)
         self.main_window.status_bar.addPermanentWidget(self.main_window._progress_bar)
+
+        # Кнопка отмены длительной фоновой операции
+        self.main_window._cancel_button = QPushButton("Отмена")
+        self.main_window._cancel_button.setVisible(False)
+        self.main_window._cancel_button.clicked.connect(self.main_window.cancel_background_task)
+        self.main_window.status_bar.addPermanentWidget(self.main_window._cancel_button)
+
+        # Результат фоновой проверки XML; ссылка ведёт к месту ошибки
+        self.main_window._validation_label = QLabel()
+        self.main_window._validation_label.linkActivated.connect(self.main_window.go_to_validation_error)
+        self.main_window.status_bar.addPermanentWidget(self.main_window._validation_label)
+        self.main_window.live_validator.started.connect(self.main_window.on_validation_started)
+        self.main_window.live_validator.finished.connect(self.main_window.on_validation_finished)
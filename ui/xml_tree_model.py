@@ -0,0 +1,359 @@
+"""Виртуальная модель дерева XML для ``QTreeView``.
+
+Модель не создаёт объектов на каждый узел: индексы Qt ссылаются на номер
+узла в плоской таблице документа, а имя, значение и атрибуты вычисляются
+только для строк, которые представление действительно запрашивает.
+"""
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt, pyqtSignal
+from model.document import text_change_region
+
+# Пара «имя=значение» в колонке атрибутов; значение тянется до следующей пары
+_ATTR_TEXT_RE = re.compile(r"\s*([^\s=<>\"'/]+)=(.*?)(?=\s+[^\s=<>\"'/]+=|\s*$)", re.S)
+
+
+def format_attributes(attrs) -> str:
+    """Форматирует атрибуты для колонки дерева: ``имя=значение`` через пробел."""
+    return " ".join(f"{k}={v}" for k, v in attrs)
+
+
+def parse_attributes(text: str):
+    """Разбирает строку колонки атрибутов в список пар (или None при ошибке)."""
+    attrs = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _ATTR_TEXT_RE.match(text, pos)
+        if m is None:
+            return None
+        attrs.append((m.group(1), m.group(2)))
+        pos = m.end()
+    return attrs
+
+
+def _count_children(ids, positions, offset: int) -> int:
+    """Возвращает, сколько первых детей ``ids`` имеют позицию ``positions[id]`` не больше ``offset``.
+
+    Дети идут в порядке документа, поэтому их начала и концы возрастают.
+    """
+    lo, hi = 0, len(ids)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if positions[ids[mid]] <= offset:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _align_to_tag(old: str, new: str, start: int, old_end: int, new_end: int):
+    """Сдвигает вставку или удаление влево, чтобы участок начинался с «<».
+
+    Для вставки ``<n/>`` перед ``<b>`` общее начало текстов захватывает
+    «<» тега ``b``, и участок задевает этот тег. Сдвиг на совпадающие
+    символы даёт тот же текст, но участок целиком лежит между тегами.
+    """
+    if old_end == start:
+        text, end = new, new_end
+    elif new_end == start:
+        text, end = old, old_end
+    else:
+        return start, old_end, new_end
+    shift = 0
+    while (start - shift > 0 and text[start - shift] != "<"
+           and text[start - shift - 1] == text[end - shift - 1]):
+        shift += 1
+    if text[start - shift] != "<":
+        return start, old_end, new_end
+    return start - shift, old_end - shift, new_end - shift
+
+
+class XmlTreeModel(QAbstractItemModel):
+    """Модель «Элемент / Значение / Атрибуты» поверх ``XmlDocument``."""
+    item_edited = pyqtSignal(int, int, str)  # номер узла, колонка, новое значение
+
+    HEADERS = ["Элемент", "Значение", "Атрибуты"]
+    VALUE_COLUMN = 1
+    ATTRIBUTES_COLUMN = 2
+
+    def __init__(self, parent=None):
+        """Создаёт пустую модель."""
+        super().__init__(parent)
+        self._document = None
+        # Номера детей для раскрытых узлов; строятся по требованию
+        self._children = {}
+
+    def document(self):
+        """Возвращает документ, по которому построена модель (или None)."""
+        return self._document
+
+    def set_document(self, document):
+        """Заменяет документ модели и сбрасывает представление."""
+        self.beginResetModel()
+        self._document = document
+        self._children = {}
+        self.endResetModel()
+
+    def clear(self):
+        """Очищает модель."""
+        self.set_document(None)
+
+    def update_document(self, document):
+        """Переводит модель на новую версию документа без полного сброса.
+
+        Если структура не изменилась (правка значения или атрибута), узлы
+        сохраняют номера, и сигнал ``dataChanged`` получают только строки,
+        задетые изменённым участком текста. При изменении структуры строки
+        детей самого глубокого элемента, содержащего участок, которые участок
+        задевает, удаляются и вставляются заново сигналами ``rowsRemoved`` и
+        ``rowsInserted``; остальные строки сохраняют раскрытие и выделение,
+        а их постоянные индексы переносятся на сдвинутые номера узлов.
+        Если участок задевает теги корня, модель сбрасывается.
+        """
+        old = self._document
+        if old is None or document is None or not len(old.store) or not len(document.store):
+            self.set_document(document)
+            return
+        if old.store.has_same_shape(document.store):
+            self._document = document
+            self._emit_region_changed(*text_change_region(old.text, document.text))
+            return
+
+        start, old_end, new_end = _align_to_tag(old.text, document.text,
+                                                *text_change_region(old.text, document.text))
+        old_store, new_store = old.store, document.store
+        parent_id = old_store.enclosing_element(start, old_end)
+        if (parent_id is None or new_store.enclosing_element(start, new_end) != parent_id
+                or new_store.tag(parent_id) != old_store.tag(parent_id)):
+            self.set_document(document)
+            return
+        # Дети до участка и после него совпадают; задетые участком заменяются
+        old_ids = self._child_ids(parent_id)
+        new_ids = array('i', new_store.children(parent_id))
+        before = _count_children(old_ids, old_store.end, start)
+        after = len(old_ids) - _count_children(old_ids, old_store.start, old_end - 1)
+        if (before != _count_children(new_ids, new_store.end, start)
+                or after != len(new_ids) - _count_children(new_ids, new_store.start, new_end - 1)):
+            self.set_document(document)
+            return
+        # Задетый участком ребёнок с тем же текстом (участок мог захватить
+        # совпадающие символы его тега) не заменяется
+        while (before < len(old_ids) - after and before < len(new_ids) - after
+               and self._same_element(old, old_ids[before], document, new_ids[before])):
+            before += 1
+        while (before < len(old_ids) - after and before < len(new_ids) - after
+               and self._same_element(old, old_ids[-after - 1], document, new_ids[-after - 1])):
+            after += 1
+        # Сохранённый ребёнок -> (сдвиг номеров, сдвиг позиций) его поддерева
+        kept = {}
+        for old_id, new_id in zip(old_ids[:before], new_ids[:before]):
+            kept[old_id] = (new_id - old_id, new_store.start[new_id] - old_store.start[old_id])
+        for old_id, new_id in zip(old_ids[len(old_ids) - after:], new_ids[len(new_ids) - after:]):
+            kept[old_id] = (new_id - old_id, new_store.start[new_id] - old_store.start[old_id])
+
+        removed_end = len(old_ids) - after
+        if removed_end > before:
+            self.beginRemoveRows(self.index_for_node(parent_id), before, removed_end - 1)
+            self._children[parent_id] = old_ids[:before] + old_ids[removed_end:]
+            self.endRemoveRows()
+
+        # Узлы до родителя сохраняют номера, узлы после его поддерева
+        # сдвигаются на разницу в числе элементов, внутри — как их ребёнок родителя
+        subtree_end = old_store.subtree_end(parent_id)
+        shift = (len(new_store) - len(old_store), new_end - old_end)
+        old_indexes = self.persistentIndexList()
+        targets = []
+        for index in old_indexes:
+            node_id = index.internalId()
+            if node_id <= parent_id:
+                delta = (0, 0)
+            elif node_id >= subtree_end:
+                delta = shift
+            else:
+                child = node_id
+                while old_store.parent[child] != parent_id:
+                    child = old_store.parent[child]
+                delta = kept.get(child)
+            if delta is None:
+                targets.append(None)
+            else:
+                targets.append((node_id + delta[0], old_store.tag(node_id), old_store.start[node_id] + delta[1]))
+        inserted_end = len(new_ids) - after
+        self._document = document
+        self._children = {parent_id: new_ids[:before] + new_ids[inserted_end:]}
+        new_indexes = []
+        for target, index in zip(targets, old_indexes):
+            if target is None or not (target[0] < len(new_store) and new_store.tag(target[0]) == target[1]
+                                      and new_store.start[target[0]] == target[2]):
+                new_indexes.append(QModelIndex())
+            else:
+                new_indexes.append(self.index_for_node(target[0], index.column()))
+        self.changePersistentIndexList(old_indexes, new_indexes)
+
+        if inserted_end > before:
+            self.beginInsertRows(self.index_for_node(parent_id), before, inserted_end - 1)
+            self._children[parent_id] = new_ids
+            self.endInsertRows()
+        else:
+            self._children[parent_id] = new_ids
+        # Значения и иконки родителя и его предков тоже могли измениться
+        self._emit_region_changed(start, old_end, new_end)
+
+    @staticmethod
+    def _same_element(old, old_id: int, new, new_id: int) -> bool:
+        """Проверяет, что у элементов двух документов одинаковый текст (вместе с тегами)."""
+        old_store, new_store = old.store, new.store
+        old_start, old_end = old_store.start[old_id], old_store.end[old_id]
+        new_start, new_end = new_store.start[new_id], new_store.end[new_id]
+        return (old_end - old_start == new_end - new_start
+                and old.text[old_start:old_end] == new.text[new_start:new_end])
+
+    def _emit_region_changed(self, start: int, old_end: int, new_end: int):
+        """Сообщает об изменении строк, чьи теги или текст задеты участком текста."""
+        store = self._document.store
+        last_column = len(self.HEADERS) - 1
+        # Узлы, начинающиеся внутри участка, — по одному диапазону строк на раскрытого родителя
+        first_id = bisect_left(store.start, start)
+        last_id = bisect_right(store.start, new_end) - 1
+        if first_id == 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(0, last_column))
+        if first_id <= last_id:
+            for parent_id, ids in list(self._children.items()):
+                lo = bisect_left(ids, first_id)
+                hi = bisect_right(ids, last_id) - 1
+                if lo <= hi:
+                    parent = self.index_for_node(parent_id)
+                    self.dataChanged.emit(self.index(lo, 0, parent), self.index(hi, last_column, parent))
+        # Элементы, внутри тегов или текста которых находится начало участка; строки,
+        # чьих соседей представление ещё не запрашивало, на экране быть не могут
+        node_id = bisect_right(store.start, start) - 1
+        while node_id != -1:
+            parent_id = store.parent[node_id]
+            if store.end[node_id] >= start and (parent_id == -1 or parent_id in self._children):
+                self.dataChanged.emit(self.index_for_node(node_id), self.index_for_node(node_id, last_column))
+            node_id = parent_id
+
+    def node_id(self, index: QModelIndex):
+        """Возвращает номер узла для индекса модели (или None)."""
+        if not index.isValid() or self._document is None:
+            return None
+        return index.internalId()
+
+    def index_for_node(self, node_id: int, column: int = 0) -> QModelIndex:
+        """Возвращает индекс модели для номера узла."""
+        if self._document is None:
+            return QModelIndex()
+        return self.createIndex(self._row_of(node_id), column, node_id)
+
+    def _child_ids(self, node_id: int):
+        """Возвращает (и кэширует) номера детей узла в порядке документа."""
+        ids = self._children.get(node_id)
+        if ids is None:
+            ids = array('i', self._document.store.children(node_id))
+            self._children[node_id] = ids
+        return ids
+
+    def _row_of(self, node_id: int) -> int:
+        """Возвращает номер строки узла среди его соседей."""
+        parent_id = self._document.store.parent[node_id]
+        if parent_id == -1:
+            return 0
+        # Номера узлов идут в порядке обхода, поэтому дети упорядочены по возрастанию
+        return bisect_left(self._child_ids(parent_id), node_id)
+
+    def index(self, row, column, parent=QModelIndex()):
+        """Возвращает индекс дочерней строки ``row`` узла ``parent``."""
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        return self.createIndex(row, column, self._child_ids(parent.internalId())[row])
+
+    def parent(self, index):
+        """Возвращает индекс родителя."""
+        if not index.isValid() or self._document is None:
+            return QModelIndex()
+        parent_id = self._document.store.parent[index.internalId()]
+        if parent_id == -1:
+            return QModelIndex()
+        return self.createIndex(self._row_of(parent_id), 0, parent_id)
+
+    def rowCount(self, parent=QModelIndex()):
+        """Возвращает число дочерних строк."""
+        if self._document is None:
+            return 0
+        if not parent.isValid():
+            # Документ, разобранный с ошибками, может не содержать ни одного элемента
+            return min(1, len(self._document.store))
+        if parent.column() > 0:
+            return 0
+        return len(self._child_ids(parent.internalId()))
+
+    def hasChildren(self, parent=QModelIndex()):
+        """Проверяет наличие детей без построения их списка."""
+        if self._document is None:
+            return False
+        if not parent.isValid():
+            return len(self._document.store) > 0
+        return parent.column() == 0 and self._document.store.first_child[parent.internalId()] != -1
+
+    def columnCount(self, parent=QModelIndex()):
+        """Возвращает число колонок."""
+        return len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Возвращает данные ячейки, вычисляя их из текста документа."""
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        document = self._document
+        node_id = index.internalId()
+        column = index.column()
+        if column == 0:
+            return f"{self._icon_for(node_id)} {document.tag(node_id)}"
+        if column == 1:
+            return document.value(node_id)
+        return format_attributes(document.attributes(node_id))
+
+    def _icon_for(self, node_id: int) -> str:
+        """Подбирает иконку узла по наличию детей, текста и атрибутов."""
+        document = self._document
+        if document.store.first_child[node_id] != -1:
+            return "📦"  # контейнер элемента
+        has_text = bool(document.value(node_id))
+        has_attrs = bool(document.attributes(node_id))
+        if has_text and has_attrs:
+            return "🧾"  # элемент с данными и атрибутами
+        if has_text:
+            return "📝"  # текстовый элемент
+        if has_attrs:
+            return "🏷️"  # элемент только с атрибутами
+        return "📄"  # пустой листовой элемент
+
+    def flags(self, index):
+        """Разрешает редактирование колонок значения и атрибутов."""
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() in (self.VALUE_COLUMN, self.ATTRIBUTES_COLUMN):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        """Передаёт правку значения или атрибутов наружу; текст меняет главное окно."""
+        if role != Qt.EditRole or not index.isValid():
+            return False
+        if index.column() not in (self.VALUE_COLUMN, self.ATTRIBUTES_COLUMN):
+            return False
+        if index.column() == self.ATTRIBUTES_COLUMN and parse_attributes(str(value)) is None:
+            return False
+        self.item_edited.emit(index.internalId(), index.column(), str(value))
+        return True
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Возвращает заголовки колонок."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None